@@ -13,10 +13,12 @@ import requests
 from json import JSONDecodeError
 
 # Project imports
+from mirror import MirrorSession
 from utils import APIError, extract_prev_href, print_line, \
                   api_entry, \
                   process_body, \
-                  get_resource, post_resource, put_resource, delete_resource
+                  get_resource, post_resource, put_resource, \
+                  patch_resource, delete_resource
 
 
 def main():
@@ -45,13 +47,18 @@ def main():
 
     breakout = False
     while True and not breakout:
-        with requests.Session() as s:
+        # Resources are kept in a local mirror, see mirror.py
+        with MirrorSession() as s:
             SERVER_URL, href, method = api_entry(s)
             SERVER_URL = SERVER_URL.strip("/api/")
             # print("DEBUG MAIN:\t\tFull URL: ", SERVER_URL + href, "\r\n")
             try:
                 body = None
                 while True:
+                    # Queued writes the API refused when they were sent
+                    for err in s.rejected:
+                        print("\nQueued write refused.\n", err)
+                    s.rejected.clear()
                     if body is not None:
                         # Print UI
                         print_line()
@@ -124,6 +131,21 @@ def main():
                         except APIError as err:
                             print("\n", err)
                             input("Press Enter to continue...")
+                    elif method == "patch":
+                        try:
+                            # Make changes to the given values only
+                            resp = patch_resource(s, SERVER_URL + href,
+                                                  schema)
+                            if resp.status_code == 204:
+                                print("\r\nResource modified: ", href)
+                                # Resfresh UI
+                                print("Refreshing UI...")
+                                body = get_resource(s, SERVER_URL + href)
+                            else:
+                                raise APIError(resp.status_code, resp.content)
+                        except APIError as err:
+                            print("\n", err)
+                            input("Press Enter to continue...")
                     elif method == "delete":
                         # print("DEBUG MAIN:\t\thref for DELETE is: ", href)
                         # print("DEBUG MAIN:\t\tDELETing: ", SERVER_URL + href)
@@ -0,0 +1,345 @@
+'''
+This module provides the local mirror of the API-client.
+
+MirrorSession is a requests session keeping a local SQLite copy of the
+resources it has got, with their ETags. A resource is refreshed with a
+conditional GET, which the API answers with 304 Not Modified while the copy
+is current. Once the client has visited a user whose representation has a
+"cyequ:changes" control, the resources of that user are refreshed from the
+user's change feed instead: at most every max_age seconds, one request tells
+which copies have changed, and the others are served from the mirror without
+going to the network. The feed only reports changes of the user, its
+equipment, components and rides, and of the collections listing them. Other
+resources of the user, such as its garage or the changes themselves, are
+always refreshed with a conditional GET.
+
+If the API is unreachable, GETs are served from the mirror, and writes are
+queued to an outbox and raise WriteQueued. Queued writes are sent in order
+before the next request that reaches the API. While the API answers them
+with 429 Too Many Requests or a server error, they are kept for a later
+retry, and new writes are queued behind them. Queued writes are not applied
+to the mirror, so copies are shown as they were until the writes are sent.
+'''
+
+import json
+import re
+import sqlite3
+import time
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils import APIError
+
+MASON = "application/vnd.mason+json"
+# Methods of writes, queued when the API is unreachable
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Status codes of queued writes kept to be sent again later
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Paths relative to a user's URL of the resources its change feed reports:
+# the user, its equipment collection, equipment and components, and rides
+_FOLLOWED = re.compile(r"(all_equipment/([^/?#]+/){0,2}|rides/[^/?#]+/)?")
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS resource ("
+    " url TEXT PRIMARY KEY, etag TEXT, body BLOB NOT NULL,"
+    " stale INTEGER NOT NULL DEFAULT 0)",
+    # Change feeds of visited users and the last change seen of each
+    "CREATE TABLE IF NOT EXISTS feed ("
+    " user_url TEXT PRIMARY KEY, feed_url TEXT NOT NULL,"
+    " last_seq INTEGER, synced REAL NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS outbox ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT, method TEXT NOT NULL,"
+    " url TEXT NOT NULL, body BLOB, content_type TEXT)",
+]
+
+
+class WriteQueued(APIError):
+    '''
+    Exception raised when a write is queued, because the API could not be
+    reached. The write is sent later, see MirrorSession.
+    '''
+
+    def __init__(self, method, url):
+        '''
+        Initializes the exception with *method* and *url* of the write.
+        '''
+
+        self.method = method
+        self.url = url
+
+
+def rejection(resp):
+    '''
+    Returns an APIError of the response *resp* refusing a queued write. A
+    body which is not a Mason error is replaced with a message of its own.
+    '''
+
+    try:
+        error = APIError(resp.status_code, resp.content)
+        if isinstance(error.error, dict) and "@error" in error.error:
+            return error
+    except ValueError:
+        pass
+    return APIError(resp.status_code, json.dumps({
+        "resource_url": urlsplit(resp.url).path,
+        "@error": {"@message": resp.reason or "Write refused",
+                   "@messages": [resp.text[:200]]}
+    }))
+
+    def __str__(self):
+        '''
+        Returns a description of the queued write.
+        '''
+
+        return "API unavailable, {} {} queued. It will be sent when the " \
+               "API is available again.".format(self.method, self.url)
+
+
+def followed(user_url, url):
+    '''
+    Returns whether the change feed of the user of *user_url* reports the
+    changes of the resource of *url*.
+    '''
+
+    return url.startswith(user_url) \
+        and _FOLLOWED.fullmatch(url[len(user_url):]) is not None
+
+
+def parent_url(url):
+    '''
+    Returns the URL of the collection or resource one level up of *url*,
+    whose representation lists it.
+    '''
+
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/").rsplit("/", 1)[0] + "/"
+    return urlunsplit((parts.scheme, parts.netloc, path, "", ""))
+
+
+class MirrorSession(requests.Session):
+    '''
+    Requests session serving GETs from, and keeping them in, the local
+    mirror at *path*. Copies of resources with a change feed are served
+    without going to the network for *max_age* seconds after the feed was
+    read.
+    '''
+
+    def __init__(self, path="mirror.db", max_age=5):
+        super().__init__()
+        self.db = sqlite3.connect(path, isolation_level=None)
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+        self.max_age = max_age
+        # APIErrors of queued writes the API has refused, to be shown
+        self.rejected = []
+
+    def close(self):
+        '''
+        Closes the session and the mirror.
+        '''
+
+        super().close()
+        self.db.close()
+
+    def request(self, method, url, *args, **kwargs):
+        '''
+        Sends the request as requests.Session does, through the mirror for
+        GETs and the outbox for writes.
+        '''
+
+        method = method.upper()
+        if method == "GET" and not kwargs.get("params"):
+            return self._get(url, **kwargs)
+        try:
+            sent = self.replay()
+            if sent or method not in WRITE_METHODS:
+                resp = super().request(method, url, *args, **kwargs)
+        except requests.ConnectionError:
+            if method not in WRITE_METHODS:
+                raise
+            sent = False
+        if not sent and method in WRITE_METHODS:
+            # Queued behind the writes not yet sent, to keep their order
+            headers = CaseInsensitiveDict(kwargs.get("headers") or {})
+            self.db.execute("INSERT INTO outbox (method, url, body,"
+                            " content_type) VALUES (?, ?, ?, ?)",
+                            (method, url, kwargs.get("data"),
+                             headers.get("Content-Type")))
+            raise WriteQueued(method, url)
+        if method in WRITE_METHODS and resp.status_code < 400:
+            self._written(url, method)
+        return resp
+
+    def replay(self):
+        '''
+        Sends the queued writes in order, until all are sent or the API can
+        not take one now. Returns True if all were sent. Writes the API
+        refuses are dropped and added to rejected, those it answers with a
+        status of RETRY_STATUSES are kept.
+        '''
+
+        while True:
+            row = self.db.execute("SELECT id, method, url, body, content_type"
+                                  " FROM outbox ORDER BY id LIMIT 1"
+                                  ).fetchone()
+            if row is None:
+                return True
+            queued, method, url, body, content_type = row
+            headers = {"Content-type": content_type} if content_type else {}
+            resp = super().request(method, url, data=body, headers=headers)
+            if resp.status_code in RETRY_STATUSES:
+                return False
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (queued,))
+            if resp.status_code >= 400:
+                self.rejected.append(rejection(resp))
+            else:
+                self._written(url, method)
+
+    def _written(self, url, method):
+        '''
+        Marks the copies changed by a successful write to *url* stale.
+        '''
+
+        if method == "DELETE":
+            self.db.execute("DELETE FROM resource WHERE url = ?", (url,))
+        self.db.execute("UPDATE resource SET stale = 1 WHERE url IN (?, ?)",
+                        (url, parent_url(url)))
+
+    def _get(self, url, **kwargs):
+        '''
+        Returns the response of GET *url*, from the mirror if its copy is
+        current.
+        '''
+
+        feed = self._feed(url)
+        if feed is not None and not followed(feed[0], url):
+            # Revalidated, as the feed does not tell when it changes
+            feed = None
+        online = True
+        if feed is not None and time.time() - feed[3] >= self.max_age:
+            try:
+                self.replay()
+                self.sync(feed)
+            except requests.ConnectionError:
+                online = False
+        row = self.db.execute("SELECT etag, body, stale FROM resource"
+                              " WHERE url = ?", (url,)).fetchone()
+        if row is not None and (not online or
+                                feed is not None and not row[2]):
+            return self._response(url, row[0], row[1])
+        headers = dict(kwargs.pop("headers", None) or {})
+        if row is not None and row[0]:
+            headers["If-None-Match"] = row[0]
+        try:
+            if online:
+                self.replay()
+            resp = super().request("GET", url, headers=headers, **kwargs)
+        except requests.ConnectionError:
+            if row is None:
+                raise
+            return self._response(url, row[0], row[1])
+        if resp.status_code == 304:
+            self.db.execute("UPDATE resource SET stale = 0 WHERE url = ?",
+                            (url,))
+            return self._response(url, row[0], row[1])
+        if resp.status_code == 200 and resp.headers.get("Content-Type",
+                                                        "") == MASON:
+            self.db.execute("INSERT OR REPLACE INTO resource (url, etag, body)"
+                            " VALUES (?, ?, ?)",
+                            (url, resp.headers.get("ETag"), resp.content))
+            self._discover(url, resp)
+        elif resp.status_code in (404, 410):
+            self.db.execute("DELETE FROM resource WHERE url = ?", (url,))
+        return resp
+
+    def _response(self, url, etag, body):
+        '''
+        Returns a 200 response of the copy of *url* in the mirror.
+        '''
+
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.reason = "OK"
+        resp.url = url
+        resp.encoding = "utf-8"
+        resp.headers["Content-Type"] = MASON
+        if etag:
+            resp.headers["ETag"] = etag
+        resp._content = body
+        return resp
+
+    def _feed(self, url):
+        '''
+        Returns the feed row of the user of *url*, or None.
+        '''
+
+        return self.db.execute("SELECT user_url, feed_url, last_seq, synced"
+                               " FROM feed"
+                               " WHERE substr(?, 1, length(user_url))"
+                               " = user_url"
+                               " ORDER BY length(user_url) DESC LIMIT 1",
+                               (url,)).fetchone()
+
+    def _discover(self, url, resp):
+        '''
+        Starts following the change feed advertised by the representation
+        of user *url*, if any and not followed yet.
+        '''
+
+        try:
+            control = resp.json()["@controls"]["cyequ:changes"]
+        except (ValueError, KeyError):
+            return
+        if self._feed(url) is not None:
+            return
+        feed_url = urljoin(url, control["href"])
+        self.db.execute("INSERT INTO feed (user_url, feed_url) VALUES (?, ?)",
+                        (url, feed_url))
+        self.sync(self._feed(url))
+
+    def sync(self, feed):
+        '''
+        Reads the changes after the last one seen from the change feed of
+        *feed* and marks the changed copies stale.
+        '''
+
+        user_url, feed_url, last_seq, _ = feed
+        if last_seq is None:
+            # Copies got before the feed was followed are revalidated
+            self._stale_all(user_url)
+        url = "{}?since={}".format(feed_url, last_seq or 0)
+        while url:
+            resp = super().request("GET", url)
+            if resp.status_code == 410:
+                # Changes compacted away, revalidate everything
+                self._stale_all(user_url)
+                url = "{}?since=0".format(feed_url)
+                continue
+            if resp.status_code != 200:
+                return
+            body = resp.json()
+            changed = set()
+            for item in body["items"]:
+                href = urljoin(url, item["href"])
+                changed.update((href, parent_url(href)))
+            self.db.executemany("UPDATE resource SET stale = 1 WHERE url = ?",
+                                [(href,) for href in changed])
+            last_seq = body["last_seq"]
+            url = body["@controls"].get("next", {}).get("href")
+            if url:
+                url = urljoin(feed_url, url)
+        self.db.execute("UPDATE feed SET last_seq = ?, synced = ?"
+                        " WHERE user_url = ?",
+                        (last_seq, time.time(), user_url))
+
+    def _stale_all(self, user_url):
+        '''
+        Marks all copies of the resources of *user_url* stale.
+        '''
+
+        self.db.execute("UPDATE resource SET stale = 1"
+                        " WHERE substr(url, 1, length(?)) = ?",
+                        (user_url, user_url))
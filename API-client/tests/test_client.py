@@ -0,0 +1,238 @@
+'''
+This module contains tests of the local mirror of the API-client. The
+requests of the client are sent to the API application through its Flask
+test client.
+
+Run with "python -m pytest" in the API-client folder.
+'''
+
+import json
+import os
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from mirror import MirrorSession, WriteQueued, followed
+
+# The API application
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "API", "src"))
+from cyequ import create_app, db  # noqa: E402
+
+SERVER_URL = "http://localhost"
+USER_URL = SERVER_URL + "/api/users/Joonas1/"
+
+
+class AppAdapter(BaseAdapter):
+    '''
+    Transport adapter sending requests to the Flask test client *client*.
+    Keeps a list of the requests sent, and raises ConnectionError while
+    *online* is False. While *answer* is a (status, reason, body) tuple,
+    requests are answered with it instead, as a proxy in front of the API
+    would.
+    '''
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.sent = []
+        self.online = True
+        self.answer = None
+
+    def send(self, request, **kwargs):
+        if not self.online:
+            raise requests.ConnectionError("API unreachable")
+        self.sent.append((request.method, request.url))
+        response = requests.Response()
+        if self.answer is not None:
+            response.status_code, response.reason, response._content = \
+                self.answer
+            response.headers = CaseInsensitiveDict(
+                {"Content-Type": "text/html"})
+            response.url = request.url
+            response.request = request
+            return response
+        parts = urlsplit(request.url)
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() != "accept-encoding"}
+        resp = self.client.open(parts.path, method=request.method,
+                                query_string=parts.query, data=request.body,
+                                headers=headers)
+        response.status_code = resp.status_code
+        response.reason = resp.status.split(" ", 1)[-1]
+        response.headers = CaseInsensitiveDict(resp.headers)
+        response._content = resp.data
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session():
+    '''
+    Creates the API application with a user and one bike, and yields a
+    MirrorSession to it with a fresh mirror.
+    '''
+
+    db_fd, db_fname = tempfile.mkstemp()
+    mirror_fd, mirror_fname = tempfile.mkstemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+                      "STREAM_STORE": db_fname + ".streams",
+                      "TESTING": True})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    assert client.post("/api/users/", json={"name": "Joonas"}) \
+        .status_code == 201
+    assert client.post("/api/users/Joonas1/all_equipment/",
+                       json=_equipment("Polkuaura")).status_code == 201
+    s = MirrorSession(mirror_fname, max_age=0)
+    s.adapter = AppAdapter(client)
+    s.mount(SERVER_URL, s.adapter)
+    yield s
+    s.close()
+    for fd, fname in ((db_fd, db_fname), (mirror_fd, mirror_fname)):
+        os.close(fd)
+        os.unlink(fname)
+    if os.path.exists(db_fname + ".streams"):
+        os.unlink(db_fname + ".streams")
+
+
+def _equipment(name):
+    '''
+    Returns a valid equipment JSON object of *name*.
+    '''
+
+    return {"name": name,
+            "category": "Mountain Bike",
+            "brand": "Kona",
+            "model": "Hei Hei",
+            "date_added": "2019-11-21 11:20:30"
+            }
+
+
+def _gets(s, url):
+    '''
+    Returns how many GETs of *url* the session has sent to the API.
+    '''
+
+    return s.adapter.sent.count(("GET", url))
+
+
+def test_followed():
+    '''
+    Tests that only the resources reported by a user's change feed are
+    followed.
+    '''
+
+    for path in ["", "all_equipment/", "all_equipment/Polkuaura1/",
+                 "all_equipment/Polkuaura1/Hissitolppa1/", "rides/Lenkki1/"]:
+        assert followed(USER_URL, USER_URL + path)
+    for path in ["garage/", "maintenance-due/", "export", "changes",
+                 "changes?since=0", "rides/Lenkki1/streams", "search"]:
+        assert not followed(USER_URL, USER_URL + path)
+    assert not followed(USER_URL, SERVER_URL + "/api/users/Joonas12/")
+
+
+def test_feed(session):
+    '''
+    Tests that copies followed by the change feed are served from the mirror
+    until the feed reports their change.
+    '''
+
+    equipment_url = USER_URL + "all_equipment/Polkuaura1/"
+    assert session.get(USER_URL).status_code == 200
+    assert session.get(equipment_url).json()["model"] == "Hei Hei"
+    assert session.get(equipment_url).json()["model"] == "Hei Hei"
+    assert _gets(session, equipment_url) == 1
+    resp = session.put(equipment_url, json=dict(_equipment("Polkuaura"),
+                                                model="Process 153"))
+    assert resp.status_code == 204
+    assert session.get(equipment_url).json()["model"] == "Process 153"
+    assert _gets(session, equipment_url) == 2
+
+
+def test_not_followed(session):
+    '''
+    Tests that resources of a user the change feed does not report are
+    revalidated on every GET.
+    '''
+
+    garage_url = USER_URL + "garage/"
+    assert session.get(USER_URL).status_code == 200
+    assert session.get(garage_url).json()["counts"]["equipment"] == 1
+    resp = session.post(USER_URL + "all_equipment/",
+                        json=_equipment("Kisarassi"))
+    assert resp.status_code == 201
+    assert session.get(garage_url).json()["counts"]["equipment"] == 2
+    # Unchanged, answered with 304 from the copy
+    assert session.get(garage_url).json()["counts"]["equipment"] == 2
+    assert _gets(session, garage_url) == 3
+
+
+def test_offline(session):
+    '''
+    Tests that copies are served and writes are queued while the API can not
+    be reached, and the writes are sent once it can.
+    '''
+
+    garage_url = USER_URL + "garage/"
+    assert session.get(USER_URL).status_code == 200
+    assert session.get(garage_url).status_code == 200
+    session.adapter.online = False
+    assert session.get(garage_url).json()["counts"]["equipment"] == 1
+    with pytest.raises(WriteQueued):
+        session.post(USER_URL + "all_equipment/",
+                     data=json.dumps(_equipment("Kisarassi")),
+                     headers={"Content-Type": "application/json"})
+    session.adapter.online = True
+    assert session.get(garage_url).json()["counts"]["equipment"] == 2
+    assert not session.rejected
+
+
+def test_replay_retry(session):
+    '''
+    Tests that queued writes answered with 503 are kept and later writes
+    queued behind them, and that refusals are recorded, also without a
+    Mason error body.
+    '''
+
+    garage_url = USER_URL + "garage/"
+    session.adapter.online = False
+    # Polkuaura already exists and is refused with 409
+    for name in ("Kisarassi", "Polkuaura"):
+        with pytest.raises(WriteQueued):
+            session.post(USER_URL + "all_equipment/",
+                         data=json.dumps(_equipment(name)),
+                         headers={"Content-Type": "application/json"})
+    session.adapter.online = True
+    session.adapter.answer = (503, "Service Unavailable", b"<h1>Busy</h1>")
+    with pytest.raises(WriteQueued):
+        session.post(USER_URL + "all_equipment/",
+                     data=json.dumps(_equipment("Maantie")),
+                     headers={"Content-Type": "application/json"})
+    assert not session.rejected
+    assert session.db.execute("SELECT count(*) FROM outbox").fetchone()[0] \
+        == 3
+    session.adapter.answer = None
+    assert session.get(garage_url).json()["counts"]["equipment"] == 3
+    assert session.db.execute("SELECT count(*) FROM outbox").fetchone()[0] \
+        == 0
+    # Refused by a proxy, with an HTML body
+    session.adapter.online = False
+    with pytest.raises(WriteQueued):
+        session.delete(USER_URL + "all_equipment/Kisarassi2/")
+    session.adapter.online = True
+    session.adapter.answer = (403, "Forbidden", b"<h1>Forbidden</h1>")
+    assert session.get(USER_URL + "export").status_code == 403
+    assert [error.code for error in session.rejected] == [409, 403]
+    assert "Already exists" in str(session.rejected[0])
+    assert "Forbidden" in str(session.rejected[1])
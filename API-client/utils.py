@@ -643,6 +643,46 @@ def put_resource(s, href, schema):
     return resp
 
 
+def patch_resource(s, href, schema):
+    '''
+    Function for PATCH-request.
+    Sends only the values the user gives as a JSON merge patch to the API
+    using URI. Asks for each property of the provided schema in turn, empty
+    input keeps the current value.
+
+    Returns patch response object provided by requests.
+    '''
+
+    # Build the merge patch according to provided schema
+    data = {}
+    print("\nModify resource. Press Enter to keep a current value.\n")
+    for key, prop in schema["properties"].items():
+        while True:
+            if "pattern" in prop:
+                print("Give date and time in format 'YYYY-MM-DD hh:mm:ss'.")
+            value = ask_input(key, prop["type"])
+            if not value:
+                break
+            # Test for length and pattern
+            if "pattern" in prop:
+                if re.match(prop["pattern"], value):
+                    data[key] = value
+                    break
+                print("Input must be format 'YYYY-MM-DD hh:mm:ss'.")
+            elif prop["minLength"] <= len(value) <= prop["maxLength"]:
+                data[key] = value
+                break
+            else:
+                print("Input must be between {} and {} characters long"
+                      .format(prop["minLength"], prop["maxLength"]))
+    # Then patch
+    resp = s.patch(href,
+                   data=json.dumps(data),
+                   headers={"Content-type": "application/merge-patch+json"}
+                   )
+    return resp
+
+
 def extract_prev_href(href):
     '''
     Extracts the "one level down" href of given API href based on "/".
@@ -0,0 +1,151 @@
+'''
+This module benchmarks the async read path against the WSGI application
+with many slow clients.
+Run with:
+    python bench_asgi.py [clients] [delay] [threads]
+Creates a user with ten bikes in a database file in a temporary directory.
+Then *clients* (default 2000) clients each poll UserItem and EquipmentItem
+once, taking *delay* seconds (default 0.5) to receive a response, as mobile
+clients on a slow network do. The WSGI application serves them with a pool
+of *threads* (default 64) threads, each pinned to a request until its
+response has been received. The ASGI application serves them on one event
+loop. Prints the wall time, requests per second and the median and 99th
+percentile latency of each.
+'''
+
+# Library imports
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.asgi import AsyncReadApp
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+ENDPOINTS = ["/api/users/Rider1/",
+             "/api/users/Rider1/all_equipment/Bike1/"]
+
+
+def populate(bikes=10):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def report(name, latencies, wall):
+    '''
+    Prints the results of a run.
+    '''
+
+    latencies.sort()
+    print("{:<6} {:>8} {:>8.2f}s {:>8.0f} {:>8.2f}s {:>8.2f}s".format(
+        name, len(latencies), wall, len(latencies) / wall,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)]))
+
+
+def run_wsgi(app, clients, delay, threads):
+    '''
+    Serves the clients with the WSGI application in a thread pool.
+    '''
+
+    client = app.test_client()
+
+    def request(url):
+        assert client.get(url).status_code == 200
+        # Sending to a slow client blocks the thread
+        time.sleep(delay)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [(time.perf_counter(), executor.submit(
+            request, ENDPOINTS[i % len(ENDPOINTS)])) for i in range(clients)]
+        latencies = []
+        for submitted, future in futures:
+            future.result()
+            latencies.append(time.perf_counter() - submitted)
+    report("wsgi", latencies, time.perf_counter() - start)
+
+
+async def run_asgi(app, clients, delay):
+    '''
+    Serves the clients with the ASGI application on the event loop.
+    '''
+
+    async def request(url):
+        start = time.perf_counter()
+        scope = {"type": "http", "method": "GET", "path": url,
+                 "query_string": b"", "headers": [],
+                 "server": ("localhost", 80)}
+        received = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                received.append(message["status"])
+            elif not message.get("more_body"):
+                # Sending to a slow client is awaited
+                await asyncio.sleep(delay)
+
+        await app(scope, receive, send)
+        assert received == [200]
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(
+        request(ENDPOINTS[i % len(ENDPOINTS)]) for i in range(clients)))
+    wall = time.perf_counter() - start
+    await app.close()
+    report("asgi", list(latencies), wall)
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db")})
+    with app.app_context():
+        db.create_all()
+        populate()
+    print("{:<6} {:>8} {:>9} {:>8} {:>9} {:>9}".format(
+        "app", "requests", "wall", "req/s", "p50", "p99"))
+    run_wsgi(app, clients, delay, threads)
+    asyncio.run(run_asgi(AsyncReadApp(app), clients, delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+'''
+This module benchmarks building a bike with separate requests against one
+batch request.
+Run with:
+    python bench_batch.py [bikes]
+Creates 50 bikes (by default), each with ten components, in a database file
+in a temporary directory, first with one request per resource and then with
+one POST /api/batch per bike, and prints the time per bike of both.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import time
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.models import User
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+
+
+def bike(name):
+    '''
+    Returns the equipment and component documents of a bike.
+    '''
+
+    equipment = {"name": name, "category": "Mountain Bike",
+                 "brand": "Kona", "model": "Hei Hei",
+                 "date_added": "2020-01-01 12:00:00"}
+    components = [{"name": "{} {}".format(name, category),
+                   "category": category, "brand": "Shimano", "model": "XT",
+                   "date_added": "2020-01-01 12:00:00"}
+                  for category in CATEGORIES]
+    return equipment, components
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    bikes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db")})
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(uri="Rider1", name="Rider"))
+        db.session.commit()
+    client = app.test_client()
+    url = "/api/users/Rider1/all_equipment/"
+    start = time.perf_counter()
+    for i in range(bikes):
+        equipment, components = bike("Single {}".format(i))
+        location = client.post(url, json=equipment).headers["Location"]
+        for component in components:
+            client.post(location, json=component)
+    single = (time.perf_counter() - start) / bikes
+    start = time.perf_counter()
+    for i in range(bikes):
+        equipment, components = bike("Batch {}".format(i))
+        operations = [{"method": "POST", "href": url, "body": equipment}]
+        operations += [{"method": "POST", "href": "${0}", "body": component}
+                       for component in components]
+        resp = client.post("/api/batch", json={"operations": operations})
+        assert resp.status_code == 200
+    batch = (time.perf_counter() - start) / bikes
+    print("Separate requests {:.1f} ms per bike, batch {:.1f} ms per bike"
+          .format(single * 1000, batch * 1000))
+
+
+if __name__ == "__main__":
+    main()
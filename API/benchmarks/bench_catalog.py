@@ -0,0 +1,60 @@
+'''
+This module benchmarks the brand and model suggestion index.
+Run with:
+    python bench_catalog.py [values]
+Builds the index of 200k distinct values per field (by default) and prints
+the build time and the median latency of suggestions for prefixes of one to
+four characters.
+'''
+
+# Library imports
+import random
+import string
+import sys
+import time
+
+# Project imports
+from cyequ.catalog import Catalog, FIELDS
+
+
+def timed(func, repeat=1000):
+    '''
+    Returns the median seconds of *repeat* calls of func.
+    '''
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    values = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rng = random.Random(1)
+
+    def value():
+        return " ".join("".join(rng.choice(string.ascii_letters)
+                                for _ in range(rng.randint(3, 9)))
+                        for _ in range(rng.randint(1, 3)))
+
+    counts = {field: {value(): rng.randint(1, 50) for _ in range(values)}
+              for field in FIELDS}
+    start = time.perf_counter()
+    catalog = Catalog(counts)
+    print("Built index of {} values per field in {:.0f} ms"
+          .format(values, (time.perf_counter() - start) * 1000))
+    for prefix in ("s", "sr", "sra", "sram"):
+        median = timed(lambda: catalog.suggest(prefix))
+        print("prefix {:<5} {:7.1f} us".format(prefix, median * 1e6))
+    median = timed(lambda: catalog.apply({("brand", value()): 1}))
+    print("insert of a new value {:.1f} us".format(median * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+'''
+This module benchmarks incremental synchronization with the change feed
+against crawling the garage again.
+Run with:
+    python bench_changes.py [changes] [sizes...]
+Creates a user with each number of bikes in *sizes* (default 10, 100 and
+500) of ten components each, in a database file in a temporary directory.
+Then renames *changes* (default 5) bikes and syncs a client that had seen
+everything before, first by crawling EquipmentItem of every bike, then by
+reading the change feed after its last sequence number and getting the
+changed resources only. Prints the requests, response bytes and time of each.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db, json
+from cyequ.constants import MERGE_PATCH
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+BIKE_URL = "/api/users/Rider1/all_equipment/Bike{}/"
+CHANGES_URL = "/api/users/Rider1/changes?since={}"
+
+
+def populate(bikes):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def crawl(client, bikes):
+    '''
+    Gets every bike. Returns the requests made and bytes received.
+    '''
+
+    received = 0
+    for i in range(1, bikes + 1):
+        resp = client.get(BIKE_URL.format(i))
+        assert resp.status_code == 200
+        received += len(resp.data)
+    return bikes, received
+
+
+def sync(client, since):
+    '''
+    Reads the change feed after *since* and gets each changed resource.
+    Returns the requests made and bytes received.
+    '''
+
+    requests, received = 0, 0
+    url = CHANGES_URL.format(since)
+    while url:
+        resp = client.get(url)
+        requests += 1
+        received += len(resp.data)
+        body = json.loads(resp.data)
+        for item in body["items"]:
+            if item["op"] != "delete":
+                resp = client.get(item["href"])
+                requests += 1
+                received += len(resp.data)
+        url = body["@controls"].get("next", {}).get("href")
+    return requests, received
+
+
+def run(bikes, changes):
+    '''
+    Runs both syncs on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db")})
+    with app.app_context():
+        db.create_all()
+        populate(bikes)
+    client = app.test_client()
+    # Catch up with the populated garage first
+    since = 0
+    while True:
+        body = json.loads(client.get(CHANGES_URL.format(since)
+                                     + "&limit=1000").data)
+        if body["last_seq"] == since:
+            break
+        since = body["last_seq"]
+    for i in range(1, changes + 1):
+        resp = client.patch(BIKE_URL.format(i),
+                            data=json.dumps({"name": "Renamed {}".format(i)}),
+                            content_type=MERGE_PATCH)
+        assert resp.status_code == 204
+    for name, function, argument in (("crawl", crawl, bikes),
+                                     ("feed", sync, since)):
+        start = time.perf_counter()
+        requests, received = function(client, argument)
+        print("{:<6} {:>6} {:>8} {:>10} {:>8.1f}ms".format(
+            name, bikes, requests, received,
+            (time.perf_counter() - start) * 1000))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    changes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sizes = [int(size) for size in sys.argv[2:]] or [10, 100, 500]
+    print("{:<6} {:>6} {:>8} {:>10} {:>10}".format(
+        "sync", "bikes", "requests", "bytes", "time"))
+    for bikes in sizes:
+        run(bikes, changes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+'''
+This module benchmarks the compression of API responses.
+Run with:
+    python bench_compression.py [bikes]
+Creates a user with 50 bikes (by default), each with ten components, in a
+database file in a temporary directory. Then prints for each endpoint the
+uncompressed and compressed body sizes, the median CPU time of compressing
+the body alone, and the median time per request without compression, with
+compression on every request, and with the compressed body found in the
+cache.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.compression import encodings, compress
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+ENDPOINTS = ["/api/",
+             "/api/users/",
+             "/api/users/Rider1/",
+             "/api/users/Rider1/all_equipment/",
+             "/api/users/Rider1/all_equipment/Bike1/",
+             "/api/users/Rider1/all_equipment/Bike1/Bike1Fork1/"]
+
+
+def populate(bikes):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def timed(func, repeat):
+    '''
+    Returns the median seconds of *repeat* calls of func.
+    '''
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    bikes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeat = 50
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db")})
+    with app.app_context():
+        db.create_all()
+        populate(bikes)
+    client = app.test_client()
+    print("{:<50} {:>8} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8}".format(
+        "endpoint", "encoding", "bytes", "sent", "cpu", "plain",
+        "compress", "cached"))
+    for url in ENDPOINTS:
+        for encoding in encodings():
+            headers = {"Accept-Encoding": encoding}
+            data = client.get(url).data
+            size = len(data)
+            cpu = timed(lambda: compress(data, encoding), repeat)
+            sent = len(client.get(url, headers=headers).data)
+            plain = timed(lambda: client.get(url), repeat)
+
+            def uncached():
+                app.extensions.pop("cyequ_compressed", None)
+                client.get(url, headers=headers)
+
+            compressed = timed(uncached, repeat)
+            cached = timed(lambda: client.get(url, headers=headers), repeat)
+            print("{:<50} {:>8} {:>6} {:>6} {:>6.0f}us {:>6.2f}ms {:>6.2f}ms"
+                  " {:>6.2f}ms".format(url, encoding, size, sent, cpu * 1e6,
+                                       plain * 1000, compressed * 1000,
+                                       cached * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+'''
+This module benchmarks dashboards following a bike by polling against
+subscribing to the event stream.
+Run with:
+    python bench_events.py [dashboards] [seconds] [interval]
+Creates a user with a bike of ten components in a database file in a
+temporary directory. A writer renames a component of the bike once a second
+for *seconds* (default 10). Meanwhile *dashboards* (default 50) dashboards
+follow the bike, first by polling EquipmentItem every *interval* seconds
+(default 2) with conditional GETs, then by reading the event stream of the
+user. Prints the requests served and SQL statements run besides the writes,
+and the median and largest delay from a write to the dashboards seeing it.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event
+
+# Project imports
+from cyequ import create_app, db, json
+from cyequ.constants import MERGE_PATCH
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+BIKE_URL = "/api/users/Rider1/all_equipment/Bike1/"
+FORK_URL = BIKE_URL + "Bike1Fork1/"
+EVENTS_URL = "/api/users/Rider1/events"
+
+
+def populate():
+    '''
+    Adds a user with a bike of ten components.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    bike = Equipment(uri="Bike1", name="Bike 1", category="Mountain Bike",
+                     brand="Kona", model="Hei Hei", date_added=added,
+                     owner=user.id)
+    db.session.add(bike)
+    db.session.flush()
+    for category in CATEGORIES:
+        db.session.add(Component(
+            uri="Bike1{}1".format(category.replace(" ", "")),
+            name="Bike 1 {}".format(category), category=category,
+            brand="Shimano", model="XT", date_added=added,
+            date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def run(mode, dashboards, seconds, interval):
+    '''
+    Runs the dashboards on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db"),
+                      "EVENTS_HEARTBEAT": 1})
+    with app.app_context():
+        db.create_all()
+        populate()
+        engine = db.engine
+    client = app.test_client()
+    statements = [0]
+    requests = [0]
+    # Times of the writes by the name written, and delays seen
+    written = {}
+    delays = []
+    lock = threading.Lock()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*args):
+        statements[0] += 1
+
+    stop = threading.Event()
+
+    def poll():
+        etag = None
+        name = None
+        while not stop.wait(interval):
+            resp = client.get(BIKE_URL, headers={"If-None-Match": etag}
+                              if etag else {})
+            requests[0] += 1
+            if resp.status_code == 304:
+                continue
+            etag = resp.headers["ETag"]
+            found = [item["name"] for item in json.loads(resp.data)["items"]
+                     if item["category"] == "Fork"][0]
+            if found != name and found in written:
+                with lock:
+                    delays.append(time.perf_counter() - written[found])
+            name = found
+
+    def subscribe():
+        resp = client.get(EVENTS_URL)
+        requests[0] += 1
+        for message in resp.response:
+            if stop.is_set():
+                break
+            if message.startswith(b"id: "):
+                arrived = time.perf_counter()
+                with lock:
+                    delays.append(arrived - written[max(written)])
+        resp.close()
+
+    target = poll if mode == "poll" else subscribe
+    threads = [threading.Thread(target=target) for _ in range(dashboards)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    before = statements[0]
+    for i in range(int(seconds)):
+        name = "Fork {:04d}".format(i)
+        written[name] = time.perf_counter()
+        writes = statements[0]
+        resp = client.patch(FORK_URL, data=json.dumps({"name": name}),
+                            content_type=MERGE_PATCH)
+        assert resp.status_code == 204
+        # Statements of the write itself are not counted
+        statements[0] = writes
+        time.sleep(1)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    delays.sort()
+    print("{:<6} {:>10} {:>8} {:>10} {:>9.0f}ms {:>9.0f}ms".format(
+        mode, dashboards, requests[0], statements[0] - before,
+        delays[len(delays) // 2] * 1000 if delays else 0,
+        delays[-1] * 1000 if delays else 0))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    dashboards = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    interval = float(sys.argv[3]) if len(sys.argv) > 3 else 2
+    print("{:<6} {:>10} {:>8} {:>10} {:>11} {:>11}".format(
+        "mode", "dashboards", "requests", "statements", "delay p50",
+        "delay max"))
+    for mode in ("poll", "events"):
+        run(mode, dashboards, seconds, interval)
+
+
+if __name__ == "__main__":
+    main()
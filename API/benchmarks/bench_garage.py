@@ -0,0 +1,141 @@
+'''
+This module benchmarks rendering a garage overview from the normalized
+resources against reading the garage summary.
+Run with:
+    python bench_garage.py [sizes...]
+Creates a user with each number of bikes in *sizes* (default 10, 100 and
+500) of ten components each, in a database file in a temporary directory.
+Renders the overview first from UserItem, EquipmentByUser and EquipmentItem
+of every bike, then from UserGarage. Prints the requests, SQL statements and
+time of each, and the statements and time of renaming a bike, which
+refreshes the summary.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import event
+
+# Project imports
+from cyequ import create_app, db, json
+from cyequ.constants import MERGE_PATCH
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+USER_URL = "/api/users/Rider1/"
+GARAGE_URL = USER_URL + "garage/"
+
+
+def populate(bikes):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def normalized(client):
+    '''
+    Renders the overview from the normalized resources. Returns the
+    requests made.
+    '''
+
+    client.get(USER_URL)
+    body = json.loads(client.get(USER_URL + "all_equipment/").data)
+    for item in body["items"]:
+        assert client.get(item["@controls"]["self"]["href"]) \
+            .status_code == 200
+    return 2 + len(body["items"])
+
+
+def summary(client):
+    '''
+    Renders the overview from the garage summary. Returns the requests
+    made.
+    '''
+
+    assert client.get(GARAGE_URL).status_code == 200
+    return 1
+
+
+def run(bikes):
+    '''
+    Runs both renders on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db")})
+    with app.app_context():
+        db.create_all()
+        populate(bikes)
+        engine = db.engine
+    client = app.test_client()
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*args):
+        statements[0] += 1
+
+    results = []
+    for function in (normalized, summary):
+        # Best of three
+        best = None
+        for _ in range(3):
+            statements[0] = 0
+            start = time.perf_counter()
+            requests = function(client)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best[2]:
+                best = (requests, statements[0], elapsed)
+        results.append(best)
+    statements[0] = 0
+    start = time.perf_counter()
+    resp = client.patch(USER_URL + "all_equipment/Bike1/",
+                        data=json.dumps({"name": "Renamed"}),
+                        content_type=MERGE_PATCH)
+    assert resp.status_code == 204
+    write = (statements[0], time.perf_counter() - start)
+    for name, (requests, count, elapsed) in zip(("tables", "garage"),
+                                                results):
+        print("{:<7} {:>6} {:>8} {:>10} {:>9.1f}ms".format(
+            name, bikes, requests, count, elapsed * 1000))
+    print("{:<7} {:>6} {:>8} {:>10} {:>9.1f}ms".format(
+        "rename", bikes, 1, write[0], write[1] * 1000))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    sizes = [int(size) for size in sys.argv[1:]] or [10, 100, 500]
+    print("{:<7} {:>6} {:>8} {:>10} {:>11}".format(
+        "render", "bikes", "requests", "statements", "time"))
+    for bikes in sizes:
+        run(bikes)
+
+
+if __name__ == "__main__":
+    main()
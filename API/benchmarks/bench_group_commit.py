@@ -0,0 +1,85 @@
+'''
+This module benchmarks write requests with and without GROUP_COMMIT.
+Run with:
+    python bench_group_commit.py [threads] [requests] [window]
+Creates a user in a database file in a temporary directory for each run.
+Then *threads* (default 16) threads each POST *requests* (default 50)
+pieces of equipment for the user, as a burst of uploads would, first with
+every request committing on its own, then through the group commit writer
+with a window of *window* seconds (default 0.002). Prints the requests per
+second, the median and 99th percentile latency, and the transactions
+committed by the writer.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.models import User
+
+
+def run(group_commit, threads, requests, window):
+    '''
+    Runs the burst on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db"),
+                      "GROUP_COMMIT": group_commit,
+                      "GROUP_COMMIT_WINDOW": window})
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(uri="Rider1", name="Rider"))
+        db.session.commit()
+    client = app.test_client()
+    latencies = []
+
+    def post(index):
+        for i in range(requests):
+            body = {"name": "Bike {} {}".format(index, i),
+                    "category": "Mountain Bike", "brand": "Kona",
+                    "model": "Hei Hei", "date_added": "2020-01-01 12:00:00"}
+            start = time.perf_counter()
+            resp = client.post("/api/users/Rider1/all_equipment/", json=body)
+            latencies.append(time.perf_counter() - start)
+            assert resp.status_code == 201, resp.data
+
+    workers = [threading.Thread(target=post, args=(i,))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    writer = app.extensions.get("cyequ_writer")
+    print("{:<6} {:>8} {:>8.0f} {:>8.2f}ms {:>8.2f}ms {:>8}".format(
+        "on" if group_commit else "off", len(latencies),
+        len(latencies) / wall, latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        writer.groups if writer else "-"))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    window = float(sys.argv[3]) if len(sys.argv) > 3 else 0.002
+    print("{:<6} {:>8} {:>8} {:>10} {:>10} {:>8}".format(
+        "group", "requests", "req/s", "p50", "p99", "commits"))
+    for group_commit in (False, True):
+        run(group_commit, threads, requests, window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+'''
+This module benchmarks the JSON backends of the API.
+Run with:
+    python bench_json.py [bikes]
+Creates a user with 50 bikes (by default), each with ten components, in a
+database file in a temporary directory. Then prints for each endpoint and
+installed backend the median time of serializing and parsing its body, and
+the median time per request.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db, json, JSONProvider
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+ENDPOINTS = ["/api/",
+             "/api/users/",
+             "/api/users/Rider1/",
+             "/api/users/Rider1/all_equipment/",
+             "/api/users/Rider1/all_equipment/Bike1/",
+             "/api/users/Rider1/all_equipment/Bike1/Bike1Fork1/",
+             "/api/users/Rider1/search?q=shimano&limit=100"]
+
+
+def populate(bikes):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def timed(func, repeat):
+    '''
+    Returns the median seconds of *repeat* calls of func.
+    '''
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    bikes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeat = 50
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db"),
+                      "COMPRESS": False})
+    with app.app_context():
+        db.create_all()
+        populate(bikes)
+    client = app.test_client()
+    backends = []
+    for backend in JSONProvider.BACKENDS:
+        try:
+            json.use(backend)
+            backends.append(backend)
+        except ValueError:
+            print("{} not installed".format(backend))
+    print("{:<50} {:>7} {:>6} {:>9} {:>9} {:>9}".format(
+        "endpoint", "backend", "bytes", "dumps", "loads", "request"))
+    for url in ENDPOINTS:
+        for backend in backends:
+            json.use(backend)
+            data = client.get(url).data
+            body = json.loads(data)
+            dumps = timed(lambda: json.dumps(body), repeat)
+            loads = timed(lambda: json.loads(data), repeat)
+            request = timed(lambda: client.get(url), repeat)
+            print("{:<50} {:>7} {:>6} {:>7.0f}us {:>7.0f}us {:>7.2f}ms"
+                  .format(url[:50], backend, len(data), dumps * 1e6,
+                          loads * 1e6, request * 1000))
+    json.use()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+'''
+This module benchmarks the latency of well-behaved clients next to a
+misbehaving one, without and with the rate limits.
+Run with:
+    python bench_ratelimit.py [seconds] [noisy threads] [bikes]
+Creates a user with *bikes* bikes (default 200) and five other users in a
+database file in a temporary directory. For *seconds* (default 5) a noisy
+client loops on the first user's equipment collection from *noisy threads*
+threads (default 4) at once, while five other clients each get their own
+user ten times a second. The noisy client runs without limits, with limits
+ignoring Retry-After and with limits waiting as told by Retry-After. Prints
+the requests of the noisy client served and throttled, and the median and
+99th percentile latency of the other clients.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.models import User, Equipment
+
+NOISY_URL = "/api/users/Rider1/all_equipment/"
+QUIET_URL = "/api/users/Quiet{}/"
+
+
+def populate(bikes):
+    '''
+    Adds a user with *bikes* bikes and five users without.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    for i in range(5):
+        db.session.add(User(uri="Quiet{}".format(i),
+                            name="Quiet {}".format(i)))
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    for i in range(1, bikes + 1):
+        db.session.add(Equipment(uri="Bike{}".format(i),
+                                 name="Bike {}".format(i),
+                                 category="Mountain Bike", brand="Kona",
+                                 model="Hei Hei", date_added=added,
+                                 owner=user.id))
+    db.session.commit()
+
+
+def run(mode, seconds, noisy, bikes):
+    '''
+    Runs the clients on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db"),
+                      "RATE_LIMIT": mode != "open"})
+    with app.app_context():
+        db.create_all()
+        populate(bikes)
+    stop = threading.Event()
+    statuses = {200: 0, 429: 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def loop():
+        client = app.test_client()
+        while not stop.is_set():
+            resp = client.get(NOISY_URL,
+                              environ_base={"REMOTE_ADDR": "10.0.0.1"})
+            with lock:
+                statuses[resp.status_code] += 1
+            if mode == "waiting" and resp.status_code == 429:
+                stop.wait(int(resp.headers["Retry-After"]))
+
+    def quiet(number):
+        client = app.test_client()
+        address = "10.0.1.{}".format(number)
+        while not stop.wait(0.1):
+            start = time.perf_counter()
+            resp = client.get(QUIET_URL.format(number),
+                              environ_base={"REMOTE_ADDR": address})
+            assert resp.status_code == 200
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=loop) for _ in range(noisy)]
+    threads += [threading.Thread(target=quiet, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    print("{:<8} {:>8} {:>10} {:>9.1f}ms {:>9.1f}ms".format(
+        mode, statuses[200], statuses[429],
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    noisy = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    bikes = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    print("{:<8} {:>8} {:>10} {:>11} {:>11}".format(
+        "noisy", "served", "throttled", "quiet p50", "quiet p99"))
+    for mode in ("open", "ignoring", "waiting"):
+        run(mode, seconds, noisy, bikes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+'''
+This module benchmarks GPX ride file parsing and summary computation.
+Run with:
+    python bench_ride_import.py [points]
+Generates a GPX document of 100k track points (by default), then reports the
+parse throughput and the peak memory allocated while parsing.
+'''
+
+# Library imports
+import io
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Project imports
+from cyequ.ridefile import parse_ride_file, ride_summary
+
+
+def make_gpx(points):
+    '''
+    Returns a GPX document of *points* track points, one per second.
+    '''
+
+    out = io.StringIO()
+    out.write('<?xml version="1.0" encoding="UTF-8"?>'
+              '<gpx version="1.1" creator="bench"'
+              ' xmlns="http://www.topografix.com/GPX/1/1">'
+              '<trk><name>Benchmark</name><trkseg>')
+    start = datetime(2020, 4, 30, 12, 0, 0)
+    for i in range(points):
+        out.write('<trkpt lat="{:.6f}" lon="{:.6f}"><ele>{:.1f}</ele>'
+                  '<time>{:%Y-%m-%dT%H:%M:%S}Z</time></trkpt>'
+                  .format(65.0 + i * 1e-5, 25.47 + i * 1e-5, 10 + i % 50,
+                          start + timedelta(seconds=i)))
+    out.write('</trkseg></trk></gpx>')
+    return out.getvalue().encode("utf-8")
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    doc = make_gpx(points)
+    print("GPX document: {} points, {:.1f} MB"
+          .format(points, len(doc) / 1e6))
+    # Throughput without tracemalloc overhead
+    start = time.perf_counter()
+    name, track = parse_ride_file(io.BytesIO(doc))
+    parsed = time.perf_counter()
+    summary = ride_summary(track)
+    done = time.perf_counter()
+    print("Parse:   {:.3f} s, {:.0f} points/s, {:.1f} MB/s"
+          .format(parsed - start, points / (parsed - start),
+                  len(doc) / 1e6 / (parsed - start)))
+    print("Summary: {:.4f} s".format(done - parsed))
+    print("Summary: {}".format(summary))
+    # Peak memory of parsing, the document itself excluded
+    tracemalloc.start()
+    parse_ride_file(io.BytesIO(doc))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("Peak memory while parsing: {:.1f} MB ({:.0f} B/point)"
+          .format(peak / 1e6, peak / points))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+'''
+This module benchmarks the read latency of the API under concurrent writes,
+with and without DB_ROUTING.
+Run with:
+    python bench_routing.py [readers] [writers] [seconds]
+Creates a user with ten bikes in a database file in a temporary directory
+for each run. *readers* (default 4) threads GET EquipmentItem for *seconds*
+(default 5), alone and with *writers* (default 2) threads renaming bikes
+with PATCH. Prints the reads and writes done and the median and 99th
+percentile read latency of each run.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db, json
+from cyequ.constants import MERGE_PATCH
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+BIKE_URL = "/api/users/Rider1/all_equipment/Bike{}/"
+
+
+def populate(bikes=10):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def run(routing, readers, writers, seconds):
+    '''
+    Runs the load on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db"),
+                      "DB_ROUTING": routing})
+    with app.app_context():
+        db.create_all()
+        populate()
+    client = app.test_client()
+    stop = time.monotonic() + seconds
+    latencies = []
+    writes = []
+
+    def read(index):
+        url = BIKE_URL.format(index % 10 + 1)
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            assert client.get(url).status_code == 200
+            latencies.append(time.perf_counter() - start)
+
+    def write(index):
+        url = BIKE_URL.format(index % 10 + 1)
+        count = 0
+        while time.monotonic() < stop:
+            body = json.dumps({"name": "Bike {} {}".format(index, count)})
+            resp = client.patch(url, data=body, content_type=MERGE_PATCH)
+            assert resp.status_code == 204, resp.data
+            count += 1
+        writes.append(count)
+
+    threads = [threading.Thread(target=read, args=(i,))
+               for i in range(readers)]
+    threads += [threading.Thread(target=write, args=(i,))
+                for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    print("{:<8} {:>7} {:>7} {:>7} {:>8.2f}ms {:>8.2f}ms".format(
+        "on" if routing else "off", writers, len(latencies), sum(writes),
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print("{:<8} {:>7} {:>7} {:>7} {:>10} {:>10}".format(
+        "routing", "writers", "reads", "writes", "read p50", "read p99"))
+    for routing in (False, True):
+        for count in (0, writers):
+            run(routing, readers, count, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+'''
+This module benchmarks the full-text search of equipment and components.
+Run with:
+    python bench_search.py [components]
+Builds a database of 1M components (by default) in a temporary directory,
+with the search index filled by its triggers, then compares the latency of
+ranked searches of one user to LIKE scans over the same columns, both of
+one user and of the whole fleet.
+'''
+
+# Library imports
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.models import intern_catalog
+from cyequ.search import search
+
+BRANDS = ["RockShox", "Fox", "Shimano", "Sram", "DT Swiss", "Mavic",
+          "Continental", "Maxxis", "Schwalbe", "Hope", "Race Face", "Magura"]
+MODELS = ["Reverb", "Pike", "Lyrik", "XT", "Deore", "GX Eagle", "XD 1501",
+          "Crossmax", "Trail King", "Minion DHF", "Nobby Nic", "Tech 4",
+          "Atlas", "MT7", "Transfer", "Float X2"]
+CATEGORIES = ["Seat Post", "Fork", "Rear Shock", "Rear Wheel", "Front Wheel",
+              "Front Tire", "Rear Tire", "Brakes", "Crank", "Derailleur"]
+QUERIES = ["rockshox reverb", "minion", "sram gx ea", "float x2",
+           "front tire maxxis", "trail k"]
+USERS = 1000
+EQUIPMENT_PER_USER = 5
+
+
+def populate(components):
+    '''
+    Inserts users, equipment and *components* components with random
+    brands and models. Returns the rows per second of the component insert.
+    '''
+
+    rng = random.Random(1)
+    connection = db.session.connection()
+    connection.exec_driver_sql(
+        "INSERT INTO user (uri, name) VALUES (?, ?)",
+        [("U{}".format(i), "U{}".format(i)) for i in range(1, USERS + 1)]
+    )
+    equipment = USERS * EQUIPMENT_PER_USER
+    keys = [(rng.choice(BRANDS), rng.choice(MODELS), "Mountain Bike")
+            for i in range(equipment)]
+    connection.exec_driver_sql(
+        "INSERT INTO equipment (uri, name, category, catalog_id,"
+        " date_added, owner) VALUES (?, ?, 'Mountain Bike', ?, ?, ?)",
+        [("B{}".format(i), "Bike {}".format(i), catalog_id,
+          datetime(2019, 1, 1), (i - 1) % USERS + 1)
+         for i, catalog_id in enumerate(intern_catalog(db.session, keys), 1)]
+    )
+    start = time.perf_counter()
+    retired = datetime(2019, 6, 1)
+    for first in range(1, components + 1, 100000):
+        numbers = range(first, min(first + 100000, components + 1))
+        keys = [(rng.choice(BRANDS), rng.choice(MODELS),
+                 rng.choice(CATEGORIES)) for i in numbers]
+        ids = intern_catalog(db.session, keys)
+        connection.exec_driver_sql(
+            "INSERT INTO component (uri, name, category, catalog_id,"
+            " date_added, date_retired, ride_seconds, equipment_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+            [(None, "Part {}".format(i), key[2], catalog_id,
+              datetime(2019, 1, 1),
+              retired.replace(second=i % 60, minute=i // 60 % 60,
+                              hour=i // 3600 % 24, day=1 + i // 86400 % 28),
+              (i - 1) % equipment + 1)
+             for i, key, catalog_id in zip(numbers, keys, ids)]
+        )
+    db.session.commit()
+    return components / (time.perf_counter() - start)
+
+
+def timed(func, repeat=20):
+    '''
+    Returns the median seconds of *repeat* calls of func.
+    '''
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def like_search(query, owner=None):
+    '''
+    The LIKE scan the search index replaces. Without *owner* all matches of
+    the fleet are counted.
+    '''
+
+    conditions, params = [], {"owner": owner}
+    for i, word in enumerate(query.split()):
+        params["w{}".format(i)] = "%{}%".format(word)
+        conditions.append("(c.name LIKE :w{0} OR c.category LIKE :w{0}"
+                          " OR k.brand LIKE :w{0} OR k.model LIKE :w{0})"
+                          .format(i))
+    if owner is None:
+        select = "SELECT count(*) FROM component c JOIN catalog k" \
+                 " ON k.id = c.catalog_id WHERE "
+    else:
+        # CROSS JOIN keeps SQLite from reordering: owner's equipment first
+        select = "SELECT c.id FROM equipment e CROSS JOIN component c" \
+                 " ON c.equipment_id = e.id CROSS JOIN catalog k" \
+                 " ON k.id = c.catalog_id WHERE e.owner = :owner AND "
+    return db.session.execute(db.text(select + " AND ".join(conditions)),
+                              params).fetchall()
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    components = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db")})
+    with app.app_context():
+        db.create_all()
+        rate = populate(components)
+        print("Inserted {} components with index triggers: {:.0f} rows/s"
+              .format(components, rate))
+        for query in QUERIES:
+            total = search(query, 42)[0]
+            fts = timed(lambda: search(query, 42))
+            like = timed(lambda: like_search(query, 42), repeat=3)
+            fleet = timed(lambda: like_search(query), repeat=3)
+            print("{:<18} {:>3} hits  FTS5 {:6.2f} ms  LIKE {:6.2f} ms"
+                  "  fleet LIKE {:8.2f} ms"
+                  .format(query, total, fts * 1000, like * 1000,
+                          fleet * 1000))
+
+
+if __name__ == "__main__":
+    main()
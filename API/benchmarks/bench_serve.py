@@ -0,0 +1,205 @@
+'''
+This module benchmarks cyequ-serve against the flask development server.
+Run with:
+    python bench_serve.py [workers] [clients] [seconds]
+Creates a populated database and a configuration file in a temporary
+directory and starts each server on it in turn. Then prints the requests per
+second of *clients* (default 32) threads fetching API documents for
+*seconds* (default 10), and the memory of the server processes after the
+load: the resident set size (RSS) summed over the processes, which counts
+shared pages once per process, and the proportional set size (PSS), which
+divides them between the processes sharing them.
+'''
+
+# Library imports
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.models import User, Equipment, Component
+
+CATEGORIES = ["Fork", "Rear Shock", "Seat Post", "Saddle", "Crank",
+              "Derailleur", "Brakes", "Front Wheel", "Rear Wheel", "Chain"]
+ENDPOINTS = ["/api/users/",
+             "/api/users/Rider1/",
+             "/api/users/Rider1/all_equipment/",
+             "/api/users/Rider1/all_equipment/Bike1/"]
+
+
+def populate(bikes=10):
+    '''
+    Adds a user with *bikes* bikes of ten components each.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    retired = datetime(9999, 12, 31, 23, 59, 59)
+    for i in range(1, bikes + 1):
+        bike = Equipment(uri="Bike{}".format(i), name="Bike {}".format(i),
+                         category="Mountain Bike", brand="Kona",
+                         model="Hei Hei", date_added=added, owner=user.id)
+        db.session.add(bike)
+        db.session.flush()
+        for category in CATEGORIES:
+            db.session.add(Component(
+                uri="Bike{}{}1".format(i, category.replace(" ", "")),
+                name="Bike {} {}".format(i, category), category=category,
+                brand="Shimano", model="XT", date_added=added,
+                date_retired=retired, equipment_id=bike.id))
+    db.session.commit()
+
+
+def free_port():
+    '''
+    Returns a free TCP port of localhost.
+    '''
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, timeout=60):
+    '''
+    Waits until the server at *port* answers.
+    '''
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(
+                "http://127.0.0.1:{}/api/".format(port)).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def processes(pid):
+    '''
+    Returns *pid* and the pids of its descendants.
+    '''
+
+    pids = [pid]
+    for child in pids:
+        try:
+            with open("/proc/{0}/task/{0}/children".format(child)) as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def memory(pid):
+    '''
+    Returns the summed RSS and PSS in kB of *pid* and its descendants.
+    '''
+
+    rss = pss = 0
+    for child in processes(pid):
+        try:
+            with open("/proc/{}/smaps_rollup".format(child)) as f:
+                for line in f:
+                    key, value = line.split(":", 1)
+                    if key == "Rss":
+                        rss += int(value.split()[0])
+                    elif key == "Pss":
+                        pss += int(value.split()[0])
+        except OSError:
+            pass
+    return rss, pss
+
+
+def load(port, clients, seconds):
+    '''
+    Fetches the endpoints with *clients* threads for *seconds* and returns
+    the requests per second.
+    '''
+
+    done = []
+    stop = time.monotonic() + seconds
+
+    def client():
+        count = 0
+        while time.monotonic() < stop:
+            url = ENDPOINTS[count % len(ENDPOINTS)]
+            urllib.request.urlopen(
+                "http://127.0.0.1:{}{}".format(port, url)).read()
+            count += 1
+        done.append(count)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / seconds
+
+
+def run(name, command, port, env, clients, seconds):
+    '''
+    Starts the server of *command*, loads it and prints the results.
+    '''
+
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        rps = load(port, clients, seconds)
+        rss, pss = memory(server.pid)
+        print("{:<12} {:>10.0f} {:>10} {:>10}".format(
+            name, rps, rss // 1024, pss // 1024))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    workers = sys.argv[1] if len(sys.argv) > 1 else str(os.cpu_count())
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    tmpdir = tempfile.mkdtemp()
+    uri = "sqlite:///" + os.path.join(tmpdir, "bench.db")
+    app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+    with app.app_context():
+        db.create_all()
+        populate()
+    config = os.path.join(tmpdir, "config.py")
+    with open(config, "w") as f:
+        f.write("SQLALCHEMY_DATABASE_URI = {!r}\n".format(uri))
+    env = dict(os.environ, CYEQU_CONFIG=config)
+    print("{:<12} {:>10} {:>10} {:>10}".format(
+        "server", "req/s", "RSS MB", "PSS MB"))
+    port = free_port()
+    # The development server reads the configuration through create_app
+    run("flask run", [sys.executable, "-c",
+                      "import os; from cyequ import create_app; "
+                      "from flask import Config; "
+                      "c = Config('.'); c.from_pyfile(os.environ"
+                      "['CYEQU_CONFIG']); "
+                      "create_app(dict(c)).run(port={}, threaded=True)"
+                      .format(port)],
+        port, env, clients, seconds)
+    port = free_port()
+    run("cyequ-serve", [sys.executable, "-m", "cyequ.serve", "--port",
+                        str(port), "--workers", workers, "--config", config],
+        port, env, clients, seconds)
+
+
+if __name__ == "__main__":
+    main()
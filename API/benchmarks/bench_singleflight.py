@@ -0,0 +1,108 @@
+'''
+This module benchmarks identical concurrent GET requests without and with
+request coalescing.
+Run with:
+    python bench_singleflight.py [screens] [rounds] [bikes]
+Creates a user with *bikes* bikes (default 500) in a database file in a
+temporary directory. Then *screens* screens (default 20) get the user's
+equipment collection at the same moment, *rounds* times (default 20).
+Prints the SQL statements run, the requests coalesced and the median and
+largest latency of the requests.
+'''
+
+# Library imports
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event
+
+# Project imports
+from cyequ import create_app, db
+from cyequ.models import User, Equipment
+
+URL = "/api/users/Rider1/all_equipment/"
+
+
+def populate(bikes):
+    '''
+    Adds a user with *bikes* bikes.
+    '''
+
+    user = User(uri="Rider1", name="Rider")
+    db.session.add(user)
+    db.session.flush()
+    added = datetime(2020, 1, 1, 12)
+    for i in range(1, bikes + 1):
+        db.session.add(Equipment(uri="Bike{}".format(i),
+                                 name="Bike {}".format(i),
+                                 category="Mountain Bike", brand="Kona",
+                                 model="Hei Hei", date_added=added,
+                                 owner=user.id))
+    db.session.commit()
+
+
+def run(coalesce, screens, rounds, bikes):
+    '''
+    Runs the screens on a new database and prints the results.
+    '''
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                      + os.path.join(tmpdir, "bench.db"),
+                      "SINGLEFLIGHT": coalesce})
+    with app.app_context():
+        db.create_all()
+        populate(bikes)
+        engine = db.engine
+    statements = [0]
+    latencies = []
+    lock = threading.Lock()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*args):
+        statements[0] += 1
+
+    def get(barrier):
+        client = app.test_client()
+        barrier.wait()
+        start = time.perf_counter()
+        resp = client.get(URL)
+        assert resp.status_code == 200
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    for _ in range(rounds):
+        barrier = threading.Barrier(screens)
+        threads = [threading.Thread(target=get, args=(barrier,))
+                   for _ in range(screens)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    latencies.sort()
+    flights = app.extensions.get("cyequ_flights")
+    print("{:<9} {:>10} {:>9} {:>9.1f}ms {:>9.1f}ms".format(
+        "coalesced" if coalesce else "plain", statements[0],
+        flights.coalesced if flights else 0,
+        latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+
+
+def main():
+    '''
+    Runs the benchmark and prints the results.
+    '''
+
+    screens = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    bikes = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    print("{:<9} {:>10} {:>9} {:>11} {:>11}".format(
+        "mode", "statements", "coalesced", "p50", "max"))
+    for coalesce in (False, True):
+        run(coalesce, screens, rounds, bikes)
+
+
+if __name__ == "__main__":
+    main()
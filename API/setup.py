@@ -17,13 +17,17 @@ setup(
       install_requires=["Flask>=1.0.2",
                         "Flask-RESTful>=0.3.7",
                         "Flask-SQLAlchemy>=2.3.2",
-                        "SQLAlchemy>=1.3.1",
+                        "SQLAlchemy>=1.4",
                         "Click>=7.0",
                         "jsonschema>=3.0.1",
+                        "numpy>=1.18.0",
                         "pytest>=5.4.1",
                         "pytest-cov>=2.8.1",
                         "ipython>=7.13.0",
                         "ipython-genutils>=0.2.0",
                         "requests>=2.23.0"
-                        ]
+                        ],
+      entry_points={
+          "console_scripts": ["cyequ-serve=cyequ.serve:main"]
+      }
       )
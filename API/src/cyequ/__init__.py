@@ -8,14 +8,114 @@ See https://github.com/vesamaki/PWP_2020 for details
 # Library imports
 import os
 from datetime import datetime
-from flask import Flask
+from urllib.request import pathname2url
+from flask import Flask, Request, has_request_context, request, \
+    _app_ctx_stack
+from flask import json as flask_json
 from flask.json import JSONEncoder
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 # Project imports
 # --
 
-db = SQLAlchemy()
+# Request methods whose statements DB_ROUTING runs on the reader engine
+READ_METHODS = frozenset(("GET", "HEAD"))
+
+
+class RoutingSession(SignallingSession):
+    '''
+    This class defines the database session of the API. With the DB_ROUTING
+    option, the statements of GET and HEAD requests are run on the read-only
+    connections of the reader engine, and all other statements on the single
+    writer connection of the database engine. Flushes, and sessions bound to
+    a connection such as those of batches, are never routed to the reader.
+    '''
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        reader = self.app.extensions.get("cyequ_reader")
+        if reader is not None and isinstance(self.bind, Engine) \
+                and not self._flushing \
+                and has_request_context() and request.method in READ_METHODS:
+            return reader
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''
+    This class defines the Flask-SQLAlchemy extension of the API, creating
+    RoutingSessions.
+    '''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def _journal_wal(dbapi_connection, connection_record):
+    '''
+    Puts the database of a new writer connection in WAL mode, letting
+    readers continue while it writes.
+    '''
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def _manual_begin(dbapi_connection, connection_record):
+    '''
+    Leaves the transactions of a new reader connection to _begin_snapshot.
+    '''
+
+    dbapi_connection.isolation_level = None
+
+
+def _begin_snapshot(connection):
+    '''
+    Begins the transaction of a reader, so all reads of a session see the
+    same WAL snapshot.
+    '''
+
+    connection.exec_driver_sql("BEGIN")
+
+
+def _route_connections(app):
+    '''
+    Sets up the connections of DB_ROUTING: the database engine of *app* is
+    given a single writer connection and WAL mode, and a reader engine of
+    DB_READERS read-only connections is created.
+
+    Exceptions.
+    ValueError. If the database is not an SQLite database file.
+    '''
+
+    writer = db.get_engine(app)
+    path = writer.url.database
+    if writer.dialect.name != "sqlite" or not path or path == ":memory:":
+        raise ValueError("DB_ROUTING needs an SQLite database file")
+    event.listen(writer, "connect", _journal_wal)
+    reader = create_engine(
+        "sqlite:///file:{}?mode=ro&uri=true".format(pathname2url(path)),
+        poolclass=QueuePool, pool_size=app.config["DB_READERS"],
+        max_overflow=0,
+        connect_args={"check_same_thread": False})
+    event.listen(reader, "connect", _manual_begin)
+    event.listen(reader, "begin", _begin_snapshot)
+    app.extensions["cyequ_reader"] = reader
 
 
 # Custom JSONEncoder for converting dates to ISO 8601
@@ -34,6 +134,105 @@ class CustomJSONEncoder(JSONEncoder):
         return JSONEncoder.default(self, obj)
 
 
+def _isoformat(obj):
+    '''
+    Default of native encoders for types they do not handle.
+    '''
+
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable"
+                    .format(type(obj).__name__))
+
+
+class JSONProvider(object):
+    '''
+    This class defines the JSON encoder and decoder of the API, with the
+    dumps and loads functions of flask.json. Uses the fastest backend
+    installed of orjson, ujson and the standard library, unless one is
+    named. Output of all backends decodes to the same documents: keys
+    sorted and datetimes in ISO 8601 as by CustomJSONEncoder.
+
+    Calls with keyword arguments, such as indent, always use the standard
+    library. An application created with JSON_BACKEND uses that backend
+    within its context, others the default set with use().
+    '''
+
+    BACKENDS = ("orjson", "ujson", "stdlib")
+
+    def __init__(self, backend=None):
+        self.use(backend)
+
+    def use(self, backend=None):
+        '''
+        Switches the default to *backend*, or the fastest installed if None.
+
+        Exceptions.
+        ValueError. If the backend is unknown or not installed.
+        '''
+
+        available = {"orjson": orjson, "ujson": ujson, "stdlib": flask_json}
+        if backend is None:
+            backend = next(name for name in self.BACKENDS
+                           if available[name] is not None)
+        elif available.get(backend) is None:
+            raise ValueError("JSON backend {} is not available"
+                             .format(backend))
+        self.backend = backend
+
+    def current(self):
+        '''
+        Returns the backend of the current application, or the default.
+        '''
+
+        # The stack directly, as the current_app proxy costs more than
+        # encoding a small document
+        context = _app_ctx_stack.top
+        if context is None:
+            return self.backend
+        return context.app.extensions.get("cyequ_json", self.backend)
+
+    def dumps(self, obj, **kwargs):
+        '''
+        Serializes *obj* to a JSON formatted str.
+        '''
+
+        backend = self.current()
+        if kwargs or backend == "stdlib":
+            kwargs.setdefault("cls", CustomJSONEncoder)
+            return flask_json.dumps(obj, **kwargs)
+        if backend == "orjson":
+            return orjson.dumps(obj, default=_isoformat,
+                                option=orjson.OPT_SORT_KEYS).decode()
+        return ujson.dumps(obj, default=_isoformat, sort_keys=True,
+                           ensure_ascii=False, escape_forward_slashes=False)
+
+    def loads(self, s, **kwargs):
+        '''
+        Deserializes a JSON document of str or bytes *s*.
+        '''
+
+        backend = self.current()
+        if kwargs or backend == "stdlib":
+            return flask_json.loads(s, **kwargs)
+        if backend == "orjson":
+            return orjson.loads(s)
+        return ujson.loads(s)
+
+
+# JSON provider of all responses and request bodies
+json = JSONProvider()
+
+
+class JSONRequest(Request):
+    '''
+    This class defines the request class of the API, parsing JSON bodies
+    with the JSON provider.
+    '''
+
+    json_module = json
+
+
 # Adapted from PWP "Flask API Project Layout" -material
 # Based on:
 # http://flask.pocoo.org/docs/1.0/tutorial/factory/#the-application-factory
@@ -53,7 +252,26 @@ def create_app(test_config=None):
         # Path to database file
         SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path,
                                                             "development.db"),
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Path to append-only ride stream store file
+        STREAM_STORE=os.path.join(app.instance_path, "rides.streams"),
+        # Parser processes of archive imports, one per core if None
+        ARCHIVE_WORKERS=None,
+        # Directory of background job status files, shared by the
+        # processes serving the application
+        JOB_DIR=os.path.join(app.instance_path, "jobs"),
+        # JSON backend of the application, orjson, ujson or stdlib. The
+        # default of cyequ.json if None
+        JSON_BACKEND=None,
+        # Warm up the application before returning it, see cyequ.warmup
+        WARMUP=False,
+        # Route the reads of GET requests to read-only connections and all
+        # writes to a single writer connection, see RoutingSession
+        DB_ROUTING=False,
+        # Read-only connections of DB_ROUTING
+        DB_READERS=4,
+        # Days the change log is kept in full, see cyequ.changes
+        CHANGES_RETENTION_DAYS=30
     )
     # Optionally set Flask instance config from test_config or from file.
     # if config.py is given, then it overrides the above default configuration
@@ -68,7 +286,34 @@ def create_app(test_config=None):
         pass
     # Callback used to initialize an application
     # for the use with this database setup.
+    if app.config["DB_ROUTING"]:
+        # One pooled writer connection, shared by the threads in turn
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+        connect_args = dict(options.get("connect_args") or {},
+                            check_same_thread=False)
+        options.update(poolclass=QueuePool, pool_size=1, max_overflow=0,
+                       connect_args=connect_args)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.init_app(app)
+    if app.config["DB_ROUTING"]:
+        _route_connections(app)
+    # Compress responses with an encoding accepted by the client
+    from cyequ import compression
+    compression.init_app(app)
+    # Limit the requests of each user and client IP if configured. Before
+    # the group commit writer, which dispatches the writes it admits
+    from cyequ import ratelimit
+    ratelimit.init_app(app)
+    # Run write requests through the group commit writer if configured
+    from cyequ import groupcommit
+    groupcommit.init_app(app)
+    # Give GET responses ETags, pushed by the event streams
+    from cyequ import events
+    events.init_app(app)
+    # Run identical concurrent GET requests once if configured. Last, so
+    # responses are shared before the other after-request hooks
+    from cyequ import singleflight
+    singleflight.init_app(app)
     # Models defines the init-db command, but
     # import inside this function to prevent circular imports
     from cyequ import models
@@ -78,6 +323,46 @@ def create_app(test_config=None):
     # Register the testgen command for the Flask instance
     # Use as "flask testgen" in CMD
     app.cli.add_command(models.add_test_data)
+    # Maintenance scheduler hooks into model events and defines the
+    # due-report and set-interval commands
+    from cyequ import maintenance
+    app.cli.add_command(maintenance.due_report_command)
+    app.cli.add_command(maintenance.set_interval_command)
+    # Commands of modules not needed by requests are registered with
+    # LazyCommand, importing the module only when the command is run
+    from cyequ.lazy import LazyCommand
+    # Register the import-archive command for bulk ride imports
+    app.cli.add_command(LazyCommand(
+        "import-archive", "cyequ.archive:import_archive_command",
+        "Imports a ZIP archive of GPX and TCX files for a user."))
+    # Register the export command sharing the export endpoint's pipeline
+    app.cli.add_command(LazyCommand(
+        "export", "cyequ.export:export_command",
+        "Exports the equipment, components and rides of a user."))
+    app.cli.add_command(LazyCommand(
+        "export-columnar", "cyequ.columnar:export_columnar_command",
+        "Exports all tables as columns to a directory."))
+    # Search index is created with the tables. Also register the
+    # search-rebuild command for existing databases
+    from cyequ import search
+    app.cli.add_command(search.search_rebuild_command)
+    # Change log is also created with the tables. Register the
+    # compact-changes command run to truncate it past retention
+    from cyequ import changes
+    app.cli.add_command(changes.compact_changes_command)
+    # Garage summaries are kept up to date from the change log. Register
+    # the garage-rebuild and garage-check commands
+    from cyequ import garage
+    app.cli.add_command(garage.garage_rebuild_command)
+    app.cli.add_command(garage.garage_check_command)
+    # Register the bulk-load command for CSV migrations
+    app.cli.add_command(LazyCommand(
+        "bulk-load", "cyequ.bulkload:bulk_load_command",
+        "Loads users, equipment, components and rides from CSV files."))
+    # Register the migrate-catalog command for databases created before
+    # brands and models were moved into the catalog table
+    from cyequ import catalog
+    app.cli.add_command(catalog.migrate_catalog_command)
     # API blueprint defined in api, but
     # import inside this function to prevent circular imports
     from cyequ import api
@@ -85,5 +370,18 @@ def create_app(test_config=None):
     app.register_blueprint(api.api_bp)
     # Use CustomJSONEndcoder
     app.json_encoder = CustomJSONEncoder
+    # Parse request bodies with the JSON provider
+    app.request_class = JSONRequest
+    if app.config.get("JSON_BACKEND"):
+        app.extensions["cyequ_json"] = \
+            JSONProvider(app.config["JSON_BACKEND"]).backend
+    # Register the warmup command, and warm up now if configured
+    app.cli.add_command(LazyCommand(
+        "warmup", "cyequ.warmup:warmup_command",
+        "Warms up the application and reports the time of each step."))
+    if app.config["WARMUP"]:
+        from cyequ.warmup import warmup
+        with app.app_context():
+            warmup()
     # print(app.instance_path)  # Just to see where instance data is stored
     return app
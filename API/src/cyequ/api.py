@@ -12,7 +12,8 @@ from flask_restful import Api
 
 # Project imports
 from cyequ.constants import USER_PROFILE, EQUIPMENT_PROFILE, \
-                            COMPONENT_PROFILE, ERROR_PROFILE, \
+                            COMPONENT_PROFILE, RIDE_PROFILE, JOB_PROFILE, \
+                            ERROR_PROFILE, \
                             LINK_RELATIONS_URL, APIARY_URL
 
 api_bp = Blueprint("api", __name__)
@@ -25,6 +26,17 @@ from cyequ.resources.user import UserCollection, UserItem  # noqa:E402
 from cyequ.resources.equipment import EquipmentByUser, \
                                       EquipmentItem  # noqa:E402
 from cyequ.resources.component import ComponentItem  # noqa:E402
+from cyequ.resources.maintenance import MaintenanceDue  # noqa:E402
+from cyequ.resources.ride import RideImport, RideArchive, RideItem, \
+                                 RideStreams  # noqa:E402
+from cyequ.resources.job import JobItem  # noqa:E402
+from cyequ.resources.export import UserExport  # noqa:E402
+from cyequ.resources.search import UserSearch  # noqa:E402
+from cyequ.resources.changes import UserChanges  # noqa:E402
+from cyequ.resources.events import UserEvents  # noqa:E402
+from cyequ.resources.garage import UserGarage  # noqa:E402
+from cyequ.resources.catalog import CatalogSuggest  # noqa:E402
+from cyequ.resources.batch import Batch  # noqa:E402
 
 # Adapted from PWP Ex3
 # Static route: Link relations
@@ -59,6 +71,22 @@ def redirect_to_apiary_comp_prof():
     '''
     return redirect(APIARY_URL + "component-profile")
 
+# Static route: Ride Profile
+@api_bp.route(RIDE_PROFILE, methods=['GET'])
+def redirect_to_apiary_ride_prof():
+    '''
+    Redirect to API's APIARY-documentation for ride profile url.
+    '''
+    return redirect(APIARY_URL + "ride-profile")
+
+# Static route: Job Profile
+@api_bp.route(JOB_PROFILE, methods=['GET'])
+def redirect_to_apiary_job_prof():
+    '''
+    Redirect to API's APIARY-documentation for job profile url.
+    '''
+    return redirect(APIARY_URL + "job-profile")
+
 # Static route: Error Profile
 @api_bp.route(ERROR_PROFILE, methods=['GET'])
 def redirect_to_apiary_err_prof():
@@ -70,9 +98,22 @@ def redirect_to_apiary_err_prof():
 
 # Registering resource routes
 api.add_resource(Entry, "/api/")
+api.add_resource(Batch, "/api/batch")
 api.add_resource(UserCollection, "/api/users/")
 api.add_resource(UserItem, "/api/users/<user>/")
 api.add_resource(EquipmentByUser, "/api/users/<user>/all_equipment/")
 api.add_resource(EquipmentItem, "/api/users/<user>/all_equipment/<equipment>/")
 api.add_resource(ComponentItem, "/api/users/<user>/all_equipment/"
                                 "<equipment>/<component>/")
+api.add_resource(UserExport, "/api/users/<user>/export")
+api.add_resource(UserSearch, "/api/users/<user>/search")
+api.add_resource(UserChanges, "/api/users/<user>/changes")
+api.add_resource(UserEvents, "/api/users/<user>/events")
+api.add_resource(UserGarage, "/api/users/<user>/garage/")
+api.add_resource(MaintenanceDue, "/api/users/<user>/maintenance-due/")
+api.add_resource(RideImport, "/api/users/<user>/rides/import")
+api.add_resource(RideArchive, "/api/users/<user>/rides/archive")
+api.add_resource(RideItem, "/api/users/<user>/rides/<ride>/")
+api.add_resource(RideStreams, "/api/users/<user>/rides/<ride>/streams")
+api.add_resource(JobItem, "/api/jobs/<job>/")
+api.add_resource(CatalogSuggest, "/api/catalog/suggest")
@@ -0,0 +1,253 @@
+'''
+This module imports ride archives, ZIP files of GPX and TCX ride files, such
+as account exports of other platforms.
+
+Ride files are parsed in parallel by a ProcessPoolExecutor. The calling
+thread is the single writer: it appends the parsed streams to the stream
+store and inserts the rides in batches with one executemany and one commit
+per batch, after writing the batch's streams with one fsync. Files already
+imported by the user are skipped by content hash.
+'''
+
+# Library imports
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from xml.etree.ElementTree import ParseError
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+# Project imports
+from cyequ import db
+from cyequ.models import User, Ride
+from cyequ.ridefile import RideFileError, parse_ride_file, ride_summary
+from cyequ.streams import encode_stream, get_store, stream_fields
+
+# Ride file name extensions read from archives
+RIDE_FILE_EXTENSIONS = (".gpx", ".tcx")
+
+
+def parse_member(filename, data):
+    '''
+    Parses one ride file of an archive. Runs in a worker process.
+
+    Returns a dict of the content hash, the ride row values and the encoded
+    stream segment, or of the content hash and an error message.
+    '''
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    try:
+        name, points = parse_ride_file(io.BytesIO(data))
+        summary = ride_summary(points)
+        if summary["duration"] <= 0:
+            raise RideFileError("Ride must have a positive duration")
+    except (ParseError, RideFileError, ValueError) as err:
+        return {"hash": content_hash, "error": "{}: {}".format(filename, err)}
+    if not name:
+        name = os.path.splitext(os.path.basename(filename))[0]
+    summary["name"] = name[:64]
+    return {"hash": content_hash,
+            "ride": summary,
+            "segment": encode_stream(stream_fields(points))
+            }
+
+
+class ImportProgress(object):
+    '''
+    Counters of an archive import, updated by the writer.
+    '''
+
+    def __init__(self, total=0):
+        self.total = total
+        self.processed = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        '''
+        Seconds since the import started, until it finished.
+        '''
+
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        '''
+        Processed files per second.
+        '''
+
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        '''
+        Returns the counters as a JSON compatible dict.
+        '''
+
+        return {"total": self.total,
+                "processed": self.processed,
+                "inserted": self.inserted,
+                "duplicates": self.duplicates,
+                "failed": self.failed,
+                "errors": self.errors[:20],
+                "elapsed": round(self.elapsed, 3),
+                "files_per_second": round(self.throughput, 1)
+                }
+
+
+def _write_batch(user_id, batch, seen, progress):
+    '''
+    Writes a batch of parsed rides of a user. Rides whose content hash is
+    already imported, or seen earlier in the archive, are skipped.
+    '''
+
+    hashes = [parsed["hash"] for parsed in batch]
+    seen.update(row[0] for row in db.session.query(Ride.content_hash)
+                .filter(Ride.rider == user_id)
+                .filter(Ride.content_hash.in_(hashes)))
+    new = []
+    for parsed in batch:
+        if parsed["hash"] in seen:
+            progress.duplicates += 1
+            continue
+        seen.add(parsed["hash"])
+        new.append(parsed)
+    spans = get_store().extend([parsed["segment"] for parsed in new])
+    rows = [dict(parsed["ride"],
+                 rider=user_id,
+                 content_hash=parsed["hash"],
+                 stream_offset=offset,
+                 stream_length=length
+                 )
+            for parsed, (offset, length) in zip(new, spans)]
+    if rows:
+        # One executemany for the batch, then URIs as for single rides
+        db.session.execute(Ride.__table__.insert(), rows)
+        db.session.execute(text("UPDATE ride SET uri = name || id "
+                                "WHERE rider = :rider AND uri IS NULL"),
+                           {"rider": user_id}
+                           )
+    db.session.commit()
+    progress.inserted += len(rows)
+
+
+def import_archive(user_id, archive, workers=None, batch_size=200,
+                   progress=None, report=None):
+    '''
+    Imports the ride files of a ZIP archive (path or binary file object) for
+    the user of id *user_id*. Must be called within an application context.
+
+    Parsing is fanned out to *workers* processes, with at most two files per
+    worker in flight to keep memory bounded. *report* is called with the
+    progress after each written batch.
+
+    Returns the ImportProgress.
+
+    Exceptions.
+    zipfile.BadZipFile. If the archive is not a ZIP file.
+    '''
+
+    with zipfile.ZipFile(archive) as zf:
+        members = [info for info in zf.infolist()
+                   if not info.is_dir()
+                   and info.filename.lower().endswith(RIDE_FILE_EXTENSIONS)]
+        if progress is None:
+            progress = ImportProgress()
+        progress.total = len(members)
+        workers = workers or os.cpu_count() or 1
+        # Spawned workers do not inherit the server's threads or connections
+        context = multiprocessing.get_context("spawn")
+        pending, batch, seen = set(), [], set()
+        # Member names of pending parses, for errors raised by a worker
+        names = {}
+        queue = iter(members)
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            while True:
+                while len(pending) < workers * 2:
+                    info = next(queue, None)
+                    if info is None:
+                        break
+                    future = pool.submit(parse_member, info.filename,
+                                         zf.read(info))
+                    names[future] = info.filename
+                    pending.add(future)
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename = names.pop(future)
+                    try:
+                        parsed = future.result()
+                    except Exception as err:
+                        # A file the parser did not foresee fails alone
+                        parsed = {"error": "{}: {}".format(filename, err)}
+                    progress.processed += 1
+                    if "error" in parsed:
+                        progress.failed += 1
+                        progress.errors.append(parsed["error"])
+                    else:
+                        batch.append(parsed)
+                if len(batch) >= batch_size:
+                    _write_batch(user_id, batch, seen, progress)
+                    batch = []
+                    if report is not None:
+                        report(progress)
+        _write_batch(user_id, batch, seen, progress)
+    progress.finished = time.monotonic()
+    if report is not None:
+        report(progress)
+    return progress
+
+
+def run_archive_job(job, user_id, path, workers=None):
+    '''
+    Job function of archive imports uploaded to the API. Imports the archive
+    saved at *path* and removes it afterwards.
+    '''
+
+    job.progress = ImportProgress()
+    try:
+        import_archive(user_id, path, workers, progress=job.progress,
+                       report=lambda progress: job.save())
+    finally:
+        os.unlink(path)
+
+
+@click.command("import-archive")
+@click.argument("user")
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", type=int, default=None,
+              help="Parser processes, one per core by default.")
+@click.option("--batch-size", type=int, default=200,
+              help="Rides per insert batch.")
+@with_appcontext
+def import_archive_command(user, archive, workers, batch_size):
+    '''
+    Imports a ZIP archive of GPX and TCX files for the user of URI USER.
+    '''
+
+    db_user = User.query.filter_by(uri=user).first()
+    if db_user is None:
+        raise click.BadParameter("No user was found with URI {}".format(user))
+
+    def report(progress):
+        click.echo("{processed}/{total} files, {inserted} inserted, "
+                   "{duplicates} duplicates, {failed} failed, "
+                   "{files_per_second} files/s".format(**progress.as_dict()))
+
+    try:
+        progress = import_archive(db_user.id, archive, workers, batch_size,
+                                  report=report)
+    except zipfile.BadZipFile as err:
+        raise click.ClickException(str(err))
+    for error in progress.errors:
+        click.echo("Failed: {}".format(error))
@@ -0,0 +1,474 @@
+'''
+This module holds the ASGI application of the API, an optional entry point
+for deployments with many slow clients.
+
+A WSGI worker thread is pinned to a request until its response has been
+sent, so clients on slow networks polling UserItem and EquipmentItem use up
+the threads of a worker. AsyncReadApp serves the GET requests of these two
+resources on the event loop instead: the database is read asynchronously
+with aiosqlite if it is installed, or else with queries run in a small
+thread pool that only holds a thread for the duration of a query, and the
+slow sending of the response is awaited. The documents are built by the
+same functions as the resources' GET methods, with the same request hooks,
+so they are identical. All other requests, including every write, are
+passed to the WSGI application in a thread pool.
+
+A server-sent event stream of UserEvents holds a thread until the client
+disconnects. Streams are run in a pool of their own, so they never take the
+threads of other requests. The pool has ASGI_EVENT_STREAMS threads, and a
+stream beyond them is answered with 503 Service Unavailable and a
+Retry-After header.
+
+Run with an ASGI server supporting application factories, e.g.
+    uvicorn --factory cyequ.asgi:create_asgi_app
+The async read path needs an SQLite database file.
+'''
+
+# Library imports
+import asyncio
+import io
+import sqlite3
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.request import pathname2url
+from flask import Response
+from werkzeug.exceptions import HTTPException
+
+try:
+    import aiosqlite
+except ImportError:
+    # Queries are run in a thread pool without aiosqlite
+    aiosqlite = None
+
+# Project imports
+from cyequ import create_app, db, json
+from cyequ.constants import MASON, ASYNC_READ
+from cyequ.utils import create_error_response
+from cyequ.resources.events import RETRY
+from cyequ.resources.user import user_item_body
+from cyequ.resources.equipment import equipment_item_body
+
+# Defaults of the configuration keys of the module
+DEFAULTS = {
+    # Read-only database connections of the async read path
+    "ASGI_DB_CONNECTIONS": 4,
+    # Threads running the requests passed to the WSGI application
+    "ASGI_WSGI_THREADS": 16,
+    # Threads of event streams, one held by each open stream
+    "ASGI_EVENT_STREAMS": 64,
+}
+
+# Queries of the async read path. They select the same rows in the same
+# order as the queries of the models.
+USER_SQL = "SELECT id, name FROM user WHERE user.uri = ? LIMIT 1"
+EQUIPMENT_SQL = ("SELECT id, uri, name, category, "
+                 "(SELECT brand FROM catalog "
+                 "WHERE catalog.id = equipment.catalog_id), "
+                 "(SELECT model FROM catalog "
+                 "WHERE catalog.id = equipment.catalog_id), "
+                 "date_added, date_retired FROM equipment "
+                 "WHERE equipment.uri = ? LIMIT 1")
+COMPONENTS_SQL = ("SELECT id, uri, name, category, "
+                  "(SELECT brand FROM catalog "
+                  "WHERE catalog.id = component.catalog_id), "
+                  "(SELECT model FROM catalog "
+                  "WHERE catalog.id = component.catalog_id), "
+                  "date_added, date_retired FROM component "
+                  "WHERE component.equipment_id = ? "
+                  "ORDER BY component.category")
+
+# Rows standing in for the models when building documents
+UserRow = namedtuple("UserRow", "id name")
+ItemRow = namedtuple("ItemRow", "id uri name category brand model "
+                                "date_added date_retired")
+
+
+def _datetime(value):
+    '''
+    Returns a datetime of a DateTime column value as stored by SQLAlchemy.
+    '''
+
+    if value is None:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def _item(row):
+    '''
+    Returns an ItemRow of an equipment or component query row.
+    '''
+
+    return ItemRow(*row[:6], _datetime(row[6]), _datetime(row[7]))
+
+
+def _fetchall(connection, sql, params):
+    '''
+    Returns all rows of a query. Runs in a thread of the pool.
+    '''
+
+    cursor = connection.execute(sql, params)
+    try:
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class _Reader(object):
+    '''
+    Pool of read-only connections to the database file *path*, used by the
+    event loop.
+    '''
+
+    def __init__(self, path, size):
+        self.uri = "file:{}?mode=ro".format(pathname2url(path))
+        self.size = size
+        self.opened = 0
+        self.idle = None
+        self.executor = None
+        if aiosqlite is None:
+            self.executor = ThreadPoolExecutor(
+                size, thread_name_prefix="cyequ-asgi-db")
+
+    async def _acquire(self):
+        '''
+        Returns an idle connection, opening a new one if the pool is not
+        full.
+        '''
+
+        if self.idle is None:
+            self.idle = asyncio.LifoQueue()
+        if self.idle.empty() and self.opened < self.size:
+            self.opened += 1
+            try:
+                if aiosqlite is not None:
+                    return await aiosqlite.connect(self.uri, uri=True)
+                return sqlite3.connect(self.uri, uri=True,
+                                       check_same_thread=False)
+            except BaseException:
+                self.opened -= 1
+                raise
+        return await self.idle.get()
+
+    async def fetch(self, sql, params=()):
+        '''
+        Returns all rows of query *sql* with *params*.
+        '''
+
+        connection = await self._acquire()
+        try:
+            if aiosqlite is not None:
+                async with connection.execute(sql, params) as cursor:
+                    return await cursor.fetchall()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, _fetchall, connection, sql, params)
+        finally:
+            self.idle.put_nowait(connection)
+
+    async def close(self):
+        '''
+        Closes the idle connections and the thread pool.
+        '''
+
+        while self.idle is not None and not self.idle.empty():
+            connection = self.idle.get_nowait()
+            self.opened -= 1
+            if aiosqlite is not None:
+                await connection.close()
+            else:
+                connection.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+def _environ(scope, body):
+    '''
+    Returns the WSGI environ of the request of HTTP *scope* with *body*.
+    '''
+
+    root = scope.get("root_path", "")
+    path = scope["path"]
+    if root and path.startswith(root):
+        path = path[len(root):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root.encode("utf8").decode("latin1"),
+        "PATH_INFO": path.encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    # The body has been read, also when it was sent chunked
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def _read_body(receive):
+    '''
+    Returns the request body, or None if the client disconnected.
+    '''
+
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _start(status, headers):
+    '''
+    Returns the response start message of a WSGI status and header list.
+    '''
+
+    return {"type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin1"),
+                         value.encode("latin1"))
+                        for name, value in headers]}
+
+
+def _streams_busy():
+    '''
+    Returns the 503 response of an event stream over ASGI_EVENT_STREAMS.
+    '''
+
+    retry = RETRY // 1000
+    response = create_error_response(503, "Service unavailable",
+                                     "Too many event streams are open. "
+                                     "Retry after {} seconds.".format(retry)
+                                     )
+    response.headers["Retry-After"] = str(retry)
+    return response
+
+
+class AsyncReadApp(object):
+    '''
+    ASGI application serving GET requests of UserItem and EquipmentItem on
+    the event loop and passing other requests to the WSGI application *app*.
+    '''
+
+    def __init__(self, app):
+        for key, value in DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self.app = app
+        path = db.get_engine(app).url.database
+        if not path or path == ":memory:":
+            raise ValueError("The async read path needs a database file")
+        self.reader = _Reader(path, app.config["ASGI_DB_CONNECTIONS"])
+        self.executor = ThreadPoolExecutor(app.config["ASGI_WSGI_THREADS"],
+                                           thread_name_prefix="cyequ-asgi")
+        self.streams = ThreadPoolExecutor(app.config["ASGI_EVENT_STREAMS"],
+                                          thread_name_prefix="cyequ-events")
+        # Streams in the stream pool, changed on the event loop only
+        self.open_streams = 0
+        self.handlers = {"api.useritem": self._user_item,
+                         "api.equipmentitem": self._equipment_item}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError("Unsupported ASGI scope {}"
+                             .format(scope["type"]))
+        body = await _read_body(receive)
+        if body is None:
+            return
+        environ = _environ(scope, body)
+        endpoint, args = self._match(environ)
+        loop = asyncio.get_running_loop()
+        if endpoint == "api.userevents":
+            return await self._user_events(environ, send, loop)
+        handler = self.handlers.get(endpoint)
+        if handler is None:
+            return await loop.run_in_executor(
+                self.executor, self._call_wsgi, environ, send, loop)
+        response = await handler(environ, **args)
+        await self._send(send, response)
+
+    @staticmethod
+    async def _send(send, response):
+        '''
+        Sends flask Response *response*.
+        '''
+
+        await send(_start(response.status, response.headers.to_wsgi_list()))
+        await send({"type": "http.response.body",
+                    "body": response.get_data()})
+
+    async def _lifespan(self, receive, send):
+        '''
+        Handles the startup and shutdown events of the server.
+        '''
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def close(self):
+        '''
+        Closes the database connections and thread pools.
+        '''
+
+        await self.reader.close()
+        self.executor.shutdown(wait=False)
+        self.streams.shutdown(wait=False)
+
+    def _match(self, environ):
+        '''
+        Returns the endpoint of the GET request of *environ* and its view
+        arguments, or None for other requests and URLs not matched.
+        '''
+
+        if environ["REQUEST_METHOD"] != "GET":
+            return None, None
+        try:
+            endpoint, args = self.app.url_map.bind_to_environ(environ) \
+                .match()
+        except HTTPException:
+            # Redirects and errors are left for the WSGI application
+            return None, None
+        return endpoint, args
+
+    async def _user_events(self, environ, send, loop):
+        '''
+        Runs the event stream of *environ* with the WSGI application in a
+        thread of the stream pool, or answers 503 if every thread holds a
+        stream.
+        '''
+
+        if self.open_streams >= self.app.config["ASGI_EVENT_STREAMS"]:
+            return await self._send(send,
+                                    self._respond(environ, _streams_busy))
+        self.open_streams += 1
+        try:
+            await loop.run_in_executor(self.streams, self._call_wsgi,
+                                       environ, send, loop)
+        finally:
+            self.open_streams -= 1
+
+    def _call_wsgi(self, environ, send, loop):
+        '''
+        Runs the request of *environ* with the WSGI application and sends
+        the response as it is produced. Runs in a thread of the pool.
+        '''
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    if started:
+                        send_sync(_start(*started))
+                        started.clear()
+                    send_sync({"type": "http.response.body", "body": chunk,
+                               "more_body": True})
+            if started:
+                send_sync(_start(*started))
+            send_sync({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    def _respond(self, environ, build):
+        '''
+        Returns the response of function *build* in a request context of
+        *environ*, with the request hooks of the application run as for a
+        WSGI request.
+        '''
+
+        # Already read, not to be coalesced
+        environ[ASYNC_READ] = True
+        with self.app.request_context(environ):
+            response = self.app.preprocess_request()
+            if response is None:
+                response = build()
+            return self.app.process_response(
+                self.app.make_response(response))
+
+    async def _user_item(self, environ, user):
+        '''
+        Serves GET of UserItem.
+        '''
+
+        rows = await self.reader.fetch(USER_SQL, (user,))
+        if not rows:
+            return self._respond(environ, lambda: create_error_response(
+                404, "Not found", "No user was found with URI {}"
+                .format(user)))
+        db_user = UserRow(*rows[0])
+        return self._respond(environ, lambda: self._mason(
+            user_item_body(user, db_user)))
+
+    async def _equipment_item(self, environ, user, equipment):
+        '''
+        Serves GET of EquipmentItem.
+        '''
+
+        rows = await self.reader.fetch(USER_SQL, (user,))
+        if not rows:
+            return self._respond(environ, lambda: create_error_response(
+                404, "Not found", "No user was found with URI {}"
+                .format(user)))
+        db_user = UserRow(*rows[0])
+        rows = await self.reader.fetch(EQUIPMENT_SQL, (equipment,))
+        if not rows:
+            return self._respond(environ, lambda: create_error_response(
+                404, "Not found", "No equipment was found with URI {}"
+                .format(equipment)))
+        db_equip = _item(rows[0])
+        components = [_item(row) for row in await self.reader.fetch(
+            COMPONENTS_SQL, (db_equip.id,))]
+        return self._respond(environ, lambda: self._mason(
+            equipment_item_body(user, equipment, db_user, db_equip,
+                                components)))
+
+    def _mason(self, body):
+        '''
+        Returns the 200 response of Mason document *body*.
+        '''
+
+        return Response(json.dumps(body), 200, mimetype=MASON)
+
+
+def create_asgi_app(test_config=None):
+    '''
+    Creates the API flask application and returns it as an ASGI application
+    with the async read path.
+    '''
+
+    return AsyncReadApp(create_app(test_config))
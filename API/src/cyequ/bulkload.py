@@ -0,0 +1,412 @@
+'''
+This module holds the CSV bulk loader of the API database.
+
+Each input file is read in chunks. A chunk is validated column by column with
+NumPy, its parent URIs and catalog entries are resolved with one query per
+chunk, and its valid rows are inserted with one DB-API executemany and
+committed together.
+Non-unique indexes of the loaded tables are dropped for the load and rebuilt
+once at the end, and component schedules are recomputed with one set-based
+reschedule.
+
+Input files have a header row. Columns (optional ones in brackets):
+
+    users       name, [uri]
+    equipment   owner, name, category, brand, model, date_added,
+                [date_retired], [uri]
+    components  equipment, name, category, brand, model, date_added,
+                [date_retired], [uri]
+    rides       rider, name, datetime, duration, [equipment], [uri]
+
+owner and rider are user URIs, equipment is an equipment URI. Dates are given
+as "YYYY-MM-DD HH:MM:SS" like in the API. Rows without a uri get the API's
+URI, name followed by id. Rows violating a uniqueness constraint, such as
+rows loaded already, are skipped, so a load can be safely run again.
+'''
+
+# Library imports
+import csv
+import time
+import click
+import numpy as np
+from flask.cli import with_appcontext
+from sqlalchemy import select, text
+
+# Project imports
+from cyequ import db
+from cyequ.models import User, Equipment, Component, Ride, intern_catalog
+from cyequ.maintenance import IN_SERVICE, reschedule
+
+# Rows per chunk, validated and committed together
+CHUNK_SIZE = 50000
+
+
+class _Chunk(object):
+    '''
+    A chunk of CSV rows as NumPy string columns, with a mask of the rows
+    still valid and the errors of rejected rows.
+    '''
+
+    def __init__(self, columns, first_line):
+        self.columns = columns
+        self.size = len(next(iter(columns.values())))
+        self.lines = np.arange(first_line, first_line + self.size)
+        self.valid = np.ones(self.size, bool)
+        self.errors = []
+        self.values = {}
+
+    def reject(self, bad, message):
+        '''
+        Marks rows of mask *bad* invalid and records the error of each.
+        '''
+
+        bad &= self.valid
+        for line in self.lines[bad]:
+            self.errors.append("line {}: {}".format(line, message))
+        self.valid &= ~bad
+
+    def text(self, name, length, required=True):
+        '''
+        Validates a string column against the column's maximum length.
+        '''
+
+        column = np.char.strip(self.columns[name])
+        lengths = np.char.str_len(column)
+        self.reject(lengths > length,
+                    "{} longer than {} characters".format(name, length))
+        if required:
+            self.reject(lengths == 0, "{} missing".format(name))
+        self.values[name] = column
+        return column
+
+    def dates(self, name, required=True):
+        '''
+        Validates a datetime column. Empty values are NaT.
+        '''
+
+        column = np.char.strip(self.columns[name])
+        empty = column == ""
+        column = np.where(empty, "NaT", column)
+        try:
+            parsed = column.astype("datetime64[us]")
+        except ValueError:
+            # Locate the malformed values one by one
+            parsed = np.empty(self.size, "datetime64[us]")
+            for i, value in enumerate(column):
+                try:
+                    parsed[i] = np.datetime64(value, "us")
+                except ValueError:
+                    parsed[i] = np.datetime64("NaT")
+                    self.reject(np.arange(self.size) == i,
+                                "{} is not a date".format(name))
+        if required:
+            self.reject(empty, "{} missing".format(name))
+        self.values[name] = parsed
+        return parsed
+
+    def positive(self, name):
+        '''
+        Validates a column of positive integers.
+        '''
+
+        column = np.char.strip(self.columns[name])
+        digits = np.char.isdigit(column)
+        self.reject(~digits, "{} is not a positive integer".format(name))
+        parsed = np.where(digits, column, "0").astype(np.int64)
+        self.reject(parsed <= 0, "{} is not a positive integer".format(name))
+        self.values[name] = parsed
+        return parsed
+
+    def resolve(self, name, model, cache, required=True):
+        '''
+        Resolves a column of URIs to ids of *model* with one query for the
+        URIs not in *cache*.
+        '''
+
+        column = np.char.strip(self.columns[name])
+        missing = [uri for uri in np.unique(column[self.valid])
+                   if uri and uri not in cache]
+        table = model.__table__
+        for start in range(0, len(missing), 500):
+            batch = [str(uri) for uri in missing[start:start + 500]]
+            cache.update(db.session.execute(
+                select(table.c.uri, table.c.id)
+                .where(table.c.uri.in_(batch))
+            ).all())
+        ids = np.array([cache.get(uri, -1) for uri in column], np.int64)
+        empty = column == ""
+        if required:
+            self.reject(empty, "{} missing".format(name))
+        self.reject(~empty & (ids < 0), "{} not found".format(name))
+        self.values[name] = np.where(empty, -1, ids)
+        return self.values[name]
+
+    def catalog(self):
+        '''
+        Interns the brand, model and category of the valid rows into catalog
+        entries, see cyequ.models.intern_catalog.
+        '''
+
+        keys = list(zip(*(self.values[name][self.valid].tolist()
+                          for name in ("brand", "model", "category"))))
+        ids = np.full(self.size, -1, np.int64)
+        ids[self.valid] = intern_catalog(db.session, keys)
+        self.values["catalog_id"] = ids
+        return ids
+
+    def rows(self, names):
+        '''
+        Returns the valid rows as a list of tuples for executemany. Dates are
+        formatted as SQLAlchemy stores them, missing dates and ids are None.
+        '''
+
+        if not self.valid.any():
+            return []
+        columns = []
+        for name in names:
+            values = self.values[name][self.valid]
+            if values.dtype.kind == "M":
+                missing = np.isnat(values)
+                values = np.char.replace(
+                    np.datetime_as_string(values, unit="us"), "T", " "
+                ).astype(object)
+                values[missing] = None
+                values = values.tolist()
+            elif values.dtype.kind == "i":
+                values = values.astype(object)
+                values[values < 0] = None
+                values = values.tolist()
+            else:
+                values = [value or None for value in values.tolist()]
+            columns.append(values)
+        return list(zip(*columns))
+
+
+def _read_chunks(path, required, optional, chunk_size):
+    '''
+    Reads a CSV file in chunks of *chunk_size* rows. Yields _Chunks of the
+    required and optional columns, where missing optional columns are empty.
+
+    Exceptions.
+    click.ClickException. If a required column is missing.
+    '''
+
+    with open(path, newline="", encoding="utf-8") as infile:
+        reader = csv.reader(infile)
+        header = [name.strip() for name in next(reader, [])]
+        absent = [name for name in required if name not in header]
+        if absent:
+            raise click.ClickException("{}: missing column(s) {}"
+                                       .format(path, ", ".join(absent)))
+        index = [header.index(name) if name in header else None
+                 for name in required + optional]
+        line = 2
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                break
+            # Short rows are padded, so their missing values are empty
+            width = len(header)
+            rows = [row + [""] * (width - len(row)) for row in rows]
+            columns = {
+                name: np.array([row[i] if i is not None else ""
+                                for row in rows], str)
+                for name, i in zip(required + optional, index)
+            }
+            yield _Chunk(columns, line)
+            line += len(rows)
+
+
+def _insert(model, names, rows):
+    '''
+    Inserts rows skipping those violating uniqueness, gives rows without
+    uri their URI and commits. Returns the number of rows inserted.
+    '''
+
+    if not rows:
+        return 0
+    table = model.__table__.name
+    # Plain DB-API executemany, the values are already in stored form
+    cursor = db.session.connection().exec_driver_sql(
+        "INSERT OR IGNORE INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(names), ", ".join("?" * len(names))),
+        rows
+    )
+    db.session.execute(text("UPDATE {0} SET uri = name || id"
+                            " WHERE uri IS NULL".format(table)))
+    db.session.commit()
+    return cursor.rowcount
+
+
+def _validate_users(chunk, caches):
+    '''
+    Validates a chunk of users. Returns the columns to insert.
+    '''
+
+    chunk.text("name", 64)
+    chunk.text("uri", 128, required=False)
+    return ["name", "uri"]
+
+
+def _validate_owned(chunk, caches, parent, model):
+    '''
+    Validates the common columns of equipment and components.
+    '''
+
+    chunk.resolve(parent, model, caches[parent])
+    chunk.text("name", 64)
+    chunk.text("category", 64)
+    chunk.text("brand", 64)
+    chunk.text("model", 128)
+    chunk.text("uri", 128, required=False)
+    added = chunk.dates("date_added")
+    retired = chunk.dates("date_retired", required=False)
+    chunk.reject(~np.isnat(retired) & (retired <= added),
+                 "date_retired not after date_added")
+    chunk.catalog()
+    return retired
+
+
+def _validate_equipment(chunk, caches):
+    '''
+    Validates a chunk of equipment. Returns the columns to insert.
+    '''
+
+    _validate_owned(chunk, caches, "owner", User)
+    return ["owner", "name", "category", "catalog_id", "date_added",
+            "date_retired", "uri"]
+
+
+def _validate_components(chunk, caches):
+    '''
+    Validates a chunk of components. Components without date_retired are in
+    service. Returns the columns to insert.
+    '''
+
+    retired = _validate_owned(chunk, caches, "equipment", Equipment)
+    chunk.values["date_retired"] = np.where(np.isnat(retired),
+                                            np.datetime64(IN_SERVICE, "us"),
+                                            retired)
+    chunk.values["equipment_id"] = chunk.values.pop("equipment")
+    chunk.values["ride_seconds"] = np.zeros(chunk.size, np.int64)
+    return ["equipment_id", "name", "category", "catalog_id", "date_added",
+            "date_retired", "ride_seconds", "uri"]
+
+
+def _validate_rides(chunk, caches):
+    '''
+    Validates a chunk of rides. Returns the columns to insert.
+    '''
+
+    chunk.resolve("rider", User, caches["owner"])
+    chunk.resolve("equipment", Equipment, caches["equipment"],
+                  required=False)
+    chunk.text("name", 64)
+    chunk.text("uri", 128, required=False)
+    chunk.dates("datetime")
+    chunk.positive("duration")
+    chunk.values["equipment_id"] = chunk.values.pop("equipment")
+    return ["rider", "equipment_id", "name", "datetime", "duration", "uri"]
+
+
+# Loaders in load order: model, required and optional columns, validator
+LOADERS = (
+    ("users", User, ["name"], ["uri"], _validate_users),
+    ("equipment", Equipment,
+     ["owner", "name", "category", "brand", "model", "date_added"],
+     ["date_retired", "uri"], _validate_equipment),
+    ("components", Component,
+     ["equipment", "name", "category", "brand", "model", "date_added"],
+     ["date_retired", "uri"], _validate_components),
+    ("rides", Ride, ["rider", "name", "datetime", "duration"],
+     ["equipment", "uri"], _validate_rides),
+)
+
+
+def bulk_load(files, chunk_size=CHUNK_SIZE, report=None):
+    '''
+    Loads CSV files given as a dict of loader names ("users", "equipment",
+    "components", "rides") and paths, in load order. Must be called within
+    an application context. *report* is called with the loader name and
+    statistics after each chunk.
+
+    Returns a dict of statistics (read, inserted, skipped, rejected,
+    seconds and errors) per loader.
+    '''
+
+    loaders = [loader for loader in LOADERS if files.get(loader[0])]
+    models = [loader[1] for loader in loaders]
+    # Non-unique indexes are rebuilt once after the load
+    deferred = [index for model in models
+                for index in model.__table__.indexes if not index.unique]
+    # Dropped in the session's transaction, which may hold the only
+    # connection to the database
+    for index in deferred:
+        index.drop(bind=db.session.connection(), checkfirst=True)
+    caches = {"owner": {}, "equipment": {}}
+    stats = {}
+    try:
+        for name, model, required, optional, validate in loaders:
+            stat = stats[name] = {"read": 0, "inserted": 0, "skipped": 0,
+                                  "rejected": 0, "errors": []}
+            started = time.monotonic()
+            for chunk in _read_chunks(files[name], required, optional,
+                                      chunk_size):
+                columns = validate(chunk, caches)
+                rows = chunk.rows(columns)
+                inserted = _insert(model, columns, rows)
+                stat["read"] += chunk.size
+                stat["inserted"] += inserted
+                stat["skipped"] += len(rows) - inserted
+                stat["rejected"] += chunk.size - len(rows)
+                stat["errors"] += chunk.errors
+                stat["seconds"] = time.monotonic() - started
+                if report is not None:
+                    report(name, stat)
+            stat["seconds"] = time.monotonic() - started
+    finally:
+        # Release the database before rebuilding, also after a failure
+        db.session.rollback()
+        for index in deferred:
+            index.create(bind=db.engine, checkfirst=True)
+    if "components" in stats or "rides" in stats:
+        reschedule()
+        db.session.commit()
+    return stats
+
+
+@click.command("bulk-load")
+@click.option("--users", type=click.Path(exists=True, dir_okay=False),
+              help="CSV file of users.")
+@click.option("--equipment", type=click.Path(exists=True, dir_okay=False),
+              help="CSV file of equipment.")
+@click.option("--components", type=click.Path(exists=True, dir_okay=False),
+              help="CSV file of components.")
+@click.option("--rides", type=click.Path(exists=True, dir_okay=False),
+              help="CSV file of rides.")
+@click.option("--chunk-size", type=int, default=CHUNK_SIZE,
+              help="Rows per validated and committed chunk.")
+@with_appcontext
+def bulk_load_command(users, equipment, components, rides, chunk_size):
+    '''
+    Loads users, equipment, components and rides from CSV files.
+    '''
+
+    def report(name, stat):
+        click.echo("{}: {} rows read, {} inserted, {:.0f} rows/s".format(
+            name, stat["read"], stat["inserted"],
+            stat["read"] / stat["seconds"] if stat["seconds"] else 0
+        ))
+
+    stats = bulk_load({"users": users,
+                       "equipment": equipment,
+                       "components": components,
+                       "rides": rides
+                       }, chunk_size, report)
+    for name, stat in stats.items():
+        click.echo("{}: {} inserted, {} skipped as existing, {} rejected "
+                   "in {:.2f} s".format(name, stat["inserted"],
+                                        stat["skipped"], stat["rejected"],
+                                        stat["seconds"]))
+        for error in stat["errors"][:20]:
+            click.echo("  {}".format(error))
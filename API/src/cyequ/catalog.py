@@ -0,0 +1,378 @@
+'''
+This module holds the in-memory brand and model suggestion index of the API.
+
+The distinct brands and models of all equipment and components are kept in
+sorted lists of (folded value, value) pairs, with a count of the rows using
+each value. Suggestions for a prefix are found by bisecting to the first
+folded value at or after the prefix and reading on while it matches, so a
+lookup costs O(log n + limit) without touching the database.
+
+The index is built from the database on first use and then follows writes
+made through the ORM sessions of the same process: changes are collected on
+flush and applied on commit, so rolled back writes never show. Writes made
+by other processes or with SQL, such as bulk-load, show after a restart or
+rebuild().
+
+The module also holds the migrate-catalog command, which moves the brand
+and model columns of databases created before the catalog table into
+catalog entries, see cyequ.models.CatalogEntry.
+'''
+
+# Library imports
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import MetaData, event, func, inspect, select, union_all
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+# Project imports
+from cyequ import db
+from cyequ.models import Equipment, Component, CatalogEntry, catalog_key
+from cyequ.search import rebuild_index
+
+# Indexed fields
+FIELDS = ("brand", "model")
+# Suggestions returned by default and at most
+LIMIT = 10
+MAX_LIMIT = 50
+# Rows given a catalog entry per committed batch of migrate_catalog
+MIGRATE_BATCH_SIZE = 10000
+
+
+def fold(value):
+    '''
+    Returns the form of *value* compared with prefixes: case-folded and
+    without diacritics.
+    '''
+
+    if value.isascii():
+        return value.lower()
+    value = unicodedata.normalize("NFKD", value).casefold()
+    return "".join(char for char in value if not unicodedata.combining(char))
+
+
+class _FieldIndex(object):
+    '''
+    Sorted distinct values of one field with their row counts.
+    '''
+
+    def __init__(self, counts):
+        self.counts = Counter(counts)
+        self.keys = sorted((fold(value), value) for value in self.counts)
+
+    def add(self, value, count):
+        '''
+        Adds *count* rows of *value*, which may be negative for removed rows.
+        '''
+
+        if value is None or not count:
+            return
+        old = self.counts.pop(value, 0)
+        if old + count > 0:
+            self.counts[value] = old + count
+            if old <= 0:
+                insort(self.keys, (fold(value), value))
+        elif old > 0:
+            key = (fold(value), value)
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+
+    def suggest(self, prefix, limit):
+        '''
+        Returns up to *limit* values beginning with *prefix*, in order.
+        '''
+
+        prefix = fold(prefix)
+        keys = self.keys
+        found = []
+        i = bisect_left(keys, (prefix,))
+        while i < len(keys) and len(found) < limit \
+                and keys[i][0].startswith(prefix):
+            found.append(keys[i][1])
+            i += 1
+        return found
+
+
+class Catalog(object):
+    '''
+    Suggestion index of all indexed fields.
+    '''
+
+    def __init__(self, counts):
+        self.lock = threading.Lock()
+        self.fields = {field: _FieldIndex(counts.get(field, {}))
+                       for field in FIELDS}
+
+    def apply(self, changes):
+        '''
+        Applies a Counter of (field, value) row count changes.
+        '''
+
+        with self.lock:
+            for (field, value), count in changes.items():
+                self.fields[field].add(value, count)
+
+    def suggest(self, prefix, fields=FIELDS, limit=LIMIT):
+        '''
+        Returns a dict of the suggested values of each field in *fields*.
+        '''
+
+        with self.lock:
+            return {field: self.fields[field].suggest(prefix, limit)
+                    for field in fields}
+
+
+def _load():
+    '''
+    Reads the row counts of each distinct value of the indexed fields.
+    '''
+
+    rows = union_all(select(Equipment.catalog_id),
+                     select(Component.catalog_id)).subquery()
+    counts = {}
+    for field in FIELDS:
+        value = getattr(CatalogEntry, field)
+        counts[field] = dict(db.session.execute(
+            select(value, func.count())
+            .join_from(rows, CatalogEntry,
+                       rows.c.catalog_id == CatalogEntry.id)
+            .group_by(value)
+        ).fetchall())
+    return counts
+
+
+def get_catalog():
+    '''
+    Returns the Catalog of the current application, building it first if
+    needed.
+    '''
+
+    extensions = current_app.extensions
+    catalog = extensions.get("cyequ_catalog")
+    if catalog is None:
+        catalog = extensions.setdefault("cyequ_catalog", Catalog(_load()))
+    return catalog
+
+
+def rebuild():
+    '''
+    Rebuilds the Catalog of the current application from the database.
+    '''
+
+    current_app.extensions["cyequ_catalog"] = Catalog(_load())
+
+
+def _changes(session):
+    '''
+    Returns the pending (field, value) count changes of a session.
+    '''
+
+    return session.info.setdefault("cyequ_catalog", Counter())
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changes(session, flush_context):
+    '''
+    Collects the brand and model changes of a flush until commit.
+    '''
+
+    changes = None
+    for target, sign in ([(obj, 1) for obj in session.new]
+                         + [(obj, 0) for obj in session.dirty]
+                         + [(obj, -1) for obj in session.deleted]):
+        if not isinstance(target, (Equipment, Component)):
+            continue
+        history = inspect(target).attrs.catalog_id.history
+        if sign > 0:
+            counts = [(target.catalog_id, 1)]
+        elif sign < 0:
+            counts = [(catalog_id, -1) for catalog_id
+                      in history.deleted or history.unchanged]
+        else:
+            counts = [(catalog_id, 1) for catalog_id in history.added] \
+                + [(catalog_id, -1) for catalog_id in history.deleted]
+        for catalog_id, count in counts:
+            if catalog_id is None:
+                continue
+            if changes is None:
+                changes = _changes(session)
+            brand, model, _ = catalog_key(catalog_id)
+            changes["brand", brand] += count
+            changes["model", model] += count
+
+
+@event.listens_for(Session, "after_commit")
+def apply_changes(session):
+    '''
+    Applies the collected changes of a committed transaction to the Catalog
+    of the current application, if it has been built. Within a batch, the
+    batch's own commit is waited for, see cyequ.resources.batch.
+    '''
+
+    if session.info.get("cyequ_batch"):
+        return
+    changes = session.info.pop("cyequ_catalog", None)
+    if not changes or not has_app_context():
+        return
+    catalog = current_app.extensions.get("cyequ_catalog")
+    if catalog is not None:
+        catalog.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changes(session):
+    '''
+    Discards the collected changes of a rolled back transaction.
+    '''
+
+    session.info.pop("cyequ_catalog", None)
+
+
+def _columns(connection, table):
+    '''
+    Returns the column names of a table in the database.
+    '''
+
+    return [row[1] for row in connection.exec_driver_sql(
+        "PRAGMA table_info({})".format(table))]
+
+
+def migrate_catalog(batch_size=MIGRATE_BATCH_SIZE, report=None):
+    '''
+    Moves the brand and model columns of equipment and components of a
+    database created before the catalog into catalog entries. Must be called
+    within an application context. *report* is called with the table name
+    and the number of rows rewritten after each batch.
+
+    Rows get their catalog_id in batches of *batch_size* rows, each batch
+    committed on its own, so an interrupted migration continues where it was
+    left. Then both tables are rebuilt without the old columns in one
+    transaction, and the search index is rebuilt.
+
+    Returns a dict of rows rewritten per table, empty if the database was
+    migrated already.
+    '''
+
+    # The session must not hold the database while tables are rebuilt
+    db.session.remove()
+    engine = db.engine
+    with engine.connect() as connection:
+        if "brand" not in _columns(connection, "equipment"):
+            return {}
+    CatalogEntry.__table__.create(bind=engine, checkfirst=True)
+    rewritten = {}
+    for table in ("equipment", "component"):
+        with engine.begin() as connection:
+            if "catalog_id" not in _columns(connection, table):
+                connection.exec_driver_sql(
+                    "ALTER TABLE {} ADD COLUMN catalog_id INTEGER"
+                    " REFERENCES catalog (id)".format(table))
+        rewritten[table] = 0
+        after = 0
+        while True:
+            with engine.begin() as connection:
+                ids = [row[0] for row in connection.exec_driver_sql(
+                    "SELECT id FROM {} WHERE id > ? AND catalog_id IS NULL"
+                    " ORDER BY id LIMIT ?".format(table),
+                    (after, batch_size))]
+                if not ids:
+                    break
+                bounds = (ids[0], ids[-1])
+                connection.exec_driver_sql(
+                    "INSERT OR IGNORE INTO catalog (brand, model, category)"
+                    " SELECT DISTINCT brand, model, category FROM {}"
+                    " WHERE id BETWEEN ? AND ?".format(table), bounds)
+                connection.exec_driver_sql(
+                    "UPDATE {0} SET catalog_id = (SELECT id FROM catalog"
+                    " WHERE brand = {0}.brand AND model = {0}.model"
+                    " AND category = {0}.category)"
+                    " WHERE id BETWEEN ? AND ? AND catalog_id IS NULL"
+                    .format(table), bounds)
+            rewritten[table] += len(ids)
+            after = ids[-1]
+            if report is not None:
+                report(table, rewritten[table])
+    _rebuild_tables(engine, (Equipment.__table__, Component.__table__))
+    # Search index triggers were dropped with the old tables
+    rebuild_index()
+    rebuild()
+    return rewritten
+
+
+def _rebuild_tables(engine, tables):
+    '''
+    Recreates *tables* as defined by the models, copying the values of the
+    columns both define, in one transaction with foreign keys off.
+    '''
+
+    dialect = engine.dialect
+    # Referenced tables are needed to compile the foreign keys of the copies
+    metadata = MetaData()
+    for table in db.Model.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    raw = engine.raw_connection()
+    try:
+        sqlite = raw.dbapi_connection
+        isolation_level = sqlite.isolation_level
+        sqlite.isolation_level = None
+        cursor = sqlite.cursor()
+        cursor.execute("PRAGMA foreign_keys=OFF")
+        cursor.execute("BEGIN")
+        try:
+            for table in tables:
+                triggers = cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+                    " AND tbl_name = ?", (table.name,)).fetchall()
+                for trigger, in triggers:
+                    cursor.execute("DROP TRIGGER {}".format(trigger))
+                copy = table.to_metadata(metadata, name=table.name + "_new")
+                cursor.execute(str(CreateTable(copy).compile(
+                    dialect=dialect)))
+                existing = [row[1] for row in cursor.execute(
+                    "PRAGMA table_info({})".format(table.name))]
+                names = ", ".join(column.name for column in table.columns
+                                  if column.name in existing)
+                cursor.execute("INSERT INTO {0}_new ({1}) SELECT {1} FROM {0}"
+                               .format(table.name, names))
+                cursor.execute("DROP TABLE {}".format(table.name))
+                cursor.execute("ALTER TABLE {0}_new RENAME TO {0}"
+                               .format(table.name))
+                for index in table.indexes:
+                    cursor.execute(str(CreateIndex(index).compile(
+                        dialect=dialect)))
+            if cursor.execute("PRAGMA foreign_key_check").fetchall():
+                raise click.ClickException("Foreign keys broken, "
+                                           "migration rolled back")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.execute("PRAGMA foreign_keys=ON")
+            sqlite.isolation_level = isolation_level
+    finally:
+        raw.close()
+
+
+@click.command("migrate-catalog")
+@click.option("--batch-size", type=int, default=MIGRATE_BATCH_SIZE,
+              help="Rows rewritten per committed batch.")
+@with_appcontext
+def migrate_catalog_command(batch_size):
+    '''
+    Moves brands and models of an existing database into the catalog.
+    '''
+
+    def report(table, rows):
+        click.echo("{}: {} rows rewritten".format(table, rows))
+
+    if not migrate_catalog(batch_size, report):
+        click.echo("Database uses the catalog already.")
+    else:
+        click.echo("Catalog migration done.")
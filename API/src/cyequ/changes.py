@@ -0,0 +1,213 @@
+'''
+This module holds the change log of users, equipment, components and rides.
+
+Every create, update and delete of the four tables appends a record to the
+changelog table: its sequence number, the owning user, the kind and URI of
+the resource, the URI of the equipment of a component and the time. Records
+are written by triggers, in the transaction of the write itself, so writes
+that bypass the ORM are logged as well. A row is logged once it has a URI,
+which the resources give it right after the insert.
+
+Clients synchronize by reading the records of their user after the last
+sequence number they have seen, see cyequ.resources.changes. Past the
+retention horizon, records superseded by a later record of the same resource
+and deletes are compacted away. The latest record of every live resource is
+kept, so a sync from the start still finds all of them.
+'''
+
+# Library imports
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, event, text
+
+# Project imports
+from cyequ import db
+
+USER, EQUIPMENT, COMPONENT, RIDE = "user", "equipment", "component", "ride"
+CREATE, UPDATE, DELETE = "create", "update", "delete"
+
+_INSERT = "INSERT INTO changelog (user_id, kind, op, uri, parent, time)"
+# SQL of the operation of an update, a create once the row gets its URI
+_UPDATE_OP = "CASE WHEN old.uri IS NULL THEN 'create' ELSE 'update' END"
+# SQL selecting the owner and URI of the equipment of a component
+_EQUIPMENT_OF = "SELECT owner, uri FROM equipment WHERE id = {0}" \
+                " AND owner IS NOT NULL"
+
+# Statements run after the tables are created, SQLite only
+_SCHEMA = [
+    # Users
+    "CREATE TRIGGER IF NOT EXISTS user_changes_ai"
+    " AFTER INSERT ON \"user\" WHEN new.uri IS NOT NULL BEGIN "
+    + _INSERT + " VALUES (new.id, 'user', 'create', new.uri, NULL,"
+    " datetime('now'));"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS user_changes_au"
+    " AFTER UPDATE OF uri, name ON \"user\" WHEN new.uri IS NOT NULL BEGIN "
+    + _INSERT + " VALUES (new.id, 'user', " + _UPDATE_OP + ", new.uri,"
+    " NULL, datetime('now'));"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS user_changes_bd"
+    " BEFORE DELETE ON \"user\" WHEN old.uri IS NOT NULL BEGIN "
+    + _INSERT + " VALUES (old.id, 'user', 'delete', old.uri, NULL,"
+    " datetime('now'));"
+    " END",
+    # Equipment, logged for its owner
+    "CREATE TRIGGER IF NOT EXISTS equipment_changes_ai"
+    " AFTER INSERT ON equipment"
+    " WHEN new.uri IS NOT NULL AND new.owner IS NOT NULL BEGIN "
+    + _INSERT + " VALUES (new.owner, 'equipment', 'create', new.uri, NULL,"
+    " datetime('now'));"
+    " END",
+    # A change of owner is a delete for the old owner and a create for the
+    # new one
+    "CREATE TRIGGER IF NOT EXISTS equipment_changes_au"
+    " AFTER UPDATE OF uri, name, category, catalog_id, date_added,"
+    " date_retired, owner ON equipment WHEN new.uri IS NOT NULL BEGIN "
+    + _INSERT + " SELECT old.owner, 'equipment', 'delete', old.uri, NULL,"
+    " datetime('now') WHERE old.uri IS NOT NULL AND old.owner IS NOT NULL"
+    " AND old.owner IS NOT new.owner; "
+    + _INSERT + " SELECT new.owner, 'equipment',"
+    " CASE WHEN old.owner IS NOT new.owner THEN 'create' ELSE "
+    + _UPDATE_OP + " END, new.uri, NULL, datetime('now')"
+    " WHERE new.owner IS NOT NULL;"
+    " END",
+    # Before, so components deleted by the database cascade are logged
+    "CREATE TRIGGER IF NOT EXISTS equipment_changes_bd"
+    " BEFORE DELETE ON equipment"
+    " WHEN old.uri IS NOT NULL AND old.owner IS NOT NULL BEGIN "
+    + _INSERT + " SELECT old.owner, 'component', 'delete', uri, old.uri,"
+    " datetime('now') FROM component"
+    " WHERE equipment_id = old.id AND uri IS NOT NULL; "
+    + _INSERT + " VALUES (old.owner, 'equipment', 'delete', old.uri, NULL,"
+    " datetime('now'));"
+    " END",
+    # Components, logged for the owner of their equipment
+    "CREATE TRIGGER IF NOT EXISTS component_changes_ai"
+    " AFTER INSERT ON component WHEN new.uri IS NOT NULL BEGIN "
+    + _INSERT + " SELECT owner, 'component', 'create', new.uri, uri,"
+    " datetime('now') FROM (" + _EQUIPMENT_OF.format("new.equipment_id")
+    + ");"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS component_changes_au"
+    " AFTER UPDATE OF uri, name, category, catalog_id, date_added,"
+    " date_retired, equipment_id ON component"
+    " WHEN new.uri IS NOT NULL BEGIN "
+    + _INSERT + " SELECT owner, 'component', 'delete', old.uri, uri,"
+    " datetime('now') FROM (" + _EQUIPMENT_OF.format("old.equipment_id")
+    + ") WHERE old.uri IS NOT NULL"
+    " AND old.equipment_id IS NOT new.equipment_id; "
+    + _INSERT + " SELECT owner, 'component',"
+    " CASE WHEN old.equipment_id IS NOT new.equipment_id THEN 'create' ELSE "
+    + _UPDATE_OP + " END, new.uri, uri, datetime('now') FROM ("
+    + _EQUIPMENT_OF.format("new.equipment_id") + ");"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS component_changes_bd"
+    " BEFORE DELETE ON component WHEN old.uri IS NOT NULL BEGIN "
+    + _INSERT + " SELECT owner, 'component', 'delete', old.uri, uri,"
+    " datetime('now') FROM (" + _EQUIPMENT_OF.format("old.equipment_id")
+    + ");"
+    " END",
+    # Rides, logged for their rider
+    "CREATE TRIGGER IF NOT EXISTS ride_changes_ai"
+    " AFTER INSERT ON ride"
+    " WHEN new.uri IS NOT NULL AND new.rider IS NOT NULL BEGIN "
+    + _INSERT + " VALUES (new.rider, 'ride', 'create', new.uri, NULL,"
+    " datetime('now'));"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS ride_changes_au"
+    " AFTER UPDATE OF uri, name, datetime, duration, moving_time, distance,"
+    " elevation_gain, equipment_id, rider ON ride"
+    " WHEN new.uri IS NOT NULL BEGIN "
+    + _INSERT + " SELECT old.rider, 'ride', 'delete', old.uri, NULL,"
+    " datetime('now') WHERE old.uri IS NOT NULL AND old.rider IS NOT NULL"
+    " AND old.rider IS NOT new.rider; "
+    + _INSERT + " SELECT new.rider, 'ride',"
+    " CASE WHEN old.rider IS NOT new.rider THEN 'create' ELSE "
+    + _UPDATE_OP + " END, new.uri, NULL, datetime('now')"
+    " WHERE new.rider IS NOT NULL;"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS ride_changes_bd"
+    " BEFORE DELETE ON ride"
+    " WHEN old.uri IS NOT NULL AND old.rider IS NOT NULL BEGIN "
+    + _INSERT + " VALUES (old.rider, 'ride', 'delete', old.uri, NULL,"
+    " datetime('now'));"
+    " END",
+]
+
+for _statement in _SCHEMA:
+    event.listen(db.Model.metadata, "after_create",
+                 DDL(_statement).execute_if(dialect="sqlite"))
+
+
+def _horizon(days):
+    '''
+    Returns the SQLite datetime() modifier of the retention horizon.
+    '''
+
+    return "-{} days".format(days)
+
+
+def first_retained(days=None):
+    '''
+    Returns the sequence number of the first record within the retention
+    horizon of *days* (CHANGES_RETENTION_DAYS by default), or the next
+    sequence number if there are none. Nothing from this number on has been
+    compacted away, so clients that have seen all records before it can
+    continue syncing.
+    '''
+
+    if days is None:
+        days = current_app.config["CHANGES_RETENTION_DAYS"]
+    return db.session.execute(
+        text("SELECT coalesce("
+             " (SELECT min(seq) FROM changelog"
+             "  WHERE time >= datetime('now', :horizon)),"
+             " (SELECT seq FROM sqlite_sequence"
+             "  WHERE name = 'changelog') + 1, 1)"),
+        {"horizon": _horizon(days)}
+    ).scalar()
+
+
+def compact_changes(days=None):
+    '''
+    Deletes the records older than *days* (CHANGES_RETENTION_DAYS by
+    default) which are deletes or superseded by a later record of the same
+    resource. Returns the number of records deleted.
+    '''
+
+    if days is None:
+        days = current_app.config["CHANGES_RETENTION_DAYS"]
+    result = db.session.execute(
+        text("DELETE FROM changelog"
+             " WHERE time < datetime('now', :horizon) AND (op = 'delete'"
+             " OR EXISTS (SELECT 1 FROM changelog AS later"
+             "  WHERE later.kind = changelog.kind"
+             "  AND later.uri = changelog.uri"
+             "  AND later.seq > changelog.seq))"),
+        {"horizon": _horizon(days)}
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@click.command("compact-changes")
+@click.option("--days", type=int, default=None,
+              help="Retention horizon in days, CHANGES_RETENTION_DAYS "
+                   "by default.")
+@with_appcontext
+def compact_changes_command(days):
+    '''
+    Compacts the change log past the retention horizon. Also creates the
+    change log and its triggers, e.g. for databases created before it
+    existed.
+    '''
+
+    from cyequ.models import ChangeLog
+    ChangeLog.__table__.create(bind=db.session.connection(),
+                                checkfirst=True)
+    for statement in _SCHEMA:
+        db.session.execute(text(statement))
+    db.session.commit()
+    click.echo("Compacted {} change log records."
+               .format(compact_changes(days)))
@@ -0,0 +1,261 @@
+'''
+This module exports the user, catalog, equipment, component and ride tables
+to a column-oriented directory for analytics.
+
+Every column is written to its own NumPy .npy file, so it can be loaded with
+numpy.load(..., mmap_mode="r") without copying:
+
+    int64 / float64     Numbers. Nullable integers have a <column>.valid.npy
+                        boolean mask, null floats are NaN.
+    datetime64[us]      Datetimes, null is NaT.
+    dict                Low-cardinality strings: int32 codes (-1 for null) in
+                        <column>.npy and the distinct values, in code order,
+                        in <column>.dict.json.
+    string              Other strings: UTF-8 bytes concatenated in
+                        <column>.bin and int64 offsets of length rows + 1 in
+                        <column>.npy. Null is an empty string.
+
+Rows are read by primary key in chunks of chunk_size rows and written into
+preallocated memory-mapped arrays, so memory use depends on the chunk size
+only. manifest.json describes the tables and columns.
+'''
+
+# Library imports
+import json
+import os
+import click
+import numpy as np
+from flask.cli import with_appcontext
+from numpy.lib.format import open_memmap
+from sqlalchemy import func, select, types
+
+# Project imports
+from cyequ import db
+from cyequ.models import User, CatalogEntry, Equipment, Component, Ride
+
+# Exported tables. Equipment and components refer to the catalog by id.
+TABLES = (User, CatalogEntry, Equipment, Component, Ride)
+# String columns to dictionary-encode, as they have few distinct values
+DICTIONARY_COLUMNS = {"category", "brand", "model"}
+# Rows read per chunk
+CHUNK_SIZE = 100000
+
+
+def _kind(column):
+    '''
+    Returns the export kind of a table column.
+    '''
+
+    if isinstance(column.type, types.DateTime):
+        return "datetime64[us]"
+    if isinstance(column.type, types.Float):
+        return "float64"
+    if isinstance(column.type, types.Integer):
+        return "int64"
+    return "dict" if column.name in DICTIONARY_COLUMNS else "string"
+
+
+class _ColumnWriter(object):
+    '''
+    Writes the values of one column chunk by chunk.
+    '''
+
+    def __init__(self, path, column, rows):
+        self.path = path
+        self.kind = _kind(column)
+        self.nullable = column.nullable and not column.primary_key
+        self.valid = None
+        if self.kind == "string":
+            self.data = open_memmap(path + ".npy", "w+", np.int64,
+                                    (rows + 1,))
+            self.data[0] = 0
+            self.blob = open(path + ".bin", "wb")
+        elif self.kind == "dict":
+            self.data = open_memmap(path + ".npy", "w+", np.int32, (rows,))
+            self.codes = {}
+        else:
+            self.data = open_memmap(path + ".npy", "w+", self.kind, (rows,))
+            if self.kind == "int64" and self.nullable:
+                self.valid = open_memmap(path + ".valid.npy", "w+", np.bool_,
+                                         (rows,))
+
+    def write(self, start, values):
+        '''
+        Writes a chunk of values beginning at row *start*.
+        '''
+
+        stop = start + len(values)
+        if self.kind == "string":
+            encoded = [(value or "").encode("utf-8") for value in values]
+            lengths = np.fromiter(map(len, encoded), np.int64, len(encoded))
+            self.data[start + 1:stop + 1] = \
+                self.data[start] + np.cumsum(lengths)
+            self.blob.write(b"".join(encoded))
+        elif self.kind == "dict":
+            codes = self.codes
+            self.data[start:stop] = [
+                -1 if value is None else codes.setdefault(value, len(codes))
+                for value in values
+            ]
+        elif self.kind == "datetime64[us]":
+            # Stored as text by SQLite, parsed by NumPy
+            self.data[start:stop] = np.array(
+                ["NaT" if value is None else value for value in values],
+                "datetime64[us]"
+            )
+        elif self.kind == "float64":
+            self.data[start:stop] = np.array(values, np.float64)
+        else:
+            if self.valid is not None:
+                mask = np.fromiter((value is not None for value in values),
+                                   np.bool_, len(values))
+                self.valid[start:stop] = mask
+                values = [0 if value is None else value for value in values]
+            self.data[start:stop] = np.array(values, np.int64)
+
+    def close(self, rows):
+        '''
+        Flushes the column, truncated to *rows* if fewer rows were written
+        than allocated. Returns the manifest entry of the column.
+        '''
+
+        entry = {"kind": self.kind, "file": os.path.basename(self.path)
+                 + ".npy"}
+        arrays = [(self.data, self.path + ".npy")]
+        if self.kind == "string":
+            self.blob.close()
+            entry["bytes"] = os.path.basename(self.path) + ".bin"
+            rows += 1
+        if self.kind == "dict":
+            with open(self.path + ".dict.json", "w", encoding="utf-8") as out:
+                json.dump(list(self.codes), out, ensure_ascii=False)
+            entry["dictionary"] = os.path.basename(self.path) + ".dict.json"
+        if self.valid is not None:
+            arrays.append((self.valid, self.path + ".valid.npy"))
+            entry["valid"] = os.path.basename(self.path) + ".valid.npy"
+        for array, path in arrays:
+            array.flush()
+            if len(array) != rows:
+                # Rows deleted during the export, rewrite at the final length
+                np.save(path, np.array(array[:rows]))
+        return entry
+
+
+def _select(table):
+    '''
+    Returns the columns of a table selected as stored. DateTime columns are
+    read as their stored text, skipping per-value conversion in Python.
+    '''
+
+    return [column.cast(types.String) if isinstance(column.type,
+                                                    types.DateTime)
+            else column for column in table.columns]
+
+
+def export_table(model, outdir, chunk_size=CHUNK_SIZE):
+    '''
+    Exports the table of a model into directory *outdir*/<table name>.
+    Must be called within an application context.
+
+    Returns the manifest entry of the table.
+    '''
+
+    table = model.__table__
+    key = table.primary_key.columns.values()[0]
+    tabledir = os.path.join(outdir, table.name)
+    os.makedirs(tabledir, exist_ok=True)
+    # Rows added after this are left out
+    last_id, rows = db.session.execute(
+        select(func.max(key), func.count(key))
+    ).one()
+    writers = [_ColumnWriter(os.path.join(tabledir, column.name), column,
+                             rows)
+               for column in table.columns]
+    query = select(*_select(table)).where(key <= (last_id or 0)) \
+        .order_by(key).limit(chunk_size)
+    written, after = 0, None
+    while written < rows:
+        chunk = db.session.execute(
+            query if after is None else query.where(key > after)
+        ).fetchall()
+        if not chunk:
+            break
+        # Never more than allocated, if rows were added in between
+        chunk = chunk[:rows - written]
+        for writer, values in zip(writers, zip(*chunk)):
+            writer.write(written, values)
+        written += len(chunk)
+        after = chunk[-1][0]
+    return {"rows": written,
+            "columns": {column.name: writer.close(written)
+                        for column, writer in zip(table.columns, writers)}
+            }
+
+
+def export_columnar(outdir, chunk_size=CHUNK_SIZE, report=None):
+    '''
+    Exports all tables of TABLES and writes the manifest. *report* is called
+    with the name and manifest entry of each exported table.
+
+    Returns the manifest.
+    '''
+
+    os.makedirs(outdir, exist_ok=True)
+    manifest = {"format": 1, "tables": {}}
+    for model in TABLES:
+        entry = export_table(model, outdir, chunk_size)
+        manifest["tables"][model.__table__.name] = entry
+        if report is not None:
+            report(model.__table__.name, entry)
+    with open(os.path.join(outdir, "manifest.json"), "w") as out:
+        json.dump(manifest, out, indent=2)
+    return manifest
+
+
+def load_columnar(outdir, table):
+    '''
+    Loads an exported table as a dict of memory-mapped column arrays.
+    Dictionary-encoded columns are returned as (codes, values), string
+    columns as (offsets, bytes) and nullable integer columns as
+    (values, valid) tuples, all without copying.
+    '''
+
+    with open(os.path.join(outdir, "manifest.json")) as manifest:
+        entry = json.load(manifest)["tables"][table]
+    tabledir = os.path.join(outdir, table)
+    columns = {}
+    for name, column in entry["columns"].items():
+        data = np.load(os.path.join(tabledir, column["file"]), mmap_mode="r")
+        if column["kind"] == "dict":
+            with open(os.path.join(tabledir, column["dictionary"]),
+                      encoding="utf-8") as values:
+                data = (data, json.load(values))
+        elif column["kind"] == "string":
+            data = (data, np.memmap(os.path.join(tabledir, column["bytes"]),
+                                    np.uint8, "r")
+                    if os.path.getsize(os.path.join(tabledir,
+                                                    column["bytes"]))
+                    else np.zeros(0, np.uint8))
+        elif "valid" in column:
+            data = (data, np.load(os.path.join(tabledir, column["valid"]),
+                                  mmap_mode="r"))
+        columns[name] = data
+    return columns
+
+
+@click.command("export-columnar")
+@click.argument("outdir", type=click.Path(file_okay=False))
+@click.option("--chunk-size", type=int, default=CHUNK_SIZE,
+              help="Rows read per chunk.")
+@with_appcontext
+def export_columnar_command(outdir, chunk_size):
+    '''
+    Exports users, catalog, equipment, components and rides as columns to
+    OUTDIR.
+    '''
+
+    def report(table, entry):
+        click.echo("{}: {} rows, {} columns".format(table, entry["rows"],
+                                                    len(entry["columns"])))
+
+    export_columnar(outdir, chunk_size, report)
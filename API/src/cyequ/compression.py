@@ -0,0 +1,167 @@
+'''
+This module holds the response compression of the API.
+
+Responses are compressed with the best encoding accepted by the client of
+brotli (if the brotli package is installed), gzip and deflate, when their
+media type is compressible and their body at least COMPRESS_MIN_SIZE bytes.
+Streamed responses, such as exports and static files, are sent as they are.
+
+Compressed bodies are kept in a per-application LRU cache keyed by the
+encoding and a digest of the uncompressed body, so a representation that
+is served again unchanged is compressed only once. Hashing the body costs a
+fraction of compressing it.
+'''
+
+# Library imports
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+
+# Project imports
+from cyequ.constants import MASON, MERGE_PATCH
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, gzip and deflate are always available
+    brotli = None
+
+# Defaults of the configuration keys of the module
+DEFAULTS = {
+    # Set False to send all responses uncompressed
+    "COMPRESS": True,
+    # Smallest body compressed, in bytes
+    "COMPRESS_MIN_SIZE": 500,
+    # zlib level of gzip and deflate, 1-9
+    "COMPRESS_LEVEL": 6,
+    # Brotli quality, 0-11
+    "COMPRESS_BROTLI_QUALITY": 5,
+    # Compressed bodies kept in the cache
+    "COMPRESS_CACHE_SIZE": 256,
+}
+# Compressible media types besides text/*
+MIMETYPES = frozenset((MASON, MERGE_PATCH, "application/json",
+                       "application/x-ndjson", "application/schema+json"))
+
+
+def encodings():
+    '''
+    Returns the supported content codings in the order of preference.
+    '''
+
+    if brotli is not None:
+        return ("br", "gzip", "deflate")
+    return ("gzip", "deflate")
+
+
+def compress(data, encoding, level=DEFAULTS["COMPRESS_LEVEL"],
+             quality=DEFAULTS["COMPRESS_BROTLI_QUALITY"]):
+    '''
+    Returns *data* compressed with content coding *encoding*. Gzip output
+    has no timestamp, so equal bodies compress to equal bytes.
+    '''
+
+    if encoding == "br":
+        return brotli.compress(data, quality=quality)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "deflate":
+        # HTTP deflate is the zlib format
+        return zlib.compress(data, level)
+    raise ValueError("Unsupported content coding {}".format(encoding))
+
+
+class _CompressedCache(object):
+    '''
+    LRU cache of compressed bodies by encoding and body digest.
+    '''
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, data, encoding, level, quality):
+        '''
+        Returns *data* compressed with *encoding*, from the cache if found.
+        '''
+
+        key = (encoding, level, quality,
+               hashlib.blake2b(data, digest_size=16).digest())
+        with self.lock:
+            compressed = self.entries.get(key)
+            if compressed is not None:
+                self.entries.move_to_end(key)
+                return compressed
+        compressed = compress(data, encoding, level, quality)
+        with self.lock:
+            self.entries[key] = compressed
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return compressed
+
+
+def get_cache():
+    '''
+    Returns the compressed body cache of the current application, creating
+    it first if needed.
+    '''
+
+    extensions = current_app.extensions
+    cache = extensions.get("cyequ_compressed")
+    if cache is None:
+        cache = extensions.setdefault(
+            "cyequ_compressed",
+            _CompressedCache(current_app.config["COMPRESS_CACHE_SIZE"]))
+    return cache
+
+
+def _compressible(response):
+    '''
+    Tells if the media type of *response* is worth compressing.
+    '''
+
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in MIMETYPES
+
+
+def compress_response(response):
+    '''
+    Compresses the body of *response* with the best content coding accepted
+    by the request, if it is compressible and large enough.
+    '''
+
+    config = current_app.config
+    if not config["COMPRESS"] or not _compressible(response) \
+            or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add("Accept-Encoding")
+    if not 200 <= response.status_code < 300 or response.status_code == 204 \
+            or "Content-Encoding" in response.headers \
+            or request.method == "HEAD":
+        return response
+    data = response.get_data()
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+    encoding = request.accept_encodings.best_match(encodings())
+    if encoding is None:
+        return response
+    response.set_data(get_cache().get(data, encoding,
+                                      config["COMPRESS_LEVEL"],
+                                      config["COMPRESS_BROTLI_QUALITY"]))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    '''
+    Sets the configuration defaults of the module and compresses the
+    responses of *app*.
+    '''
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.after_request(compress_response)
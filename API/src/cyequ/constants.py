@@ -5,10 +5,25 @@ This module includes constants defined for Cyclist equipment usage API.
 
 # Constants
 MASON = "application/vnd.mason+json"
+# Media type of partial updates, see RFC 7386
+MERGE_PATCH = "application/merge-patch+json"
 USER_PROFILE = "/profiles/user/"
 EQUIPMENT_PROFILE = "/profiles/equipment/"
 COMPONENT_PROFILE = "/profiles/component/"
+RIDE_PROFILE = "/profiles/ride/"
+JOB_PROFILE = "/profiles/job/"
 ERROR_PROFILE = "/profiles/error/"
 LINK_RELATIONS_URL = "/cyequ/link-relations/"
 APIARY_URL = "https://cyclistequipmentusageapipwpcourse." \
                 "docs.apiary.io/#reference/"
+# Media types accepted for ride file imports
+GPX = "application/gpx+xml"
+TCX = "application/vnd.garmin.tcx+xml"
+RIDE_FILE_TYPES = (GPX, TCX, "application/xml", "text/xml")
+# Media type of ride archive imports
+ZIP = "application/zip"
+# WSGI environ key of requests the API dispatches to itself, in batches and
+# the event hub, which are not rate limited
+INTERNAL_REQUEST = "cyequ.internal"
+# WSGI environ key of requests of the async read path, see cyequ.asgi
+ASYNC_READ = "cyequ.async_read"
@@ -0,0 +1,299 @@
+'''
+This module holds the event hub of the API's server-sent event streams.
+
+Clients subscribe to the changes of a user at the UserEvents resource, see
+cyequ.resources.events. One hub thread per process tails the change log
+(see cyequ.changes) while there are subscribers: one query per round for
+all of them, woken by the commits of the process and every EVENTS_POLL
+seconds for writes of other processes. Each new record of a subscribed user
+is rendered once into an event of the changed resource's href and new ETag,
+which is put to the buffer of each of the user's subscribers. A subscriber
+whose buffer of EVENTS_BUFFER events is full is dropped, and its stream
+ends. Clients reconnect with the Last-Event-ID they have seen and the missed
+events are read from the change log.
+
+GET responses are given a weak ETag of their body, and answered with 304
+Not Modified if it matches If-None-Match, so a pushed ETag tells a client
+whether its copy is current.
+'''
+
+# Library imports
+import queue
+import threading
+from flask import current_app, request, url_for
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Project imports
+from cyequ import db, json
+from cyequ.changes import COMPONENT, DELETE
+from cyequ.constants import INTERNAL_REQUEST
+
+# Defaults of the configuration keys of the module
+DEFAULTS = {
+    # Seconds between rounds of the hub without commits in the process
+    "EVENTS_POLL": 0.5,
+    # Seconds between heartbeat comments of an idle stream
+    "EVENTS_HEARTBEAT": 15,
+    # Events buffered for a subscriber before it is dropped
+    "EVENTS_BUFFER": 256,
+}
+# Change log records read by the hub in one query
+_BATCH = 1000
+_RECORDS = "SELECT seq, user_id, kind, op, uri, parent FROM changelog" \
+           " WHERE seq > :seq {} ORDER BY seq LIMIT :limit"
+
+
+class Subscriber(object):
+    '''
+    Subscription of one stream to the changes of user *user_id* with URI
+    *user*.
+    '''
+
+    def __init__(self, user_id, user, size):
+        self.user_id = user_id
+        self.user = user
+        self.queue = queue.Queue(size)
+        # Sequence number of the last event sent, later ones only are sent
+        self.seq = 0
+        self.dropped = False
+
+    def put(self, seq, data):
+        '''
+        Buffers the event of sequence number *seq*. Returns False if the
+        buffer is full.
+        '''
+
+        try:
+            self.queue.put_nowait((seq, data))
+        except queue.Full:
+            return False
+        return True
+
+
+def format_event(seq, data):
+    '''
+    Returns the text/event-stream message of event *data* with id *seq*.
+    '''
+
+    return "id: {}\nevent: change\ndata: {}\n\n".format(seq, json.dumps(data))
+
+
+class EventHub(object):
+    '''
+    Fan-out of the change log records of *app* to the subscribers of their
+    users.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.poll = app.config["EVENTS_POLL"]
+        self.size = app.config["EVENTS_BUFFER"]
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        # Subscribers by user id
+        self.subscribers = {}
+        self.thread = None
+        # Sequence number of the last record read
+        self.seq = None
+        # Rounds run, events sent and subscribers dropped, for monitoring
+        self.rounds = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id, user):
+        '''
+        Subscribes to the changes of user *user_id* with URI *user* from now
+        on. Returns the Subscriber.
+        '''
+
+        subscriber = Subscriber(user_id, user, self.size)
+        with self.lock:
+            if self.thread is None:
+                self.seq = db.session.execute(
+                    text("SELECT coalesce(max(seq), 0) FROM changelog")
+                ).scalar()
+                self.thread = threading.Thread(target=self._run,
+                                               name="cyequ-events",
+                                               daemon=True)
+                self.thread.start()
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        '''
+        Removes *subscriber* from the hub.
+        '''
+
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[subscriber.user_id]
+
+    def records(self, seq, user_id=None):
+        '''
+        Reads the change log records after *seq* of the subscribed users, of
+        user *user_id* only if given. Returns the sequence number of the
+        last record read and a list of (record, href, equipment href)
+        tuples, the last one None for others than components.
+        '''
+
+        from cyequ.resources.changes import change_href
+        where, users = "", {}
+        if user_id is not None:
+            where = "AND user_id = :user_id"
+        params = {"seq": seq, "limit": _BATCH, "user_id": user_id}
+        found = []
+        with self.app.test_request_context():
+            while True:
+                rows = db.session.execute(text(_RECORDS.format(where)),
+                                          params).fetchall()
+                for row in rows:
+                    if row.user_id not in users:
+                        users[row.user_id] = self._user(row.user_id)
+                    user = users[row.user_id]
+                    if user is None:
+                        continue
+                    up = None
+                    if row.kind == COMPONENT:
+                        up = url_for("api.equipmentitem", user=user,
+                                     equipment=row.parent)
+                    found.append((row, change_href(user, row), up))
+                if rows:
+                    params["seq"] = rows[-1].seq
+                if len(rows) < _BATCH:
+                    break
+        return params["seq"], found
+
+    def _user(self, user_id):
+        '''
+        Returns the URI of subscribed user *user_id*, or None.
+        '''
+
+        with self.lock:
+            for subscriber in self.subscribers.get(user_id, ()):
+                return subscriber.user
+        return None
+
+    def render(self, records):
+        '''
+        Returns the events of *records*, as returned by records(), a list of
+        (seq, user id, data) tuples. The ETag of each resource changed is got
+        once, by getting the resource through the API's own resources.
+        '''
+
+        etags = {}
+
+        def etag(href):
+            if href not in etags:
+                with self.app.test_request_context(
+                        href, method="GET",
+                        environ_base={INTERNAL_REQUEST: True}):
+                    response = self.app.full_dispatch_request()
+                etags[href] = response.headers.get("ETag") \
+                    if response.status_code == 200 else None
+            return etags[href]
+
+        events = []
+        for row, href, up in records:
+            data = {"op": row.op, "kind": row.kind, "href": href,
+                    "etag": None if row.op == DELETE else etag(href)}
+            if up is not None:
+                # Equipment documents list their components
+                data["up"] = {"href": up, "etag": etag(up)}
+            events.append((row.seq, row.user_id, data))
+        return events
+
+    def _run(self):
+        '''
+        Sends the events of new records until there are no subscribers.
+        '''
+
+        while True:
+            self.wake.wait(self.poll)
+            self.wake.clear()
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            self.seq, records = self.records(self.seq)
+            if records:
+                self._publish(self.render(records))
+            self.rounds += 1
+
+    def _publish(self, events):
+        '''
+        Puts *events* to the buffers of the subscribers of their users,
+        dropping subscribers whose buffer is full.
+        '''
+
+        with self.lock:
+            for seq, user_id, data in events:
+                message = format_event(seq, data)
+                for subscriber in list(self.subscribers.get(user_id, ())):
+                    if subscriber.put(seq, message):
+                        self.sent += 1
+                        continue
+                    subscriber.dropped = True
+                    self.dropped += 1
+                    self.subscribers[user_id].discard(subscriber)
+                if not self.subscribers.get(user_id, True):
+                    del self.subscribers[user_id]
+
+
+def get_hub():
+    '''
+    Returns the event hub of the current application, creating it first if
+    needed.
+    '''
+
+    extensions = current_app.extensions
+    hub = extensions.get("cyequ_events")
+    if hub is None:
+        hub = extensions.setdefault(
+            "cyequ_events", EventHub(current_app._get_current_object()))
+    return hub
+
+
+@event.listens_for(Session, "after_commit")
+def wake_hub(session):
+    '''
+    Wakes the event hub of the application after a commit. Within a batch,
+    the batch's own commit is waited for.
+    '''
+
+    if session.info.get("cyequ_batch"):
+        return
+    try:
+        hub = current_app.extensions.get("cyequ_events")
+    except RuntimeError:
+        # Outside of an application context
+        return
+    if hub is not None:
+        hub.wake.set()
+
+
+def set_etag(response):
+    '''
+    Gives the response of a GET request a weak ETag of its body, and makes
+    it 304 Not Modified if the request's If-None-Match matches.
+    '''
+
+    if request.method not in ("GET", "HEAD") or response.status_code != 200 \
+            or response.direct_passthrough or response.is_streamed:
+        return response
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    '''
+    Sets the configuration defaults of the module and gives the GET
+    responses of *app* ETags.
+    '''
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.after_request(set_etag)
@@ -0,0 +1,191 @@
+'''
+This module exports the full history of a user (equipment, components with
+their service intervals, and rides) as NDJSON or CSV.
+
+Rows are read with yield_per, so the database cursor is consumed in batches
+and never loaded as a whole. Encoded rows are gathered into chunks of about
+CHUNK_SIZE bytes, optionally gzipped on the fly, and yielded to the caller:
+the API streams them to the socket and the export command to a file.
+'''
+
+# Library imports
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+
+# Project imports
+from cyequ import db
+from cyequ.models import User, Equipment, Component, ServiceInterval, Ride, \
+                         CatalogEntry
+
+# Rows fetched from the database per batch
+YIELD_PER = 1000
+# Output bytes per yielded chunk
+CHUNK_SIZE = 64 * 1024
+# Export formats and their media types
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Columns of each record type. CSV output uses their union with a type column.
+EQUIPMENT_COLUMNS = ("uri", "name", "category", "brand", "model",
+                     "date_added", "date_retired")
+COMPONENT_COLUMNS = EQUIPMENT_COLUMNS + ("equipment", "ride_seconds",
+                                         "due_date", "due_seconds",
+                                         "interval_days", "interval_hours")
+RIDE_COLUMNS = ("uri", "name", "equipment", "datetime", "duration",
+                "moving_time", "distance", "elevation_gain")
+CSV_COLUMNS = ("type",) + COMPONENT_COLUMNS \
+    + tuple(col for col in RIDE_COLUMNS if col not in COMPONENT_COLUMNS)
+
+
+def _columns(model):
+    '''
+    Returns the EQUIPMENT_COLUMNS of equipment or components, brand and
+    model read from the joined catalog entry.
+    '''
+
+    return [getattr(CatalogEntry if col in ("brand", "model") else model, col)
+            for col in EQUIPMENT_COLUMNS]
+
+
+def export_records(user_id):
+    '''
+    Generates the records of a user as (type, row) tuples, where row is a
+    tuple of the values of the type's columns. Equipment comes first, then
+    components and rides, each in id order.
+    '''
+
+    equipment = db.session.query(*_columns(Equipment)) \
+        .join(CatalogEntry, Equipment.catalog_id == CatalogEntry.id) \
+        .filter(Equipment.owner == user_id).order_by(Equipment.id)
+    for row in equipment.yield_per(YIELD_PER):
+        yield "equipment", tuple(row)
+    components = db.session.query(
+        *_columns(Component),
+        Equipment.uri,
+        Component.ride_seconds,
+        Component.due_date,
+        Component.due_seconds,
+        ServiceInterval.interval_days,
+        ServiceInterval.interval_hours
+    ).join(CatalogEntry, Component.catalog_id == CatalogEntry.id) \
+        .join(Equipment, Component.equipment_id == Equipment.id) \
+        .outerjoin(ServiceInterval,
+                   Component.category == ServiceInterval.category) \
+        .filter(Equipment.owner == user_id).order_by(Component.id)
+    for row in components.yield_per(YIELD_PER):
+        yield "component", tuple(row)
+    rides = db.session.query(
+        Ride.uri, Ride.name, Equipment.uri, Ride.datetime, Ride.duration,
+        Ride.moving_time, Ride.distance, Ride.elevation_gain
+    ).outerjoin(Equipment, Ride.equipment_id == Equipment.id) \
+        .filter(Ride.rider == user_id).order_by(Ride.id)
+    for row in rides.yield_per(YIELD_PER):
+        yield "ride", tuple(row)
+
+
+def _value(value):
+    '''
+    Converts a database value for output. Datetimes are given in ISO 8601
+    like in the API.
+    '''
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+_COLUMNS = {"equipment": EQUIPMENT_COLUMNS,
+            "component": COMPONENT_COLUMNS,
+            "ride": RIDE_COLUMNS}
+
+
+def _ndjson_lines(records):
+    '''
+    Encodes records as NDJSON lines, one object per record.
+    '''
+
+    encoder = json.JSONEncoder(ensure_ascii=False, default=_value)
+    for rtype, row in records:
+        obj = {"type": rtype}
+        obj.update(zip(_COLUMNS[rtype], map(_value, row)))
+        yield encoder.encode(obj) + "\n"
+
+
+def _csv_lines(records):
+    '''
+    Encodes records as CSV lines under a header of all columns.
+    '''
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    index = {col: i for i, col in enumerate(CSV_COLUMNS)}
+    writer.writerow(CSV_COLUMNS)
+    yield buf.getvalue()
+    for rtype, row in records:
+        line = [""] * len(CSV_COLUMNS)
+        line[0] = rtype
+        for col, value in zip(_COLUMNS[rtype], row):
+            line[index[col]] = "" if value is None else _value(value)
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(line)
+        yield buf.getvalue()
+
+
+def export_chunks(user_id, fmt="ndjson", compress=False):
+    '''
+    Generates the export of a user in format *fmt* ("ndjson" or "csv") as
+    chunks of UTF-8 bytes, gzipped if *compress* is true.
+
+    Exceptions.
+    ValueError. If the format is unknown.
+    '''
+
+    if fmt not in FORMATS:
+        raise ValueError("Format must be one of {}"
+                         .format(", ".join(FORMATS)))
+    lines = (_ndjson_lines if fmt == "ndjson" else _csv_lines)(
+        export_records(user_id)
+    )
+    # gzip container, i.e. zlib with a gzip header and trailer
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    parts, size = [], 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            chunk = "".join(parts).encode("utf-8")
+            parts, size = [], 0
+            chunk = gzip.compress(chunk) if gzip else chunk
+            if chunk:
+                yield chunk
+    chunk = "".join(parts).encode("utf-8")
+    if gzip:
+        chunk = gzip.compress(chunk) + gzip.flush()
+    if chunk:
+        yield chunk
+
+
+@click.command("export")
+@click.argument("user")
+@click.option("--format", "fmt", type=click.Choice(list(FORMATS)),
+              default="ndjson", help="Output format.")
+@click.option("--gzip", "compress", is_flag=True,
+              help="Compress the output with gzip.")
+@click.option("--output", "-o", type=click.Path(dir_okay=False),
+              default="-", help="Output file, stdout by default.")
+@with_appcontext
+def export_command(user, fmt, compress, output):
+    '''
+    Exports the equipment, components and rides of the user of URI USER.
+    '''
+
+    db_user = User.query.filter_by(uri=user).first()
+    if db_user is None:
+        raise click.BadParameter("No user was found with URI {}".format(user))
+    with click.open_file(output, "wb") as out:
+        for chunk in export_chunks(db_user.id, fmt, compress):
+            out.write(chunk)
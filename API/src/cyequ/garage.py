@@ -0,0 +1,377 @@
+'''
+This module holds the garage summaries of the API.
+
+Rendering a user's garage takes UserItem, EquipmentByUser and one
+EquipmentItem per bike. The garage table instead keeps a precomputed
+summary per user: the user's equipment with the components in service,
+their counts and the time of the last change, serialized as JSON, with a
+version incremented on every change. UserGarage (see
+cyequ.resources.garage) serves it with one query.
+
+Summaries are kept up to date from the change log (see cyequ.changes).
+Before a transaction that has written users, equipment or components
+commits, the summaries of the users concerned are refreshed: the records
+after the last one a summary has applied name the bikes changed, and only
+those are read again. Writes that bypass the ORM are logged too, and
+applied by the next refresh of the user; until then, UserGarage applies
+them to the document it serves without saving it. A summary is built in
+full when it is missing, or when records it has not applied may have been
+compacted away.
+
+The garage-check command compares the summaries with the normalized
+tables, and garage-rebuild builds them all again.
+'''
+
+# Library imports
+from itertools import chain
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+# Project imports
+from cyequ import db, json
+from cyequ.changes import EQUIPMENT, COMPONENT, first_retained
+from cyequ.maintenance import IN_SERVICE
+from cyequ.models import CatalogEntry, ChangeLog, Component, Equipment, \
+                         GarageSummary, User
+
+_user = User.__table__
+_equipment = Equipment.__table__
+_component = Component.__table__
+_catalog = CatalogEntry.__table__
+_log = ChangeLog.__table__
+_garage = GarageSummary.__table__
+# Kinds of change log records changing a summary
+_KINDS = (EQUIPMENT, COMPONENT)
+# Id and summary of a user by URI, and whether records are not applied yet
+_LOAD = select(
+    _user.c.id, _garage.c.version, _garage.c.modified, _garage.c.body,
+    select(_log.c.seq)
+    .where(_log.c.user_id == _user.c.id)
+    .where(_log.c.seq > _garage.c.seq)
+    .where(_log.c.kind.in_(_KINDS))
+    .exists().label("pending")
+).select_from(_user.outerjoin(_garage, _garage.c.user_id == _user.c.id))
+
+
+def _iso(value):
+    '''
+    Returns datetime *value* in ISO 8601, or None.
+    '''
+
+    return value.isoformat() if value is not None else None
+
+
+def _bikes(session, user_id, uris=None):
+    '''
+    Reads the equipment of user *user_id*, only that with URIs *uris* if
+    given, and its components in service. Returns a list of bike documents.
+    '''
+
+    stmt = select(_equipment.c.id, _equipment.c.uri, _equipment.c.name,
+                  _equipment.c.category, _catalog.c.brand, _catalog.c.model,
+                  _equipment.c.date_added, _equipment.c.date_retired) \
+        .join(_catalog, _catalog.c.id == _equipment.c.catalog_id) \
+        .where(_equipment.c.owner == user_id) \
+        .where(_equipment.c.uri.isnot(None))
+    if uris is not None:
+        stmt = stmt.where(_equipment.c.uri.in_(uris))
+    bikes = {}
+    for row in session.execute(stmt):
+        bikes[row.id] = {"uri": row.uri,
+                         "name": row.name,
+                         "category": row.category,
+                         "brand": row.brand,
+                         "model": row.model,
+                         "date_added": _iso(row.date_added),
+                         "date_retired": _iso(row.date_retired),
+                         "components": []
+                         }
+    if not bikes:
+        return []
+    stmt = select(_component.c.equipment_id, _component.c.uri,
+                  _component.c.name, _component.c.category, _catalog.c.brand,
+                  _catalog.c.model, _component.c.date_added) \
+        .join(_catalog, _catalog.c.id == _component.c.catalog_id) \
+        .join(_equipment, _equipment.c.id == _component.c.equipment_id) \
+        .where(_equipment.c.owner == user_id) \
+        .where(_component.c.date_retired == IN_SERVICE) \
+        .where(_component.c.uri.isnot(None)) \
+        .order_by(_component.c.category, _component.c.uri)
+    if uris is not None:
+        stmt = stmt.where(_equipment.c.uri.in_(uris))
+    for row in session.execute(stmt):
+        bikes[row.equipment_id]["components"].append({
+            "uri": row.uri,
+            "name": row.name,
+            "category": row.category,
+            "brand": row.brand,
+            "model": row.model,
+            "date_added": _iso(row.date_added)
+        })
+    return list(bikes.values())
+
+
+def _document(bikes):
+    '''
+    Returns the summary document of *bikes*, in the order of
+    EquipmentByUser, with their counts.
+    '''
+
+    bikes.sort(key=lambda bike: (bike["category"], bike["name"]))
+    return {"bikes": bikes,
+            "counts": {
+                "equipment": len(bikes),
+                "equipment_in_use": sum(1 for bike in bikes
+                                        if bike["date_retired"] is None),
+                "components_in_service": sum(len(bike["components"])
+                                             for bike in bikes)
+            }}
+
+
+def refresh(session, user_id, save=True, full=False):
+    '''
+    Brings the summary of user *user_id* up to date with the change log,
+    built in full if *full*, and saves it if *save*. Returns its version,
+    time of the last change and document, or None if the user does not
+    exist, in which case a saved summary is deleted.
+    '''
+
+    if session.execute(select(_user.c.id).where(_user.c.id == user_id)
+                       ).first() is None:
+        if save:
+            session.execute(_garage.delete()
+                            .where(_garage.c.user_id == user_id))
+        return None
+    row = session.execute(select(_garage.c.version, _garage.c.seq,
+                                 _garage.c.modified, _garage.c.body)
+                          .where(_garage.c.user_id == user_id)).first()
+    if row is not None and not full:
+        records = session.execute(
+            select(_log.c.seq, _log.c.kind, _log.c.uri, _log.c.parent,
+                   _log.c.time)
+            .where(_log.c.user_id == user_id).where(_log.c.seq > row.seq)
+            .order_by(_log.c.seq)).fetchall()
+        document = json.loads(row.body)
+        if not records:
+            return row.version, row.modified, document
+        # Records not applied may have been compacted away
+        full = row.seq + 1 < first_retained()
+    if row is None or full:
+        seq, modified = session.execute(
+            select(func.coalesce(func.max(_log.c.seq), 0),
+                   func.max(case((_log.c.kind.in_(_KINDS), _log.c.time))))
+            .where(_log.c.user_id == user_id)).first()
+        document = _document(_bikes(session, user_id))
+        version = row.version + 1 if row is not None else 1
+    else:
+        seq, version, modified = records[-1].seq, row.version, row.modified
+        changed = set()
+        for record in records:
+            if record.kind in _KINDS:
+                changed.add(record.uri if record.kind == EQUIPMENT
+                            else record.parent)
+                modified = record.time
+        if changed:
+            bikes = [bike for bike in document["bikes"]
+                     if bike["uri"] not in changed]
+            document = _document(bikes + _bikes(session, user_id, changed))
+            version += 1
+    if save:
+        values = {"version": version, "seq": seq, "modified": modified,
+                  "body": json.dumps(document).encode()}
+        if row is None:
+            session.execute(_garage.insert().values(user_id=user_id,
+                                                    **values))
+        else:
+            session.execute(_garage.update()
+                            .where(_garage.c.user_id == user_id)
+                            .values(**values))
+    return version, modified, document
+
+
+def load(user):
+    '''
+    Returns the id of the user with URI *user* and the version, time of the
+    last change and document of the user's garage summary, or None if there
+    is no such user. Changes not applied to the summary yet are applied to
+    the document returned.
+    '''
+
+    row = db.session.execute(_LOAD.where(_user.c.uri == user)).first()
+    if row is None:
+        return None
+    if row.body is None or row.pending:
+        return (row.id,) + refresh(db.session, row.id, save=False)
+    return row.id, row.version, row.modified, json.loads(row.body)
+
+
+def check_garage(session, user_id):
+    '''
+    Compares the saved summary of user *user_id* with one built from the
+    normalized tables. Returns a list of the differences found.
+    '''
+
+    row = session.execute(select(_garage.c.body)
+                          .where(_garage.c.user_id == user_id)).first()
+    exists = session.execute(select(_user.c.id)
+                             .where(_user.c.id == user_id)).first()
+    if exists is None:
+        return ["summary of a deleted user"] if row is not None else []
+    if row is None:
+        return ["summary missing"]
+    saved = json.loads(row.body)
+    built = _document(_bikes(session, user_id))
+    saved_bikes = {bike["uri"]: bike for bike in saved["bikes"]}
+    built_bikes = {bike["uri"]: bike for bike in built["bikes"]}
+    differences = []
+    for uri in sorted(set(saved_bikes) | set(built_bikes)):
+        if uri not in built_bikes:
+            differences.append("equipment {} no longer exists".format(uri))
+        elif uri not in saved_bikes:
+            differences.append("equipment {} missing".format(uri))
+        elif saved_bikes[uri] != built_bikes[uri]:
+            differences.append("equipment {} differs".format(uri))
+    if saved["counts"] != built["counts"]:
+        differences.append("counts differ")
+    if not differences and saved != built:
+        differences.append("order differs")
+    return differences
+
+
+def _has_table(session):
+    '''
+    Returns whether the database has the garage table, which databases
+    created before it existed get with garage-rebuild.
+    '''
+
+    if has_app_context() and current_app.extensions.get("cyequ_garage"):
+        return True
+    if not inspect(session.connection()).has_table(_garage.name):
+        return False
+    if has_app_context():
+        current_app.extensions["cyequ_garage"] = True
+    return True
+
+
+def _values(target, key):
+    '''
+    Returns the current and previous values of attribute *key* of
+    *target*, without loading it.
+    '''
+
+    state = inspect(target)
+    values = set(state.attrs[key].history.deleted)
+    values.add(state.dict.get(key))
+    values.discard(None)
+    return values
+
+
+@event.listens_for(Session, "after_flush")
+def note_garages(session, flush_context):
+    '''
+    Notes the users, and the equipment of the components, written by a
+    flush, whose summaries are refreshed before the commit.
+    '''
+
+    users, equipment = set(), set()
+    for target in chain(session.new, session.dirty, session.deleted):
+        if isinstance(target, User):
+            users.update(_values(target, "id"))
+        elif isinstance(target, Equipment):
+            users.update(_values(target, "owner"))
+        elif isinstance(target, Component):
+            equipment.update(_values(target, "equipment_id"))
+    if users or equipment:
+        noted = session.info.setdefault("cyequ_garage", (set(), set()))
+        noted[0].update(users)
+        noted[1].update(equipment)
+
+
+@event.listens_for(Session, "before_commit")
+def refresh_garages(session):
+    '''
+    Refreshes the summaries of the users noted, in the transaction being
+    committed.
+    '''
+
+    # Flushed first, so the change log has the records of the transaction
+    session.flush()
+    noted = session.info.pop("cyequ_garage", None)
+    if noted is None or not _has_table(session):
+        return
+    users, equipment = noted
+    if equipment:
+        users.update(session.execute(
+            select(_equipment.c.owner)
+            .where(_equipment.c.id.in_(equipment))
+            .where(_equipment.c.owner.isnot(None))).scalars())
+    for user_id in sorted(users):
+        refresh(session, user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_garages(session, previous_transaction):
+    '''
+    Forgets the users noted by a rolled back transaction.
+    '''
+
+    session.info.pop("cyequ_garage", None)
+
+
+def rebuild_garages():
+    '''
+    Creates the garage table if needed and builds the summaries of all
+    users in full. Returns the number of summaries built.
+    '''
+
+    _garage.create(db.engine, checkfirst=True)
+    users = db.session.execute(select(_user.c.id)).scalars().all()
+    for user_id in users:
+        refresh(db.session, user_id, full=True)
+    # Summaries of deleted users, kept if foreign keys are not enforced
+    db.session.execute(_garage.delete()
+                       .where(_garage.c.user_id.notin_(select(_user.c.id))))
+    db.session.commit()
+    return len(users)
+
+
+@click.command("garage-rebuild")
+@with_appcontext
+def garage_rebuild_command():
+    '''
+    Creates the garage table if needed and builds the garage summaries of
+    all users again, e.g. for databases created before summaries existed.
+    '''
+
+    click.echo("{} garage summaries built.".format(rebuild_garages()))
+
+
+@click.command("garage-check")
+@click.option("--repair", is_flag=True,
+              help="Build the summaries found inconsistent again.")
+@with_appcontext
+def garage_check_command(repair):
+    '''
+    Compares the garage summaries with the equipment and component tables
+    and lists the differences found.
+    '''
+
+    users = set(db.session.execute(select(_user.c.id)).scalars())
+    users.update(db.session.execute(select(_garage.c.user_id)).scalars())
+    inconsistent = 0
+    for user_id in sorted(users):
+        differences = check_garage(db.session, user_id)
+        if not differences:
+            continue
+        inconsistent += 1
+        click.echo("User {}: {}".format(user_id, "; ".join(differences)))
+        if repair:
+            refresh(db.session, user_id, full=True)
+    if repair:
+        db.session.commit()
+    click.echo("{} garage summaries checked, {} inconsistent{}.".format(
+        len(users), inconsistent, ", repaired" if repair and inconsistent
+        else ""))
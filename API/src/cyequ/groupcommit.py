@@ -0,0 +1,257 @@
+'''
+This module holds the group commit writer of the API.
+
+Every write request commits its own transaction, and with SQLite each
+commit waits for the disk. With the GROUP_COMMIT option, the views of
+POST, PUT, PATCH and DELETE requests are instead submitted as units of work
+to a single writer thread. The writer collects the units submitted within
+GROUP_COMMIT_WINDOW seconds of the first one, runs each in a savepoint of
+one transaction and commits them all at once, then completes each request's
+future with its own response.
+
+Units run on sessions joined to the group's transaction, as the operations
+of a batch do (see cyequ.resources.batch): commits of the resources end up
+in the one commit of the group, and a rollback only undoes the unit's own
+savepoint. A unit which raises or responds with an error status is rolled
+back to its savepoint without affecting the others, including what it
+committed before failing. The whole view runs on the writer thread, so
+requests parsing large uploads delay the group.
+'''
+
+# Library imports
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app, request, _request_ctx_stack
+from sqlalchemy import event
+
+# Project imports
+from cyequ import db
+
+# Defaults of the configuration keys of the module
+DEFAULTS = {
+    # Set True to run write requests through the group commit writer
+    "GROUP_COMMIT": False,
+    # Seconds to wait for more units after the first one of a group
+    "GROUP_COMMIT_WINDOW": 0.002,
+    # Most units committed in one transaction
+    "GROUP_COMMIT_MAX": 64,
+}
+# Request methods run through the writer
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+
+class UnitFailed(Exception):
+    '''
+    Raised by a unit of work to have its savepoint rolled back while still
+    completing its future with *result*.
+    '''
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+class GroupCommitWriter(object):
+    '''
+    Writer thread committing the units of work of *app* in groups.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.window = app.config["GROUP_COMMIT_WINDOW"]
+        self.max_units = app.config["GROUP_COMMIT_MAX"]
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        # Groups committed and units run, for monitoring
+        self.groups = 0
+        self.units = 0
+
+    def submit(self, unit):
+        '''
+        Submits function *unit* to be run on the writer thread within an
+        application context. Returns a Future of its result.
+        '''
+
+        with self.lock:
+            # Started on first use, so forked workers start their own
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run,
+                                               name="cyequ-group-commit",
+                                               daemon=True)
+                self.thread.start()
+        future = Future()
+        self.queue.put((unit, future))
+        return future
+
+    def _run(self):
+        '''
+        Collects and commits groups of units until the process exits.
+        '''
+
+        while True:
+            units = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(units) < self.max_units:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        units.append(self.queue.get(timeout=remaining))
+                    else:
+                        units.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                self._commit(units)
+
+    def _unit(self, connection, unit, future):
+        '''
+        Runs *unit* in a savepoint of *connection*. Returns the session of
+        the unit and its outcome, a (result, exception) pair, or None if the
+        unit was rolled back.
+        '''
+
+        savepoint = connection.begin_nested()
+        # The session's commits and rollbacks end an inner savepoint only,
+        # and the rest of the unit runs in a new one
+        inner = [connection.begin_nested()]
+
+        def restart(session, transaction):
+            if transaction.parent is None and not inner[0].is_active:
+                inner[0] = connection.begin_nested()
+
+        session = db.session.session_factory(bind=connection, binds={})
+        # Commit hooks of the session wait for the group's commit
+        session.info["cyequ_batch"] = True
+        event.listen(session, "after_transaction_end", restart)
+        registry = db.session.registry
+        registry.set(session)
+        try:
+            result = unit()
+        except UnitFailed as failed:
+            outcome = (failed.result, None)
+        except Exception as err:
+            outcome = (None, err)
+        else:
+            # Commit hooks are still deferred by the flag
+            session.commit()
+            outcome = None
+        finally:
+            registry.clear()
+        event.remove(session, "after_transaction_end", restart)
+        if outcome is None:
+            inner[0].rollback()
+            savepoint.commit()
+            return session, (result, None)
+        session.rollback()
+        if inner[0].is_active:
+            inner[0].rollback()
+        # Also undoes what the unit committed before failing
+        savepoint.rollback()
+        session.close()
+        result, error = outcome
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+        return None
+
+    def _commit(self, units):
+        '''
+        Runs *units* in one transaction and commits it, then completes the
+        futures of the units.
+        '''
+
+        done = []
+        connection = db.engine.connect()
+        # pysqlite begins a transaction only before DML, and the SAVEPOINT of
+        # the first unit would otherwise start and commit one of its own
+        dbapi_connection = connection.connection.dbapi_connection
+        isolation_level = getattr(dbapi_connection, "isolation_level", None)
+        manual = connection.dialect.driver == "pysqlite"
+        if manual:
+            dbapi_connection.isolation_level = None
+        try:
+            transaction = connection.begin()
+            if manual:
+                connection.exec_driver_sql("BEGIN")
+            for unit, future in units:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                ran = self._unit(connection, unit, future)
+                if ran is not None:
+                    done.append((future,) + ran)
+            try:
+                for _, session, _ in done:
+                    del session.info["cyequ_batch"]
+                    session.commit()
+                transaction.commit()
+            except Exception as err:
+                if transaction.is_active:
+                    transaction.rollback()
+                for future, _, _ in done:
+                    future.set_exception(err)
+                return
+        finally:
+            for _, session, _ in done:
+                session.close()
+            if manual:
+                dbapi_connection.isolation_level = isolation_level
+            connection.close()
+        self.groups += 1
+        self.units += len(units)
+        for future, _, (result, _) in done:
+            future.set_result(result)
+
+
+def get_writer():
+    '''
+    Returns the group commit writer of the current application, creating it
+    first if needed.
+    '''
+
+    extensions = current_app.extensions
+    writer = extensions.get("cyequ_writer")
+    if writer is None:
+        writer = extensions.setdefault(
+            "cyequ_writer",
+            GroupCommitWriter(current_app._get_current_object()))
+    return writer
+
+
+def dispatch_write():
+    '''
+    Runs the view of a write request on the writer thread and returns its
+    response. Requests within a batch, which has a transaction of its own,
+    are dispatched as usual.
+    '''
+
+    if not current_app.config["GROUP_COMMIT"] \
+            or request.method not in WRITE_METHODS \
+            or db.session.info.get("cyequ_batch") \
+            or request.endpoint in (None, "api.batch"):
+        return None
+    app = current_app._get_current_object()
+    context = _request_ctx_stack.top.copy()
+
+    def unit():
+        with context:
+            response = app.make_response(app.dispatch_request())
+        if response.status_code >= 400:
+            raise UnitFailed(response)
+        return response
+
+    return get_writer().submit(unit).result()
+
+
+def init_app(app):
+    '''
+    Sets the configuration defaults of the module and runs the write
+    requests of *app* through the group commit writer if enabled.
+    '''
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.before_request(dispatch_write)
@@ -0,0 +1,165 @@
+'''
+This module holds the background job registry of the API.
+
+Long running work, such as archive imports, is run in a thread with its own
+application context. Jobs are kept in memory of the serving process, and
+each change of their status is also written to a file in JOB_DIR. Other
+processes serving the same application, such as the workers of cyequ-serve,
+read the status from there.
+'''
+
+# Library imports
+import os
+import re
+import threading
+import uuid
+from flask import current_app
+
+# Project imports
+from cyequ import json
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Ids of jobs, also their file names
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class Job(object):
+    '''
+    Status of one background job. *progress* is an object with as_dict(),
+    which the job function may update while running.
+    '''
+
+    def __init__(self, kind, owner):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.state = QUEUED
+        self.progress = None
+        self.error = None
+        # Status file, see save()
+        self.path = None
+
+    def as_dict(self):
+        '''
+        Returns the job status as a JSON compatible dict.
+        '''
+
+        return {"id": self.id,
+                "kind": self.kind,
+                "owner": self.owner,
+                "state": self.state,
+                "progress": self.progress.as_dict()
+                if self.progress is not None else None,
+                "error": self.error
+                }
+
+    def save(self):
+        '''
+        Writes the status to the job's file, replacing the previous status
+        at once so readers never see a partial file.
+        '''
+
+        if self.path is None:
+            return
+        partial = self.path + ".partial"
+        with open(partial, "w") as status:
+            status.write(json.dumps(self.as_dict()))
+        os.replace(partial, self.path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Returns the Job of a status file written by save(), or None if there
+        is no such file.
+        '''
+
+        try:
+            with open(path) as status:
+                values = json.loads(status.read())
+        except FileNotFoundError:
+            return None
+        job = cls(values["kind"], values["owner"])
+        job.id = values["id"]
+        job.state = values["state"]
+        job.error = values["error"]
+        if values["progress"] is not None:
+            job.progress = _Progress(values["progress"])
+        return job
+
+
+class _Progress(object):
+    '''
+    Progress of a job loaded from its status file.
+    '''
+
+    def __init__(self, values):
+        self.values = values
+
+    def as_dict(self):
+        return self.values
+
+
+def _path(app, job_id):
+    '''
+    Returns the status file path of job *job_id* of an application.
+    '''
+
+    return os.path.join(app.config["JOB_DIR"], job_id + ".json")
+
+
+def _registry(app):
+    '''
+    Returns the job registry of an application.
+    '''
+
+    return app.extensions.setdefault("cyequ_jobs", {})
+
+
+def start_job(kind, owner, target, *args):
+    '''
+    Registers a job and runs target(job, *args) in a daemon thread within an
+    application context. The target may call job.save() to publish its
+    progress to other processes. Returns the Job.
+    '''
+
+    app = current_app._get_current_object()
+    job = Job(kind, owner)
+    os.makedirs(app.config["JOB_DIR"], exist_ok=True)
+    job.path = _path(app, job.id)
+    job.save()
+    _registry(app)[job.id] = job
+
+    def run():
+        with app.app_context():
+            job.state = RUNNING
+            job.save()
+            try:
+                target(job, *args)
+            except Exception as err:
+                job.error = str(err)
+                job.state = FAILED
+                app.logger.exception("Job %s failed", job.id)
+            else:
+                job.state = DONE
+            job.save()
+
+    threading.Thread(target=run, name="cyequ-job-" + job.id,
+                     daemon=True).start()
+    return job
+
+
+def get_job(job_id):
+    '''
+    Returns the Job of id *job_id* of the current application, or None.
+    Jobs started by other processes are loaded from their status files.
+    '''
+
+    job = _registry(current_app).get(job_id)
+    if job is None and _JOB_ID.fullmatch(job_id):
+        job = Job.load(_path(current_app, job_id))
+    return job
@@ -0,0 +1,101 @@
+'''
+This module holds the lazy importing of heavy dependencies of the API.
+
+Modules such as numpy and jsonschema are only needed by some requests and
+commands, but importing them takes a large share of the start up time of
+create_app. lazy_import returns a stand-in which imports the module on its
+first attribute access instead. See cyequ.warmup for loading them before a
+worker serves requests. Likewise, LazyCommand registers a CLI command
+without importing the module defining it.
+'''
+
+# Library imports
+import importlib
+import importlib.util
+import sys
+import click
+
+# Project imports
+# --
+
+
+class _LazyModule(object):
+    '''
+    Stands in for a module not imported yet, importing it on the first
+    attribute access. The import system's lock of the module makes the
+    first access safe from several threads, unlike modules of
+    importlib.util.LazyLoader before Python 3.12, which other threads may
+    see half executed.
+    '''
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attribute):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self.__dict__["_name"])
+
+
+def lazy_import(name):
+    '''
+    Returns module *name*, imported on first attribute access if it has not
+    been imported yet.
+
+    Exceptions.
+    ImportError. If the module is not installed.
+    '''
+
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ImportError("No module named '{}'".format(name), name=name)
+    return _LazyModule(name)
+
+
+def is_loaded(name):
+    '''
+    Tells if module *name* has been imported, not only imported lazily.
+    '''
+
+    return name in sys.modules
+
+
+class LazyCommand(click.Command):
+    '''
+    This class defines a command of the flask CLI which imports the module
+    defining it only when it is run or its help is shown. *import_name* is
+    "module:attribute" of the real command.
+    '''
+
+    def __init__(self, name, import_name, help):
+        super().__init__(name, help=help)
+        self.import_name = import_name
+        self._command = None
+
+    def command(self):
+        '''
+        Returns the real command, importing its module first if needed.
+        '''
+
+        if self._command is None:
+            module, attribute = self.import_name.split(":")
+            self._command = getattr(importlib.import_module(module),
+                                    attribute)
+        return self._command
+
+    def get_params(self, ctx):
+        return self.command().get_params(ctx)
+
+    def get_help(self, ctx):
+        return self.command().get_help(ctx)
+
+    def invoke(self, ctx):
+        return self.command().invoke(ctx)
@@ -0,0 +1,296 @@
+'''
+This module holds the component maintenance scheduler of the API.
+
+Each component category can have a service interval rule given in days since
+the component was added and/or in ride-hours. The scheduler keeps two indexed
+columns per component, due_date and due_seconds (ride seconds left), up to
+date incrementally with SQLAlchemy mapper events. Due-queries are then index
+range scans ordered by the due column, instead of scans over all components.
+'''
+
+# Library imports
+import heapq
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect, select, text, bindparam
+
+# Project imports
+from cyequ import db
+from cyequ.models import Component, Equipment, Ride, ServiceInterval
+
+# date_retired of a component, which is currently installed to equipment
+IN_SERVICE = datetime(9999, 12, 31, 23, 59, 59)
+
+# Changes to these component attributes require rescheduling
+_SCHEDULE_KEYS = ("category", "date_added", "date_retired", "equipment_id")
+
+
+def _ride_seconds(connection, equipment_id, date_added, date_retired):
+    '''
+    Returns the sum of ride durations with the equipment between given dates.
+    '''
+
+    if equipment_id is None:
+        return 0
+    ride = Ride.__table__
+    stmt = select(func.coalesce(func.sum(ride.c.duration), 0)) \
+        .where(ride.c.equipment_id == equipment_id) \
+        .where(ride.c.datetime >= date_added) \
+        .where(ride.c.datetime < date_retired)
+    return connection.execute(stmt).scalar()
+
+
+def _schedule(connection, component):
+    '''
+    Computes ride_seconds, due_date and due_seconds for a component about to
+    be inserted or updated. Only components in service are scheduled.
+    '''
+
+    # Leave invalid values for the database to reject on flush
+    if not isinstance(component.date_added, datetime) \
+            or not isinstance(component.date_retired, datetime):
+        return
+    component.ride_seconds = _ride_seconds(connection,
+                                           component.equipment_id,
+                                           component.date_added,
+                                           component.date_retired
+                                           )
+    component.due_date = None
+    component.due_seconds = None
+    if component.date_retired != IN_SERVICE:
+        return
+    rules = ServiceInterval.__table__
+    rule = connection.execute(
+        select(rules.c.interval_days, rules.c.interval_hours)
+        .where(rules.c.category == component.category)
+    ).first()
+    if rule is None:
+        return
+    if rule.interval_days is not None:
+        component.due_date = component.date_added \
+            + timedelta(days=rule.interval_days)
+    if rule.interval_hours is not None:
+        component.due_seconds = rule.interval_hours * 3600 \
+            - component.ride_seconds
+
+
+@event.listens_for(Component, "before_insert")
+def schedule_new_component(mapper, connection, target):
+    '''
+    Schedules a component when it is added to the database.
+    '''
+
+    _schedule(connection, target)
+
+
+@event.listens_for(Component, "before_update")
+def reschedule_component(mapper, connection, target):
+    '''
+    Reschedules a component when any attribute affecting its schedule changes.
+    '''
+
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes() for key in _SCHEDULE_KEYS):
+        _schedule(connection, target)
+
+
+def _apply_ride(connection, equipment_id, when, seconds):
+    '''
+    Adds ride seconds to all components installed to the equipment at the
+    time of the ride, and takes the same amount from their due_seconds.
+    '''
+
+    if equipment_id is None or not isinstance(when, datetime) \
+            or not isinstance(seconds, int):
+        return
+    comp = Component.__table__
+    connection.execute(
+        comp.update()
+        .where(comp.c.equipment_id == equipment_id)
+        .where(comp.c.date_added <= when)
+        .where(comp.c.date_retired > when)
+        .values(ride_seconds=comp.c.ride_seconds + seconds,
+                due_seconds=comp.c.due_seconds - seconds
+                )
+    )
+
+
+def _old_value(state, key):
+    '''
+    Returns the value of an attribute before the pending change, if any.
+    '''
+
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return state.attrs[key].value
+
+
+@event.listens_for(Ride, "after_insert")
+def add_ride_usage(mapper, connection, target):
+    '''
+    Updates the usage of components used in a new ride.
+    '''
+
+    _apply_ride(connection, target.equipment_id, target.datetime,
+                target.duration)
+
+
+@event.listens_for(Ride, "after_update")
+def move_ride_usage(mapper, connection, target):
+    '''
+    Moves the usage of a modified ride from old to new components.
+    '''
+
+    state = inspect(target)
+    keys = ("equipment_id", "datetime", "duration")
+    if not any(state.attrs[key].history.has_changes() for key in keys):
+        return
+    old = [_old_value(state, key) for key in keys]
+    if isinstance(old[2], int):
+        _apply_ride(connection, old[0], old[1], -old[2])
+    _apply_ride(connection, target.equipment_id, target.datetime,
+                target.duration)
+
+
+@event.listens_for(Ride, "after_delete")
+def remove_ride_usage(mapper, connection, target):
+    '''
+    Removes the usage of a deleted ride from its components.
+    '''
+
+    if isinstance(target.duration, int):
+        _apply_ride(connection, target.equipment_id, target.datetime,
+                    -target.duration)
+
+
+def reschedule(category=None):
+    '''
+    Recomputes usage and due columns for all components, or for components of
+    a single category, with two set-based UPDATE statements. Used when rules
+    change and after bulk writes, which bypass the mapper events.
+    '''
+
+    # Second statement reads ride_seconds updated by the first one
+    usage = text(
+        "UPDATE component SET ride_seconds = ("
+        " SELECT COALESCE(SUM(ride.duration), 0) FROM ride"
+        " WHERE ride.equipment_id = component.equipment_id"
+        " AND ride.datetime >= component.date_added"
+        " AND ride.datetime < component.date_retired)"
+        " WHERE :category IS NULL OR category = :category"
+    )
+    due = text(
+        "UPDATE component SET"
+        " due_date = CASE WHEN date_retired = :in_service THEN ("
+        "  SELECT strftime('%Y-%m-%d %H:%M:%f000', component.date_added,"
+        "  '+' || interval_days || ' days') FROM service_interval"
+        "  WHERE service_interval.category = component.category)"
+        " END,"
+        " due_seconds = CASE WHEN date_retired = :in_service THEN ("
+        "  SELECT interval_hours * 3600 - component.ride_seconds"
+        "  FROM service_interval"
+        "  WHERE service_interval.category = component.category)"
+        " END"
+        " WHERE :category IS NULL OR category = :category"
+    ).bindparams(bindparam("in_service", type_=db.DateTime))
+    db.session.execute(usage, {"category": category})
+    db.session.execute(due, {"category": category, "in_service": IN_SERVICE})
+
+
+def due_components(days=0, hours=0, owner=None, limit=None, now=None):
+    '''
+    Returns components due for service within *days* by time rules or within
+    *hours* of riding by ride-hour rules. Both are read in due order from
+    their indexes, so only the due rows are visited, and merged by the
+    seconds left until due, of the calendar or of riding: the most overdue
+    come first by either rule. With *owner* (user id) only that user's
+    components are returned.
+    '''
+
+    if now is None:
+        now = datetime.now()
+    by_time = Component.query \
+        .filter(Component.due_date <= now + timedelta(days=days)) \
+        .order_by(Component.due_date)
+    by_hours = Component.query \
+        .filter(Component.due_seconds <= hours * 3600) \
+        .order_by(Component.due_seconds)
+    if owner is not None:
+        by_time = by_time.join(Equipment).filter(Equipment.owner == owner)
+        by_hours = by_hours.join(Equipment).filter(Equipment.owner == owner)
+    if limit is not None:
+        by_time = by_time.limit(limit)
+        by_hours = by_hours.limit(limit)
+    left = heapq.merge(
+        [((component.due_date - now).total_seconds(), component)
+         for component in by_time],
+        [(component.due_seconds, component) for component in by_hours],
+        key=lambda pair: pair[0])
+    # Components due by both rules are listed once, by the sooner
+    due, seen = [], set()
+    for _, component in left:
+        if component.id not in seen:
+            seen.add(component.id)
+            due.append(component)
+    return due[:limit]
+
+
+def hours_left(component):
+    '''
+    Returns ride-hours left until service, or None without a ride-hour rule.
+    '''
+
+    if component.due_seconds is None:
+        return None
+    return round(component.due_seconds / 3600, 1)
+
+
+@click.command("due-report")
+@click.option("--days", default=0, help="Time horizon in days.")
+@click.option("--hours", default=0, help="Ride-hour horizon.")
+@click.option("--limit", default=50, help="Maximum number of components.")
+@with_appcontext
+def due_report_command(days, hours, limit):
+    '''
+    Prints components of the whole fleet due for service.
+    '''
+
+    due = due_components(days=days, hours=hours, limit=limit)
+    for component in due:
+        equipment = component.installedTo
+        click.echo("{:<24} {:<20} {:<24} {:<20} {}".format(
+            equipment.ownedBy.name if equipment.ownedBy else "-",
+            equipment.name,
+            component.name,
+            str(component.due_date or "-"),
+            hours_left(component) if component.due_seconds is not None
+            else "-"
+        ))
+    click.echo("{} component(s) due.".format(len(due)))
+
+
+@click.command("set-interval")
+@click.argument("category")
+@click.option("--days", type=int, default=None,
+              help="Service interval in days.")
+@click.option("--hours", type=int, default=None,
+              help="Service interval in ride-hours.")
+@with_appcontext
+def set_interval_command(category, days, hours):
+    '''
+    Sets the service interval rule of a component category and reschedules
+    the components of the category.
+    '''
+
+    rule = ServiceInterval.query.filter_by(category=category).first()
+    if rule is None:
+        rule = ServiceInterval(category=category)
+        db.session.add(rule)
+    rule.interval_days = days
+    rule.interval_hours = hours
+    db.session.flush()
+    reschedule(category)
+    db.session.commit()
+    click.echo("Rescheduled components of category '{}'.".format(category))
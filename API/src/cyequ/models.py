@@ -3,10 +3,14 @@ This module holds class-definitions for the API equipment database models.
 '''
 
 # Library imports
+import threading
 import click
+from flask import current_app, has_app_context
 from flask.cli import with_appcontext
-from sqlalchemy import event
+from sqlalchemy import event, inspect, select, tuple_
 from sqlalchemy.engine import Engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session
 
 # Project imports
 from cyequ import db
@@ -23,7 +27,266 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor.close()
 
 
-class Component(db.Model):
+class CatalogEntry(db.Model):
+    '''
+    This class defines the database model for catalog entries, the distinct
+    brand, model and category combinations of equipment and components.
+    Entries are never changed, so they can be cached by id.
+    '''
+
+    __tablename__ = "catalog"
+    __table_args__ = (db.UniqueConstraint("brand", "model", "category",
+                                          name="_catalog_entry_uc"), )
+
+    id = db.Column(db.Integer, primary_key=True)
+    brand = db.Column(db.String(64), nullable=False)
+    model = db.Column(db.String(128), nullable=False)
+    category = db.Column(db.String(64), nullable=False)
+
+    def __repr__(self):
+        '''
+        Return the canonical string representation of the object.
+        '''
+
+        return "[{}] {} {} ({})".format(self.id, self.brand, self.model,
+                                        self.category)
+
+
+class _InternCache(object):
+    '''
+    Catalog entries of an application by (brand, model, category) key and
+    by id.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.keys = {}
+
+    def add(self, rows):
+        '''
+        Caches (brand, model, category, id) rows.
+        '''
+
+        with self.lock:
+            for brand, model, category, catalog_id in rows:
+                self.ids[brand, model, category] = catalog_id
+                self.keys[catalog_id] = (brand, model, category)
+
+    def discard(self, keys):
+        '''
+        Forgets entries of *keys*, e.g. ones created by a rolled back
+        transaction.
+        '''
+
+        with self.lock:
+            for key in keys:
+                catalog_id = self.ids.pop(key, None)
+                self.keys.pop(catalog_id, None)
+
+
+def _interned():
+    '''
+    Returns the catalog entry cache of the current application.
+    '''
+
+    cache = current_app.extensions.get("cyequ_interned")
+    if cache is None:
+        cache = current_app.extensions.setdefault("cyequ_interned",
+                                                  _InternCache())
+    return cache
+
+
+def catalog_key(catalog_id):
+    '''
+    Returns the (brand, model, category) of a catalog entry id.
+    '''
+
+    cache = _interned()
+    key = cache.keys.get(catalog_id)
+    if key is None:
+        table = CatalogEntry.__table__
+        row = db.session.connection().execute(
+            select(table.c.brand, table.c.model, table.c.category,
+                   table.c.id).where(table.c.id == catalog_id)
+        ).first()
+        if row is None:
+            return (None, None, None)
+        cache.add([row])
+        key = tuple(row[:3])
+    return key
+
+
+def intern_catalog(session, keys):
+    '''
+    Returns the catalog entry ids of a list of (brand, model, category)
+    *keys*. Entries not cached are looked up, and missing ones created, in
+    the transaction of *session*, with one statement per batch of keys.
+    '''
+
+    cache = _interned()
+    missing = list({key for key in keys if key not in cache.ids})
+    if missing:
+        table = CatalogEntry.__table__
+        connection = session.connection()
+        columns = tuple_(table.c.brand, table.c.model, table.c.category)
+
+        def lookup(batch):
+            found = []
+            for start in range(0, len(batch), 300):
+                found += connection.execute(
+                    select(table.c.brand, table.c.model, table.c.category,
+                           table.c.id)
+                    .where(columns.in_(batch[start:start + 300]))
+                ).all()
+            return found
+
+        found = lookup(missing)
+        created = list(set(missing) - {tuple(row[:3]) for row in found})
+        if created:
+            # Ignored, if another connection created the same entries
+            connection.execute(
+                table.insert().prefix_with("OR IGNORE"),
+                [{"brand": brand, "model": model, "category": category}
+                 for brand, model, category in created]
+            )
+            found += lookup(created)
+            # Forgotten again, if the transaction is rolled back
+            session.info.setdefault("cyequ_interned", []).extend(created)
+        cache.add(found)
+    return [cache.ids[key] for key in keys]
+
+
+class _Catalogued(object):
+    '''
+    Brand and model of equipment and components, stored as a reference to
+    an interned catalog entry of the brand, model and the row's category.
+    Assigned values are kept pending and interned when the session flushes.
+    '''
+
+    def _catalog_value(self, index):
+        '''
+        Returns the pending or the stored brand (0) or model (1).
+        '''
+
+        pending = self.__dict__.get("_catalog_pending")
+        if pending is not None:
+            return pending[index]
+        if self.catalog_id is None:
+            return None
+        return catalog_key(self.catalog_id)[index]
+
+    def _set_catalog_value(self, index, value):
+        '''
+        Sets the brand (0) or model (1) pending until flush.
+        '''
+
+        pending = self.__dict__.get("_catalog_pending")
+        if pending is None:
+            pending = [self.brand, self.model]
+        pending[index] = value
+        self.__dict__["_catalog_pending"] = pending
+        # Marks the row changed, and unresolved until interned
+        self.catalog_id = None
+
+    @hybrid_property
+    def brand(self):
+        '''
+        Brand, read from the catalog entry in SQL expressions.
+        '''
+
+        return self._catalog_value(0)
+
+    @brand.setter
+    def brand(self, value):
+        self._set_catalog_value(0, value)
+
+    @brand.expression
+    def brand(cls):
+        return select(CatalogEntry.brand) \
+            .where(CatalogEntry.id == cls.catalog_id).scalar_subquery()
+
+    @hybrid_property
+    def model(self):
+        '''
+        Model, read from the catalog entry in SQL expressions.
+        '''
+
+        return self._catalog_value(1)
+
+    @model.setter
+    def model(self, value):
+        self._set_catalog_value(1, value)
+
+    @model.expression
+    def model(cls):
+        return select(CatalogEntry.model) \
+            .where(CatalogEntry.id == cls.catalog_id).scalar_subquery()
+
+
+@event.listens_for(Session, "before_flush")
+def intern_catalog_entries(session, flush_context, instances):
+    '''
+    Resolves the catalog entries of new and changed equipment and
+    components before they are written. A changed category moves the row to
+    the entry of its new category. Rows with a missing brand, model or
+    category are left without an entry, for the database to reject.
+    '''
+
+    targets = []
+    for target in list(session.new) + list(session.dirty):
+        if not isinstance(target, _Catalogued):
+            continue
+        pending = target.__dict__.get("_catalog_pending")
+        if pending is None:
+            state = inspect(target)
+            if state.pending or \
+                    not state.attrs.category.history.has_changes():
+                continue
+            pending = [target.brand, target.model]
+        key = (pending[0], pending[1], target.category)
+        if None not in key:
+            targets.append((target, key))
+    if targets:
+        ids = intern_catalog(session, [key for _, key in targets])
+        for (target, _), catalog_id in zip(targets, ids):
+            target.catalog_id = catalog_id
+
+
+@event.listens_for(Session, "after_flush")
+def clear_catalog_pending(session, flush_context):
+    '''
+    Drops the pending brands and models of written rows.
+    '''
+
+    for target in list(session.new) + list(session.dirty):
+        if isinstance(target, _Catalogued) and target.catalog_id is not None:
+            target.__dict__.pop("_catalog_pending", None)
+
+
+@event.listens_for(Session, "after_commit")
+def keep_interned(session):
+    '''
+    Keeps the catalog entries created by a committed transaction. Within a
+    batch, the batch's own commit is waited for, see cyequ.resources.batch.
+    '''
+
+    if not session.info.get("cyequ_batch"):
+        session.info.pop("cyequ_interned", None)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_interned(session, previous_transaction):
+    '''
+    Forgets the catalog entries created by a rolled back transaction.
+    '''
+
+    created = session.info.pop("cyequ_interned", None)
+    if created and has_app_context():
+        _interned().discard(created)
+
+
+class Component(_Catalogued, db.Model):
     '''
     This class defines the database model for components.
     '''
@@ -31,17 +294,27 @@ class Component(db.Model):
     # Check that date_retired is not before date_added.
     __table_args__ = (db.CheckConstraint('date_retired > date_added',
                                          name='_c_add_bfr_retire_cc'),
-                      db.UniqueConstraint("category", "date_retired",
+                      # One unretired component per category per equipment.
+                      db.UniqueConstraint("equipment_id", "category",
+                                          "date_retired",
                                           name="_compo_in_equip_uc"), )
 
     id = db.Column(db.Integer, primary_key=True)
     uri = db.Column(db.String(128), nullable=True, unique=True)
     name = db.Column(db.String(64), nullable=False)
     category = db.Column(db.String(64), nullable=False)
-    brand = db.Column(db.String(64), nullable=False)
-    model = db.Column(db.String(128), nullable=False)
+    # Brand and model, see _Catalogued
+    catalog_id = db.Column(db.Integer, db.ForeignKey("catalog.id"),
+                           nullable=False, index=True)
     date_added = db.Column(db.DateTime, nullable=False)
     date_retired = db.Column(db.DateTime, nullable=False)
+    # Ride time accumulated while installed, kept up to date by
+    # cyequ.maintenance whenever rides or the component change.
+    ride_seconds = db.Column(db.Integer, nullable=False, default=0)
+    # Service due date by time rule and ride seconds left by ride-hour rule.
+    # Both are indexed, so due-queries are range scans instead of full scans.
+    due_date = db.Column(db.DateTime, nullable=True, index=True)
+    due_seconds = db.Column(db.Integer, nullable=True, index=True)
     equipment_id = db.Column(db.Integer,
                              # Bike is a sum of its parts,
                              # thus delete parts if equipment is deleted
@@ -68,16 +341,43 @@ class Component(db.Model):
                                        )
 
 
+class ServiceInterval(db.Model):
+    '''
+    This class defines the database model for service interval rules.
+    A rule applies to all components of its category and can be given in
+    days since the component was added, in ride-hours or both.
+    '''
+
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(64), nullable=False, unique=True)
+    interval_days = db.Column(db.Integer, nullable=True)
+    interval_hours = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        '''
+        Return the canonical string representation of the object.
+        '''
+
+        return "[{}] {} every {} days or {} ride-hours" \
+            .format(self.id,
+                    self.category,
+                    self.interval_days,
+                    self.interval_hours
+                    )
+
+
 class Ride(db.Model):
     '''
-    This class defines the database model for ride. (NOT USED BY THE API)
+    This class defines the database model for ride.
     '''
 
     # Check that 0 duration rides are not accepted.
     __table_args__ = (db.CheckConstraint('duration > 0',
                                          name='_no_zero_duration_cc'),
                       db.UniqueConstraint("name", "equipment_id",
-                                          name="_compo_in_equip_uc")
+                                          name="_compo_in_equip_uc"),
+                      # Imports look up a rider's rides by file content
+                      db.Index("ix_ride_rider_hash", "rider", "content_hash")
                       )
 
     id = db.Column(db.Integer, primary_key=True)
@@ -85,6 +385,16 @@ class Ride(db.Model):
     name = db.Column(db.String(64), nullable=False)
     duration = db.Column(db.Integer, nullable=False)
     datetime = db.Column(db.DateTime, nullable=False)
+    # Summary of an imported ride file, see cyequ.ridefile
+    moving_time = db.Column(db.Integer, nullable=True)
+    distance = db.Column(db.Float, nullable=True)
+    elevation_gain = db.Column(db.Float, nullable=True)
+    # Location of the ride's sample streams in the stream store,
+    # see cyequ.streams
+    stream_offset = db.Column(db.BigInteger, nullable=True)
+    stream_length = db.Column(db.Integer, nullable=True)
+    # SHA-256 of the imported ride file, used to skip duplicate imports
+    content_hash = db.Column(db.String(64), nullable=True)
     # A rider (or riders in case of a tandem-bike) can only use one equipment
     #   per ride.
     equipment_id = db.Column(db.Integer,
@@ -118,7 +428,7 @@ class Ride(db.Model):
                                                  )
 
 
-class Equipment(db.Model):
+class Equipment(_Catalogued, db.Model):
     '''
     This class defines the database model for equipment.
     '''
@@ -134,8 +444,9 @@ class Equipment(db.Model):
     uri = db.Column(db.String(128), nullable=True, unique=True)
     name = db.Column(db.String(64), nullable=False)
     category = db.Column(db.String(64), nullable=False)
-    brand = db.Column(db.String(64), nullable=False)
-    model = db.Column(db.String(128), nullable=False)
+    # Brand and model, see _Catalogued
+    catalog_id = db.Column(db.Integer, db.ForeignKey("catalog.id"),
+                           nullable=False, index=True)
     date_added = db.Column(db.DateTime, nullable=False)
     date_retired = db.Column(db.DateTime, nullable=True,)
     owner = db.Column(db.Integer,
@@ -206,6 +517,71 @@ class User(db.Model):
         return "[{}] {}".format(self.id, self.name)
 
 
+class ChangeLog(db.Model):
+    '''
+    This class defines the database model for the append-only change log of
+    users, equipment, components and rides. Records are written by database
+    triggers, see cyequ.changes.
+    '''
+
+    __tablename__ = "changelog"
+    __table_args__ = (db.Index("ix_changelog_user_seq", "user_id", "seq"),
+                      db.Index("ix_changelog_kind_uri", "kind", "uri"),
+                      # Sequence numbers are never reused, even if the
+                      # latest records are compacted away
+                      {"sqlite_autoincrement": True})
+
+    seq = db.Column(db.Integer, primary_key=True)
+    # Owner of the changed resource, not a foreign key so that records
+    # outlive the rows they describe
+    user_id = db.Column(db.Integer, nullable=True)
+    kind = db.Column(db.String(16), nullable=False)
+    op = db.Column(db.String(8), nullable=False)
+    uri = db.Column(db.String(128), nullable=False)
+    # URI of the equipment of a component
+    parent = db.Column(db.String(128), nullable=True)
+    time = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        '''
+        Return the canonical string representation of the object.
+        '''
+
+        return "[{}] {} {} {} of user {}".format(self.seq, self.op,
+                                                 self.kind, self.uri,
+                                                 self.user_id)
+
+
+class GarageSummary(db.Model):
+    '''
+    This class defines the database model for the precomputed garage
+    summary of a user, kept up to date from the change log, see
+    cyequ.garage.
+    '''
+
+    __tablename__ = "garage"
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey("user.id", ondelete="CASCADE"),
+                        primary_key=True
+                        )
+    # Incremented whenever the summary changes
+    version = db.Column(db.Integer, nullable=False)
+    # Sequence number of the last change log record applied
+    seq = db.Column(db.Integer, nullable=False)
+    # Time of the last change to the user's equipment or components
+    modified = db.Column(db.DateTime, nullable=True)
+    # Summary document serialized as JSON
+    body = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        '''
+        Return the canonical string representation of the object.
+        '''
+
+        return "Garage of user {} version {}".format(self.user_id,
+                                                     self.version)
+
 # Adapted from PWP "Flask API Project Layout" -material
 @click.command("init-db")
 @with_appcontext
@@ -223,6 +599,15 @@ def add_test_data():
     '''
     Creating custom command for Flask to add test data to the database
     '''
+    # Service intervals first, so components are scheduled when added
+    db.session.add(ServiceInterval(category="Seat Post",
+                                   interval_days=365,
+                                   interval_hours=50
+                                   ))
+    db.session.add(ServiceInterval(category="Rear Wheel",
+                                   interval_hours=200
+                                   ))
+    db.session.commit()
     user1 = User(uri="Joonas1",
                  name="Joonas"
                  )
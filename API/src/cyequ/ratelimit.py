@@ -0,0 +1,263 @@
+'''
+This module holds the admission control of the API.
+
+With the RATE_LIMIT option, every request takes tokens from the token
+bucket of its client IP, and requests to the resources of a user also from
+the bucket of the user's URI. A bucket holds at most its burst of tokens and
+is refilled at its rate per second. Reads take one token and writes
+RATE_LIMIT_WRITE_COST. Each user and IP also has a cap on the requests it
+has in progress at once. A request over any limit is answered with 429 Too
+Many Requests and a Retry-After header, before its view runs, so one client
+looping on a collection or posting in bulk can not starve the others.
+
+Buckets are kept in a fixed table of RATE_LIMIT_SLOTS slots by a digest of
+their key, so memory does not grow with the clients seen. A slot of an idle
+key is taken over by another key hashing to it; busy keys colliding share
+their limits. With RATE_LIMIT_SHARED the table is in anonymous shared
+memory, created with the application, so the workers forked afterwards by
+cyequ-serve (see cyequ.serve) share the limits. Otherwise each process
+limits on its own.
+
+Requests the API dispatches to itself, the operations of a batch and the
+renders of the event hub, are not limited; the batch itself is.
+'''
+
+# Library imports
+import math
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from flask import current_app, request
+
+# Project imports
+from cyequ.constants import INTERNAL_REQUEST
+from cyequ.groupcommit import WRITE_METHODS
+from cyequ.utils import create_error_response
+
+# Defaults of the configuration keys of the module
+DEFAULTS = {
+    # Set True to limit the requests of each user and client IP
+    "RATE_LIMIT": False,
+    # Tokens per second and most tokens of the bucket of a user
+    "RATE_LIMIT_USER_RATE": 10,
+    "RATE_LIMIT_USER_BURST": 50,
+    # Tokens per second and most tokens of the bucket of a client IP
+    "RATE_LIMIT_IP_RATE": 20,
+    "RATE_LIMIT_IP_BURST": 100,
+    # Most requests in progress at once of a user and of a client IP
+    "RATE_LIMIT_USER_CONCURRENCY": 4,
+    "RATE_LIMIT_IP_CONCURRENCY": 8,
+    # Tokens taken by POST, PUT, PATCH and DELETE requests
+    "RATE_LIMIT_WRITE_COST": 5,
+    # Slots of the bucket table
+    "RATE_LIMIT_SLOTS": 4096,
+    # Set True to share the bucket table with forked worker processes
+    "RATE_LIMIT_SHARED": False,
+}
+# Key digest, requests in progress, tokens and time of the tokens of a slot
+_SLOT = struct.Struct("=Iidd")
+# WSGI environ key of the slots a request was admitted in
+_ADMITTED = "cyequ.admitted"
+# Seconds to retry after when a concurrency cap is reached
+_CONCURRENCY_RETRY = 1
+
+
+class TokenBuckets(object):
+    '''
+    Table of *slots* token buckets with caps on requests in progress, in
+    anonymous shared memory if *shared*.
+    '''
+
+    def __init__(self, slots, shared=False):
+        self.slots = slots
+        if shared:
+            # Anonymous maps are shared with child processes
+            self.table = mmap.mmap(-1, slots * _SLOT.size)
+            self.lock = multiprocessing.Lock()
+        else:
+            self.table = bytearray(slots * _SLOT.size)
+            self.lock = threading.Lock()
+
+    def _slot(self, key):
+        '''
+        Returns the digest of *key* and the offset of its slot.
+        '''
+
+        digest = zlib.crc32(key.encode())
+        return digest, digest % self.slots * _SLOT.size
+
+    def acquire(self, limits, cost, now=None):
+        '''
+        Takes *cost* tokens and a request in progress from the bucket of
+        each of *limits*, a list of (name, key, rate, burst, concurrency)
+        tuples, from all or none of them. Returns the offsets of the slots
+        taken, to be given to release, and None. If not taken, returns None
+        and the name of the limit exceeded, with "_rate" or "_concurrency"
+        appended, and the seconds to retry after.
+        '''
+
+        now = time.monotonic() if now is None else now
+        taken, offsets = {}, []
+        with self.lock:
+            for name, key, rate, burst, concurrency in limits:
+                digest, offset = self._slot(key)
+                if offset in taken:
+                    # Keys of the request colliding in one slot
+                    owner, active, tokens, stamp = taken[offset]
+                else:
+                    owner, active, tokens, stamp = _SLOT.unpack_from(
+                        self.table, offset)
+                if not stamp or owner != digest and not active:
+                    # Unused slot, or the slot of an idle key taken over
+                    owner, active, tokens, stamp = digest, 0, burst, now
+                tokens = min(burst, tokens + (now - stamp) * rate)
+                if active >= concurrency:
+                    return None, (name + "_concurrency", _CONCURRENCY_RETRY)
+                # More than the burst could never be taken
+                needed = min(cost, burst)
+                if tokens < needed:
+                    return None, (name + "_rate", max(1, math.ceil(
+                        (needed - tokens) / rate)))
+                taken[offset] = (owner, active + 1, tokens - needed, now)
+                offsets.append(offset)
+            for offset, slot in taken.items():
+                _SLOT.pack_into(self.table, offset, *slot)
+        return offsets, None
+
+    def release(self, offsets):
+        '''
+        Ends a request in progress in each of the slots at *offsets*, as
+        returned by acquire, whichever key owns the slot now.
+        '''
+
+        with self.lock:
+            for offset in offsets:
+                owner, active, tokens, stamp = _SLOT.unpack_from(self.table,
+                                                                 offset)
+                if active > 0:
+                    _SLOT.pack_into(self.table, offset, owner, active - 1,
+                                    tokens, stamp)
+
+
+class RateLimiter(object):
+    '''
+    Admission control of the requests of *app*.
+    '''
+
+    def __init__(self, app):
+        config = app.config
+        self.buckets = TokenBuckets(config["RATE_LIMIT_SLOTS"],
+                                    config["RATE_LIMIT_SHARED"])
+        self.user = (config["RATE_LIMIT_USER_RATE"],
+                     config["RATE_LIMIT_USER_BURST"],
+                     config["RATE_LIMIT_USER_CONCURRENCY"])
+        self.ip = (config["RATE_LIMIT_IP_RATE"],
+                   config["RATE_LIMIT_IP_BURST"],
+                   config["RATE_LIMIT_IP_CONCURRENCY"])
+        self.write_cost = config["RATE_LIMIT_WRITE_COST"]
+        self.lock = threading.Lock()
+        # Requests admitted, and throttled by the limit exceeded, of this
+        # process, for monitoring
+        self.admitted = 0
+        self.throttled = Counter()
+
+    def limits(self, user, address):
+        '''
+        Returns the limits of a request to the resources of *user*, None
+        for others, from client IP *address*.
+        '''
+
+        limits = [("ip", "ip:{}".format(address)) + self.ip]
+        if user is not None:
+            limits.insert(0, ("user", "user:{}".format(user)) + self.user)
+        return limits
+
+    def admit(self, limits, method):
+        '''
+        Admits a request of *method* under *limits*. Returns the slots
+        taken and None if admitted, else None and the name of the limit
+        exceeded and the seconds to retry after.
+        '''
+
+        cost = self.write_cost if method in WRITE_METHODS else 1
+        taken, refused = self.buckets.acquire(limits, cost)
+        with self.lock:
+            if refused is None:
+                self.admitted += 1
+            else:
+                self.throttled[refused[0]] += 1
+        return taken, refused
+
+
+def get_limiter():
+    '''
+    Returns the rate limiter of the current application, creating it first
+    if needed.
+    '''
+
+    extensions = current_app.extensions
+    limiter = extensions.get("cyequ_limiter")
+    if limiter is None:
+        limiter = extensions.setdefault(
+            "cyequ_limiter", RateLimiter(current_app._get_current_object()))
+    return limiter
+
+
+def admit_request():
+    '''
+    Responds with 429 Too Many Requests if the request is over the limits
+    of its user or client IP.
+    '''
+
+    if not current_app.config["RATE_LIMIT"] \
+            or request.environ.get(INTERNAL_REQUEST):
+        return None
+    limiter = get_limiter()
+    limits = limiter.limits((request.view_args or {}).get("user"),
+                            request.remote_addr)
+    taken, refused = limiter.admit(limits, request.method)
+    if refused is None:
+        request.environ[_ADMITTED] = taken
+        return None
+    name, retry = refused
+    scope = "user" if name.startswith("user") else "client"
+    if name.endswith("_concurrency"):
+        message = "Too many requests of the {} in progress".format(scope)
+    else:
+        message = "Request rate of the {} exceeded".format(scope)
+    response = create_error_response(429, "Too many requests",
+                                     "{}. Retry after {} seconds."
+                                     .format(message, retry)
+                                     )
+    response.headers["Retry-After"] = str(retry)
+    return response
+
+
+def end_request(exc):
+    '''
+    Ends the request in progress in the slots it was admitted in. Also
+    called by copies of the request context, so only once per request.
+    '''
+
+    taken = request.environ.pop(_ADMITTED, None)
+    if taken is not None:
+        get_limiter().buckets.release(taken)
+
+
+def init_app(app):
+    '''
+    Sets the configuration defaults of the module and limits the requests
+    of *app* if enabled. A shared bucket table is created now, before any
+    workers are forked.
+    '''
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if app.config["RATE_LIMIT_SHARED"]:
+        app.extensions["cyequ_limiter"] = RateLimiter(app)
+    app.before_request(admit_request)
+    app.teardown_request(end_request)
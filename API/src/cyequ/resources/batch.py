@@ -0,0 +1,165 @@
+'''
+This module holds class-definitions for the API batch resource.
+'''
+
+# Library imports
+import re
+from urllib.parse import urlsplit
+from flask import request, Response, current_app
+from flask_restful import Resource
+
+# Project imports
+from cyequ import db, json
+from cyequ.lazy import lazy_import
+from cyequ.constants import MASON, ERROR_PROFILE, LINK_RELATIONS_URL, \
+                            INTERNAL_REQUEST
+from cyequ.utils import MasonBuilder, create_error_response, schema_validator
+from cyequ.static.schemas.batch_schema import batch_schema
+
+jsonschema = lazy_import("jsonschema")
+# Back-reference to the Location of an earlier operation
+_REFERENCE = re.compile(r"\$\{(\d+)\}")
+
+
+def _resolve(value, locations):
+    '''
+    Replaces back-references in the strings of *value* with the locations
+    of earlier operations.
+
+    Exceptions.
+    ValueError. If a reference is not to an earlier created resource.
+    '''
+
+    if isinstance(value, str):
+        def location(match):
+            index = int(match.group(1))
+            if index >= len(locations) or locations[index] is None:
+                raise ValueError("${{{}}} does not refer to a resource "
+                                 "created by an earlier operation"
+                                 .format(index))
+            return locations[index]
+        return _REFERENCE.sub(location, value)
+    if isinstance(value, dict):
+        return {key: _resolve(item, locations) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item, locations) for item in value]
+    return value
+
+
+def _run(operation):
+    '''
+    Runs one operation through the API's own resources in a request context
+    of its own. Returns the response.
+    '''
+
+    with current_app.test_request_context(operation["href"],
+                                          method=operation["method"],
+                                          json=operation.get("body"),
+                                          environ_base={INTERNAL_REQUEST:
+                                                        True}):
+        return current_app.full_dispatch_request()
+
+
+class Batch(Resource):
+    '''
+    This class defines responses for Batch resource.
+    '''
+
+    def post(self):
+        '''
+        POST-method definition.
+        Runs a list of operations in order, all in one database transaction,
+        and responds with the status, Location and body of each. If an
+        operation fails, the transaction is rolled back, the rest are not
+        run, and the response has the failed operation's status code.
+
+        Each operation runs through the same resource as its own request
+        would, on a session joined to the batch's transaction: commits of the
+        resources end up in the one commit of the batch.
+
+        Returns flask Response object.
+        '''
+
+        # Check for json. If fails, respond with error 415
+        if request.json is None:
+            return create_error_response(415, "Unsupported media type",
+                                         "Payload format is in an "
+                                         "unsupported format"
+                                         )
+        # Validate request against the schema. If fails, respond with error 400
+        try:
+            schema_validator(batch_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
+            return create_error_response(400, "Invalid JSON document",
+                                         str(err)
+                                         )
+        operations = request.json["operations"]
+        results, locations = [], []
+        failed = None
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        session = db.session.session_factory(bind=connection, binds={})
+        # Commit hooks of the session wait for the batch's own commit
+        session.info["cyequ_batch"] = True
+        registry = db.session.registry
+        previous = registry() if registry.has() else None
+        registry.set(session)
+        try:
+            for index, operation in enumerate(operations):
+                try:
+                    operation = dict(operation,
+                                     href=_resolve(operation["href"],
+                                                   locations),
+                                     body=_resolve(operation.get("body"),
+                                                   locations))
+                except ValueError as err:
+                    failed = (index, 400, str(err))
+                    break
+                if urlsplit(operation["href"]).path.rstrip("/") \
+                        == request.path.rstrip("/"):
+                    failed = (index, 400, "Batches can not be nested")
+                    break
+                response = _run(operation)
+                location = response.headers.get("Location")
+                if location is not None:
+                    location = urlsplit(location).path
+                locations.append(location)
+                results.append({"method": operation["method"],
+                                "href": operation["href"],
+                                "status": response.status_code,
+                                "location": location,
+                                "body": response.get_json(silent=True)
+                                })
+                if response.status_code >= 400:
+                    failed = (index, response.status_code,
+                              "Operation failed with status {}"
+                              .format(response.status_code))
+                    break
+            del session.info["cyequ_batch"]
+            if failed is None:
+                session.commit()
+                transaction.commit()
+            else:
+                # Already rolled back, if a resource rolled back its error
+                session.rollback()
+                if transaction.is_active:
+                    transaction.rollback()
+        finally:
+            session.close()
+            connection.close()
+            if previous is not None:
+                registry.set(previous)
+            else:
+                registry.clear()
+        body = MasonBuilder(committed=failed is None, results=results)
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        if failed is None:
+            return Response(json.dumps(body), 200, mimetype=MASON)
+        index, status, message = failed
+        body.add_error("Batch failed",
+                       "Operation {} ({} {}): {}. No changes were saved."
+                       .format(index, operations[index]["method"],
+                               operations[index]["href"], message))
+        body["resource_url"] = request.path
+        body.add_control("profile", href=ERROR_PROFILE)
+        return Response(json.dumps(body), status, mimetype=MASON)
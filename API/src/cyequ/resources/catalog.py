@@ -0,0 +1,52 @@
+'''
+This module holds class-definitions for the API catalog resources.
+'''
+
+# Library imports
+from flask import request, Response, url_for
+from flask_restful import Resource
+
+# Project imports
+from cyequ import json
+from cyequ.constants import MASON, LINK_RELATIONS_URL
+from cyequ.utils import MasonBuilder, create_error_response
+from cyequ.catalog import FIELDS, LIMIT, MAX_LIMIT, get_catalog
+
+
+class CatalogSuggest(Resource):
+    '''
+    This class defines responses for CatalogSuggest resource.
+    '''
+
+    def get(self):
+        '''
+        GET-method definition.
+        Suggests known brands and models for a typed prefix. Query parameters:
+            prefix  Beginning of the value, case and diacritics ignored.
+            field   brand or model. Both are suggested if not given.
+            limit   Suggestions per field.
+
+        Returns flask Response object.
+        '''
+
+        # Check query parameters. If invalid, respond with error 400
+        prefix = request.args.get("prefix", "")
+        field = request.args.get("field")
+        limit = request.args.get("limit", LIMIT, type=int)
+        if not prefix or (field is not None and field not in FIELDS) \
+                or not 0 < limit <= MAX_LIMIT:
+            return create_error_response(400, "Invalid query",
+                                         "Parameter prefix is required, "
+                                         "field must be one of {} and limit "
+                                         "at most {}"
+                                         .format(", ".join(FIELDS), MAX_LIMIT)
+                                         )
+        fields = FIELDS if field is None else (field,)
+        body = MasonBuilder(prefix=prefix,
+                            **get_catalog().suggest(prefix, fields, limit))
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.catalogsuggest", **request.args),
+                         title="Get these suggestions."
+                         )
+        return Response(json.dumps(body), 200, mimetype=MASON)
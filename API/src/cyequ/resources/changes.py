@@ -0,0 +1,112 @@
+'''
+This module holds class-definitions for the API change feed resources.
+'''
+
+# Library imports
+from flask import request, Response, url_for
+from flask_restful import Resource
+
+# Project imports
+from cyequ import json
+from cyequ.constants import MASON, LINK_RELATIONS_URL
+from cyequ.utils import CommonBuilder, create_error_response
+from cyequ.models import User, ChangeLog
+from cyequ.changes import USER, EQUIPMENT, COMPONENT, first_retained
+
+# Change records per page, by default and at most
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def change_href(user, record):
+    '''
+    Returns the URL of the resource of a change record of *user*.
+    '''
+
+    if record.kind == USER:
+        return url_for("api.useritem", user=record.uri)
+    if record.kind == EQUIPMENT:
+        return url_for("api.equipmentitem", user=user, equipment=record.uri)
+    if record.kind == COMPONENT:
+        return url_for("api.componentitem", user=user,
+                       equipment=record.parent, component=record.uri)
+    return url_for("api.rideitem", user=user, ride=record.uri)
+
+
+class UserChanges(Resource):
+    '''
+    This class defines responses for UserChanges resource.
+    '''
+
+    def get(self, user):
+        '''
+        GET-method definition.
+        Lists the changes of the user's resources, the user itself, its
+        equipment, components and rides, in the order they were made.
+        Query parameters:
+            since   Sequence number of the last change already seen,
+                    0 to list all.
+            limit   Changes per page.
+        Clients sync by following the next control until there is none,
+        then keep last_seq for the next sync. If changes after since have
+        been compacted away, responds with error 410 and the client must
+        sync again from 0.
+
+        Returns flask Response object.
+        '''
+
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Check query parameters. If invalid, respond with error 400
+        since = request.args.get("since", 0, type=int)
+        limit = request.args.get("limit", PAGE_SIZE, type=int)
+        if since < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+            return create_error_response(400, "Invalid query",
+                                         "Parameter since must not be "
+                                         "negative and limit at most {}"
+                                         .format(MAX_PAGE_SIZE)
+                                         )
+        if since and since + 1 < first_retained():
+            return create_error_response(410, "Changes compacted",
+                                         "Changes after {} are no longer "
+                                         "available, sync again from 0"
+                                         .format(since)
+                                         )
+        # Keyset paging, an index range scan from since on
+        records = ChangeLog.query \
+            .filter(ChangeLog.user_id == db_user.id, ChangeLog.seq > since) \
+            .order_by(ChangeLog.seq).limit(limit + 1).all()
+        more = len(records) > limit
+        records = records[:limit]
+        last_seq = records[-1].seq if records else since
+        # Instantiate message body
+        body = CommonBuilder(since=since, last_seq=last_seq, items=[])
+        # Add general controls to message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.userchanges", user=user, since=since,
+                                 limit=limit),
+                         title="Get this page of changes."
+                         )
+        if more:
+            body.add_control("next",
+                             url_for("api.userchanges", user=user,
+                                     since=last_seq, limit=limit),
+                             title="Get the next page of changes."
+                             )
+        body.add_control("up",
+                         url_for("api.useritem", user=user),
+                         title="Get associated user's information."
+                         )
+        for record in records:
+            body["items"].append({"seq": record.seq,
+                                  "op": record.op,
+                                  "kind": record.kind,
+                                  "href": change_href(user, record)
+                                  })
+        return Response(json.dumps(body), 200, mimetype=MASON)
@@ -3,20 +3,24 @@ This module holds class-definitions for the API component resources.
 '''
 
 # Library imports
-from flask import request, Response, json, url_for
+from flask import request, Response, url_for
 from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
-from jsonschema import validate, ValidationError
 
 # Project imports
-from cyequ import db
-from cyequ.constants import MASON, COMPONENT_PROFILE, LINK_RELATIONS_URL
+from cyequ import db, json
+from cyequ.lazy import lazy_import
+from cyequ.constants import MASON, MERGE_PATCH, COMPONENT_PROFILE, \
+                            LINK_RELATIONS_URL
 from cyequ.utils import ComponentBuilder, create_error_response, \
-                        convert_req_date
+                        schema_validator, convert_req_date, patch_validator, \
+                        patch_fields
 from cyequ.models import User, Equipment, Component  # , Ride
 from cyequ.static.schemas.component_schema import component_schema
 # from cyequ.static.schemas.ride_schema import ride_schema
 
+jsonschema = lazy_import("jsonschema")
+
 
 class ComponentItem(Resource):
     '''
@@ -85,6 +89,7 @@ class ComponentItem(Resource):
                          )
         body.add_control_all_users()
         body.add_control_edit_component(user, equipment, component)
+        body.add_control_patch_component(user, equipment, component)
         body.add_control_delete_component(user, equipment, component)
         return Response(json.dumps(body), 200, mimetype=MASON)
 
@@ -110,8 +115,8 @@ class ComponentItem(Resource):
                                          )
         # Validate request against the schema. If fails, respond with error 400
         try:
-            validate(request.json, component_schema())
-        except ValidationError as err:
+            schema_validator(component_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
             return create_error_response(400, "Invalid JSON "
                                          "document", str(err)
                                          )
@@ -194,6 +199,116 @@ class ComponentItem(Resource):
                                          )
         return Response(status=204)
 
+    def patch(self, user, equipment, component):
+        '''
+        PATCH-method definition.
+        Checks for a JSON merge patch and modifies the given fields of a
+        component resource in the API. Only changed fields are written.
+
+        Exceptions.
+        jsonschema.ValidationError. If request is not
+            a valid JSON merge patch.
+        sqlalchemy.exc.IntegrityError. Violation of SQLite database
+            integrity.
+
+        Returns flask Response object.
+        '''
+
+        # Check for merge patch. If fails, respond with error 415
+        if request.mimetype != MERGE_PATCH or request.json is None:
+            return create_error_response(415, "Unsupported media type",
+                                         "Requests must be {}"
+                                         .format(MERGE_PATCH)
+                                         )
+        # Validate request against the schema. If fails, respond with error 400
+        try:
+            patch_validator(component_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
+            return create_error_response(400, "Invalid JSON "
+                                         "document", str(err)
+                                         )
+        # Find user by name in database. If not found, respond with error 404
+        if User.query.filter_by(uri=user).first() is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Find equipment by name in database.
+        # If not found, respond with error 404
+        db_equip = Equipment.query.filter_by(uri=equipment).first()
+        if db_equip is None:
+            return create_error_response(404, "Not found",
+                                         "No equipment was found with URI {}"
+                                         .format(equipment)
+                                         )
+        # Find component by category in database.
+        # If not found, respond with error 404
+        db_comp = Component.query.filter_by(uri=component).first()
+        if db_comp is None:
+            return create_error_response(404, "Not found",
+                                         "No component was found with "
+                                         "URI {}"
+                                         .format(component)
+                                         )
+        # Update changed component data
+        changed = patch_fields(db_comp, request.json,
+                               ("name", "category", "brand", "model"))
+        # Convert %Y-%m-%d %H:%M:%S dates to Python datetime format
+        p_date_added = convert_req_date(request.json.get("date_added"))
+        p_date_retired = convert_req_date(request.json.get("date_retired"))
+        if p_date_added is not None and p_date_added != db_comp.date_added:
+            # Make sure component date_added cannot be moved backward in time
+            # past associated equipment's date_added
+            if db_equip.date_added > p_date_added:
+                db.session.rollback()
+                return create_error_response(409, "Inconsistent dates",
+                                             "New added date {} must be at or "
+                                             "in the future of associated "
+                                             "equipment's current added "
+                                             "date {}"
+                                             .format(p_date_added,
+                                                     db_equip.date_added
+                                                     )
+                                             )
+            db_comp.date_added = p_date_added
+            changed.append("date_added")
+        if p_date_retired is not None \
+                and p_date_retired != db_comp.date_retired:
+            # Check if date_retired is later than date_added
+            if db_comp.date_added >= p_date_retired:
+                db.session.rollback()
+                return create_error_response(409, "Inconsistent dates",
+                                             "Retire date {} must be in the "
+                                             "future with respect to"
+                                             " added date {}"
+                                             .format(p_date_retired,
+                                                     db_comp.date_added
+                                                     )
+                                             )
+            # Cannot re- or unretire components of retired equipment
+            if db_equip.date_retired is not None:
+                db.session.rollback()
+                return create_error_response(409, "Not allowed",
+                                             "Cannot reretire components of a"
+                                             " retired equipment {}"
+                                             .format(db_equip.uri)
+                                             )
+            db_comp.date_retired = p_date_retired
+            changed.append("date_retired")
+        if not changed:
+            return Response(status=204)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # In case of database error
+            db.session.rollback()
+            return create_error_response(409, "Already exists",
+                                         "Unretired component of category"
+                                         " {} already exists."
+                                         .format(db_comp.category)
+                                         )
+        return Response(status=204)
+
     def delete(self, user, equipment, component):
         '''
         DELETE-method definition.
@@ -3,10 +3,11 @@ This module holds class-definitions for the API entry point resource.
 '''
 
 # Library imports
-from flask import Response, json
+from flask import Response
 from flask_restful import Resource
 
 # Project imports
+from cyequ import json
 from cyequ.constants import LINK_RELATIONS_URL, MASON
 from cyequ.utils import UserBuilder
 
@@ -19,11 +20,12 @@ class Entry(Resource):
 
     def get(self):
         '''
-        Builds the response body and adds link relation cyequ:users-all as the
-        sole control.
+        Builds the response body and adds link relations cyequ:users-all and
+        cyequ:batch as controls.
         '''
 
         body = UserBuilder()
         body.add_namespace("cyequ", LINK_RELATIONS_URL)
         body.add_control_all_users()
+        body.add_control_batch()
         return Response(json.dumps(body), 200, mimetype=MASON)
@@ -3,23 +3,104 @@ This module holds class-definitions for the API equipment resources.
 '''
 
 # Library imports
-from flask import request, Response, json, url_for
+from flask import request, Response, url_for
 from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
-from jsonschema import validate, ValidationError
 from datetime import datetime
 
 # Project imports
-from cyequ import db
-from cyequ.constants import MASON, EQUIPMENT_PROFILE, \
+from cyequ import db, json
+from cyequ.lazy import lazy_import
+from cyequ.constants import MASON, MERGE_PATCH, EQUIPMENT_PROFILE, \
                             COMPONENT_PROFILE, LINK_RELATIONS_URL
 from cyequ.utils import EquipmentBuilder, ComponentBuilder, \
-                        create_error_response, convert_req_date
+                        create_error_response, schema_validator, \
+                        convert_req_date, patch_validator, patch_fields
 from cyequ.models import User, Equipment, Component  # , Ride
+from cyequ.maintenance import IN_SERVICE
 from cyequ.static.schemas.equipment_schema import equipment_schema
 from cyequ.static.schemas.component_schema import component_schema
 # from cyequ.static.schemas.ride_schema import ride_schema
 
+jsonschema = lazy_import("jsonschema")
+
+
+def equipment_item_body(user, equipment, db_user, db_equip, components):
+    '''
+    Builds the EquipmentItem document of *db_equip* with URI *equipment*,
+    owned by *db_user* with URI *user*, and its list of *components*. Also
+    used by the async read path, see cyequ.asgi.
+
+    Returns EquipmentBuilder object.
+    '''
+
+    # Instantiate response message body
+    body = EquipmentBuilder(name=db_equip.name,
+                            category=db_equip.category,
+                            brand=db_equip.brand,
+                            model=db_equip.model,
+                            date_added=db_equip.date_added,
+                            date_retired=db_equip.date_retired,
+                            user=db_user.name,
+                            items=[]
+                            )
+    # Loop through all users in database and build each item with data and
+    # controls.
+    for component in components:
+        # If component is in active service, don't attach retired_date
+        if component.date_retired == datetime(9999, 12, 31, 23, 59, 59):
+            comp = ComponentBuilder(name=component.name,
+                                    category=component.category,
+                                    brand=component.brand,
+                                    model=component.brand,
+                                    date_added=component.date_added
+                                    )
+        else:
+            comp = ComponentBuilder(name=component.name,
+                                    category=component.category,
+                                    brand=component.brand,
+                                    model=component.brand,
+                                    date_added=component.date_added,
+                                    date_retired=component.date_retired
+                                    )
+        # Add controls to each item
+        comp.add_control("self", url_for("api.componentitem",
+                                         user=user,
+                                         equipment=equipment,
+                                         component=component.uri
+                                         ),
+                         title="Get this component's information."
+                         )
+        comp.add_control("profile",
+                         COMPONENT_PROFILE,
+                         title="Get profile of component resource."
+                         )
+        # Append each item to items-list of response body
+        body["items"].append(comp)
+    # Add controls response message body
+    body.add_namespace("cyequ", LINK_RELATIONS_URL)
+    body.add_control("self", url_for("api.equipmentitem",
+                                     user=user,
+                                     equipment=equipment
+                                     ),
+                     title="Get this equipment's information."
+                     )
+    body.add_control("profile",
+                     EQUIPMENT_PROFILE,
+                     title="Get profile of equipment resource."
+                     )
+    body.add_control("cyequ:owner",
+                     url_for("api.equipmentbyuser", user=user),
+                     title="Get associated user's information."
+                     )
+    body.add_control_all_users()
+    body.add_control_all_equipment(user)
+    body.add_control_edit_equipment(user, equipment)
+    body.add_control_patch_equipment(user, equipment)
+    body.add_control_delete_equipment(user, equipment)
+    body.add_control_add_component(user, equipment)
+    return body
+
 
 class EquipmentByUser(Resource):
     '''
@@ -99,8 +180,8 @@ class EquipmentByUser(Resource):
                                          )
         # Validate request against the schema. If fails, respond with error 400
         try:
-            validate(request.json, component_schema())
-        except ValidationError as err:
+            schema_validator(component_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
             return create_error_response(400, "Invalid JSON"
                                          "document", str(err)
                                          )
@@ -191,70 +272,8 @@ class EquipmentItem(Resource):
                                          "No equipment was found with URI {}"
                                          .format(equipment)
                                          )
-        # Instantiate response message body
-        body = EquipmentBuilder(name=db_equip.name,
-                                category=db_equip.category,
-                                brand=db_equip.brand,
-                                model=db_equip.model,
-                                date_added=db_equip.date_added,
-                                date_retired=db_equip.date_retired,
-                                user=db_user.name,
-                                items=[]
-                                )
-        # Loop through all users in database and build each item with data and
-        # controls.
-        for component in db_equip.hasCompos:
-            # If component is in active service, don't attach retired_date
-            if component.date_retired == datetime(9999, 12, 31, 23, 59, 59):
-                comp = ComponentBuilder(name=component.name,
-                                        category=component.category,
-                                        brand=component.brand,
-                                        model=component.brand,
-                                        date_added=component.date_added
-                                        )
-            else:
-                comp = ComponentBuilder(name=component.name,
-                                        category=component.category,
-                                        brand=component.brand,
-                                        model=component.brand,
-                                        date_added=component.date_added,
-                                        date_retired=component.date_retired
-                                        )
-            # Add controls to each item
-            comp.add_control("self", url_for("api.componentitem",
-                                             user=user,
-                                             equipment=equipment,
-                                             component=component.uri
-                                             ),
-                             title="Get this component's information."
-                             )
-            comp.add_control("profile",
-                             COMPONENT_PROFILE,
-                             title="Get profile of component resource."
-                             )
-            # Append each item to items-list of response body
-            body["items"].append(comp)
-        # Add controls response message body
-        body.add_namespace("cyequ", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("api.equipmentitem",
-                                         user=user,
-                                         equipment=equipment
-                                         ),
-                         title="Get this equipment's information."
-                         )
-        body.add_control("profile",
-                         EQUIPMENT_PROFILE,
-                         title="Get profile of equipment resource."
-                         )
-        body.add_control("cyequ:owner",
-                         url_for("api.equipmentbyuser", user=user),
-                         title="Get associated user's information."
-                         )
-        body.add_control_all_users()
-        body.add_control_all_equipment(user)
-        body.add_control_edit_equipment(user, equipment)
-        body.add_control_delete_equipment(user, equipment)
-        body.add_control_add_component(user, equipment)
+        body = equipment_item_body(user, equipment, db_user, db_equip,
+                                   db_equip.hasCompos)
         return Response(json.dumps(body), 200, mimetype=MASON)
 
     def post(self, user, equipment):
@@ -279,8 +298,8 @@ class EquipmentItem(Resource):
                                          )
         # Validate request against the schema. If fails, respond with error 400
         try:
-            validate(request.json, equipment_schema())
-        except ValidationError as err:
+            schema_validator(equipment_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
             return create_error_response(400, "Invalid JSON "
                                          "document", str(err)
                                          )
@@ -361,12 +380,8 @@ class EquipmentItem(Resource):
                                          " '{}' already exists."
                                          .format(request.json["category"])
                                          )
-        # Find new component by category & date_retired in database.
-        db_comp = Component.query.filter_by(category=request.json["category"],
-                                            date_retired=p_date_retired
-                                            ).first()
-        # Create URI for user
-        db_comp.uri = db_comp.name + str(db_comp.id)
+        # Create URI for component
+        new_comp.uri = new_comp.name + str(new_comp.id)
         db.session.commit()
         # Respond with location of new resource
         return Response(status=201,
@@ -374,7 +389,7 @@ class EquipmentItem(Resource):
                                  url_for("api.componentitem",
                                          user=user,
                                          equipment=equipment,
-                                         component=db_comp.uri
+                                         component=new_comp.uri
                                          )
                                  }
                         )
@@ -401,8 +416,8 @@ class EquipmentItem(Resource):
                                          )
         # Validate request against the schema. If fails, respond with error 400
         try:
-            validate(request.json, equipment_schema())
-        except ValidationError as err:
+            schema_validator(equipment_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
             return create_error_response(400, "Invalid JSON "
                                          "document", str(err)
                                          )
@@ -475,6 +490,107 @@ class EquipmentItem(Resource):
                                          )
         return Response(status=204)
 
+    def patch(self, user, equipment):
+        '''
+        PATCH-method definition.
+        Checks for a JSON merge patch and modifies the given fields of an
+        equipment resource in the API. Only changed fields are written, and
+        components are retired only when date_retired changes.
+
+        Exceptions.
+        jsonschema.ValidationError. If request is not
+            a valid JSON merge patch.
+        sqlalchemy.exc.IntegrityError. Violation of SQLite database
+            integrity.
+
+        Returns flask Response object.
+        '''
+
+        # Check for merge patch. If fails, respond with error 415
+        if request.mimetype != MERGE_PATCH or request.json is None:
+            return create_error_response(415, "Unsupported media type",
+                                         "Requests must be {}"
+                                         .format(MERGE_PATCH)
+                                         )
+        # Validate request against the schema. If fails, respond with error 400
+        try:
+            patch_validator(equipment_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
+            return create_error_response(400, "Invalid JSON "
+                                         "document", str(err)
+                                         )
+        # Find user by name in database. If not found, respond with error 404
+        if User.query.filter_by(uri=user).first() is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Find equipment by name in database.
+        # If not found, respond with error 404
+        db_equip = Equipment.query.filter_by(uri=equipment).first()
+        if db_equip is None:
+            return create_error_response(404, "Not found",
+                                         "No equipment was found with URI {}"
+                                         .format(equipment)
+                                         )
+        # Update changed equipment data
+        changed = patch_fields(db_equip, request.json,
+                               ("name", "category", "brand", "model"))
+        # Convert %Y-%m-%d %H:%M:%S dates to Python datetime format
+        p_date_added = convert_req_date(request.json.get("date_added"))
+        p_date_retired = convert_req_date(request.json.get("date_retired"))
+        if p_date_added is not None and p_date_added != db_equip.date_added:
+            # Make sure equipment date_added cannot be moved forward in time
+            # if equipment has associated components
+            if db_equip.date_added < p_date_added and \
+                    Component.query.filter_by(equipment_id=db_equip.id) \
+                    .first():
+                db.session.rollback()
+                return create_error_response(409, "Inconsistent dates",
+                                             "New added date {} must not be "
+                                             "in the future of current added "
+                                             "date {} if equipment has "
+                                             "components associated with it"
+                                             .format(p_date_added,
+                                                     db_equip.date_added
+                                                     )
+                                             )
+            db_equip.date_added = p_date_added
+            changed.append("date_added")
+        if p_date_retired is not None \
+                and p_date_retired != db_equip.date_retired:
+            # Check if date_retired is later than date_added
+            if db_equip.date_added >= p_date_retired:
+                db.session.rollback()
+                return create_error_response(409, "Inconsistent dates",
+                                             "Retire date {} must be in the "
+                                             "future with respect to"
+                                             " added date {}"
+                                             .format(p_date_retired,
+                                                     db_equip.date_added
+                                                     )
+                                             )
+            # When retiring equipment, also retire associated components
+            db_equip.date_retired = p_date_retired
+            in_service = Component.query.filter_by(equipment_id=db_equip.id,
+                                                   date_retired=IN_SERVICE)
+            for component in in_service.all():
+                component.date_retired = p_date_retired
+            changed.append("date_retired")
+        if not changed:
+            return Response(status=204)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # In case of database error
+            db.session.rollback()
+            return create_error_response(409, "Already exists",
+                                         "Equipment with name '{}' already "
+                                         "exists for user."
+                                         .format(db_equip.name)
+                                         )
+        return Response(status=204)
+
     def delete(self, user, equipment):
         '''
         DELETE-method definition.
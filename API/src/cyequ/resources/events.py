@@ -0,0 +1,109 @@
+'''
+This module holds class-definitions for the API event stream resources.
+'''
+
+# Library imports
+import queue
+from flask import request, Response, current_app, url_for
+from flask_restful import Resource
+
+# Project imports
+from cyequ import json
+from cyequ.changes import first_retained
+from cyequ.events import format_event, get_hub
+from cyequ.utils import create_error_response
+from cyequ.models import User
+
+# Media type of server-sent event streams
+EVENT_STREAM = "text/event-stream"
+# Milliseconds a client waits before reconnecting
+RETRY = 3000
+
+
+def _stream(hub, subscriber, since, reset, heartbeat):
+    '''
+    Yields the messages of the event stream of *subscriber*: the events
+    after *since* from the change log if given, or a reset event if *reset*
+    is, then the events of the hub as they come. Ends if the subscriber is
+    dropped.
+    '''
+
+    try:
+        yield "retry: {}\n\n".format(RETRY)
+        if reset is not None:
+            yield "event: reset\ndata: {}\n\n".format(
+                json.dumps({"href": reset}))
+        elif since is not None:
+            _, records = hub.records(since, subscriber.user_id)
+            for seq, _, data in hub.render(records):
+                subscriber.seq = seq
+                yield format_event(seq, data)
+        while not subscriber.dropped:
+            try:
+                seq, message = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                # Keeps proxies from closing the connection and finds out
+                # disconnected clients
+                yield ": heartbeat\n\n"
+                continue
+            # Already sent from the change log
+            if seq > subscriber.seq:
+                subscriber.seq = seq
+                yield message
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+class UserEvents(Resource):
+    '''
+    This class defines responses for UserEvents resource.
+    '''
+
+    def get(self, user):
+        '''
+        GET-method definition.
+        Streams the changes of the user's resources, the user itself, its
+        equipment, components and rides, as server-sent events. Each change
+        event has the sequence number of the change as its id, and the
+        operation, kind, href and new ETag of the resource as JSON data.
+        Events of components also have the href and new ETag of their
+        equipment as up. A client reconnecting with header Last-Event-ID
+        gets the events it missed first. If they have been compacted away, a
+        reset event with the href of the change feed is sent instead, to
+        sync again from 0.
+
+        Returns flask Response object.
+        '''
+
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Check the id of the last event seen. If invalid, respond with 400
+        since = request.headers.get("Last-Event-ID")
+        if since is not None:
+            try:
+                since = int(since)
+                if since < 0:
+                    raise ValueError
+            except ValueError:
+                return create_error_response(400, "Invalid Last-Event-ID",
+                                             "Last-Event-ID must be a "
+                                             "sequence number"
+                                             )
+        reset = None
+        if since and since + 1 < first_retained():
+            reset = url_for("api.userchanges", user=user, since=0)
+        hub = get_hub()
+        subscriber = hub.subscribe(db_user.id, user)
+        return Response(_stream(hub, subscriber, since, reset,
+                                current_app.config["EVENTS_HEARTBEAT"]),
+                        200,
+                        mimetype=EVENT_STREAM,
+                        headers={"Cache-Control": "no-cache",
+                                 # Unbuffered by reverse proxies
+                                 "X-Accel-Buffering": "no"}
+                        )
@@ -0,0 +1,53 @@
+'''
+This module holds class-definitions for the API export resources.
+'''
+
+# Library imports
+from flask import request, Response, stream_with_context
+from flask_restful import Resource
+
+# Project imports
+from cyequ.utils import create_error_response
+from cyequ.models import User
+from cyequ.export import FORMATS, export_chunks
+
+
+class UserExport(Resource):
+    '''
+    This class defines responses for UserExport resource.
+    '''
+
+    def get(self, user):
+        '''
+        GET-method definition.
+        Streams the user's equipment, components and rides in the format of
+        query parameter "format" (ndjson by default, or csv). The body is
+        gzipped, if the client accepts gzip encoding.
+
+        Returns flask Response object.
+        '''
+
+        # Check format. If unknown, respond with error 400
+        fmt = request.args.get("format", "ndjson")
+        if fmt not in FORMATS:
+            return create_error_response(400, "Invalid query",
+                                         "Format must be one of {}"
+                                         .format(", ".join(FORMATS))
+                                         )
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        compress = request.accept_encodings["gzip"] > 0
+        headers = {"Content-Disposition":
+                   "attachment; filename={}.{}".format(user, fmt),
+                   "Vary": "Accept-Encoding"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        # Stream chunks as they are produced, within the request context
+        return Response(stream_with_context(export_chunks(db_user.id, fmt,
+                                                          compress)),
+                        200, headers=headers, mimetype=FORMATS[fmt])
@@ -0,0 +1,84 @@
+'''
+This module holds class-definitions for the API garage summary resources.
+'''
+
+# Library imports
+from flask import Response, url_for
+from flask_restful import Resource
+from werkzeug.urls import url_quote
+
+# Project imports
+from cyequ import json
+from cyequ.constants import MASON, EQUIPMENT_PROFILE, COMPONENT_PROFILE, \
+                            LINK_RELATIONS_URL
+from cyequ.garage import load
+from cyequ.utils import EquipmentBuilder, ComponentBuilder, \
+                        create_error_response
+
+
+class UserGarage(Resource):
+    '''
+    This class defines responses for UserGarage resource.
+    '''
+
+    def get(self, user):
+        '''
+        GET-method definition.
+        Responds with the garage summary of the user: its equipment with the
+        components in service of each, their counts, and the version of the
+        summary and time of the last change to it. Read from the summary
+        precomputed by cyequ.garage, in one query.
+
+        Returns flask Response object.
+        '''
+
+        found = load(user)
+        # If user not found, respond with error 404
+        if found is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        _, version, modified, document = found
+        # Instantiate message body
+        body = EquipmentBuilder(version=version,
+                                modified=modified,
+                                counts=document["counts"],
+                                items=[]
+                                )
+        # Hrefs of the items are built from the collection's, the same as
+        # url_for would
+        base = url_for("api.equipmentbyuser", user=user)
+        for bike in document["bikes"]:
+            href = base + url_quote(bike["uri"]) + "/"
+            equip = EquipmentBuilder(bike, components=[])
+            equip.add_control("self", href,
+                              title="Get this equipment's information."
+                              )
+            equip.add_control("profile",
+                              EQUIPMENT_PROFILE,
+                              title="Get profile of equipment resource."
+                              )
+            for component in bike["components"]:
+                comp = ComponentBuilder(component)
+                comp.add_control("self",
+                                 href + url_quote(component["uri"]) + "/",
+                                 title="Get this component's information."
+                                 )
+                comp.add_control("profile",
+                                 COMPONENT_PROFILE,
+                                 title="Get profile of component resource."
+                                 )
+                equip["components"].append(comp)
+            body["items"].append(equip)
+        # Add controls response message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self", url_for("api.usergarage", user=user),
+                         title="Get the garage summary of the user."
+                         )
+        body.add_control("cyequ:owner",
+                         url_for("api.useritem", user=user),
+                         title="Get associated user's information."
+                         )
+        body.add_control_all_equipment(user)
+        return Response(json.dumps(body), 200, mimetype=MASON)
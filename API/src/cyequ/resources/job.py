@@ -0,0 +1,52 @@
+'''
+This module holds class-definitions for the API job resources.
+'''
+
+# Library imports
+from flask import Response, url_for
+from flask_restful import Resource
+
+# Project imports
+from cyequ import json
+from cyequ.constants import MASON, JOB_PROFILE, LINK_RELATIONS_URL
+from cyequ.utils import MasonBuilder, create_error_response
+from cyequ.jobs import get_job
+
+
+class JobItem(Resource):
+    '''
+    This class defines responses for JobItem resource.
+    '''
+
+    def get(self, job):
+        '''
+        GET-method definition.
+        Builds the response body from the job's state and progress.
+
+        Returns flask Response object.
+        '''
+
+        # Find job by id. If not found, respond with error 404
+        db_job = get_job(job)
+        if db_job is None:
+            return create_error_response(404, "Not found",
+                                         "No job was found with id {}"
+                                         .format(job)
+                                         )
+        # Instantiate response message body and include job status
+        body = MasonBuilder(**db_job.as_dict())
+        # Add controls to message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.jobitem", job=job),
+                         title="Get this job's status."
+                         )
+        body.add_control("profile",
+                         JOB_PROFILE,
+                         title="Get profile of job resource."
+                         )
+        body.add_control("cyequ:owner",
+                         url_for("api.useritem", user=db_job.owner),
+                         title="Get associated user's information."
+                         )
+        return Response(json.dumps(body), 200, mimetype=MASON)
@@ -0,0 +1,78 @@
+'''
+This module holds class-definitions for the API maintenance resources.
+'''
+
+# Library imports
+from flask import request, Response, url_for
+from flask_restful import Resource
+
+# Project imports
+from cyequ import json
+from cyequ.constants import MASON, COMPONENT_PROFILE, LINK_RELATIONS_URL
+from cyequ.utils import ComponentBuilder, create_error_response
+from cyequ.models import User
+from cyequ.maintenance import due_components, hours_left
+
+
+class MaintenanceDue(Resource):
+    '''
+    This class defines responses for MaintenanceDue resource.
+    '''
+
+    def get(self, user):
+        '''
+        GET-method definition.
+        Builds the response body listing the user's components due for
+        service. Optional query parameters "days" and "hours" widen the
+        horizon to components due within that time or ride-hours.
+
+        Returns flask Response object.
+        '''
+
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        days = request.args.get("days", 0, type=int)
+        hours = request.args.get("hours", 0, type=int)
+        # Instantiate message body
+        body = ComponentBuilder(items=[])
+        # Add general controls to message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.maintenancedue", user=user),
+                         title="Get components due for service."
+                         )
+        body.add_control("cyequ:owner",
+                         url_for("api.useritem", user=user),
+                         title="Get associated user's information."
+                         )
+        body.add_control_all_equipment(user)
+        # Build each due component with data and controls.
+        for component in due_components(days=days,
+                                        hours=hours,
+                                        owner=db_user.id
+                                        ):
+            comp = ComponentBuilder(name=component.name,
+                                    category=component.category,
+                                    equipment=component.installedTo.name,
+                                    due_date=component.due_date,
+                                    hours_left=hours_left(component)
+                                    )
+            comp.add_control("self", url_for("api.componentitem",
+                                             user=user,
+                                             equipment=component
+                                             .installedTo.uri,
+                                             component=component.uri
+                                             ),
+                             title="Get this component's information."
+                             )
+            comp.add_control("profile",
+                             COMPONENT_PROFILE,
+                             title="Get profile of component resource."
+                             )
+            body["items"].append(comp)
+        return Response(json.dumps(body), 200, mimetype=MASON)
@@ -0,0 +1,316 @@
+'''
+This module holds class-definitions for the API ride resources.
+'''
+
+# Library imports
+import math
+import os
+import shutil
+import tempfile
+import zipfile
+from xml.etree.ElementTree import ParseError
+from flask import request, Response, url_for, current_app
+from flask_restful import Resource
+from sqlalchemy.exc import IntegrityError
+
+# Project imports
+from cyequ import db, json
+from cyequ.constants import MASON, RIDE_PROFILE, LINK_RELATIONS_URL, \
+                            RIDE_FILE_TYPES, ZIP
+from cyequ.utils import RideBuilder, create_error_response
+from cyequ.models import User, Equipment, Ride
+from cyequ.ridefile import HashingReader, RideFileError, \
+                           parse_ride_file, ride_summary
+from cyequ.streams import SCALES, encode_stream, get_store, stream_fields
+from cyequ.archive import run_archive_job
+from cyequ.jobs import start_job
+
+
+class RideImport(Resource):
+    '''
+    This class defines responses for RideImport resource.
+    '''
+
+    def post(self, user):
+        '''
+        POST-method definition.
+        Parses a GPX or TCX request body as a stream and creates a new ride
+        resource from its summary and sample streams. Optional query
+        parameters "equipment" (URI of the user's equipment used) and "name"
+        are stored with the ride.
+
+        Exceptions.
+        xml.etree.ElementTree.ParseError. If request is not
+            a well-formed XML document.
+        cyequ.ridefile.RideFileError. If request is not a usable ride.
+        sqlalchemy.exc.IntegrityError. Violation of SQLite database
+            integrity.
+
+        Returns flask Response object.
+        '''
+
+        # Check for ride file. If fails, respond with error 415
+        if request.mimetype not in RIDE_FILE_TYPES:
+            return create_error_response(415, "Unsupported media type",
+                                         "Requests must be GPX or TCX"
+                                         )
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Find the equipment used, if given.
+        # If not found for user, respond with error 404
+        equipment = request.args.get("equipment")
+        equipment_id = None
+        if equipment is not None:
+            db_equip = Equipment.query.filter_by(uri=equipment,
+                                                 owner=db_user.id
+                                                 ).first()
+            if db_equip is None:
+                return create_error_response(404, "Not found",
+                                             "No equipment was found with "
+                                             "URI {}".format(equipment)
+                                             )
+            equipment_id = db_equip.id
+        # Parse the body incrementally. If fails, respond with error 400
+        stream = HashingReader(request.stream)
+        try:
+            name, points = parse_ride_file(stream)
+            summary = ride_summary(points)
+        except (ParseError, RideFileError, ValueError) as err:
+            return create_error_response(400, "Invalid ride file", str(err))
+        if summary["duration"] <= 0:
+            return create_error_response(400, "Invalid ride file",
+                                         "Ride must have a positive duration"
+                                         )
+        # Check if the same file is already imported by the user
+        content_hash = stream.hexdigest()
+        if Ride.query.filter_by(rider=db_user.id,
+                                content_hash=content_hash).first():
+            return create_error_response(409,
+                                         "Already exists",
+                                         "The same ride file is already "
+                                         "imported for this user."
+                                         )
+        name = request.args.get("name", name) \
+            or "Ride {:%Y-%m-%d %H:%M}".format(summary["datetime"])
+        # Add ride to db
+        new_ride = Ride(name=name[:64],
+                        equipment_id=equipment_id,
+                        rider=db_user.id,
+                        content_hash=content_hash,
+                        **summary
+                        )
+        try:
+            db.session.add(new_ride)
+            db.session.commit()
+        except IntegrityError:
+            # In case of database error
+            db.session.rollback()
+            return create_error_response(409,
+                                         "Already exists",
+                                         "Ride with name '{}' already"
+                                         " exists for this equipment."
+                                         .format(name)
+                                         )
+        # Append sample streams to the stream store only for a committed
+        # ride, so a rolled back insert leaves no segment behind
+        new_ride.stream_offset, new_ride.stream_length = get_store().append(
+            encode_stream(stream_fields(points))
+        )
+        # Create URI for ride
+        new_ride.uri = new_ride.name + str(new_ride.id)
+        db.session.commit()
+        # Respond with location of new resource
+        return Response(status=201,
+                        headers={"Location":
+                                 url_for("api.rideitem",
+                                         user=user,
+                                         ride=new_ride.uri
+                                         )
+                                 }
+                        )
+
+
+class RideArchive(Resource):
+    '''
+    This class defines responses for RideArchive resource.
+    '''
+
+    def post(self, user):
+        '''
+        POST-method definition.
+        Saves a ZIP archive of GPX and TCX files from the request body and
+        starts a job importing its rides in the background.
+
+        Returns flask Response object.
+        '''
+
+        # Check for ZIP archive. If fails, respond with error 415
+        if request.mimetype != ZIP:
+            return create_error_response(415, "Unsupported media type",
+                                         "Requests must be ZIP archives"
+                                         )
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Spool the body to disk. If not a ZIP file, respond with error 400
+        fd, path = tempfile.mkstemp(suffix=".zip",
+                                    dir=current_app.instance_path)
+        with os.fdopen(fd, "wb") as archive:
+            shutil.copyfileobj(request.stream, archive)
+        if not zipfile.is_zipfile(path):
+            os.unlink(path)
+            return create_error_response(400, "Invalid archive",
+                                         "Request body is not a ZIP file"
+                                         )
+        job = start_job("ride-archive", user, run_archive_job, db_user.id,
+                        path, current_app.config["ARCHIVE_WORKERS"])
+        # Respond with location of the job resource
+        return Response(status=202,
+                        headers={"Location":
+                                 url_for("api.jobitem", job=job.id)
+                                 }
+                        )
+
+
+class RideItem(Resource):
+    '''
+    This class defines responses for RideItem resource.
+    '''
+
+    def get(self, user, ride):
+        '''
+        GET-method definition.
+        Builds the response body and adds controls as defined in API design
+
+        Returns flask Response object.
+        '''
+
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Find user's ride by URI in database.
+        # If not found, respond with error 404
+        db_ride = Ride.query.filter_by(uri=ride, rider=db_user.id).first()
+        if db_ride is None:
+            return create_error_response(404, "Not found",
+                                         "No ride was found with URI {}"
+                                         .format(ride)
+                                         )
+        # Instantiate response message body and include ride data
+        body = RideBuilder(name=db_ride.name,
+                           datetime=db_ride.datetime,
+                           duration=db_ride.duration,
+                           moving_time=db_ride.moving_time,
+                           distance=db_ride.distance,
+                           elevation_gain=db_ride.elevation_gain,
+                           equipment=db_ride.riddenWith.name
+                           if db_ride.riddenWith else None
+                           )
+        # Add controls to message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.rideitem", user=user, ride=ride),
+                         title="Get this ride's information."
+                         )
+        body.add_control("profile",
+                         RIDE_PROFILE,
+                         title="Get profile of ride resource."
+                         )
+        body.add_control("cyequ:owner",
+                         url_for("api.useritem", user=user),
+                         title="Get associated user's information."
+                         )
+        body.add_control_import_ride(user)
+        body.add_control_import_archive(user)
+        if db_ride.stream_offset is not None:
+            body.add_control("cyequ:streams",
+                             url_for("api.ridestreams", user=user, ride=ride),
+                             title="Get the sample streams of this ride."
+                             )
+        return Response(json.dumps(body), 200, mimetype=MASON)
+
+
+class RideStreams(Resource):
+    '''
+    This class defines responses for RideStreams resource.
+    '''
+
+    def get(self, user, ride):
+        '''
+        GET-method definition.
+        Builds the response body from a slice of the ride's sample streams.
+        Query parameters:
+            fields      Comma separated fields, all stored fields by default.
+            from, to    Slice in seconds from the ride start.
+            downsample  Return every n'th sample of the slice.
+        Time in seconds from the ride start is always included.
+
+        Returns flask Response object.
+        '''
+
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Find user's ride with streams by URI in database.
+        # If not found, respond with error 404
+        db_ride = Ride.query.filter_by(uri=ride, rider=db_user.id).first()
+        if db_ride is None or db_ride.stream_offset is None:
+            return create_error_response(404, "Not found",
+                                         "No ride streams were found with "
+                                         "URI {}".format(ride)
+                                         )
+        stream = get_store().open(db_ride.stream_offset,
+                                  db_ride.stream_length
+                                  )
+        # Check query parameters. If invalid, respond with error 400
+        fields = request.args.get("fields")
+        fields = fields.split(",") if fields else stream.fields
+        unknown = [field for field in fields if field not in stream.fields]
+        try:
+            start = float(request.args.get("from", 0))
+            stop = request.args.get("to")
+            stop = None if stop is None else float(stop)
+            step = int(request.args.get("downsample", 1))
+        except ValueError as err:
+            return create_error_response(400, "Invalid query", str(err))
+        if unknown or step < 1 or not math.isfinite(start) \
+                or stop is not None and not math.isfinite(stop):
+            return create_error_response(400, "Invalid query",
+                                         "Fields must be some of {}, from "
+                                         "and to finite numbers and "
+                                         "downsample a positive integer"
+                                         .format(", ".join(SCALES))
+                                         )
+        first = stream.locate(start)
+        last = stream.count if stop is None else stream.locate(stop)
+        body = RideBuilder(samples=len(range(first, last, step)))
+        for field in ["time"] + [f for f in fields if f != "time"]:
+            body[field] = stream.values(field, first, last, step).tolist()
+        # Add controls to message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.ridestreams", user=user, ride=ride),
+                         title="Get the sample streams of this ride."
+                         )
+        body.add_control("up",
+                         url_for("api.rideitem", user=user, ride=ride),
+                         title="Get associated ride's information."
+                         )
+        return Response(json.dumps(body), 200, mimetype=MASON)
@@ -0,0 +1,127 @@
+'''
+This module holds class-definitions for the API search resources.
+'''
+
+# Library imports
+from flask import request, Response, url_for
+from flask_restful import Resource
+
+# Project imports
+from cyequ import json
+from cyequ.constants import MASON, EQUIPMENT_PROFILE, COMPONENT_PROFILE, \
+                            LINK_RELATIONS_URL
+from cyequ.utils import CommonBuilder, create_error_response
+from cyequ.models import User, Equipment, Component
+from cyequ.search import EQUIPMENT, COMPONENT, search
+
+# Search results per page, by default and at most
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class UserSearch(Resource):
+    '''
+    This class defines responses for UserSearch resource.
+    '''
+
+    def get(self, user):
+        '''
+        GET-method definition.
+        Searches the user's equipment and components by name, category,
+        brand and model. Query parameters:
+            q       Search words. The last word also matches as a prefix.
+            page    Page of results, starting from 1.
+            limit   Results per page.
+        Results are ranked, best matches first.
+
+        Returns flask Response object.
+        '''
+
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Check query parameters. If invalid, respond with error 400
+        query = request.args.get("q", "")
+        page = request.args.get("page", 1, type=int)
+        limit = request.args.get("limit", PAGE_SIZE, type=int)
+        if not query.strip() or page < 1 or not 0 < limit <= MAX_PAGE_SIZE:
+            return create_error_response(400, "Invalid query",
+                                         "Parameter q is required, page must "
+                                         "be positive and limit at most {}"
+                                         .format(MAX_PAGE_SIZE)
+                                         )
+        total, hits = search(query, db_user.id, (page - 1) * limit, limit)
+        # Load the hits of the page with one query per kind
+        equipment_ids = [item for kind, item in hits if kind == EQUIPMENT]
+        component_ids = [item for kind, item in hits if kind != EQUIPMENT]
+        found = {}
+        for equipment in Equipment.query \
+                .filter(Equipment.id.in_(equipment_ids)):
+            found[EQUIPMENT, equipment.id] = equipment
+        for component in Component.query \
+                .filter(Component.id.in_(component_ids)):
+            found[COMPONENT, component.id] = component
+        # Instantiate message body
+        body = CommonBuilder(query=query, total=total, page=page, items=[])
+        # Add general controls to message body
+        body.add_namespace("cyequ", LINK_RELATIONS_URL)
+        body.add_control("self",
+                         url_for("api.usersearch", user=user, q=query,
+                                 page=page, limit=limit),
+                         title="Get this page of search results."
+                         )
+        if page > 1:
+            body.add_control("prev",
+                             url_for("api.usersearch", user=user, q=query,
+                                     page=page - 1, limit=limit),
+                             title="Get the previous page of results."
+                             )
+        if page * limit < total:
+            body.add_control("next",
+                             url_for("api.usersearch", user=user, q=query,
+                                     page=page + 1, limit=limit),
+                             title="Get the next page of results."
+                             )
+        body.add_control("cyequ:owner",
+                         url_for("api.useritem", user=user),
+                         title="Get associated user's information."
+                         )
+        # Build each hit in rank order with data and controls
+        for hit in hits:
+            db_item = found.get(hit)
+            if db_item is None:
+                continue
+            item = CommonBuilder(kind=hit[0],
+                                 name=db_item.name,
+                                 category=db_item.category,
+                                 brand=db_item.brand,
+                                 model=db_item.model
+                                 )
+            if hit[0] == EQUIPMENT:
+                item.add_control("self",
+                                 url_for("api.equipmentitem", user=user,
+                                         equipment=db_item.uri),
+                                 title="Get this equipment's information."
+                                 )
+                item.add_control("profile",
+                                 EQUIPMENT_PROFILE,
+                                 title="Get profile of equipment resource."
+                                 )
+            else:
+                item["equipment"] = db_item.installedTo.name
+                item.add_control("self",
+                                 url_for("api.componentitem", user=user,
+                                         equipment=db_item.installedTo.uri,
+                                         component=db_item.uri),
+                                 title="Get this component's information."
+                                 )
+                item.add_control("profile",
+                                 COMPONENT_PROFILE,
+                                 title="Get profile of component resource."
+                                 )
+            body["items"].append(item)
+        return Response(json.dumps(body), 200, mimetype=MASON)
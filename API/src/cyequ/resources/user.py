@@ -3,18 +3,58 @@ This module holds class-definitions for the API user resources.
 '''
 
 # Library imports
-from flask import request, Response, json, url_for
+from flask import request, Response, url_for
 from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
-from jsonschema import validate, ValidationError
 
 # Project imports
-from cyequ import db
-from cyequ.constants import MASON, USER_PROFILE, LINK_RELATIONS_URL
-from cyequ.utils import UserBuilder, create_error_response
+from cyequ import db, json
+from cyequ.lazy import lazy_import
+from cyequ.constants import MASON, MERGE_PATCH, USER_PROFILE, \
+                            LINK_RELATIONS_URL
+from cyequ.utils import UserBuilder, create_error_response, schema_validator, \
+                        patch_validator, patch_fields
 from cyequ.models import User
 from cyequ.static.schemas.user_schema import user_schema
 
+jsonschema = lazy_import("jsonschema")
+
+
+def user_item_body(user, db_user):
+    '''
+    Builds the UserItem document of *db_user* with URI *user*. Also used by
+    the async read path, see cyequ.asgi.
+
+    Returns UserBuilder object.
+    '''
+
+    # Instantiate response message body
+    body = UserBuilder(
+        name=db_user.name
+    )
+    # Add controls to message body
+    body.add_namespace("cyequ", LINK_RELATIONS_URL)
+    body.add_control("self",
+                     url_for("api.useritem", user=user),
+                     title="Get this user's information."
+                     )
+    body.add_control("profile",
+                     USER_PROFILE,
+                     title="Get profile of user resource."
+                     )
+    body.add_control("collection",
+                     url_for("api.usercollection"),
+                     title="Get a list of all users know to the API."
+                     )
+    body.add_control_edit_user(user)
+    body.add_control_patch_user(user)
+    body.add_control_all_equipment(user)
+    body.add_control_export(user)
+    body.add_control_changes(user)
+    body.add_control_events(user)
+    body.add_control_garage(user)
+    return body
+
 
 class UserCollection(Resource):
     '''
@@ -79,8 +119,8 @@ class UserCollection(Resource):
                                          )
         # Validate request against the schema. If fails, respond with error 400
         try:
-            validate(request.json, user_schema())
-        except ValidationError as err:
+            schema_validator(user_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
             return create_error_response(400, "Invalid JSON "
                                          "document", str(err)
                                          )
@@ -131,26 +171,7 @@ class UserItem(Resource):
                                          "No user was found with URI {}"
                                          .format(user)
                                          )
-        # Instantiate response message body
-        body = UserBuilder(
-            name=db_user.name
-        )
-        # Add controls to message body
-        body.add_namespace("cyequ", LINK_RELATIONS_URL)
-        body.add_control("self",
-                         url_for("api.useritem", user=user),
-                         title="Get this user's information."
-                         )
-        body.add_control("profile",
-                         USER_PROFILE,
-                         title="Get profile of user resource."
-                         )
-        body.add_control("collection",
-                         url_for("api.usercollection"),
-                         title="Get a list of all users know to the API."
-                         )
-        body.add_control_edit_user(user)
-        body.add_control_all_equipment(user)
+        body = user_item_body(user, db_user)
         return Response(json.dumps(body), 200, mimetype=MASON)
 
     def put(self, user):
@@ -175,8 +196,8 @@ class UserItem(Resource):
                                          )
         # Validate request against the schema. If fails, respond with error 400
         try:
-            validate(request.json, user_schema())
-        except ValidationError as err:
+            schema_validator(user_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
             return create_error_response(400, "Invalid JSON "
                                          "document", str(err)
                                          )
@@ -200,6 +221,55 @@ class UserItem(Resource):
                                          )
         return Response(status=204)
 
+    def patch(self, user):
+        '''
+        PATCH-method definition.
+        Checks for a JSON merge patch and modifies the given fields of a
+        resource in the API. Only changed fields are written.
+
+        Exceptions.
+        jsonschema.ValidationError. If request is not
+            a valid JSON merge patch.
+        sqlalchemy.exc.IntegrityError. Violation of SQLite database
+            integrity.
+
+        Returns flask Response object.
+        '''
+
+        # Check for merge patch. If fails, respond with error 415
+        if request.mimetype != MERGE_PATCH or request.json is None:
+            return create_error_response(415, "Unsupported media type",
+                                         "Requests must be {}"
+                                         .format(MERGE_PATCH)
+                                         )
+        # Validate request against the schema. If fails, respond with error 400
+        try:
+            patch_validator(user_schema).validate(request.json)
+        except jsonschema.ValidationError as err:
+            return create_error_response(400, "Invalid JSON "
+                                         "document", str(err)
+                                         )
+        # Find user by name in database. If not found, respond with error 404
+        db_user = User.query.filter_by(uri=user).first()
+        if db_user is None:
+            return create_error_response(404, "Not found",
+                                         "No user was found with URI {}"
+                                         .format(user)
+                                         )
+        # Update changed user data
+        if not patch_fields(db_user, request.json, ("name",)):
+            return Response(status=204)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # In case of database error
+            db.session.rollback()
+            return create_error_response(409, "Already exists",
+                                         "User with name '{}' already "
+                                         "exists.".format(request.json["name"])
+                                         )
+        return Response(status=204)
+
 # Keeping this here just in case...
 #    def delete(self, user):
 #        '''
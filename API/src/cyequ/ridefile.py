@@ -0,0 +1,260 @@
+'''
+This module parses GPX and TCX ride files recorded by cycling computers and
+computes ride summaries from their track points.
+
+Files are read incrementally with ElementTree.iterparse, so the whole document
+tree is never built. Each track point is appended to typed arrays and its
+element is dropped, leaving memory proportional to the number of points.
+Metrics are computed with NumPy over the whole point arrays at once.
+'''
+
+# Library imports
+import hashlib
+from array import array
+from datetime import datetime, timezone
+from xml.etree.ElementTree import iterparse
+
+# Project imports
+from cyequ.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# Mean radius of the Earth in meters
+EARTH_RADIUS = 6371008.8
+# Slower than this (m/s) between two points does not count as moving
+MOVING_SPEED = 0.5
+
+# Track point element and child elements by file format
+_TRACKPOINT = {"gpx": "trkpt", "tcx": "Trackpoint"}
+_ELEVATION = {"gpx": "ele", "tcx": "AltitudeMeters"}
+# Sensor values of track point extensions. GPX heart rate is in Garmin's
+# TrackPointExtension, TCX heart rate in HeartRateBpm/Value.
+_SENSORS = {"hr": "hr", "power": "power", "PowerInWatts": "power",
+            "Watts": "power"}
+
+
+class RideFileError(Exception):
+    '''
+    Raised when a ride file is well-formed XML, but not a usable ride.
+    '''
+
+
+def _local(tag):
+    '''
+    Returns an element tag without its namespace.
+    '''
+
+    return tag.rsplit("}", 1)[-1]
+
+
+def _timestamp(value):
+    '''
+    Converts an ISO 8601 time of a ride file to POSIX seconds. Times without
+    an offset are UTC as required by both formats.
+    '''
+
+    if value is None:
+        raise RideFileError("Track point has an empty time")
+    value = value.strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    stamp = datetime.fromisoformat(value)
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return stamp.timestamp()
+
+
+def _number(value, tag):
+    '''
+    Converts a value of element or attribute *tag* of a ride file to float.
+    '''
+
+    if value is None:
+        raise RideFileError("Track point has an empty {}".format(tag))
+    return float(value)
+
+
+class HashingReader(object):
+    '''
+    Wraps a binary file object and computes the SHA-256 of everything read
+    through it, so a streamed file can be hashed while it is parsed.
+    '''
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._hash.update(data)
+        return data
+
+    def hexdigest(self):
+        '''
+        Returns the hash of the data read so far.
+        '''
+
+        return self._hash.hexdigest()
+
+
+class TrackPoints(object):
+    '''
+    Column-wise storage of parsed track points in typed arrays.
+    '''
+
+    def __init__(self):
+        self.time = array("d")
+        self.lat = array("d")
+        self.lon = array("d")
+        self.ele = array("d")
+        self.hr = array("d")
+        self.power = array("d")
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, point):
+        '''
+        Appends a point given as a dict with keys time, lat, lon, and
+        optionally ele, hr and power. Points without time or position are
+        skipped, missing optional values are stored as NaN.
+        '''
+
+        if None in (point.get("time"), point.get("lat"), point.get("lon")):
+            return
+        self.time.append(point["time"])
+        self.lat.append(point["lat"])
+        self.lon.append(point["lon"])
+        self.ele.append(point.get("ele", float("nan")))
+        self.hr.append(point.get("hr", float("nan")))
+        self.power.append(point.get("power", float("nan")))
+
+    def arrays(self):
+        '''
+        Returns the points as NumPy arrays sharing memory with the typed
+        arrays.
+        '''
+
+        return (np.frombuffer(self.time), np.frombuffer(self.lat),
+                np.frombuffer(self.lon), np.frombuffer(self.ele))
+
+    def sensors(self):
+        '''
+        Returns heart rate and power as NumPy arrays like arrays().
+        '''
+
+        return np.frombuffer(self.hr), np.frombuffer(self.power)
+
+
+def parse_ride_file(stream):
+    '''
+    Parses a GPX or TCX document from a binary file object.
+
+    Returns a tuple of the ride name (or None) and TrackPoints.
+
+    Exceptions.
+    xml.etree.ElementTree.ParseError. If the document is not well-formed.
+    RideFileError. If the document is neither GPX nor TCX, or a track point
+        has an empty value.
+    ValueError. If a coordinate, elevation or time is malformed.
+    '''
+
+    fmt, name, point, points = None, None, None, TrackPoints()
+    # Open elements, so handled track points can be removed from parents
+    stack = []
+    for evt, elem in iterparse(stream, events=("start", "end")):
+        tag = _local(elem.tag)
+        if evt == "start":
+            if fmt is None:
+                if tag not in ("gpx", "TrainingCenterDatabase"):
+                    raise RideFileError("Root element {} is not GPX or TCX"
+                                        .format(tag))
+                fmt = "gpx" if tag == "gpx" else "tcx"
+            elif tag == _TRACKPOINT[fmt]:
+                point = {}
+                if fmt == "gpx":
+                    point["lat"] = _number(elem.get("lat"), "lat")
+                    point["lon"] = _number(elem.get("lon"), "lon")
+            stack.append(elem)
+            continue
+        stack.pop()
+        if point is not None:
+            if tag == _TRACKPOINT[fmt]:
+                points.append(point)
+                point = None
+                # Drop the handled point to keep memory flat
+                stack[-1].remove(elem)
+            elif tag == "time" or tag == "Time":
+                point["time"] = _timestamp(elem.text)
+            elif tag == _ELEVATION[fmt]:
+                point["ele"] = _number(elem.text, tag)
+            elif tag == "LatitudeDegrees":
+                point["lat"] = _number(elem.text, tag)
+            elif tag == "LongitudeDegrees":
+                point["lon"] = _number(elem.text, tag)
+            elif tag in _SENSORS:
+                point[_SENSORS[tag]] = _number(elem.text, tag)
+            elif tag == "Value" and _local(stack[-1].tag) == "HeartRateBpm":
+                point["hr"] = _number(elem.text, tag)
+        elif name is None and elem.text and \
+                ((fmt == "gpx" and tag == "name"
+                  and _local(stack[-1].tag) == "trk")
+                 or (fmt == "tcx" and tag == "Id"
+                     and _local(stack[-1].tag) == "Activity")):
+            name = elem.text.strip()
+    return name, points
+
+
+def haversine(lat, lon):
+    '''
+    Returns distances in meters between consecutive points given as arrays
+    of latitudes and longitudes in degrees.
+    '''
+
+    phi = np.radians(lat)
+    lam = np.radians(lon)
+    a = np.sin(np.diff(phi) / 2) ** 2 \
+        + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def speeds(time, lat, lon):
+    '''
+    Returns the speed in m/s at each point, computed from the previous point.
+    The first point and points without elapsed time get zero speed.
+    '''
+
+    step = haversine(lat, lon)
+    dt = np.diff(time)
+    speed = np.zeros(len(time))
+    np.divide(step, dt, out=speed[1:], where=dt > 0)
+    return speed
+
+
+def ride_summary(points):
+    '''
+    Computes the summary of a ride from its TrackPoints.
+
+    Returns a dict with start datetime (naive UTC), duration and moving_time
+    in seconds, distance and elevation_gain in meters.
+
+    Exceptions.
+    RideFileError. If the ride has less than two points.
+    '''
+
+    if len(points) < 2:
+        raise RideFileError("Ride must have at least two track points")
+    time, lat, lon, ele = points.arrays()
+    step = haversine(lat, lon)
+    dt = np.diff(time)
+    # Speed of each step, zero for steps without time
+    speed = np.divide(step, dt, out=np.zeros_like(step), where=dt > 0)
+    climb = np.diff(ele)
+    start = datetime.fromtimestamp(time[0], timezone.utc)
+    return {
+        "datetime": start.replace(tzinfo=None),
+        "duration": int(round(time[-1] - time[0])),
+        "moving_time": int(round(dt[speed >= MOVING_SPEED].sum())),
+        "distance": float(step.sum()),
+        "elevation_gain": float(np.nansum(climb[climb > 0]))
+    }
@@ -0,0 +1,230 @@
+'''
+This module holds the full-text search index of equipment and components.
+
+The index is an SQLite FTS5 table, search_index, of the searched text
+columns of both tables. Triggers keep it in sync with every write, including
+writes that bypass the ORM. The rowid of an indexed row is built from the
+owner's user id and the item:
+
+    rowid = owner << 32 | id << 1 | kind     (kind 0 equipment, 1 component)
+
+so the rows of one user form a rowid range. FTS5 seeks to the range in each
+word's doclist, so a search reads the user's entries only, however large the
+fleet is. Prefixes of up to four characters have their own index, as longer
+prefixes would otherwise expand over every matching word of the fleet.
+'''
+
+# Library imports
+import re
+import unicodedata
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, event, text
+
+# Project imports
+from cyequ import db
+
+EQUIPMENT, COMPONENT = "equipment", "component"
+# Prefix lengths with their own FTS5 prefix index
+PREFIX_LENGTHS = (1, 2, 3, 4)
+
+# SQL of the rowids of an equipment or a component row
+# Bit operators of SQLite share one precedence, hence the parentheses
+_EQUIPMENT_ROWID = "((coalesce({0}.owner, 0) << 32) | ({0}.id << 1))"
+# Components without equipment, or of equipment without owner, are owner 0
+_COMPONENT_ROWID = "((coalesce((SELECT owner FROM equipment" \
+                   " WHERE id = {0}.equipment_id), 0) << 32)" \
+                   " | ({0}.id << 1) | 1)"
+_INSERT = "INSERT INTO search_index (rowid, name, category, brand, model)"
+# SQL of the indexed columns of a row, brand and model from its catalog entry
+_VALUES = "{0}.name, {0}.category," \
+          " (SELECT brand FROM catalog WHERE id = {0}.catalog_id)," \
+          " (SELECT model FROM catalog WHERE id = {0}.catalog_id)"
+
+# Triggers keeping the index in sync, all created by _SCHEMA
+_TRIGGERS = ("equipment_search_ai", "equipment_search_au",
+             "equipment_search_bd", "component_search_ai",
+             "component_search_au", "component_search_ad")
+# Statements run after the tables are created, SQLite only
+_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    " name, category, brand, model,"
+    " tokenize = 'unicode61 remove_diacritics 2', prefix = '{}')"
+    .format(" ".join(map(str, PREFIX_LENGTHS))),
+    "CREATE TRIGGER IF NOT EXISTS equipment_search_ai"
+    " AFTER INSERT ON equipment BEGIN "
+    + _INSERT + " VALUES (" + _EQUIPMENT_ROWID.format("new")
+    + ", " + _VALUES.format("new") + ");"
+    " END",
+    # Components move along, if the owner changes
+    "CREATE TRIGGER IF NOT EXISTS equipment_search_au"
+    " AFTER UPDATE OF name, category, catalog_id, owner ON equipment"
+    " BEGIN"
+    " DELETE FROM search_index WHERE rowid = "
+    + _EQUIPMENT_ROWID.format("old") + "; "
+    + _INSERT + " VALUES (" + _EQUIPMENT_ROWID.format("new")
+    + ", " + _VALUES.format("new") + ");"
+    " DELETE FROM search_index WHERE new.owner IS NOT old.owner"
+    " AND rowid IN (SELECT (coalesce(old.owner, 0) << 32) | (id << 1) | 1"
+    " FROM component WHERE equipment_id = new.id); "
+    + _INSERT + " SELECT " + _COMPONENT_ROWID.format("component")
+    + ", " + _VALUES.format("component") + " FROM component"
+    " WHERE new.owner IS NOT old.owner AND equipment_id = new.id;"
+    " END",
+    # Before, so components deleted by the database cascade are found
+    "CREATE TRIGGER IF NOT EXISTS equipment_search_bd"
+    " BEFORE DELETE ON equipment BEGIN"
+    " DELETE FROM search_index WHERE rowid = "
+    + _EQUIPMENT_ROWID.format("old") + ";"
+    " DELETE FROM search_index WHERE rowid IN (SELECT "
+    + _COMPONENT_ROWID.format("component")
+    + " FROM component WHERE equipment_id = old.id);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS component_search_ai"
+    " AFTER INSERT ON component BEGIN "
+    + _INSERT + " VALUES (" + _COMPONENT_ROWID.format("new")
+    + ", " + _VALUES.format("new") + ");"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS component_search_au"
+    " AFTER UPDATE OF name, category, catalog_id, equipment_id"
+    " ON component BEGIN"
+    " DELETE FROM search_index WHERE rowid = "
+    + _COMPONENT_ROWID.format("old") + "; "
+    + _INSERT + " VALUES (" + _COMPONENT_ROWID.format("new")
+    + ", " + _VALUES.format("new") + ");"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS component_search_ad"
+    " AFTER DELETE ON component BEGIN"
+    " DELETE FROM search_index WHERE rowid = "
+    + _COMPONENT_ROWID.format("old") + ";"
+    " END",
+]
+
+for _statement in _SCHEMA:
+    event.listen(db.Model.metadata, "after_create",
+                 DDL(_statement).execute_if(dialect="sqlite"))
+
+# Words of a search query, i.e. runs of letters and digits
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Rank weight of a word found in each indexed column
+WEIGHTS = {"name": 10, "brand": 5, "model": 5, "category": 2}
+
+
+def tokens(value):
+    '''
+    Splits text into words like the index tokenizer: case-folded, without
+    diacritics, split at anything else than letters and digits.
+    '''
+
+    value = value or ""
+    if value.isascii():
+        return _WORD.findall(value.lower().replace("_", " "))
+    value = unicodedata.normalize("NFKD", value).casefold()
+    value = "".join(char for char in value
+                    if not unicodedata.combining(char))
+    return _WORD.findall(value.replace("_", " "))
+
+
+def match_query(words):
+    '''
+    Builds an FTS5 MATCH expression requiring all *words*, the last one as a
+    prefix. A last word longer than the longest indexed prefix is matched by
+    that prefix, so the prefix index is used, and must be checked after.
+    '''
+
+    # Quoted, so words are never read as FTS5 operators
+    terms = ['"{}"'.format(word) for word in words[:-1]]
+    terms.append('"{}"*'.format(words[-1][:PREFIX_LENGTHS[-1]]))
+    return " AND ".join(terms)
+
+
+def _score(words, row):
+    '''
+    Returns the rank score of an indexed row, or None if the last word does
+    not match as a prefix.
+    '''
+
+    columns = {name: tokens(getattr(row, name)) for name in WEIGHTS}
+    score = 0
+    for i, word in enumerate(words):
+        last = i == len(words) - 1
+        for name, found in columns.items():
+            if word in found:
+                score += WEIGHTS[name] * 2
+            elif last and any(token.startswith(word) for token in found):
+                score += WEIGHTS[name]
+    if not any(token.startswith(words[-1])
+               for found in columns.values() for token in found):
+        return None
+    return score
+
+
+def search(query, owner, offset=0, limit=20):
+    '''
+    Searches equipment and components of user id *owner*, best matches
+    first. Whole words found in the name weigh most, then brand and model,
+    then category. Prefix matches of the last word weigh half.
+
+    Only the rowid range of the owner is read from the index. Ranking is done
+    on the owner's matches, as bm25() would read every user's matches for its
+    statistics.
+
+    Returns a tuple of the total number of matches and a list of
+    (kind, id) tuples of the requested page.
+    '''
+
+    words = tokens(query)
+    if not words:
+        return 0, []
+    rows = db.session.execute(
+        text("SELECT rowid, name, category, brand, model FROM search_index"
+             " WHERE search_index MATCH :q AND rowid >= :lo AND rowid < :hi"),
+        {"q": match_query(words), "lo": owner << 32, "hi": (owner + 1) << 32}
+    )
+    ranked = []
+    for row in rows:
+        score = _score(words, row)
+        if score is not None:
+            ranked.append((-score, row.rowid))
+    ranked.sort()
+    return len(ranked), [(COMPONENT if rowid & 1 else EQUIPMENT,
+                          (rowid & 0xFFFFFFFF) >> 1)
+                         for _, rowid in ranked[offset:offset + limit]]
+
+
+def rebuild_index():
+    '''
+    Recreates the search index from the equipment and component tables,
+    and its triggers, which may be of an earlier version.
+    '''
+
+    for trigger in _TRIGGERS:
+        db.session.execute(text("DROP TRIGGER IF EXISTS " + trigger))
+    for statement in _SCHEMA:
+        db.session.execute(text(statement))
+    db.session.execute(text("DELETE FROM search_index"))
+    db.session.execute(text(
+        _INSERT + " SELECT " + _EQUIPMENT_ROWID.format("equipment")
+        + ", " + _VALUES.format("equipment") + " FROM equipment"
+    ))
+    db.session.execute(text(
+        _INSERT + " SELECT " + _COMPONENT_ROWID.format("component")
+        + ", " + _VALUES.format("component") + " FROM component"
+    ))
+    db.session.execute(text(
+        "INSERT INTO search_index (search_index) VALUES ('optimize')"
+    ))
+    db.session.commit()
+
+
+@click.command("search-rebuild")
+@with_appcontext
+def search_rebuild_command():
+    '''
+    Creates or recreates the full-text search index of equipment and
+    components, e.g. for databases created before the index or its current
+    triggers existed.
+    '''
+
+    rebuild_index()
+    click.echo("Search index rebuilt.")
@@ -0,0 +1,248 @@
+'''
+This module holds cyequ-serve, the pre-forking production server of the API.
+
+The master process creates and warms up the application once (see
+cyequ.warmup), moves everything allocated so far out of the garbage
+collector's reach with gc.freeze, binds the listening socket and forks the
+workers. Workers share the preloaded memory copy-on-write: with the objects
+frozen, the collector no longer writes to their headers, so the pages stay
+shared. Each worker disposes the inherited database engines first, so no
+pooled SQLite connection is ever used by two processes, and then serves
+requests with a threaded WSGI server on the shared socket. Workers see the
+status of background jobs started by each other through JOB_DIR, see
+cyequ.jobs.
+
+Signals of the master:
+    SIGHUP          Graceful reload: the application is created again (with
+                    configuration changes), new workers are started and the
+                    old ones finish their requests and exit. If creating
+                    the application fails, the old workers keep serving.
+                    Changes to the code need a restart.
+    SIGTERM, SIGINT Graceful stop: workers finish their requests and exit.
+Workers that die are replaced.
+'''
+
+# Library imports
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import click
+from flask import Config
+from werkzeug.serving import make_server
+
+# Project imports
+from cyequ import create_app, db
+
+# Seconds workers get to finish their requests on stop and reload
+GRACEFUL_TIMEOUT = 30
+
+
+def default_workers():
+    '''
+    Returns the number of cores available to this process.
+    '''
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def load_app(config=None):
+    '''
+    Creates and warms up the application, with the configuration of Python
+    file *config* if given, and freezes the objects allocated so far.
+    '''
+
+    test_config = None
+    if config is not None:
+        loaded = Config(os.getcwd())
+        loaded.from_pyfile(os.path.abspath(config))
+        test_config = dict(loaded)
+    app = create_app(test_config)
+    from cyequ.warmup import warmup
+    with app.app_context():
+        warmup()
+        # Connections of the warm-up must not be inherited by workers
+        dispose_engines(app, close=True)
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def dispose_engines(app, close=False):
+    '''
+    Replaces the connection pools of the database engines of *app*. In a
+    forked worker, *close* must be False: the inherited connections are
+    left for the parent, not closed under it.
+    '''
+
+    engines = [db.get_engine(app, bind) for bind
+               in [None] + list(app.config.get("SQLALCHEMY_BINDS") or ())]
+    # Reader engine of DB_ROUTING
+    if "cyequ_reader" in app.extensions:
+        engines.append(app.extensions["cyequ_reader"])
+    for engine in engines:
+        engine.dispose(close=close)
+
+
+def _serve(app, listener):
+    '''
+    Serves requests on *listener* until SIGTERM. Runs in a worker.
+    '''
+
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    dispose_engines(app)
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True,
+                         fd=listener.fileno())
+    # Requests in flight are waited for when the server is closed
+    server.daemon_threads = False
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    server.server_close()
+
+
+class Master(object):
+    '''
+    Forks and supervises the worker processes.
+    '''
+
+    def __init__(self, listener, workers, config=None):
+        self.listener = listener
+        self.workers = workers
+        self.config = config
+        self.app = None
+        self.pids = set()
+        self.signals = []
+
+    def spawn(self):
+        '''
+        Forks a worker serving the current application.
+        '''
+
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                _serve(self.app, self.listener)
+            except BaseException:
+                status = 1
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        click.echo("Booting worker with pid {}".format(pid), err=True)
+        self.pids.add(pid)
+
+    def stop(self, pids, timeout=GRACEFUL_TIMEOUT):
+        '''
+        Stops the workers of *pids* gracefully, killing those still running
+        after *timeout* seconds.
+        '''
+
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        pending = set(pids)
+        while pending and time.monotonic() < deadline:
+            for pid in list(pending):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    pending.discard(pid)
+            time.sleep(0.05)
+        for pid in pending:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.pids -= set(pids)
+
+    def reload(self):
+        '''
+        Starts workers of a newly created application, then stops the old
+        ones. If the application cannot be created, the old workers keep
+        serving.
+        '''
+
+        old = set(self.pids)
+        gc.unfreeze()
+        try:
+            app = load_app(self.config)
+        except Exception:
+            traceback.print_exc()
+            click.echo("Reload failed, keeping the running workers",
+                       err=True)
+            gc.freeze()
+            return
+        self.app = app
+        for _ in range(self.workers):
+            self.spawn()
+        self.stop(old)
+
+    def run(self):
+        '''
+        Starts the workers and supervises them until stopped.
+        '''
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum,
+                          lambda signum, frame: self.signals.append(signum))
+        self.app = load_app(self.config)
+        for _ in range(self.workers):
+            self.spawn()
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    click.echo("Reloading", err=True)
+                    self.reload()
+                else:
+                    click.echo("Shutting down", err=True)
+                    self.stop(set(self.pids))
+                    return
+            # Replace workers which died
+            for pid in list(self.pids):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    self.pids.discard(pid)
+                    self.spawn()
+            time.sleep(0.2)
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Address to listen on.")
+@click.option("--port", type=int, default=5000, help="Port to listen on.")
+@click.option("--workers", type=int, default=None,
+              help="Worker processes, by default one per available core.")
+@click.option("--config", type=click.Path(exists=True, dir_okay=False),
+              help="Python configuration file. Defaults to the instance "
+                   "folder's config.py.")
+def main(host, port, workers, config):
+    '''
+    Serves the Cycling equipment usage API with pre-forked workers.
+    '''
+
+    if not hasattr(os, "fork"):
+        sys.exit("cyequ-serve needs a platform with fork")
+    listener = socket.create_server((host, port), backlog=2048)
+    listener.set_inheritable(True)
+    workers = workers or default_workers()
+    click.echo("Listening at http://{}:{} with {} workers"
+               .format(host, port, workers), err=True)
+    try:
+        Master(listener, workers, config).run()
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+'''
+This module holds the request coalescing of the API.
+
+With the SINGLEFLIGHT option, identical GET requests in progress at the same
+time, of the same path, query parameters and Accept header, are run once.
+The first one is the leader and runs its view; the others wait for it for at
+most SINGLEFLIGHT_TIMEOUT seconds and are answered with the status, headers
+and serialized body of its response. Responses are shared before the
+after-request hooks, so each request still gets its own ETag check and
+content coding (see cyequ.events and cyequ.compression). Streamed responses
+are not shared, nor are responses of leaders that raised: the waiting
+requests then run their own views, as do those that time out.
+
+A request only joins a flight started after the last commit of the
+process, so a client is never answered as of before a write the process has
+committed, such as its own. Commits of other processes are not seen: with
+several workers, a flight started before one may still be joined.
+Requests the API dispatches to itself and the reads of the async read path
+(see cyequ.asgi) are not coalesced.
+'''
+
+# Library imports
+import threading
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Project imports
+from cyequ.constants import ASYNC_READ, INTERNAL_REQUEST
+
+# Defaults of the configuration keys of the module
+DEFAULTS = {
+    # Set True to run identical concurrent GET requests once
+    "SINGLEFLIGHT": False,
+    # Seconds a request waits for its leader before running its own view
+    "SINGLEFLIGHT_TIMEOUT": 5,
+}
+# WSGI environ key of the key and flight of a leader
+_FLIGHT = "cyequ.flight"
+
+
+class Flight(object):
+    '''
+    One run of a view shared by identical requests, started after commit
+    number *commits* of the process.
+    '''
+
+    def __init__(self, commits):
+        self.commits = commits
+        self.landed = threading.Event()
+        # Status, headers and body of the response, None if not shared
+        self.result = None
+
+
+class SingleFlight(object):
+    '''
+    Flights in progress of the GET requests of *app*.
+    '''
+
+    def __init__(self, app):
+        self.timeout = app.config["SINGLEFLIGHT_TIMEOUT"]
+        self.lock = threading.Lock()
+        # Flights by request key
+        self.flights = {}
+        # Commits of the process so far
+        self.commits = 0
+        # Views run by leaders, requests answered with a leader's response,
+        # and requests which ran their own view after timing out or because
+        # the response was not shared, for monitoring
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.unshared = 0
+
+    def join(self, key):
+        '''
+        Joins the flight of *key*, starting it if there is none or it started
+        before the last commit. Returns the Flight and whether the caller
+        leads it.
+        '''
+
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None or flight.commits != self.commits:
+                flight = self.flights[key] = Flight(self.commits)
+                self.leaders += 1
+                return flight, True
+        return flight, False
+
+    def commit(self):
+        '''
+        Counts a commit of the process. Flights started before it are not
+        joined any more.
+        '''
+
+        with self.lock:
+            self.commits += 1
+
+    def wait(self, flight):
+        '''
+        Waits for *flight* to land. Returns its result, or None if it timed
+        out or was not shared.
+        '''
+
+        landed = flight.landed.wait(self.timeout)
+        with self.lock:
+            if not landed:
+                self.timeouts += 1
+            elif flight.result is None:
+                self.unshared += 1
+            else:
+                self.coalesced += 1
+        return flight.result if landed else None
+
+    def land(self, key, flight):
+        '''
+        Ends *flight* of *key*, waking the requests waiting for it. Later
+        requests start a new flight.
+        '''
+
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.landed.set()
+
+
+def get_flights():
+    '''
+    Returns the flights of the current application, creating them first if
+    needed.
+    '''
+
+    extensions = current_app.extensions
+    flights = extensions.get("cyequ_flights")
+    if flights is None:
+        flights = extensions.setdefault(
+            "cyequ_flights", SingleFlight(current_app._get_current_object()))
+    return flights
+
+
+@event.listens_for(Session, "after_commit")
+def count_commit(session):
+    '''
+    Counts a commit in the flights of the application.
+    '''
+
+    try:
+        flights = current_app.extensions.get("cyequ_flights")
+    except RuntimeError:
+        # Outside of an application context
+        return
+    if flights is not None:
+        flights.commit()
+
+
+def coalesce_request():
+    '''
+    Answers a GET request with the response of an identical one in
+    progress, or makes it the leader of its flight.
+    '''
+
+    if not current_app.config["SINGLEFLIGHT"] or request.method != "GET" \
+            or request.environ.get(INTERNAL_REQUEST) \
+            or request.environ.get(ASYNC_READ):
+        return None
+    key = (request.path, tuple(sorted(request.args.items(multi=True))),
+           request.headers.get("Accept"))
+    flights = get_flights()
+    flight, leader = flights.join(key)
+    if leader:
+        request.environ[_FLIGHT] = (key, flight)
+        return None
+    result = flights.wait(flight)
+    if result is None:
+        return None
+    status, headers, body = result
+    return Response(body, status, headers=headers)
+
+
+def share_response(response):
+    '''
+    Keeps the response of a leader for the requests waiting for it.
+    '''
+
+    entry = request.environ.get(_FLIGHT)
+    if entry is not None and not response.is_streamed \
+            and not response.direct_passthrough:
+        entry[1].result = (response.status_code, list(response.headers),
+                           response.get_data())
+    return response
+
+
+def land_request(exc):
+    '''
+    Ends the flight of a leader, shared or not.
+    '''
+
+    entry = request.environ.pop(_FLIGHT, None)
+    if entry is not None:
+        get_flights().land(*entry)
+
+
+def init_app(app):
+    '''
+    Sets the configuration defaults of the module and coalesces the GET
+    requests of *app* if enabled. Registered after the other after-request
+    hooks, so responses are shared before them.
+    '''
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.before_request(coalesce_request)
+    app.after_request(share_response)
+    app.teardown_request(land_request)
@@ -0,0 +1,50 @@
+'''
+This module defines the Batch json schema of Cycling Equipment Usage API
+
+'''
+
+# Operations accepted in one batch at most
+MAX_OPERATIONS = 100
+
+
+def batch_schema():
+    '''
+    Defines the batch schema
+    '''
+
+    schema = {
+        "title": "Batch schema",
+        "type": "object",
+        "required": ["operations"]
+    }
+    props = schema["properties"] = {}
+    props["operations"] = {
+        "description": "Operations run in order in one transaction. "
+                       "${n} in an href or a body string is replaced with "
+                       "the Location of operation n, counted from 0.",
+        "type": "array",
+        "minItems": 1,
+        "maxItems": MAX_OPERATIONS,
+        "items": {
+            "type": "object",
+            "required": ["method", "href"],
+            "properties": {
+                "method": {
+                    "description": "HTTP method of the operation",
+                    "type": "string",
+                    "enum": ["GET", "POST", "PUT", "DELETE"]
+                },
+                "href": {
+                    "description": "API path of the operation, or one "
+                                   "beginning with a back-reference",
+                    "type": "string",
+                    "pattern": "^(/api/|\\$\\{\\d+\\})"
+                },
+                "body": {
+                    "description": "JSON document of the operation",
+                    "type": "object"
+                }
+            }
+        }
+    }
+    return schema
@@ -0,0 +1,282 @@
+'''
+This module holds the ride stream store of the API.
+
+Per-sample ride streams (time, position, elevation, speed, heart rate and
+power) are stored as fixed-point integer arrays in one append-only file. Each
+ride's segment is referenced from its Ride row by offset and length. Within a
+segment every field is delta-encoded in blocks of BLOCK samples: an int64 base
+value per block followed by the smallest integer type fitting the deltas.
+
+Segments are read through a shared read-only mmap. Field arrays are NumPy
+views over the mapped memory, so a slice only decodes the blocks it touches
+and nothing is copied before decoding.
+'''
+
+# Library imports
+import mmap
+import os
+import struct
+import threading
+from flask import current_app
+
+# Project imports
+from cyequ.lazy import lazy_import
+from cyequ.ridefile import speeds
+
+np = lazy_import("numpy")
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # No advisory locking between processes on this platform
+    fcntl = None
+
+MAGIC = b"CYS1"
+# Samples per delta block
+BLOCK = 1024
+# Header: magic, number of samples, block size and number of fields
+_HEADER = struct.Struct("<4sIIH2x")
+# Field directory entry: name, type code, scale, bases and deltas offsets
+_FIELD = struct.Struct("<8sc7xdQQ")
+# Fixed-point scale of each field, i.e. the stored unit
+SCALES = {
+    "time": 1,          # s since ride start
+    "lat": 1e7,         # 1e-7 degrees
+    "lon": 1e7,
+    "ele": 10,          # dm
+    "speed": 1000,      # mm/s
+    "hr": 1,            # bpm
+    "power": 1          # W
+}
+
+
+def _filled(values):
+    '''
+    Returns values with NaNs replaced by the previous value (leading NaNs by
+    zero), or None if there are no values at all.
+    '''
+
+    missing = np.isnan(values)
+    if missing.all():
+        return None
+    if not missing.any():
+        return values
+    index = np.where(missing, 0, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    return np.where(missing[index], 0, values[index])
+
+
+def stream_fields(points):
+    '''
+    Returns the stream fields of parsed TrackPoints as a dict of arrays.
+    Fields without any values are left out.
+    '''
+
+    time, lat, lon, ele = points.arrays()
+    hr, power = points.sensors()
+    fields = {"time": time - time[0],
+              "lat": lat,
+              "lon": lon,
+              "ele": ele,
+              "speed": speeds(time, lat, lon),
+              "hr": hr,
+              "power": power
+              }
+    filled = {name: _filled(values) for name, values in fields.items()}
+    return {name: values for name, values in filled.items()
+            if values is not None}
+
+
+def _pad(size):
+    '''
+    Returns the number of bytes to align *size* to 8 bytes.
+    '''
+
+    return -size % 8
+
+
+def encode_stream(fields):
+    '''
+    Encodes stream fields given as a dict of equally long arrays into a
+    segment. Returns the segment bytes.
+    '''
+
+    names = [name for name in SCALES if name in fields]
+    count = len(fields["time"])
+    starts = np.arange(0, count, BLOCK)
+    directory_end = _HEADER.size + _FIELD.size * len(names)
+    offset = directory_end + _pad(directory_end)
+    entries, chunks = [], []
+    for name in names:
+        scaled = np.rint(fields[name] * SCALES[name]).astype(np.int64)
+        deltas = np.diff(scaled, prepend=scaled[:1])
+        deltas[starts] = 0
+        # Smallest integer type, which fits all deltas
+        for code in "bhiq":
+            info = np.iinfo(np.dtype("<" + code))
+            if deltas.size == 0 or (deltas.min() >= info.min
+                                    and deltas.max() <= info.max):
+                break
+        bases = scaled[starts].astype("<i8").tobytes()
+        packed = deltas.astype("<" + code).tobytes()
+        entries.append(_FIELD.pack(name.encode(), code.encode(),
+                                   SCALES[name], offset,
+                                   offset + len(bases)))
+        chunks += [bases, packed, b"\0" * _pad(len(packed))]
+        offset += len(bases) + len(packed) + _pad(len(packed))
+    head = _HEADER.pack(MAGIC, count, BLOCK, len(names)) + b"".join(entries)
+    return b"".join([head, b"\0" * _pad(len(head))] + chunks)
+
+
+class RideStream(object):
+    '''
+    Read access to one encoded segment given as a buffer, typically a
+    memoryview of the store's mmap.
+    '''
+
+    def __init__(self, buf):
+        magic, self.count, self.block, fields = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a ride stream segment")
+        self._buf = buf
+        self._blocks = -(-self.count // self.block)
+        self._fields = {}
+        for i in range(fields):
+            name, code, scale, bases, deltas = \
+                _FIELD.unpack_from(buf, _HEADER.size + i * _FIELD.size)
+            self._fields[name.rstrip(b"\0").decode()] = \
+                (np.dtype("<" + code.decode()), scale, bases, deltas)
+
+    @property
+    def fields(self):
+        '''
+        Names of the fields stored in the segment.
+        '''
+
+        return list(self._fields)
+
+    def _bases(self, name):
+        '''
+        Returns the base values of all blocks of a field without copying.
+        '''
+
+        bases = self._fields[name][2]
+        return np.frombuffer(self._buf, "<i8", self._blocks, bases)
+
+    def _decode(self, name, first, last):
+        '''
+        Decodes the fixed-point values of blocks first..last-1 of a field.
+        '''
+
+        dtype, scale, bases, deltas = self._fields[name]
+        lo = first * self.block
+        hi = min(self.count, last * self.block)
+        if hi <= lo:
+            return np.zeros(0, np.int64)
+        # View over the mapped deltas, decoded block by block
+        raw = np.frombuffer(self._buf, dtype, hi - lo,
+                            deltas + lo * dtype.itemsize)
+        values = np.cumsum(raw, dtype=np.int64)
+        starts = np.arange(0, hi - lo, self.block)
+        rebase = self._bases(name)[first:last] - values[starts]
+        values += np.repeat(rebase, np.diff(np.append(starts, hi - lo)))
+        return values
+
+    def values(self, name, start=0, stop=None, step=1):
+        '''
+        Returns samples start..stop-1 of a field, every step'th, in the
+        field's unit.
+
+        Exceptions.
+        KeyError. If the field is not stored for the ride.
+        '''
+
+        scale = self._fields[name][1]
+        stop = self.count if stop is None else min(stop, self.count)
+        if stop <= start:
+            return np.zeros(0)
+        first = start // self.block
+        last = -(-stop // self.block)
+        values = self._decode(name, first, last)
+        lo = first * self.block
+        return values[start - lo:stop - lo:step] / scale
+
+    def locate(self, seconds):
+        '''
+        Returns the index of the first sample at or after *seconds* from the
+        ride start. Only the block containing it is decoded.
+        '''
+
+        target = round(seconds * SCALES["time"])
+        block = max(0, int(np.searchsorted(self._bases("time"), target,
+                                           "right")) - 1)
+        times = self._decode("time", block, block + 1)
+        return block * self.block + int(np.searchsorted(times, target))
+
+
+class StreamStore(object):
+    '''
+    Append-only file of encoded ride stream segments, read through mmap.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._map = None
+
+    def append(self, segment):
+        '''
+        Appends a segment to the store. Segments are padded to 8 bytes, so
+        that every segment starts aligned.
+
+        Returns the offset and length of the segment.
+        '''
+
+        return self.extend([segment])[0]
+
+    def extend(self, segments):
+        '''
+        Appends several segments with one lock and one fsync.
+
+        Returns a list of the offsets and lengths of the segments.
+        '''
+
+        spans = []
+        with self._lock, open(self.path, "ab") as store:
+            if fcntl is not None:
+                fcntl.flock(store, fcntl.LOCK_EX)
+            offset = store.seek(0, os.SEEK_END)
+            for segment in segments:
+                store.write(segment + b"\0" * _pad(len(segment)))
+                spans.append((offset, len(segment)))
+                offset += len(segment) + _pad(len(segment))
+            store.flush()
+            os.fsync(store.fileno())
+        return spans
+
+    def open(self, offset, length):
+        '''
+        Returns a RideStream over a stored segment without copying it.
+        The mapping is renewed when the segment was appended after it.
+        '''
+
+        with self._lock:
+            if self._map is None or len(self._map) < offset + length:
+                with open(self.path, "rb") as store:
+                    # Views of the old map keep it alive until released
+                    self._map = mmap.mmap(store.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            view = memoryview(self._map)[offset:offset + length]
+        return RideStream(view)
+
+
+def get_store():
+    '''
+    Returns the stream store of the current application.
+    '''
+
+    stores = current_app.extensions.setdefault("cyequ_streams", {})
+    path = current_app.config["STREAM_STORE"]
+    if path not in stores:
+        stores[path] = StreamStore(path)
+    return stores[path]
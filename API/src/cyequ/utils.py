@@ -4,16 +4,23 @@ and resource modules.
 '''
 
 # Library imports
-from flask import json, url_for, request, Response
+from functools import lru_cache
+from flask import url_for, request, Response
 from datetime import datetime
 
 # Project imports
-from cyequ.constants import MASON, ERROR_PROFILE
+from cyequ import json
+from cyequ.lazy import lazy_import
+from cyequ.constants import MASON, MERGE_PATCH, ERROR_PROFILE, \
+                            RIDE_FILE_TYPES, ZIP
 from cyequ.static.schemas.user_schema import user_schema
 from cyequ.static.schemas.equipment_schema import equipment_schema
 from cyequ.static.schemas.component_schema import component_schema
+from cyequ.static.schemas.batch_schema import batch_schema
 # from cyequ.static.schemas.ride_schema import ride_schema
 
+jsonschema = lazy_import("jsonschema")
+
 
 class MasonBuilder(dict):
     '''
@@ -115,6 +122,20 @@ class CommonBuilder(MasonBuilder):
             title="A list of all equipment owned by the given user."
         )
 
+    def add_control_batch(self):
+        '''
+        Builds the control for running operations as one batch.
+        '''
+
+        self.add_control(
+            "cyequ:batch",
+            href=url_for("api.batch"),
+            method="POST",
+            encoding="json",
+            title="Runs operations in order as one transaction.",
+            schema=batch_schema()
+        )
+
 
 class UserBuilder(CommonBuilder):
     '''
@@ -151,6 +172,73 @@ class UserBuilder(CommonBuilder):
             schema=user_schema()
         )
 
+    def add_control_patch_user(self, user):
+        '''
+        Builds the control for partially editing a user resource.
+        '''
+
+        self.add_control(
+            "cyequ:patch",
+            href=url_for("api.useritem", user=user),
+            method="PATCH",
+            encoding="json",
+            type=MERGE_PATCH,
+            title="Edits the given fields of user's information",
+            schema=patch_schema(user_schema)
+        )
+
+    def add_control_export(self, user):
+        '''
+        Builds the control for exporting all of a user's data.
+        '''
+
+        self.add_control(
+            "cyequ:export",
+            href=url_for("api.userexport", user=user),
+            method="GET",
+            title="Export equipment, components and rides as NDJSON, or "
+                  "as CSV with query parameter format=csv."
+        )
+
+    def add_control_changes(self, user):
+        '''
+        Builds the control for the change feed of a user's data.
+        '''
+
+        self.add_control(
+            "cyequ:changes",
+            href=url_for("api.userchanges", user=user),
+            method="GET",
+            title="List changes of the user, equipment, components and "
+                  "rides, after query parameter since."
+        )
+
+    def add_control_events(self, user):
+        '''
+        Builds the control for the event stream of a user's data.
+        '''
+
+        self.add_control(
+            "cyequ:events",
+            href=url_for("api.userevents", user=user),
+            method="GET",
+            title="Stream changes of the user, equipment, components and "
+                  "rides as server-sent events."
+        )
+
+    def add_control_garage(self, user):
+        '''
+        Builds the control for the garage summary of a user.
+        '''
+
+        self.add_control(
+            "cyequ:garage",
+            href=url_for("api.usergarage", user=user),
+            method="GET",
+            title="Get the user's equipment with the components in service "
+                  "and their counts in one document."
+        )
+
 
 class EquipmentBuilder(CommonBuilder):
     '''
@@ -201,6 +289,21 @@ class EquipmentBuilder(CommonBuilder):
             schema=equipment_schema()
         )
 
+    def add_control_patch_equipment(self, user, equipment):
+        '''
+        Builds the control for partially editing an equipment resource.
+        '''
+
+        self.add_control(
+            "cyequ:patch",
+            href=url_for("api.equipmentitem", user=user, equipment=equipment),
+            method="PATCH",
+            encoding="json",
+            type=MERGE_PATCH,
+            title="Edits the given fields of equipment's information",
+            schema=patch_schema(equipment_schema)
+        )
+
     def add_control_delete_equipment(self, user, equipment):
         '''
         Builds the control for deleting an equipment resource.
@@ -237,6 +340,22 @@ class ComponentBuilder(CommonBuilder):
             schema=component_schema()
         )
 
+    def add_control_patch_component(self, user, equipment, component):
+        '''
+        Builds the control for partially editing a component resource.
+        '''
+
+        self.add_control(
+            "cyequ:patch",
+            href=url_for("api.componentitem", user=user, equipment=equipment,
+                         component=component),
+            method="PATCH",
+            encoding="json",
+            type=MERGE_PATCH,
+            title="Edits the given fields of component's information",
+            schema=patch_schema(component_schema)
+        )
+
     def add_control_delete_component(self, user, equipment, component):
         '''
         Builds the control for deleting a component resource.
@@ -252,6 +371,42 @@ class ComponentBuilder(CommonBuilder):
         )
 
 
+class RideBuilder(CommonBuilder):
+    '''
+    This class subclasses the CommonBuilder class for managing dictionaries
+    that represent Mason objects. It provides shorthands for inserting elements
+    used commonly between ride resources into the object.
+    '''
+
+    def add_control_import_ride(self, user):
+        '''
+        Builds the control for importing a ride from a GPX or TCX file.
+        '''
+
+        self.add_control(
+            "cyequ:import-ride",
+            href=url_for("api.rideimport", user=user),
+            method="POST",
+            encoding="raw",
+            accept=list(RIDE_FILE_TYPES),
+            title="Imports a ride from a GPX or TCX file."
+        )
+
+    def add_control_import_archive(self, user):
+        '''
+        Builds the control for importing rides from a ZIP archive.
+        '''
+
+        self.add_control(
+            "cyequ:import-archive",
+            href=url_for("api.ridearchive", user=user),
+            method="POST",
+            encoding="raw",
+            accept=[ZIP],
+            title="Imports rides from a ZIP archive of GPX and TCX files."
+        )
+
+
 # From PWP-course Ex3
 def create_error_response(status_code, title, message=None):
     '''
@@ -268,6 +423,57 @@ def create_error_response(status_code, title, message=None):
     return Response(json.dumps(body), status_code, mimetype=MASON)
 
 
+@lru_cache(maxsize=None)
+def schema_validator(schema):
+    '''
+    Returns a validator of documents of the resource of schema function
+    *schema*. Built once per schema function.
+    '''
+
+    document = schema()
+    return jsonschema.validators.validator_for(document)(document)
+
+
+@lru_cache(maxsize=None)
+def patch_schema(schema):
+    '''
+    Returns the schema of JSON merge patches of the resource of schema
+    function *schema*: the same properties, none of them required. Built once
+    per schema function.
+    '''
+
+    patch = schema()
+    patch["title"] = patch["title"].replace("schema", "patch schema")
+    patch.pop("required", None)
+    patch["minProperties"] = 1
+    return patch
+
+
+@lru_cache(maxsize=None)
+def patch_validator(schema):
+    '''
+    Returns a validator of JSON merge patches of the resource of schema
+    function *schema*, see patch_schema. Built once per schema function.
+    '''
+
+    patch = patch_schema(schema)
+    return jsonschema.validators.validator_for(patch)(patch)
+
+
+def patch_fields(db_object, patch, fields):
+    '''
+    Sets the *fields* of a database object given in a merge patch, if their
+    value changes. Returns the names of the changed fields.
+    '''
+
+    changed = []
+    for field in fields:
+        if field in patch and getattr(db_object, field) != patch[field]:
+            setattr(db_object, field, patch[field])
+            changed.append(field)
+    return changed
+
+
 def convert_req_date(request_date):
     '''
     Converts a datetime string to a datetime object.
@@ -0,0 +1,102 @@
+'''
+This module holds the warm-up of an API worker.
+
+create_app leaves heavy modules unloaded (see cyequ.lazy) and SQLAlchemy
+configures the mappers on their first use, so without warm-up the first
+requests of a worker pay for them. warmup does all of that once, before the
+worker accepts traffic. It is run by create_app when the WARMUP option is
+set, and by cyequ-serve before forking its workers. The warmup command runs
+it and reports the time of each step.
+'''
+
+# Library imports
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+# Project imports
+from cyequ import db
+from cyequ.lazy import lazy_import
+from cyequ.models import User, Equipment, Component, Ride
+from cyequ.utils import schema_validator, patch_validator
+from cyequ.catalog import get_catalog
+from cyequ.static.schemas.user_schema import user_schema
+from cyequ.static.schemas.equipment_schema import equipment_schema
+from cyequ.static.schemas.component_schema import component_schema
+from cyequ.static.schemas.batch_schema import batch_schema
+
+# Modules imported lazily by the API
+MODULES = ("numpy", "jsonschema")
+
+
+def _modules():
+    '''
+    Loads the lazily imported modules.
+    '''
+
+    for name in MODULES:
+        # Any attribute access executes a lazy module
+        getattr(lazy_import(name), "__name__")
+    # Validators are looked up from a submodule
+    lazy_import("jsonschema").validators
+
+
+def _validators():
+    '''
+    Builds the cached validators of all request schemas.
+    '''
+
+    for schema in (user_schema, equipment_schema, component_schema):
+        schema_validator(schema)
+        patch_validator(schema)
+    schema_validator(batch_schema)
+
+
+def _database():
+    '''
+    Opens a database connection and compiles the queries of the models.
+    '''
+
+    db.session.execute(text("SELECT 1"))
+    for model in (User, Equipment, Component, Ride):
+        model.query.limit(1).all()
+    db.session.remove()
+
+
+# Steps of warmup in order
+STEPS = (("mappers", configure_mappers),
+         ("modules", _modules),
+         ("validators", _validators),
+         ("routes", lambda: current_app.url_map.update()),
+         ("database", _database),
+         ("catalog", get_catalog))
+
+
+def warmup():
+    '''
+    Warms up the current application. Must be called within an application
+    context.
+
+    Returns a dict of seconds taken by each step.
+    '''
+
+    times = {}
+    for name, step in STEPS:
+        start = time.perf_counter()
+        step()
+        times[name] = time.perf_counter() - start
+    return times
+
+
+@click.command("warmup")
+@with_appcontext
+def warmup_command():
+    '''
+    Warms up the application and reports the time taken by each step.
+    '''
+
+    for name, seconds in warmup().items():
+        click.echo("{:<12} {:8.1f} ms".format(name, seconds * 1000))
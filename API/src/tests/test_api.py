@@ -6,22 +6,45 @@ or with additional details:
     pytest db_tests.py --cov --pep8
 '''
 
+import asyncio
+import csv
+import gzip
+import io
 import json
 import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
 import pytest
 from sqlalchemy.engine import Engine
-from sqlalchemy import event
+from sqlalchemy import event, text
 
-from cyequ import create_app, db
+from cyequ import create_app, db, JSONProvider
+from cyequ import json as cyequ_json
+from cyequ.asgi import AsyncReadApp
+from cyequ.constants import MERGE_PATCH
+from cyequ.lazy import is_loaded
+from cyequ.ratelimit import TokenBuckets
+from cyequ.utils import schema_validator
+from cyequ.warmup import STEPS
 
 from tests.utils import _get_user_json, _get_equipment_json, \
                         _get_component_json, _check_namespace, _check_profile, \
                         _check_control_get_method, \
                         _check_control_delete_method, \
                         _check_control_put_method, \
+                        _check_control_patch_method, \
                         _check_control_post_method, \
-                        _populate_db
+                        _populate_db, _get_gpx, _get_tcx, _get_archive
 
 
 @event.listens_for(Engine, "connect")
@@ -44,6 +67,9 @@ def client():
     db_fd, db_fname = tempfile.mkstemp()
     config = {
               "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+              "STREAM_STORE": db_fname + ".streams",
+              "JOB_DIR": db_fname + ".jobs",
+              "ARCHIVE_WORKERS": 2,
               "TESTING": True
               }
     # Create app to be used in testing with this fixture
@@ -57,6 +83,9 @@ def client():
     # After caller finishes, the rest after yield are executed
     os.close(db_fd)
     os.unlink(db_fname)
+    if os.path.exists(db_fname + ".streams"):
+        os.unlink(db_fname + ".streams")
+    shutil.rmtree(db_fname + ".jobs", ignore_errors=True)
 
 
 class TestEntry(object):
@@ -79,6 +108,87 @@ class TestEntry(object):
         body = json.loads(resp.data)
         _check_namespace(client, body)
         _check_control_get_method("cyequ:users-all", client, body)
+        assert body["@controls"]["cyequ:batch"]["method"] == "POST"
+
+
+class TestBatch(object):
+    '''
+    This class implements tests for each HTTP method in Batch resource.
+    '''
+
+    RESOURCE_URL = "/api/batch"
+
+    def test_post(self, client):
+        '''
+        Tests the POST method. Checks that a bike and its components are
+        created in one batch using back-references, and that a failing
+        operation rolls back the operations before it.
+        '''
+
+        equipment_url = "/api/users/Joonas1/all_equipment/"
+        # Not JSON and invalid documents
+        resp = client.post(self.RESOURCE_URL, data="operations")
+        assert resp.status_code == 415
+        resp = client.post(self.RESOURCE_URL, json={"operations": []})
+        assert resp.status_code == 400
+        resp = client.post(self.RESOURCE_URL, json={"operations": [
+            {"method": "PUT", "href": "http://example.com/"}]})
+        assert resp.status_code == 400
+        # Whole build in one batch
+        batch = {"operations": [
+            {"method": "POST", "href": equipment_url,
+             "body": _get_equipment_json(name="Uusi", brand="Zoom")},
+            {"method": "POST", "href": "${0}",
+             "body": _get_component_json(name="Keula", category="Fork")},
+            {"method": "POST", "href": "${0}",
+             "body": _get_component_json(name="Satula", category="Saddle")},
+            {"method": "GET", "href": "${0}"}
+        ]}
+        resp = client.post(self.RESOURCE_URL, json=batch)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        assert body["committed"] is True
+        assert [result["status"] for result in body["results"]] \
+            == [201, 201, 201, 200]
+        location = body["results"][0]["location"]
+        assert body["results"][1]["href"] == location
+        assert len(body["results"][3]["body"]["items"]) == 2
+        resp = client.get(location)
+        assert len(json.loads(resp.data)["items"]) == 2
+        resp = client.get("/api/catalog/suggest?prefix=zoom")
+        assert json.loads(resp.data)["brand"] == ["Zoom"]
+        # Failing operation rolls back the ones before it
+        batch = {"operations": [
+            {"method": "POST", "href": equipment_url,
+             "body": _get_equipment_json(name="Toinen", brand="Zyx")},
+            {"method": "POST", "href": equipment_url,
+             "body": _get_equipment_json(name="Polkuaura")},
+            {"method": "DELETE", "href": location}
+        ]}
+        resp = client.post(self.RESOURCE_URL, json=batch)
+        assert resp.status_code == 409
+        body = json.loads(resp.data)
+        assert body["committed"] is False
+        assert [result["status"] for result in body["results"]] == [201, 409]
+        assert "@error" in body
+        resp = client.get(body["results"][0]["location"])
+        assert resp.status_code == 404
+        resp = client.get(location)
+        assert resp.status_code == 200
+        resp = client.get("/api/catalog/suggest?prefix=zyx")
+        assert json.loads(resp.data)["brand"] == []
+        # Back-references must be to resources created before
+        resp = client.post(self.RESOURCE_URL, json={"operations": [
+            {"method": "DELETE", "href": location},
+            {"method": "GET", "href": "${0}"}]})
+        assert resp.status_code == 400
+        resp = client.get(location)
+        assert resp.status_code == 200
+        # Batches are not nested
+        resp = client.post(self.RESOURCE_URL, json={"operations": [
+            {"method": "POST", "href": self.RESOURCE_URL, "body": batch}]})
+        assert resp.status_code == 400
 
 
 class TestUserCollection(object):
@@ -191,7 +301,10 @@ class TestUserItem(object):
         _check_profile("profile", client, body, "user-profile")
         _check_control_get_method("collection", client, body)
         _check_control_put_method("edit", client, body, _get_user_json())
+        _check_control_patch_method("cyequ:patch", client, body,
+                                    {"name": "Joonas"})
         _check_control_get_method("cyequ:equipment-owned", client, body)
+        _check_control_get_method("cyequ:export", client, body)
 
     def test_put(self, client):
         '''
@@ -240,6 +353,40 @@ class TestUserItem(object):
                           )
         assert resp.status_code == 409
 
+    def test_patch(self, client):
+        '''
+        Tests the PATCH method. Checks the media type, that only given fields
+        are validated and changed, and the conflict of an existing name.
+        '''
+
+        # Test for unsupported media type, also plain JSON
+        resp = client.patch(self.resource_URL(), data=json.dumps({}))
+        assert resp.status_code == 415
+        resp = client.patch(self.resource_URL(), json={"name": "Jenni"})
+        assert resp.status_code == 415
+        # Tests for invalid and empty patches
+        for patch in ("invalid", {}, {"name": None}, {"name": "J"}):
+            resp = client.patch(self.resource_URL(), data=json.dumps(patch),
+                                content_type=MERGE_PATCH)
+            assert resp.status_code == 400
+        # Invalid route
+        resp = client.patch(self.resource_URL(user="Jaana"),
+                            data=json.dumps({"name": "Jenni"}),
+                            content_type=MERGE_PATCH)
+        assert resp.status_code == 404
+        # Test existing
+        resp = client.patch(self.resource_URL(),
+                            data=json.dumps({"name": "Janne"}),
+                            content_type=MERGE_PATCH)
+        assert resp.status_code == 409
+        # Test with valid content
+        resp = client.patch(self.resource_URL(),
+                            data=json.dumps({"name": "Jenni"}),
+                            content_type=MERGE_PATCH)
+        assert resp.status_code == 204
+        body = json.loads(client.get(self.resource_URL()).data)
+        assert body["name"] == "Jenni"
+
 
 class TestEquipmentByUser(object):
     '''
@@ -411,6 +558,8 @@ class TestEquipmentItem(object):
         _check_control_get_method("self", client, body)
         _check_profile("profile", client, body, "equipment-profile")
         _check_control_put_method("edit", client, body, _get_equipment_json())
+        _check_control_patch_method("cyequ:patch", client, body,
+                                    {"model": "Hei Hei"})
         # Test valid component items content
         assert len(body["items"]) == 2
         assert body["items"][0]["name"] == "Takatalvikiekko"
@@ -500,6 +649,23 @@ class TestEquipmentItem(object):
                                     )
         resp = client.post(self.resource_URL(), json=valid)
         assert resp.status_code == 201
+        # Test that a category in service on another bike locates the new
+        # component
+        resp = client.post("/api/users/Joonas1/all_equipment/",
+                           json=_get_equipment_json(name="Uusi"))
+        assert resp.status_code == 201
+        bike_URL = resp.headers["Location"]
+        valid = _get_component_json(name="Tolppa",
+                                    category="Seat Post",
+                                    brand="RockShox",
+                                    model="Reverb"
+                                    )
+        resp = client.post(bike_URL, json=valid)
+        assert resp.status_code == 201
+        assert resp.headers["Location"].startswith(bike_URL + "Tolppa")
+        body = json.loads(client.get(resp.headers["Location"]).data)
+        assert body["name"] == "Tolppa"
+        assert body["equipment"] == "Uusi"
         # Test component date_added < equipment date_added
         valid = _get_component_json(name="Etukesäkiekko",
                                     category="Front Wheel",
@@ -608,6 +774,74 @@ class TestEquipmentItem(object):
         for item in body["items"]:
             assert item["date_retired"] == "2019-12-21T11:20:40"
 
+    def test_patch(self, client):
+        '''
+        Tests the PATCH method. Checks the media type, that only given fields
+        are validated and changed in one UPDATE, and that components are
+        retired only when date_retired changes.
+        '''
+
+        def patch(content, url=self.resource_URL()):
+            return client.patch(url, data=json.dumps(content),
+                                content_type=MERGE_PATCH)
+
+        # Test for unsupported media type
+        resp = client.patch(self.resource_URL(), json={"model": "Hei Hei"})
+        assert resp.status_code == 415
+        # Tests for invalid patches
+        for content in ("invalid", {}, {"brand": "K"},
+                        {"date_added": "2019-11-21"}):
+            assert patch(content).status_code == 400
+        # Invalid routes
+        resp = patch({"model": "Hei Hei"},
+                     self.resource_URL(equipment="Kolmipyörä"))
+        assert resp.status_code == 404
+        # Test existing name and inconsistent dates
+        assert patch({"name": "Kisarassi"}).status_code == 409
+        assert patch({"date_added": "2019-12-21 11:20:30"}).status_code == 409
+        assert patch({"date_retired": "2019-10-21 11:20:30"}) \
+            .status_code == 409
+        # Test with valid content, only model is written
+        statements = []
+        engine = db.get_engine(client.application)
+
+        def log(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", log)
+        try:
+            assert patch({"name": "Polkuaura", "model": "Process 153"}) \
+                .status_code == 204
+        finally:
+            event.remove(engine, "before_cursor_execute", log)
+        # The garage summary is refreshed as well, see TestUserGarage
+        updates = [sql for sql in statements
+                   if sql.startswith("UPDATE") and "garage" not in sql]
+        assert updates == ["UPDATE equipment SET catalog_id=? WHERE "
+                           "equipment.id = ?"]
+        body = json.loads(client.get(self.resource_URL()).data)
+        assert body["name"] == "Polkuaura"
+        assert body["brand"] == "Kona"
+        assert body["model"] == "Process 153"
+        assert body["date_retired"] is None
+        # Test that retiring equipment also retires associated components,
+        # but keeps the date of an already retired component
+        body = json.loads(client.get(self.resource_URL()).data)
+        retired = body["items"][0]["@controls"]["self"]["href"]
+        assert patch({"date_retired": "2020-01-11 11:20:30"}, retired) \
+            .status_code == 204
+        assert patch({"date_retired": "2020-01-21 11:20:30"}) \
+            .status_code == 204
+        body = json.loads(client.get(self.resource_URL()).data)
+        assert body["date_retired"] == "2020-01-21T11:20:30"
+        assert body["items"]
+        for item in body["items"]:
+            href = item["@controls"]["self"]["href"]
+            resp = client.get(href)
+            assert json.loads(resp.data)["date_retired"] \
+                == ("2020-01-11T11:20:30" if href == retired
+                    else "2020-01-21T11:20:30")
+
     def test_delete(self, client):
         """
         Tests the DELETE method. Checks that a valid request reveives 204
@@ -707,6 +941,8 @@ class TestComponentItem(object):
         _check_control_get_method("up", client, body)
         _check_profile("profile", client, body, "component-profile")
         _check_control_put_method("edit", client, body, _get_component_json())
+        _check_control_patch_method("cyequ:patch", client, body,
+                                    {"model": "Reverb"})
         # Get new body for DELETE control test after PUT
         resp = client.get(self.resource_URL(component="Takatalvikiekko",
                                             c_id=2)
@@ -804,6 +1040,50 @@ class TestComponentItem(object):
         # Then test reretiring component
         valid = _get_component_json(date_retired="2020-02-21 11:20:30")
 
+    def test_patch(self, client):
+        '''
+        Tests the PATCH method. Checks the media type, that only given fields
+        are validated and changed, and the date consistency conflicts.
+        '''
+
+        def patch(content, url=self.resource_URL()):
+            return client.patch(url, data=json.dumps(content),
+                                content_type=MERGE_PATCH)
+
+        # Test for unsupported media type
+        resp = client.patch(self.resource_URL(), json={"model": "Reverb"})
+        assert resp.status_code == 415
+        # Tests for invalid patches
+        for content in ("invalid", {}, {"category": None},
+                        {"date_retired": "tomorrow"}):
+            assert patch(content).status_code == 400
+        # Invalid routes
+        resp = patch({"model": "Reverb"},
+                     self.resource_URL(component="Soittokello"))
+        assert resp.status_code == 404
+        # Test inconsistent dates
+        assert patch({"date_added": "2019-09-21 11:20:30"}).status_code == 409
+        assert patch({"date_retired": "2019-10-21 11:20:30"}) \
+            .status_code == 409
+        # Test with valid content
+        assert patch({"brand": "RockShox", "model": "Reverb"}) \
+            .status_code == 204
+        body = json.loads(client.get(self.resource_URL()).data)
+        assert body["name"] == "Hissitolppa"
+        assert body["brand"] == "RockShox"
+        assert body["model"] == "Reverb"
+        assert body["date_retired"] == "9999-12-31T23:59:59"
+        # Test retiring a component of an already retired equipment
+        resp = client.patch(self.EQUIPMENT_URL,
+                            data=json.dumps(
+                                {"date_retired": "2020-01-21 11:20:30"}),
+                            content_type=MERGE_PATCH)
+        assert resp.status_code == 204
+        assert patch({"date_retired": "2020-02-21 11:20:30"}) \
+            .status_code == 409
+        # Fields other than dates can still be changed
+        assert patch({"name": "Satulatolppa"}).status_code == 204
+
     def test_delete(self, client):
         """
         Tests the DELETE method. Checks that a valid request reveives 204
@@ -828,3 +1108,1327 @@ class TestComponentItem(object):
         # Test redeletion
         resp = client.delete(self.resource_URL())
         assert resp.status_code == 404
+
+
+class TestUserExport(object):
+    '''
+    This class implements tests for each HTTP method in UserExport
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/export"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks the error codes, then checks the NDJSON
+        and CSV exports, with and without gzip encoding.
+        '''
+
+        # Invalid format and unknown user
+        resp = client.get(self.RESOURCE_URL + "?format=xlsx")
+        assert resp.status_code == 400
+        resp = client.get("/api/users/Jaana3/export")
+        assert resp.status_code == 404
+        client.post("/api/users/Joonas1/rides/import?equipment=Polkuaura1",
+                    data=_get_gpx(),
+                    headers={"Content-Type": "application/gpx+xml"})
+        # NDJSON by default
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/x-ndjson"
+        assert "Content-Encoding" not in resp.headers
+        rows = [json.loads(line) for line in resp.data.splitlines()]
+        assert [row["type"] for row in rows] == ["equipment", "equipment",
+                                                 "component", "component",
+                                                 "ride"]
+        assert rows[0]["uri"] == "Polkuaura1"
+        assert rows[0]["date_retired"] is None
+        assert rows[2]["equipment"] == "Polkuaura1"
+        assert rows[2]["interval_days"] == 365
+        assert rows[2]["due_date"] == "2020-11-20T11:20:30"
+        assert rows[4]["equipment"] == "Polkuaura1"
+        assert rows[4]["duration"] == 120
+        # Gzipped CSV
+        resp = client.get(self.RESOURCE_URL + "?format=csv",
+                          headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/csv"
+        assert resp.headers["Content-Encoding"] == "gzip"
+        text = gzip.decompress(resp.data).decode("utf-8")
+        rows = list(csv.DictReader(io.StringIO(text)))
+        assert len(rows) == 5
+        assert rows[1]["date_retired"] == "2019-12-21T11:20:30"
+        assert rows[3]["interval_hours"] == "200"
+        assert rows[3]["datetime"] == ""
+        assert rows[4]["name"] == "Iltalenkki"
+        # Users without any data export nothing
+        resp = client.get("/api/users/Janne2/export")
+        assert resp.data == b""
+
+
+class TestUserSearch(object):
+    '''
+    This class implements tests for each HTTP method in UserSearch
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/search"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks the error codes, that results are ranked
+        and paginated with working controls, and that the index follows
+        writes through the API.
+        '''
+
+        # Missing query, invalid paging and unknown user
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?q=kona&page=0")
+        assert resp.status_code == 400
+        resp = client.get("/api/users/Jaana3/search?q=kona")
+        assert resp.status_code == 404
+        # Prefix of the last word, brand and model both matching
+        resp = client.get(self.RESOURCE_URL + "?q=rockshox rev")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("cyequ:owner", client, body)
+        assert body["total"] == 1
+        item = body["items"][0]
+        assert item["kind"] == "component"
+        assert item["name"] == "Hissitolppa"
+        assert item["equipment"] == "Polkuaura"
+        _check_control_get_method("self", client, item)
+        _check_profile("profile", client, item, "component-profile")
+        # Operators and punctuation are plain words
+        resp = client.get(self.RESOURCE_URL + '?q="kona" OR -')
+        assert json.loads(resp.data)["total"] == 0
+        # Name matches rank first, pages have next and prev controls
+        client.post("/api/users/Joonas1/all_equipment/",
+                    json=_get_equipment_json(name="Kona", brand="Trek"))
+        resp = client.get(self.RESOURCE_URL + "?q=kona&limit=1")
+        body = json.loads(resp.data)
+        assert body["total"] == 2
+        assert body["items"][0]["name"] == "Kona"
+        assert "prev" not in body["@controls"]
+        _check_control_get_method("next", client, body)
+        resp = client.get(body["@controls"]["next"]["href"])
+        body = json.loads(resp.data)
+        assert body["items"][0]["name"] == "Polkuaura"
+        assert "next" not in body["@controls"]
+        _check_control_get_method("prev", client, body)
+        # Deleted items are gone from the index
+        client.delete("/api/users/Joonas1/all_equipment/Polkuaura1/")
+        resp = client.get(self.RESOURCE_URL + "?q=kona")
+        assert json.loads(resp.data)["total"] == 1
+        resp = client.get(self.RESOURCE_URL + "?q=reverb")
+        assert json.loads(resp.data)["total"] == 0
+        # Other users' items are not found
+        resp = client.get("/api/users/Janne2/search?q=kona")
+        assert json.loads(resp.data)["total"] == 0
+
+
+class TestUserChanges(object):
+    '''
+    This class implements tests for each HTTP method in UserChanges
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/changes"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks the error codes, that writes through the
+        API are listed in order with working hrefs, and that pages and later
+        syncs only return the changes after since.
+        '''
+
+        # Invalid paging and unknown user
+        resp = client.get(self.RESOURCE_URL + "?since=-1")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?limit=0")
+        assert resp.status_code == 400
+        resp = client.get("/api/users/Jaana3/changes")
+        assert resp.status_code == 404
+        # Full sync lists the populated resources of the user only
+        resp = client.get("/api/users/Joonas1/")
+        _check_control_get_method("cyequ:changes", client,
+                                  json.loads(resp.data))
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("up", client, body)
+        assert "next" not in body["@controls"]
+        items = body["items"]
+        assert [item["kind"] for item in items] == \
+            ["user", "equipment", "equipment", "component", "component"]
+        assert all(item["op"] == "create" for item in items)
+        assert [item["seq"] for item in items] == \
+            sorted(item["seq"] for item in items)
+        for item in items:
+            assert client.get(item["href"]).status_code == 200
+        since = body["last_seq"]
+        assert since == items[-1]["seq"]
+        # Writes are listed after since, a new row once it has a URI
+        client.post("/api/users/Joonas1/all_equipment/",
+                    json=_get_equipment_json(name="Kona"))
+        client.patch("/api/users/Joonas1/all_equipment/Polkuaura1/",
+                     data=json.dumps({"name": "Polku"}),
+                     content_type=MERGE_PATCH)
+        client.delete("/api/users/Joonas1/all_equipment/Polkuaura1/")
+        client.put("/api/users/Janne2/", json=_get_user_json(name="Jan"))
+        resp = client.get(self.RESOURCE_URL + "?since={}".format(since))
+        items = json.loads(resp.data)["items"]
+        assert [(item["op"], item["kind"]) for item in items] == [
+            ("create", "equipment"), ("update", "equipment"),
+            ("delete", "component"), ("delete", "component"),
+            ("delete", "equipment")]
+        assert items[0]["href"].endswith("/all_equipment/Kona3/")
+        assert items[2]["href"].endswith("/Polkuaura1/Hissitolppa1/")
+        # Keyset pages follow the next control
+        resp = client.get(self.RESOURCE_URL + "?since={}&limit=3"
+                          .format(since))
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 3
+        _check_control_get_method("next", client, body)
+        resp = client.get(body["@controls"]["next"]["href"])
+        body = json.loads(resp.data)
+        assert [item["seq"] for item in body["items"]] == \
+            [item["seq"] for item in items[3:]]
+        assert "next" not in body["@controls"]
+        # Nothing new after the last change
+        resp = client.get(self.RESOURCE_URL + "?since={}"
+                          .format(body["last_seq"]))
+        assert json.loads(resp.data)["items"] == []
+
+
+class TestUserEvents(object):
+    '''
+    This class implements tests for each HTTP method in UserEvents
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/events"
+    COMPONENT_URL = "/api/users/Joonas1/all_equipment/Polkuaura1/Hissitolppa1/"
+
+    @staticmethod
+    def _next_event(stream):
+        '''
+        Returns the id and data of the next change event of *stream*,
+        skipping heartbeats.
+        '''
+
+        for message in stream:
+            message = message.decode()
+            if message.startswith("id: "):
+                lines = message.splitlines()
+                return int(lines[0][4:]), json.loads(lines[2][6:])
+        return None
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks the error codes, ETags of GET responses,
+        that writes are pushed with the new ETags, that reconnects resume
+        from Last-Event-ID and that slow subscribers are dropped.
+        '''
+
+        app = client.application
+        app.config["EVENTS_HEARTBEAT"] = 0.1
+        app.config["EVENTS_BUFFER"] = 2
+        # Unknown user and invalid event id
+        resp = client.get("/api/users/Jaana3/events")
+        assert resp.status_code == 404
+        resp = client.get(self.RESOURCE_URL,
+                          headers={"Last-Event-ID": "first"})
+        assert resp.status_code == 400
+        # Conditional GET of an unchanged resource
+        etag = client.get(self.COMPONENT_URL).headers["ETag"]
+        assert etag.startswith("W/")
+        resp = client.get(self.COMPONENT_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        # Changes are pushed with the new ETags
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/event-stream"
+        stream = iter(resp.response)
+        assert next(stream) == b"retry: 3000\n\n"
+        assert next(stream) == b": heartbeat\n\n"
+        client.patch(self.COMPONENT_URL, data=json.dumps({"name": "Tolppa"}),
+                     content_type=MERGE_PATCH)
+        seq, data = self._next_event(stream)
+        assert data["op"] == "update"
+        assert data["kind"] == "component"
+        assert data["href"] == self.COMPONENT_URL
+        assert data["etag"] != etag
+        assert data["etag"] == client.get(self.COMPONENT_URL).headers["ETag"]
+        assert data["up"]["etag"] == client.get(data["up"]["href"]) \
+            .headers["ETag"]
+        resp.close()
+        # Reconnecting resumes after the last event seen
+        resp = client.get(self.RESOURCE_URL,
+                          headers={"Last-Event-ID": str(seq - 1)})
+        stream = iter(resp.response)
+        assert self._next_event(stream) == (seq, data)
+        resp.close()
+        # A subscriber not reading its events is dropped
+        resp = client.get(self.RESOURCE_URL)
+        stream = iter(resp.response)
+        next(stream)
+        for i in range(3):
+            client.patch(self.COMPONENT_URL,
+                         data=json.dumps({"name": "Tolppa {}".format(i)}),
+                         content_type=MERGE_PATCH)
+        hub = app.extensions["cyequ_events"]
+        deadline = time.monotonic() + 5
+        while not hub.dropped and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert hub.dropped == 1
+        assert self._next_event(stream) is None
+        # Events compacted away, a reset to the change feed is sent instead
+        with app.app_context():
+            db.session.execute(text(
+                "UPDATE changelog SET time = datetime('now', '-40 days')"))
+            db.session.commit()
+        resp = client.get(self.RESOURCE_URL, headers={"Last-Event-ID": "1"})
+        stream = iter(resp.response)
+        next(stream)
+        message = next(stream).decode()
+        assert message.startswith("event: reset")
+        resp.close()
+
+
+
+class TestUserGarage(object):
+    '''
+    This class implements tests for each HTTP method in UserGarage
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/garage/"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks that the summary has the equipment and
+        components in service of the normalized resources, and that it
+        follows writes through the API and around it.
+        '''
+
+        resp = client.get("/api/users/Jaana3/garage/")
+        assert resp.status_code == 404
+        resp = client.get("/api/users/Joonas1/")
+        _check_control_get_method("cyequ:garage", client,
+                                  json.loads(resp.data))
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("cyequ:owner", client, body)
+        collection = json.loads(
+            client.get("/api/users/Joonas1/all_equipment/").data)
+        assert [item["name"] for item in body["items"]] \
+            == [item["name"] for item in collection["items"]]
+        for item in body["items"]:
+            resp = client.get(item["@controls"]["self"]["href"])
+            equip = json.loads(resp.data)
+            for key in ("name", "category", "brand", "model", "date_added",
+                        "date_retired"):
+                assert item[key] == equip.get(key)
+            assert [comp["name"] for comp in item["components"]] \
+                == [comp["name"] for comp in equip["items"]
+                    if "date_retired" not in comp]
+            for comp in item["components"]:
+                _check_control_get_method("self", client, comp)
+        assert body["counts"] == {"equipment": 2, "equipment_in_use": 1,
+                                  "components_in_service": 1}
+        version = body["version"]
+        # Writes through the API are applied before they commit
+        client.patch("/api/users/Joonas1/all_equipment/Polkuaura1/",
+                     data=json.dumps({"name": "Polku"}),
+                     content_type=MERGE_PATCH)
+        client.delete("/api/users/Joonas1/all_equipment/Kisarassi2/")
+        body = json.loads(client.get(self.RESOURCE_URL).data)
+        assert body["version"] == version + 2
+        assert [item["name"] for item in body["items"]] == ["Polku"]
+        assert body["counts"]["equipment"] == 1
+        # Writes around the ORM are applied to the summary served
+        with client.application.app_context():
+            db.session.execute(text("UPDATE component SET date_retired ="
+                                    " '2020-01-01 00:00:00.000000'"))
+            db.session.commit()
+        body = json.loads(client.get(self.RESOURCE_URL).data)
+        assert body["version"] == version + 3
+        assert body["items"][0]["components"] == []
+        assert body["counts"]["components_in_service"] == 0
+
+class TestCatalogSuggest(object):
+    '''
+    This class implements tests for each HTTP method in CatalogSuggest
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/catalog/suggest"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks the error codes, that brands and models
+        are suggested by prefix regardless of case, and that suggestions
+        follow writes through the API.
+        '''
+
+        # Missing prefix, unknown field and invalid limit
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?prefix=r&field=name")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?prefix=r&limit=0")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?prefix=r")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        assert body["brand"] == ["RockShox"]
+        assert body["model"] == ["Reverb B1", "Roam AL 650b"]
+        resp = client.get(self.RESOURCE_URL + "?prefix=ROAM&field=model")
+        body = json.loads(resp.data)
+        assert body["model"] == ["Roam AL 650b"]
+        assert "brand" not in body
+        # New values are suggested after they are added
+        client.post("/api/users/Joonas1/all_equipment/",
+                    json=_get_equipment_json(brand="Rocky Mountain"))
+        resp = client.get(self.RESOURCE_URL + "?prefix=roc&field=brand")
+        assert json.loads(resp.data)["brand"] == ["RockShox",
+                                                  "Rocky Mountain"]
+        resp = client.get(self.RESOURCE_URL + "?prefix=rocky&limit=1")
+        assert json.loads(resp.data)["brand"] == ["Rocky Mountain"]
+        # Values no longer used are not suggested
+        client.delete("/api/users/Joonas1/all_equipment/Polkuaura1/")
+        resp = client.get(self.RESOURCE_URL + "?prefix=r")
+        body = json.loads(resp.data)
+        assert body["brand"] == ["Rocky Mountain"]
+        assert body["model"] == []
+        resp = client.get(self.RESOURCE_URL + "?prefix=kona")
+        assert json.loads(resp.data)["brand"] == []
+
+
+class TestMaintenanceDue(object):
+    '''
+    This class implements tests for each HTTP method in MaintenanceDue
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/maintenance-due/"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Checks that the response status code is 200, and
+        then checks that the due component is listed with its schedule, and
+        that the controls work.
+        '''
+
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("cyequ:owner", client, body)
+        # Seat post is due by time, the rear wheel is retired
+        assert len(body["items"]) == 1
+        item = body["items"][0]
+        assert item["name"] == "Hissitolppa"
+        assert item["due_date"] == "2020-11-20T11:20:30"
+        assert item["hours_left"] == 50.0
+        _check_control_get_method("self", client, item)
+        _check_profile("profile", client, item, "component-profile")
+        # Unknown user
+        resp = client.get("/api/users/Jaana3/maintenance-due/")
+        assert resp.status_code == 404
+
+
+class TestRideImport(object):
+    '''
+    This class implements tests for each HTTP method in RideImport
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/rides/import"
+
+    def test_post(self, client):
+        '''
+        Tests the POST method. Checks all of the possible error codes, and
+        also checks that valid GPX and TCX files receive a 201 response with a
+        location header that leads into the newly created ride.
+        '''
+
+        gpx = _get_gpx()
+        headers = {"Content-Type": "application/gpx+xml"}
+        # Test for unsupported media type (content-type header)
+        resp = client.post(self.RESOURCE_URL, json={"name": "Lenkki"})
+        assert resp.status_code == 415
+        # Test for unknown user and equipment
+        resp = client.post("/api/users/Jaana3/rides/import",
+                           data=gpx, headers=headers)
+        assert resp.status_code == 404
+        resp = client.post(self.RESOURCE_URL + "?equipment=Kolmipyörä1",
+                           data=gpx, headers=headers)
+        assert resp.status_code == 404
+        # Test for malformed and unusable files
+        resp = client.post(self.RESOURCE_URL, data="<gpx>", headers=headers)
+        assert resp.status_code == 400
+        resp = client.post(self.RESOURCE_URL, data="<kml/>", headers=headers)
+        assert resp.status_code == 400
+        resp = client.post(self.RESOURCE_URL, data=_get_gpx(points=1),
+                           headers=headers)
+        assert resp.status_code == 400
+        # Test for track points without position and with empty elements
+        for old, new in ((' lat="65.000" lon="25.470"', ""),
+                         ("<ele>10</ele>", "<ele/>"),
+                         ("<time>2020-04-30T12:00:00Z</time>", "<time/>")):
+            resp = client.post(self.RESOURCE_URL,
+                               data=gpx.replace(old, new, 1),
+                               headers=headers)
+            assert resp.status_code == 400
+        # Test with valid
+        resp = client.post(self.RESOURCE_URL + "?equipment=Polkuaura1",
+                           data=gpx, headers=headers)
+        assert resp.status_code == 201
+        assert resp.headers["Location"] \
+            .endswith("/api/users/Joonas1/rides/Iltalenkki1/")
+        # Follow location header and test response
+        resp = client.get(resp.headers["Location"])
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("cyequ:owner", client, body)
+        _check_profile("profile", client, body, "ride-profile")
+        assert body["name"] == "Iltalenkki"
+        assert body["datetime"] == "2020-04-30T12:00:00"
+        assert body["duration"] == 120
+        assert body["moving_time"] == 120
+        assert round(body["distance"]) == 222
+        assert body["elevation_gain"] == 2.0
+        assert body["equipment"] == "Polkuaura"
+        # POST again for 409
+        resp = client.post(self.RESOURCE_URL + "?equipment=Polkuaura1",
+                           data=gpx, headers=headers)
+        assert resp.status_code == 409
+        # Test that a ride of an existing name leaves no stream segment
+        store = client.application.config["STREAM_STORE"]
+        size = os.path.getsize(store)
+        resp = client.post(self.RESOURCE_URL + "?equipment=Polkuaura1",
+                           data=_get_gpx(points=4), headers=headers)
+        assert resp.status_code == 409
+        assert os.path.getsize(store) == size
+        # TCX file named by query parameter
+        resp = client.post(self.RESOURCE_URL + "?name=Aamulenkki",
+                           data=_get_tcx(),
+                           headers={"Content-Type":
+                                    "application/vnd.garmin.tcx+xml"}
+                           )
+        assert resp.status_code == 201
+        body = json.loads(client.get(resp.headers["Location"]).data)
+        assert body["name"] == "Aamulenkki"
+        assert round(body["distance"]) == 222
+        assert body["equipment"] is None
+        # Rides of other users are not found
+        resp = client.get("/api/users/Janne2/rides/Aamulenkki2/")
+        assert resp.status_code == 404
+
+
+class TestRideArchive(object):
+    '''
+    This class implements tests for each HTTP method in RideArchive
+    resource, and the JobItem resource of the started import.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/rides/archive"
+
+    def test_post(self, client):
+        '''
+        Tests the POST method. Checks the error codes, then posts an archive
+        and polls the job until done. Checks that rides were imported once
+        per content, and unusable files were counted as failed.
+        '''
+
+        headers = {"Content-Type": "application/zip"}
+        archive = _get_archive({
+            "rides/Iltalenkki.gpx": _get_gpx(),
+            "rides/copy.gpx": _get_gpx(),
+            "rides/Aamulenkki.tcx": _get_tcx(points=4),
+            "rides/broken.gpx": "<gpx>",
+            "rides/nowhere.gpx": _get_gpx().replace(' lat="65.000"', "", 1),
+            "README.txt": "Not a ride"
+        })
+        # Test for unsupported media type, unknown user and invalid archive
+        resp = client.post(self.RESOURCE_URL, data=_get_gpx(),
+                           headers={"Content-Type": "application/gpx+xml"})
+        assert resp.status_code == 415
+        resp = client.post("/api/users/Jaana3/rides/archive",
+                           data=archive, headers=headers)
+        assert resp.status_code == 404
+        resp = client.post(self.RESOURCE_URL, data=b"PK", headers=headers)
+        assert resp.status_code == 400
+        # Test with valid and poll the job until done
+        resp = client.post(self.RESOURCE_URL, data=archive, headers=headers)
+        assert resp.status_code == 202
+        location = resp.headers["Location"]
+        for _ in range(600):
+            body = json.loads(client.get(location).data)
+            if body["state"] in ("done", "failed"):
+                break
+            time.sleep(0.1)
+        assert body["state"] == "done"
+        _check_namespace(client, body)
+        _check_control_get_method("self", client, body)
+        _check_control_get_method("cyequ:owner", client, body)
+        _check_profile("profile", client, body, "job-profile")
+        progress = body["progress"]
+        assert progress["total"] == 5
+        assert progress["processed"] == 5
+        assert progress["inserted"] == 2
+        assert progress["duplicates"] == 1
+        assert progress["failed"] == 2
+        assert sorted(error.split(":")[0] for error in progress["errors"]) \
+            == ["rides/broken.gpx", "rides/nowhere.gpx"]
+        # Other processes serving the application read the status file
+        client.application.extensions["cyequ_jobs"].clear()
+        body = json.loads(client.get(location).data)
+        assert body["state"] == "done"
+        assert body["progress"] == progress
+        # Imported rides are found with their streams. Parsing order is not
+        # fixed, so the ride may have either id.
+        resp = [client.get("/api/users/Joonas1/rides/Iltalenkki{}/".format(i))
+                for i in (1, 2)]
+        assert sorted(r.status_code for r in resp) == [200, 404]
+        body = json.loads([r for r in resp if r.status_code == 200][0].data)
+        assert body["duration"] == 120
+        _check_control_get_method("cyequ:streams", client, body)
+        # Already imported files are duplicates of the archive
+        resp = client.post("/api/users/Joonas1/rides/import", data=_get_gpx(),
+                           headers={"Content-Type": "application/gpx+xml"})
+        assert resp.status_code == 409
+        # Unknown job
+        resp = client.get("/api/jobs/tuntematon/")
+        assert resp.status_code == 404
+        resp = client.get("/api/jobs/{}/".format("0" * 32))
+        assert resp.status_code == 404
+
+
+class TestRideStreams(object):
+    '''
+    This class implements tests for each HTTP method in RideStreams
+    resource.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/rides/Iltalenkki1/streams"
+
+    def test_get(self, client):
+        '''
+        Tests the GET method. Imports a ride longer than one delta block and
+        checks that slices of its streams are decoded correctly, and that
+        invalid queries are rejected.
+        '''
+
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 404
+        resp = client.post("/api/users/Joonas1/rides/import",
+                           data=_get_gpx(points=2500),
+                           headers={"Content-Type": "application/gpx+xml"}
+                           )
+        assert resp.status_code == 201
+        body = json.loads(client.get(resp.headers["Location"]).data)
+        _check_control_get_method("cyequ:streams", client, body)
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("up", client, body)
+        assert body["samples"] == 2500
+        assert body["time"][:3] == [0, 60, 120]
+        assert body["ele"][2499] == 2509
+        assert body["lat"][1000] == 66.0
+        # Sliced across a block border by time and downsampled
+        resp = client.get(self.RESOURCE_URL + "?fields=ele,speed"
+                          "&from=61380&to=61620&downsample=2")
+        body = json.loads(resp.data)
+        assert sorted(body) == ["@controls", "@namespaces", "ele",
+                                "samples", "speed", "time"]
+        assert body["time"] == [61380, 61500]
+        assert body["ele"] == [1033, 1035]
+        assert round(body["speed"][0], 2) == 1.85
+        # Invalid queries
+        resp = client.get(self.RESOURCE_URL + "?fields=cadence")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?downsample=0")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?from=start")
+        assert resp.status_code == 400
+        for query in ["?from=nan", "?to=nan", "?from=-inf", "?to=inf"]:
+            resp = client.get(self.RESOURCE_URL + query)
+            assert resp.status_code == 400
+
+
+class TestCompression(object):
+    '''
+    This class implements tests for the negotiated compression of responses.
+    '''
+
+    RESOURCE_URL = "/api/users/Joonas1/all_equipment/Polkuaura1/"
+
+    def test_get(self, client):
+        '''
+        Tests GET responses with and without accepted encodings. Checks that
+        large enough bodies are compressed with the accepted encoding, small
+        ones are not, and that a compressed body is reused from the cache.
+        '''
+
+        plain = client.get(self.RESOURCE_URL)
+        assert "Content-Encoding" not in plain.headers
+        assert "Accept-Encoding" in plain.headers["Vary"]
+        for encoding, decompress in (("gzip", gzip.decompress),
+                                     ("deflate", zlib.decompress)):
+            resp = client.get(self.RESOURCE_URL,
+                              headers={"Accept-Encoding": encoding})
+            assert resp.headers["Content-Encoding"] == encoding
+            assert int(resp.headers["Content-Length"]) < len(plain.data)
+            assert decompress(resp.data) == plain.data
+        # Refused and unsupported encodings
+        resp = client.get(self.RESOURCE_URL,
+                          headers={"Accept-Encoding": "gzip;q=0, zstd"})
+        assert "Content-Encoding" not in resp.headers
+        assert resp.data == plain.data
+        # Preference of the client
+        resp = client.get(self.RESOURCE_URL,
+                          headers={"Accept-Encoding":
+                                   "gzip;q=0.5, deflate"})
+        assert resp.headers["Content-Encoding"] == "deflate"
+        # Below the size threshold
+        client.application.config["COMPRESS_MIN_SIZE"] = len(plain.data) + 1
+        resp = client.get(self.RESOURCE_URL,
+                          headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in resp.headers
+        client.application.config["COMPRESS_MIN_SIZE"] = len(plain.data)
+        # Compressed once per representation
+        cache = client.application.extensions["cyequ_compressed"]
+        entries = len(cache.entries)
+        first = client.get(self.RESOURCE_URL,
+                           headers={"Accept-Encoding": "gzip"}).data
+        second = client.get(self.RESOURCE_URL,
+                            headers={"Accept-Encoding": "gzip"}).data
+        assert first == second
+        assert len(cache.entries) == entries
+        # Disabled
+        client.application.config["COMPRESS"] = False
+        resp = client.get(self.RESOURCE_URL,
+                          headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in resp.headers
+
+
+class TestJSONProvider(object):
+    '''
+    This class implements tests for the JSON backends of responses and
+    request bodies.
+    '''
+
+    RESOURCE_URLS = ["/api/",
+                     "/api/users/",
+                     "/api/users/Joonas1/all_equipment/Polkuaura1/",
+                     "/api/users/Joonas1/all_equipment/Polkuaura1/"
+                     "Hissitolppa1/"]
+
+    def test_backends(self, client):
+        '''
+        Tests that every installed backend gives the same documents as the
+        standard library, dates included, and parses request bodies.
+        '''
+
+        default = cyequ_json.backend
+        backends = []
+        expected = {}
+        try:
+            for backend in JSONProvider.BACKENDS:
+                try:
+                    cyequ_json.use(backend)
+                    backends.append(backend)
+                except ValueError:
+                    # Not installed
+                    pass
+            for backend in backends:
+                cyequ_json.use(backend)
+                for url in self.RESOURCE_URLS:
+                    body = json.loads(client.get(url).data)
+                    assert expected.setdefault(url, body) == body
+            for backend in backends:
+                cyequ_json.use(backend)
+                resp = client.post("/api/users/",
+                                   json={"name": "Backend " + backend})
+                assert resp.status_code == 201
+                resp = client.post("/api/users/", data="{",
+                                   content_type="application/json")
+                assert resp.status_code == 400
+            body = expected[self.RESOURCE_URLS[2]]
+            assert body["date_added"] == "2019-11-21T11:20:30"
+            with pytest.raises(ValueError):
+                cyequ_json.use("simplejson")
+        finally:
+            cyequ_json.use(default)
+
+    def test_per_app(self, client):
+        '''
+        Tests that JSON_BACKEND of an application does not change the backend
+        of other applications or the default.
+        '''
+
+        default = cyequ_json.backend
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://",
+                          "JSON_BACKEND": "stdlib",
+                          "TESTING": True})
+        assert cyequ_json.backend == default
+        assert cyequ_json.current() == default
+        with app.app_context():
+            assert cyequ_json.current() == "stdlib"
+            assert cyequ_json.loads(cyequ_json.dumps({"b": 1, "a": 2})) \
+                == {"a": 2, "b": 1}
+        with client.application.app_context():
+            assert cyequ_json.current() == default
+        with pytest.raises(ValueError):
+            create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://",
+                        "JSON_BACKEND": "simplejson"})
+
+
+class TestColdStart(object):
+    '''
+    This class implements tests for the start up time of the application.
+    '''
+
+    # Seconds allowed for "import cyequ; create_app()" in a new interpreter
+    IMPORT_BUDGET = 1.5
+    SCRIPT = ("import time\n"
+              "start = time.perf_counter()\n"
+              "import cyequ\n"
+              "cyequ.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})\n"
+              "elapsed = time.perf_counter() - start\n"
+              "from cyequ.lazy import is_loaded\n"
+              "print(elapsed, is_loaded('numpy'), is_loaded('jsonschema'))\n")
+
+    def test_import_time(self):
+        '''
+        Tests that importing the package and creating the application stays
+        within the budget and leaves the heavy modules unloaded. The best of
+        three runs is compared, to leave out noise of the test machine.
+        '''
+
+        runs = []
+        for _ in range(3):
+            output = subprocess.run([sys.executable, "-c", self.SCRIPT],
+                                    capture_output=True, check=True,
+                                    text=True).stdout.split()
+            assert output[1:] == ["False", "False"]
+            runs.append(float(output[0]))
+        assert min(runs) < self.IMPORT_BUDGET
+
+    def test_warmup(self, client):
+        '''
+        Tests the warmup command. Checks that every step is reported and
+        the heavy modules and validators are loaded afterwards.
+        '''
+
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(args=["warmup"])
+        assert result.exit_code == 0
+        assert [line.split()[0] for line in result.output.splitlines()] \
+            == [name for name, _ in STEPS]
+        assert is_loaded("numpy") and is_loaded("jsonschema")
+        assert schema_validator.cache_info().currsize >= 4
+        assert "cyequ_catalog" in client.application.extensions
+
+
+class TestServe(object):
+    '''
+    This class implements tests for the pre-forking server cyequ-serve.
+    '''
+
+    def _get(self, port, url):
+        '''
+        Returns the status code of GET *url*, retrying while the server
+        starts.
+        '''
+
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(
+                        "http://127.0.0.1:{}{}".format(port, url)) as resp:
+                    return resp.status
+            except (urllib.error.URLError, ConnectionError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _logged(self, server, text, count=1, timeout=60):
+        '''
+        Reads the log of *server* until *text* has been logged *count* times.
+        Fails if the server exits or *timeout* seconds pass first.
+        '''
+
+        deadline = time.monotonic() + timeout
+        while count > 0:
+            remaining = deadline - time.monotonic()
+            assert remaining > 0, "Timed out waiting for " + text
+            # The log is unbuffered, so select sees every unread line
+            if not select.select([server.stderr], [], [], remaining)[0]:
+                continue
+            line = server.stderr.readline()
+            assert line, "Server exited waiting for " + text
+            if text in line.decode():
+                count -= 1
+
+    def test_serve(self, tmp_path):
+        '''
+        Tests serving with two workers, a graceful reload on SIGHUP, a reload
+        of a broken configuration and a graceful stop on SIGTERM.
+        '''
+
+        uri = "sqlite:///" + str(tmp_path / "serve.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+        with app.app_context():
+            db.create_all()
+            _populate_db()
+        config = tmp_path / "config.py"
+        config.write_text("SQLALCHEMY_DATABASE_URI = {!r}\n".format(uri))
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, "-m", "cyequ.serve", "--port", str(port),
+             "--workers", "2", "--config", str(config)],
+            stderr=subprocess.PIPE, bufsize=0)
+        try:
+            self._logged(server, "Booting worker", 2)
+            assert self._get(port, "/api/users/") == 200
+            server.send_signal(signal.SIGHUP)
+            self._logged(server, "Booting worker", 2)
+            assert self._get(port, "/api/users/Joonas1/") == 200
+            # A configuration which fails keeps the running workers
+            config.write_text("raise RuntimeError('broken')\n")
+            server.send_signal(signal.SIGHUP)
+            self._logged(server, "Reload failed")
+            assert self._get(port, "/api/users/Joonas1/") == 200
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=60) == 0
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+            server.stderr.close()
+
+
+class TestAsyncRead(object):
+    '''
+    This class implements tests for the ASGI application of the API.
+    '''
+
+    @staticmethod
+    async def _call(app, method, path, sent, body=b"", headers=()):
+        '''
+        Runs a request through ASGI application *app*, appending the
+        messages sent to list *sent*.
+        '''
+
+        scope = {"type": "http", "method": method, "path": path,
+                 "root_path": "", "query_string": b"", "scheme": "http",
+                 "http_version": "1.1", "server": ("localhost", 80),
+                 "client": ("127.0.0.1", 5000),
+                 "headers": [(name.lower().encode(), value.encode())
+                             for name, value in headers]}
+        messages = [{"type": "http.request", "body": body}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+
+    def _request(self, app, method, path, body=b"", headers=()):
+        '''
+        Runs a request through ASGI application *app* and returns the
+        status, headers and body of the response.
+        '''
+
+        sent = []
+
+        async def run():
+            await self._call(app, method, path, sent, body, headers)
+            await app.close()
+
+        asyncio.run(run())
+        headers = {name.decode().lower(): value.decode()
+                   for name, value in sent[0]["headers"]}
+        return sent[0]["status"], headers, \
+            b"".join(message.get("body", b"") for message in sent[1:])
+
+    def test_identical(self, client):
+        '''
+        Tests that GETs of UserItem and EquipmentItem, and their errors, are
+        identical to the responses of the WSGI application.
+        '''
+
+        for url in ["/api/users/Joonas1/",
+                    "/api/users/Joonas1/all_equipment/Polkuaura1/",
+                    "/api/users/Joonas1/all_equipment/Kisarassi2/",
+                    "/api/users/Nobody1/",
+                    "/api/users/Joonas1/all_equipment/Nothing1/",
+                    "/api/users/Nobody1/all_equipment/Polkuaura1/"]:
+            for headers in [(), (("Accept-Encoding", "gzip"),)]:
+                app = AsyncReadApp(client.application)
+                status, sent, body = self._request(app, "GET", url,
+                                                   headers=headers)
+                resp = client.get(url, headers=dict(headers))
+                assert status == resp.status_code
+                assert body == resp.data
+                assert sent["content-type"] == resp.headers["Content-Type"]
+                assert sent.get("content-encoding") \
+                    == resp.headers.get("Content-Encoding")
+                assert sent.get("etag") == resp.headers.get("ETag")
+
+    def test_wsgi(self, client):
+        '''
+        Tests that writes and other requests are passed to the WSGI
+        application.
+        '''
+
+        app = AsyncReadApp(client.application)
+        user = _get_user_json()
+        status, headers, _ = self._request(
+            app, "POST", "/api/users/", json.dumps(user).encode(),
+            (("Content-Type", "application/json"),))
+        assert status == 201
+        path = "/" + headers["location"].split("/", 3)[3]
+        app = AsyncReadApp(client.application)
+        status, _, body = self._request(app, "GET", path)
+        assert status == 200
+        assert json.loads(body)["name"] == user["name"]
+        # Redirect to the URL with a trailing slash
+        app = AsyncReadApp(client.application)
+        status, _, _ = self._request(app, "GET", path.rstrip("/"))
+        assert status == 308
+        # Streamed response of the export
+        app = AsyncReadApp(client.application)
+        status, _, body = self._request(app, "GET",
+                                        "/api/users/Joonas1/export")
+        assert status == 200
+        assert body == client.get("/api/users/Joonas1/export").data
+
+    def test_event_streams(self, client):
+        '''
+        Tests that event streams are run in their own thread pool, and that
+        a stream beyond its threads is answered with 503.
+        '''
+
+        client.application.config.update(ASGI_EVENT_STREAMS=1,
+                                         ASGI_WSGI_THREADS=1,
+                                         EVENTS_HEARTBEAT=0.1)
+        app = AsyncReadApp(client.application)
+        url = "/api/users/Joonas1/events"
+
+        async def run():
+            stream = []
+            task = asyncio.ensure_future(self._call(app, "GET", url, stream))
+            while not stream:
+                await asyncio.sleep(0.01)
+            assert stream[0]["status"] == 200
+            # Over the pool of streams
+            busy = []
+            await self._call(app, "GET", url, busy)
+            assert busy[0]["status"] == 503
+            assert (b"retry-after", b"3") in busy[0]["headers"]
+            # The thread of other requests is free
+            other = []
+            await self._call(app, "GET", "/api/users/", other)
+            assert other[0]["status"] == 200
+            # The stream ends when its subscriber is dropped
+            hub = client.application.extensions["cyequ_events"]
+            for subscribers in list(hub.subscribers.values()):
+                for subscriber in subscribers:
+                    subscriber.dropped = True
+            await asyncio.wait_for(task, 10)
+            assert app.open_streams == 0
+            await app.close()
+
+        asyncio.run(run())
+
+
+class TestGroupCommit(object):
+    '''
+    This class implements tests for the group commit writer.
+    '''
+
+    def test_group(self, client):
+        '''
+        Tests concurrent POSTs committed in groups. Checks that a conflicting
+        request fails alone and the others are saved.
+        '''
+
+        app = client.application
+        app.config.update(GROUP_COMMIT=True, GROUP_COMMIT_WINDOW=0.2)
+        names = ["Rider{}".format(i) for i in range(8)] + ["Joonas"]
+        statuses = {}
+
+        def post(name):
+            resp = app.test_client().post("/api/users/",
+                                          json=_get_user_json(name))
+            statuses[name] = resp.status_code
+
+        threads = [threading.Thread(target=post, args=(name,))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert statuses.pop("Joonas") == 409
+        assert set(statuses.values()) == {201}
+        writer = app.extensions["cyequ_writer"]
+        assert writer.units == len(names)
+        assert writer.groups < len(names)
+        body = json.loads(client.get("/api/users/").data)
+        saved = {item["name"] for item in body["items"]}
+        assert saved >= set(statuses)
+
+    def test_failed_after_commit(self, client):
+        '''
+        Tests that a unit failing after its first commit is rolled back
+        whole, and the others of its group are saved.
+        '''
+
+        app = client.application
+        app.config.update(GROUP_COMMIT=True, GROUP_COMMIT_WINDOW=0.2)
+        names = ["Rider{}".format(i) for i in range(4)] + ["Broken"]
+        statuses = {}
+
+        def fail_uri(session, flush_context, instances):
+            # The second commit of the POST, setting the uri
+            for obj in session.dirty:
+                if getattr(obj, "name", None) == "Broken":
+                    raise RuntimeError("Failed after commit")
+
+        def post(name):
+            try:
+                resp = app.test_client().post("/api/users/",
+                                              json=_get_user_json(name))
+                statuses[name] = resp.status_code
+            except RuntimeError:
+                statuses[name] = None
+
+        event.listen(db.session, "before_flush", fail_uri)
+        try:
+            threads = [threading.Thread(target=post, args=(name,))
+                       for name in names]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            event.remove(db.session, "before_flush", fail_uri)
+        assert statuses.pop("Broken") is None
+        assert set(statuses.values()) == {201}
+        with app.app_context():
+            rows = db.session.execute(text(
+                "SELECT name, uri FROM user WHERE name IN ({})".format(
+                    ", ".join("'{}'".format(name) for name in names)
+                ))).fetchall()
+        assert {name for name, _ in rows} == set(statuses)
+        assert all(uri is not None for _, uri in rows)
+
+
+class TestRateLimit(object):
+    '''
+    This class implements tests for the admission control.
+    '''
+
+    def test_limits(self, client):
+        '''
+        Tests that requests over the rate and concurrency limits of a user
+        are answered with 429 and Retry-After, others are not, and batch
+        operations are not limited.
+        '''
+
+        app = client.application
+        app.config.update(RATE_LIMIT=True, RATE_LIMIT_USER_BURST=3,
+                          RATE_LIMIT_USER_RATE=0.01)
+        for _ in range(3):
+            resp = client.get("/api/users/Joonas1/")
+            assert resp.status_code == 200
+        resp = client.get("/api/users/Joonas1/")
+        assert resp.status_code == 429
+        assert int(resp.headers["Retry-After"]) > 1
+        body = json.loads(resp.data)
+        assert body["@error"]["@message"] == "Too many requests"
+        assert "profile" in body["@controls"]
+        # Other users and the batch's own operations are not limited
+        resp = client.get("/api/users/Janne2/")
+        assert resp.status_code == 200
+        resp = client.post("/api/batch", json={"operations": [
+            {"method": "GET", "href": "/api/users/Joonas1/"}] * 2})
+        assert resp.status_code == 200
+        # Janne2 at its cap of requests in progress
+        limiter = app.extensions["cyequ_limiter"]
+        limits = limiter.limits("Janne2", "10.0.0.1")[:1]
+        for _ in range(app.config["RATE_LIMIT_USER_CONCURRENCY"]):
+            taken, refused = limiter.buckets.acquire(limits, 0)
+            assert refused is None
+        resp = client.get("/api/users/Janne2/")
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "1"
+        limiter.buckets.release(taken)
+        resp = client.get("/api/users/Janne2/")
+        assert resp.status_code == 200
+        assert limiter.throttled == {"user_rate": 1, "user_concurrency": 1}
+        assert limiter.admitted == 6
+
+    def test_shared(self):
+        '''
+        Tests that a shared bucket table is shared with a forked process.
+        '''
+
+        buckets = TokenBuckets(16, shared=True)
+        limits = [("user", "user:Joonas1", 1, 10, 2)]
+        pid = os.fork()
+        if pid == 0:
+            buckets.acquire(limits, 5)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        taken, refused = buckets.acquire(limits, 5)
+        assert refused is None
+        assert buckets.acquire(limits, 5) == (None, ("user_concurrency", 1))
+        buckets.release(taken)
+        assert buckets.acquire(limits, 5)[1][0] == "user_rate"
+
+    def test_collision(self):
+        '''
+        Tests that requests of keys colliding in one slot release what they
+        took, whichever key owns the slot.
+        '''
+
+        buckets = TokenBuckets(1)
+        first = [("user", "user:Joonas1", 1, 10, 2)]
+        second = [("user", "user:Janne2", 1, 10, 2)]
+        taken_first, _ = buckets.acquire(first, 1)
+        taken_second, _ = buckets.acquire(second, 1)
+        buckets.release(taken_second)
+        buckets.release(taken_first)
+        # Both requests in progress ended
+        for _ in range(2):
+            assert buckets.acquire(second, 1)[1] is None
+        assert buckets.acquire(second, 1)[1] == ("user_concurrency", 1)
+        # User and IP of one request in one slot
+        buckets = TokenBuckets(1)
+        limits = [("user", "user:Joonas1", 1, 10, 2),
+                  ("ip", "ip:10.0.0.1", 1, 10, 2)]
+        taken, refused = buckets.acquire(limits, 1)
+        assert refused is None
+        assert buckets.acquire(limits, 1)[1] == ("user_concurrency", 1)
+        buckets.release(taken)
+        assert buckets.acquire(limits, 1)[1] is None
+
+
+class TestSingleFlight(object):
+    '''
+    This class implements tests for the request coalescing.
+    '''
+
+    def test_coalesce(self, client):
+        '''
+        Tests that identical concurrent GETs wait for the first one and get
+        the same body, each with its own ETag check, and that they run their
+        own views after timing out.
+        '''
+
+        app = client.application
+        app.config.update(SINGLEFLIGHT=True)
+        url = "/api/users/Joonas1/all_equipment/"
+        with app.app_context():
+            engine = db.engine
+        slow = threading.Event()
+        statements = []
+
+        def delay(*args):
+            statements.append(args[2])
+            if slow.is_set():
+                time.sleep(0.3)
+
+        event.listen(engine, "before_cursor_execute", delay)
+        etag = client.get(url).headers["ETag"]
+        statements.clear()
+        responses = []
+
+        def get(headers):
+            resp = app.test_client().get(url, headers=headers)
+            responses.append((resp.status_code, resp.data))
+
+        def run(count):
+            threads = [threading.Thread(target=get, args=(
+                {"If-None-Match": etag} if i % 2 else {},))
+                for i in range(count)]
+            threads[0].start()
+            time.sleep(0.1)
+            for thread in threads[1:]:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        slow.set()
+        run(6)
+        flights = app.extensions["cyequ_flights"]
+        assert flights.coalesced == 5
+        assert len(statements) == 2
+        assert sorted(status for status, _ in responses) == [200] * 3 \
+            + [304] * 3
+        assert len({data for status, data in responses if status == 200}) \
+            == 1
+        # Followers time out and run their own views
+        flights.timeout = 0.05
+        statements.clear()
+        run(3)
+        event.remove(engine, "before_cursor_execute", delay)
+        assert flights.timeouts == 2
+        assert len(statements) == 6
+        assert not flights.flights
+
+    def test_after_commit(self, client):
+        '''
+        Tests that a GET does not join a flight started before the last
+        commit, so a client reads its own write.
+        '''
+
+        app = client.application
+        app.config.update(SINGLEFLIGHT=True)
+        url = "/api/users/Joonas1/all_equipment/"
+        shared = threading.Event()
+        leader = threading.Thread(target=lambda: app.test_client().get(url))
+
+        # Teardown functions run in reverse order, so this one keeps the
+        # leader's flight in the air after its response has been shared
+        @app.teardown_request
+        def delay(exc):
+            if threading.current_thread() is leader:
+                shared.set()
+                time.sleep(0.5)
+
+        leader.start()
+        assert shared.wait(5)
+        resp = client.post(url, json=_get_equipment_json())
+        assert resp.status_code == 201
+        body = json.loads(client.get(url).data)
+        leader.join()
+        assert "Hyppykeppi" in [item["name"] for item in body["items"]]
+        flights = app.extensions["cyequ_flights"]
+        assert flights.leaders == 2
+        assert flights.coalesced == 0
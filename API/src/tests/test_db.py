@@ -10,13 +10,22 @@ import os
 import tempfile
 import time
 from datetime import datetime
+import numpy as np
 import pytest
 from sqlalchemy.engine import Engine
-from sqlalchemy import event
-from sqlalchemy.exc import IntegrityError, StatementError
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError, OperationalError, StatementError
 
 from cyequ import create_app, db
-from cyequ.models import User, Equipment, Component, Ride
+from cyequ.models import User, Equipment, Component, Ride, ServiceInterval, \
+                         CatalogEntry, ChangeLog, catalog_key
+from cyequ.maintenance import due_components, reschedule
+from cyequ.columnar import export_columnar, load_columnar
+from cyequ.bulkload import bulk_load
+from cyequ.catalog import migrate_catalog
+from cyequ.search import rebuild_index, search
+from cyequ.changes import compact_changes, first_retained
+from cyequ.garage import check_garage, load
 from tests.utils import _get_user, _get_equipment, _get_component, _get_ride
 
 
@@ -322,6 +331,321 @@ def test_ride_del(app):
         assert Ride.query.count() == 0
 
 
+def test_component_schedule(app):
+    """
+    Tests that component usage and due columns follow service interval rules
+    and are updated incrementally as rides are added, modified and deleted.
+    """
+
+    user = _get_user()
+    equip = _get_equipment()
+    component = _get_component()
+    ride = _get_ride()
+    ride.datetime = datetime(2019, 1, 1, 10, 0, 0)
+    with app.app_context():
+        db.session.add(ServiceInterval(category="Fork",
+                                       interval_days=30,
+                                       interval_hours=1
+                                       ))
+        db.session.commit()
+        db.session.add(user)
+        db.session.add(equip)
+        db.session.add(component)
+        db.session.commit()
+        component = Component.query.get(1)
+        assert component.ride_seconds == 0
+        assert component.due_date == datetime(2018, 12, 21, 11, 20, 30)
+        assert component.due_seconds == 3600
+        # Adding a ride uses the component
+        db.session.add(ride)
+        db.session.commit()
+        component = Component.query.get(1)
+        assert component.ride_seconds == 120
+        assert component.due_seconds == 3480
+        assert due_components(hours=1) == [component]
+        # Modifying the ride moves the usage
+        ride = Ride.query.get(1)
+        ride.duration = 3600
+        db.session.commit()
+        component = Component.query.get(1)
+        assert component.ride_seconds == 3600
+        assert component.due_seconds == 0
+        assert due_components(now=datetime(2018, 1, 1)) == [component]
+        # Set-based rescheduling agrees with the incremental one
+        reschedule()
+        db.session.commit()
+        component = Component.query.get(1)
+        assert component.ride_seconds == 3600
+        assert component.due_seconds == 0
+        assert component.due_date == datetime(2018, 12, 21, 11, 20, 30)
+        # Deleting the ride releases the usage
+        db.session.delete(Ride.query.get(1))
+        db.session.commit()
+        component = Component.query.get(1)
+        assert component.ride_seconds == 0
+        assert component.due_seconds == 3600
+        # Retired components are not scheduled
+        component.date_retired = datetime(2019, 12, 1, 0, 0, 0)
+        db.session.commit()
+        component = Component.query.get(1)
+        assert component.due_date is None
+        assert component.due_seconds is None
+
+
+def test_due_order(app):
+    """
+    Tests that components due by time and by ride-hour rules are listed
+    together by the seconds left until due, before the limit is applied.
+    """
+
+    with app.app_context():
+        db.session.add(ServiceInterval(category="Fork", interval_days=30))
+        db.session.add(ServiceInterval(category="Chain", interval_days=31))
+        db.session.add(ServiceInterval(category="Shock", interval_hours=1))
+        db.session.add(_get_user())
+        db.session.add(_get_equipment())
+        db.session.add(_get_component(cat="Fork", id=1))
+        db.session.add(_get_component(cat="Chain", id=2))
+        db.session.add(_get_component(cat="Shock", id=3))
+        db.session.commit()
+        # Fork and chain due in days, the shock in an hour of riding
+        now = datetime(2018, 12, 20)
+        due = due_components(days=5, hours=1, now=now)
+        assert [component.uri for component in due] == ["Shock3", "Fork1",
+                                                        "Chain2"]
+        due = due_components(days=5, hours=1, limit=1, now=now)
+        assert [component.uri for component in due] == ["Shock3"]
+        # Fork and chain overdue by a year
+        due = due_components(days=5, hours=1, limit=2,
+                             now=datetime(2019, 12, 20))
+        assert [component.uri for component in due] == ["Fork1", "Chain2"]
+
+
+def test_columnar_export(app):
+    """
+    Tests that tables are exported to columns in chunks, and that the
+    columns load back memory-mapped with their values, nulls included.
+    """
+
+    with app.app_context():
+        user = _get_user()
+        equipment = _get_equipment()
+        db.session.add(user)
+        db.session.add(equipment)
+        db.session.commit()
+        for i in range(5):
+            ride = _get_ride(rid=1, id=i)
+            ride.name = "Ajo-{}-ä".format(i)
+            ride.datetime = datetime(2020, 4, 30, 12, i)
+            ride.distance = None if i == 2 else i * 1000.0
+            ride.equipment_id = None if i == 3 else 1
+            db.session.add(ride)
+        db.session.commit()
+        outdir = tempfile.mkdtemp()
+        manifest = export_columnar(outdir, chunk_size=2)
+    assert manifest["tables"]["ride"]["rows"] == 5
+    assert manifest["tables"]["component"]["rows"] == 0
+    rides = load_columnar(outdir, "ride")
+    assert isinstance(rides["id"], np.memmap)
+    assert rides["id"].tolist() == [1, 2, 3, 4, 5]
+    assert rides["datetime"][4] == np.datetime64("2020-04-30T12:04")
+    assert np.isnan(rides["distance"][2])
+    assert rides["distance"][4] == 4000.0
+    values, valid = rides["equipment_id"]
+    assert values.tolist() == [1, 1, 1, 0, 1]
+    assert valid.tolist() == [True, True, True, False, True]
+    offsets, blob = rides["name"]
+    assert bytes(blob[offsets[1]:offsets[2]]).decode() == "Ajo-1-ä"
+    equipment = load_columnar(outdir, "equipment")
+    codes, values = equipment["category"]
+    assert values[codes[0]] == "Mountain Bike"
+    assert np.isnat(equipment["date_retired"][0])
+
+
+def test_bulk_load(app):
+    """
+    Tests loading CSV files in chunks: parent URIs are resolved, invalid
+    rows are rejected, components are scheduled with the loaded rides, and
+    loading the same files again skips the existing rows.
+    """
+
+    csvdir = tempfile.mkdtemp()
+    files = {
+        "users": "name,uri\nJoonas,\nJanne,janne\n,\n",
+        "equipment": "owner,name,category,brand,model,date_added,"
+                     "date_retired\n"
+                     "Joonas1,Polkuaura,Mountain Bike,Kona,Hei Hei,"
+                     "2019-11-21 11:20:30,\n"
+                     "janne,Kisarassi,Road Bike,Bianchi,Intenso,"
+                     "2019-11-21 11:20:30,2019-01-01 00:00:00\n"
+                     "Jaana3,Jopo,City Bike,Jopo,Jopo,2019-11-21 11:20:30,\n",
+        "components": "equipment,name,category,brand,model,date_added\n"
+                      "Polkuaura1,Hissitolppa,Seat Post,RockShox,Reverb B1,"
+                      "2019-11-21 11:20:30\n"
+                      "Polkuaura1,Takakiekko,Rear Wheel,Sram,Roam,"
+                      "2019-11-21 eilen\n",
+        "rides": "rider,equipment,name,datetime,duration\n"
+                 "Joonas1,Polkuaura1,Lenkki,2020-01-01 12:00:00,3600\n"
+                 "Joonas1,Polkuaura1,Toinen,2020-01-02 12:00:00,1800\n"
+                 "janne,,Kävely,2020-01-03 12:00:00,0\n"
+    }
+    paths = {}
+    for name, content in files.items():
+        paths[name] = os.path.join(csvdir, name + ".csv")
+        with open(paths[name], "w", encoding="utf-8") as out:
+            out.write(content)
+    with app.app_context():
+        db.session.add(ServiceInterval(category="Seat Post",
+                                       interval_hours=50))
+        db.session.commit()
+        stats = bulk_load(paths, chunk_size=2)
+        assert stats["users"]["inserted"] == 2
+        assert stats["users"]["rejected"] == 1
+        assert stats["equipment"]["inserted"] == 1
+        assert stats["equipment"]["errors"] == [
+            "line 3: date_retired not after date_added",
+            "line 4: owner not found"]
+        assert stats["components"]["inserted"] == 1
+        assert stats["components"]["errors"] == [
+            "line 3: date_added is not a date"]
+        assert stats["rides"]["inserted"] == 2
+        assert stats["rides"]["rejected"] == 1
+        assert User.query.filter_by(name="Janne").first().uri == "janne"
+        equipment = Equipment.query.filter_by(uri="Polkuaura1").first()
+        assert equipment.date_retired is None
+        component = Component.query.filter_by(uri="Hissitolppa1").first()
+        assert component.date_retired == datetime(9999, 12, 31, 23, 59, 59)
+        assert component.ride_seconds == 5400
+        assert component.due_seconds == 50 * 3600 - 5400
+        # Indexes deferred during the load exist again
+        indexes = [row[1] for row in db.session.execute(
+            text("PRAGMA index_list('component')"))]
+        assert "ix_component_due_seconds" in indexes
+        # Loading again inserts nothing
+        stats = bulk_load(paths)
+        assert [stat["inserted"] for stat in stats.values()] == [0, 0, 0, 0]
+        assert stats["rides"]["skipped"] == 2
+        assert Ride.query.count() == 2
+
+
+def test_catalog_interning(app):
+    """
+    Tests that equipment and components share catalog entries by brand,
+    model and category, that a changed category moves a row to another
+    entry, and that entries of a rolled back transaction are not cached.
+    """
+
+    with app.app_context():
+        db.session.add(_get_user())
+        db.session.add(_get_equipment(number=1, id=1))
+        db.session.add(_get_equipment(number=2, id=2))
+        db.session.add(_get_component(cat="Fork", equi=1))
+        db.session.commit()
+        equipment = Equipment.query.order_by(Equipment.id).all()
+        assert equipment[0].catalog_id == equipment[1].catalog_id
+        assert Equipment.query.filter_by(model="HeiHei").count() == 2
+        component = Component.query.first()
+        fork = component.catalog_id
+        component.category = "Rear Shock"
+        db.session.commit()
+        assert component.catalog_id != fork
+        assert component.brand == "Fox"
+        assert CatalogEntry.query.count() == 3
+        # Entry created and rolled back, its id is taken by the next one
+        equipment[0].brand = "Canyon"
+        db.session.flush()
+        created = equipment[0].catalog_id
+        db.session.rollback()
+        assert equipment[0].brand == "Kona"
+        equipment[1].brand = "Cube"
+        db.session.commit()
+        assert equipment[1].catalog_id == created
+        assert catalog_key(created) == ("Cube", "HeiHei", "Mountain Bike")
+
+
+def test_migrate_catalog(app):
+    """
+    Tests migrating equipment and components with brand and model columns
+    to catalog entries in batches, keeping rows, relations and search.
+    """
+
+    with app.app_context():
+        for table in ("component", "equipment", "catalog"):
+            db.session.execute(text("DROP TABLE {}".format(table)))
+        db.session.execute(text(
+            "CREATE TABLE equipment (id INTEGER PRIMARY KEY,"
+            " uri VARCHAR(128) UNIQUE, name VARCHAR(64) NOT NULL,"
+            " category VARCHAR(64) NOT NULL, brand VARCHAR(64) NOT NULL,"
+            " model VARCHAR(128) NOT NULL, date_added DATETIME NOT NULL,"
+            " date_retired DATETIME,"
+            " owner INTEGER REFERENCES user (id) ON DELETE SET NULL)"))
+        db.session.execute(text(
+            "CREATE TABLE component (id INTEGER PRIMARY KEY,"
+            " uri VARCHAR(128) UNIQUE, name VARCHAR(64) NOT NULL,"
+            " category VARCHAR(64) NOT NULL, brand VARCHAR(64) NOT NULL,"
+            " model VARCHAR(128) NOT NULL, date_added DATETIME NOT NULL,"
+            " date_retired DATETIME NOT NULL, ride_seconds INTEGER NOT NULL,"
+            " due_date DATETIME, due_seconds INTEGER, equipment_id INTEGER"
+            " REFERENCES equipment (id) ON DELETE CASCADE)"))
+        db.session.execute(text("INSERT INTO user (uri, name)"
+                                " VALUES ('Joonas1', 'Joonas')"))
+        for i, brand in enumerate(["Kona", "Kona", "Trek"], 1):
+            db.session.execute(text(
+                "INSERT INTO equipment (uri, name, category, brand, model,"
+                " date_added, owner) VALUES (:uri, :name, 'Mountain Bike',"
+                " :brand, 'Hei Hei', '2019-11-21 11:20:30.000000', 1)"),
+                {"uri": "Bike{}".format(i), "name": "Bike{}".format(i),
+                 "brand": brand})
+        for i in (1, 2):
+            db.session.execute(text(
+                "INSERT INTO component (uri, name, category, brand, model,"
+                " date_added, date_retired, ride_seconds, equipment_id)"
+                " VALUES (:uri, 'Keula', 'Fork', 'Fox', '34',"
+                " '2019-11-21 11:20:30.000000',"
+                " '9999-12-31 23:59:59.000000', 0, :equipment)"),
+                {"uri": "Keula{}".format(i), "equipment": i})
+        db.session.commit()
+        assert migrate_catalog(batch_size=2) == {"equipment": 3,
+                                                 "component": 2}
+        columns = [row[1] for row in db.session.execute(
+            text("PRAGMA table_info('component')"))]
+        assert "brand" not in columns and "catalog_id" in columns
+        assert CatalogEntry.query.count() == 3
+        equipment = Equipment.query.filter_by(uri="Bike3").first()
+        assert (equipment.brand, equipment.model) == ("Trek", "Hei Hei")
+        assert [c.model for c in Equipment.query.first().hasCompos] == ["34"]
+        assert search("fox", 1)[0] == 2
+        # Cascades work on the rebuilt tables
+        db.session.delete(Equipment.query.first())
+        db.session.commit()
+        assert Component.query.count() == 1
+        assert migrate_catalog() == {}
+
+
+def test_search_rowids(app):
+    """
+    Tests that components without equipment are indexed as owner 0, also
+    after rebuilding the index of a database with triggers of an earlier
+    version.
+    """
+
+    with app.app_context():
+        db.session.add(_get_component(equi=None, id=1))
+        # Trigger of an earlier version, leaving the rowid NULL
+        db.session.execute(text("DROP TRIGGER component_search_ai"))
+        db.session.execute(text(
+            "CREATE TRIGGER component_search_ai AFTER INSERT ON component"
+            " BEGIN INSERT INTO search_index (rowid, name) VALUES (NULL,"
+            " new.name); END"))
+        db.session.commit()
+        rebuild_index()
+        db.session.add(_get_component(cat="Shock", equi=None, id=2))
+        db.session.commit()
+        rowids = db.session.execute(text(
+            "SELECT rowid FROM search_index ORDER BY rowid")).fetchall()
+        assert [rowid for rowid, in rowids] == [1 << 1 | 1, 2 << 1 | 1]
+
+
 def test_ride_equipment_one_to_one(app):
     """
     Tests that the relationship between ride and equipment is one-to-one.
@@ -738,3 +1062,154 @@ def test_ride_columns(app):
         db.session.add(ride)
         with pytest.raises(StatementError):
             db.session.commit()
+
+
+def test_change_log(app):
+    """
+    Tests that writes are logged by the triggers, a row once it has a URI,
+    and that compaction past the retention horizon keeps only the latest
+    record of each live resource.
+    """
+
+    with app.app_context():
+        db.session.add(_get_user())
+        db.session.add(_get_equipment())
+        db.session.add(_get_component(cat="Fork", equi=1))
+        ride = _get_ride(mod=True)
+        db.session.add(ride)
+        db.session.commit()
+        ride.uri = "Ajo-11"
+        db.session.commit()
+        equipment = Equipment.query.first()
+        equipment.name = "Polku"
+        db.session.commit()
+        equipment.name = "Aura"
+        db.session.commit()
+        db.session.delete(ride)
+        db.session.commit()
+        logged = [(record.kind, record.op) for record in
+                  ChangeLog.query.order_by(ChangeLog.seq)]
+        assert logged == [("user", "create"), ("equipment", "create"),
+                          ("component", "create"), ("ride", "create"),
+                          ("equipment", "update"), ("equipment", "update"),
+                          ("ride", "delete")]
+        assert all(record.user_id == 1 for record in ChangeLog.query)
+        # Nothing is past the horizon yet
+        assert compact_changes() == 0
+        assert first_retained() == 1
+        db.session.execute(text(
+            "UPDATE changelog SET time = datetime('now', '-40 days')"))
+        db.session.commit()
+        component = Component.query.first()
+        component.name = "Haarukka"
+        db.session.commit()
+        latest = ChangeLog.query.order_by(ChangeLog.seq.desc()).first().seq
+        assert first_retained() == latest
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["compact-changes"])
+        assert "Compacted 5" in result.output
+        logged = [(record.kind, record.op) for record in
+                  ChangeLog.query.order_by(ChangeLog.seq)]
+        assert logged == [("user", "create"), ("equipment", "update"),
+                          ("component", "update")]
+        # Sequence numbers are not reused
+        db.session.delete(Component.query.first())
+        db.session.commit()
+        assert ChangeLog.query.order_by(ChangeLog.seq.desc()).first().seq \
+            == latest + 1
+
+
+
+def test_garage_summary(app):
+    """
+    Tests that garage summaries are refreshed by commits, and that the
+    consistency check finds writes not applied yet and repairs them.
+    """
+
+    with app.app_context():
+        db.session.add(_get_user())
+        db.session.add(_get_equipment())
+        db.session.add(_get_equipment(number=2, id=2))
+        db.session.add(_get_component(cat="Fork", equi=1))
+        db.session.commit()
+        _, version, _, document = load("user-janne1")
+        assert [bike["uri"] for bike in document["bikes"]] \
+            == ["Bike-11", "Bike-22"]
+        assert document["counts"]["components_in_service"] == 1
+        assert check_garage(db.session, 1) == []
+        # Moving the component changes both bikes in one version
+        component = Component.query.first()
+        component.equipment_id = 2
+        db.session.commit()
+        _, moved, _, document = load("user-janne1")
+        assert moved == version + 1
+        assert [len(bike["components"]) for bike in document["bikes"]] \
+            == [0, 1]
+        assert check_garage(db.session, 1) == []
+        # Written around the ORM, not saved until checked and repaired
+        db.session.execute(text("UPDATE equipment SET name = 'Polku'"
+                                " WHERE uri = 'Bike-11'"))
+        db.session.commit()
+        assert check_garage(db.session, 1) == ["equipment Bike-11 differs"]
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["garage-check"])
+        assert "User 1: equipment Bike-11 differs" in result.output
+        assert "1 inconsistent." in result.output
+        result = runner.invoke(args=["garage-check", "--repair"])
+        assert "inconsistent, repaired" in result.output
+        assert check_garage(db.session, 1) == []
+        result = runner.invoke(args=["garage-rebuild"])
+        assert "1 garage summaries built" in result.output
+        # Deleting the user deletes the summary
+        db.session.delete(Equipment.query.filter_by(uri="Bike-11").first())
+        db.session.delete(User.query.first())
+        db.session.commit()
+        assert load("user-janne1") is None
+        assert check_garage(db.session, 1) == []
+
+def test_routing():
+    """
+    Tests DB_ROUTING: statements of GET requests run on the read-only
+    reader engine within one snapshot, and those of other requests on the
+    writer connection of a database in WAL mode.
+    """
+
+    db_fd, db_fname = tempfile.mkstemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+                      "DB_ROUTING": True,
+                      "TESTING": True})
+    reader = app.extensions["cyequ_reader"]
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add(_get_user())
+            db.session.commit()
+            assert db.session.execute(text("PRAGMA journal_mode")) \
+                .scalar() == "wal"
+        with app.test_request_context("/api/users/", method="GET"):
+            assert db.session.get_bind() is reader
+            assert User.query.count() == 1
+            # Writes of the writer are not seen within the snapshot
+            with db.engine.begin() as connection:
+                connection.execute(User.__table__.insert(),
+                                   {"name": "Jaana", "uri": "Jaana3"})
+            assert User.query.count() == 1
+            with pytest.raises(OperationalError):
+                db.session.execute(text("DELETE FROM user"))
+            db.session.remove()
+            assert User.query.count() == 2
+            db.session.remove()
+        with app.test_request_context("/api/users/", method="POST"):
+            assert db.session.get_bind() is db.engine
+            db.session.add(_get_user("joonas", id=2))
+            db.session.commit()
+            assert User.query.count() == 3
+            db.session.remove()
+    finally:
+        reader.dispose()
+        db.get_engine(app).dispose()
+        os.close(db_fd)
+        os.unlink(db_fname)
+    with pytest.raises(ValueError):
+        create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://",
+                    "DB_ROUTING": True})
@@ -7,13 +7,16 @@ or with additional details:
 '''
 
 # Library imports
-from datetime import datetime
+import io
+import json
+import zipfile
+from datetime import datetime, timedelta
 from jsonschema import validate
 
 # Project imports
 from cyequ import db
 from cyequ.constants import APIARY_URL
-from cyequ.models import User, Equipment, Component, Ride
+from cyequ.models import User, Equipment, Component, Ride, ServiceInterval
 
 
 def _populate_db():
@@ -21,6 +24,15 @@ def _populate_db():
     Populates database with test data used in the tests.
     '''
 
+    # Service intervals first, so components are scheduled when added
+    db.session.add(ServiceInterval(category="Seat Post",
+                                   interval_days=365,
+                                   interval_hours=50
+                                   ))
+    db.session.add(ServiceInterval(category="Rear Wheel",
+                                   interval_hours=200
+                                   ))
+    db.session.commit()
     # Create everything
     user1 = User(uri="Joonas1",
                  name="Joonas"
@@ -222,6 +234,30 @@ def _check_control_put_method(ctrl, client, obj, content):
     assert resp.status_code == 204
 
 
+def _check_control_patch_method(ctrl, client, obj, content):
+    '''
+    Checks a PATCH type control from a JSON object be it root document or an
+    item in a collection. In addition to checking the "href" attribute, also
+    checks that method, encoding, media type and schema can be found from the
+    control. Also validates a valid merge patch against the schema of the
+    control to ensure that they match. Finally checks that using the control
+    results in the correct status code of 204.
+    '''
+
+    ctrl_obj = obj["@controls"][ctrl]
+    href = ctrl_obj["href"]
+    method = ctrl_obj["method"].lower()
+    encoding = ctrl_obj["encoding"].lower()
+    schema = ctrl_obj["schema"]
+    assert method == "patch"
+    assert encoding == "json"
+    assert ctrl_obj["type"] == "application/merge-patch+json"
+    validate(content, schema)
+    resp = client.patch(href, data=json.dumps(content),
+                        content_type=ctrl_obj["type"])
+    assert resp.status_code == 204
+
+
 def _check_control_post_method(ctrl, client, obj, content):
     '''
     Checks a POST type control from a JSON object be it root document or
@@ -383,3 +419,59 @@ def _get_ride(equi=1, rid=1, mod=False, id=1):
                     equipment_id=equi,
                     rider=rid
                     )
+
+
+def _get_gpx(name="Iltalenkki", points=3):
+    '''
+    Creates a GPX document of *points* track points, one per minute and
+    0.001 degrees of latitude apart, climbing one meter per point.
+    '''
+
+    trkpts = "".join(
+        '<trkpt lat="{:.3f}" lon="25.470"><ele>{}</ele>'
+        '<time>{:%Y-%m-%dT%H:%M:%S}Z</time></trkpt>'
+        .format(65.0 + i * 0.001, 10 + i,
+                datetime(2020, 4, 30, 12, 0, 0) + timedelta(minutes=i))
+        for i in range(points)
+    )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<gpx version="1.1" creator="test"'
+            ' xmlns="http://www.topografix.com/GPX/1/1">'
+            '<trk><name>{}</name><trkseg>{}</trkseg></trk></gpx>'
+            .format(name, trkpts)
+            )
+
+
+def _get_tcx(points=3):
+    '''
+    Creates a TCX document equivalent to the one of _get_gpx().
+    '''
+
+    trkpts = "".join(
+        '<Trackpoint><Time>2020-04-30T12:{:02d}:00Z</Time><Position>'
+        '<LatitudeDegrees>{:.3f}</LatitudeDegrees>'
+        '<LongitudeDegrees>25.470</LongitudeDegrees></Position>'
+        '<AltitudeMeters>{}</AltitudeMeters></Trackpoint>'
+        .format(i, 65.0 + i * 0.001, 10 + i)
+        for i in range(points)
+    )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/'
+            'TrainingCenterDatabase/v2"><Activities><Activity Sport="Biking">'
+            '<Id>2020-04-30T12:00:00Z</Id><Lap><Track>{}</Track></Lap>'
+            '</Activity></Activities></TrainingCenterDatabase>'
+            .format(trkpts)
+            )
+
+
+def _get_archive(files):
+    '''
+    Creates a ZIP archive of *files* given as a dict of member names and
+    contents.
+    '''
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buf.getvalue()